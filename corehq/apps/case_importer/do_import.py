@@ -12,6 +12,7 @@ from casexml.apps.case.mock import CaseBlock, CaseBlockError
 from corehq.apps.receiverwrapper.rate_limiter import rate_limit_submission
 from corehq.util.timer import TimingContext
 from couchexport.export import SCALAR_NEVER_WAS
+from dimagi.utils.chunked import chunked
 from dimagi.utils.logging import notify_exception
 from soil.progress import set_task_progress
 
@@ -20,7 +21,7 @@ from corehq.apps.export.tasks import add_inferred_export_properties
 from corehq.apps.groups.models import Group
 from corehq.apps.hqcase.utils import submit_case_blocks
 from corehq.apps.locations.models import SQLLocation
-from corehq.apps.users.cases import get_wrapped_owner
+from corehq.apps.users.cases import get_wrapped_owner, get_wrapped_owners
 from corehq.apps.users.models import CouchUser
 from corehq.apps.users.util import format_username
 from corehq.toggles import BULK_UPLOAD_DATE_OPENED
@@ -30,9 +31,11 @@ from corehq.util.metrics import metrics_counter, metrics_histogram
 
 from . import exceptions
 from .const import LookupErrors
-from .util import EXTERNAL_ID, RESERVED_FIELDS, lookup_case
+from .util import EXTERNAL_ID, RESERVED_FIELDS, bulk_lookup_cases, lookup_case
 
-CASEBLOCK_CHUNKSIZE = 100
+CASEBLOCK_CHUNKSIZE = 500
+# number of rows whose cases and owners are looked up together
+LOOKUP_CHUNKSIZE = 1000
 RowAndCase = namedtuple('RowAndCase', ['row', 'case'])
 ALL_LOCATIONS = 'ALL_LOCATIONS'
 
@@ -52,38 +55,73 @@ class _Importer(object):
         self.results = _ImportResults()
 
         self.owner_accessor = _OwnerAccessor(domain, self.user)
+        self.case_lookups = _CaseLookups(domain)
         self.uncreated_external_ids = set()
         self._unsubmitted_caseblocks = []
 
     def do_import(self, spreadsheet):
-        for row_num, row in enumerate(spreadsheet.iter_row_dicts(), start=1):
-            set_task_progress(self.task, row_num - 1, spreadsheet.max_row)
-            if row_num == 1:
-                continue  # skip first row (header row)
+        row_dicts = enumerate(spreadsheet.iter_row_dicts(), start=1)
+        next(row_dicts, None)  # skip first row (header row)
+        for chunk in chunked(row_dicts, LOOKUP_CHUNKSIZE):
+            rows = []
+            for row_num, raw_row in chunk:
+                try:
+                    row = self.parse_row(raw_row)
+                except exceptions.CaseRowError as error:
+                    self.results.add_error(row_num, error)
+                else:
+                    if row:
+                        rows.append((row_num, row))
 
-            try:
-                self.import_row(row_num, row)
-            except exceptions.CaseRowError as error:
-                self.results.add_error(row_num, error)
+            self.prefetch([row for row_num, row in rows])
+            for row_num, row in rows:
+                set_task_progress(self.task, row_num - 1, spreadsheet.max_row)
+                try:
+                    self.import_row(row_num, row)
+                except exceptions.CaseRowError as error:
+                    self.results.add_error(row_num, error)
 
         self.commit_caseblocks()
         return self.results.to_json()
 
-    def import_row(self, row_num, raw_row):
+    def parse_row(self, raw_row):
+        """Returns a _CaseImportRow or None if the row is blank"""
         search_id = _parse_search_id(self.config, raw_row)
         fields_to_update = _populate_updated_fields(self.config, raw_row)
         if not any(fields_to_update.values()):
             # if the row was blank, just skip it, no errors
-            return
+            return None
 
-        row = _CaseImportRow(
+        return _CaseImportRow(
             search_id=search_id,
             fields_to_update=fields_to_update,
             config=self.config,
             domain=self.domain,
             user_id=self.user.user_id,
             owner_accessor=self.owner_accessor,
+            case_lookups=self.case_lookups,
+        )
+
+    def prefetch(self, rows):
+        """Look up the cases and owners of a chunk of rows in bulk rather
+        than one query per row"""
+        self.case_lookups.clear()
+        self.case_lookups.prefetch(
+            self.config.search_field, [row.search_id for row in rows], self.config.case_type
+        )
+        for parent_type in {row.parent_type for row in rows}:
+            rows_for_type = [row for row in rows if row.parent_type == parent_type]
+            self.case_lookups.prefetch(
+                'case_id', [row.parent_id for row in rows_for_type], parent_type
+            )
+            self.case_lookups.prefetch(
+                EXTERNAL_ID, [row.parent_external_id for row in rows_for_type], parent_type
+            )
+        self.owner_accessor.prefetch_owner_ids(
+            row.uploaded_owner_id for row in rows if not row.uploaded_owner_name
         )
+
+    def import_row(self, row_num, row):
         if row.relies_on_uncreated_case(self.uncreated_external_ids):
             self.commit_caseblocks()
         if row.is_new_case and not self.config.create_new_cases:
@@ -118,6 +156,9 @@ class _Importer(object):
             self.submit_and_process_caseblocks(self._unsubmitted_caseblocks)
             self.results.num_chunks += 1
             self._unsubmitted_caseblocks = []
+            # these cases exist now so the lookups made before they were
+            # submitted are out of date
+            self.case_lookups.forget(self.uncreated_external_ids)
             self.uncreated_external_ids = set()
 
     def submit_and_process_caseblocks(self, caseblocks):
@@ -230,13 +271,15 @@ class _TimedAndThrottledImporter(_Importer):
 
 
 class _CaseImportRow(object):
-    def __init__(self, search_id, fields_to_update, config, domain, user_id, owner_accessor):
+    def __init__(self, search_id, fields_to_update, config, domain, user_id, owner_accessor,
+                 case_lookups=None):
         self.search_id = search_id
         self.fields_to_update = fields_to_update
         self.config = config
         self.domain = domain
         self.user_id = user_id
         self.owner_accessor = owner_accessor
+        self.case_lookups = case_lookups or _CaseLookups(domain)
 
         self.case_name = fields_to_update.pop('name', None)
         self.external_id = fields_to_update.pop('external_id', None)
@@ -261,13 +304,11 @@ class _CaseImportRow(object):
 
     @cached_property
     def existing_case(self):
-        case, error = lookup_case(
+        case, error = self.case_lookups.lookup(
             self.config.search_field,
             self.search_id,
-            self.domain,
             self.config.case_type
         )
-        _log_case_lookup(self.domain)
         if error == LookupErrors.MultipleResults:
             raise exceptions.TooManyMatches()
         return case
@@ -292,9 +333,7 @@ class _CaseImportRow(object):
                 ('parent_external_id', 'external_id', self.parent_external_id),
         ]:
             if search_id:
-                parent_case, error = lookup_case(
-                    search_field, search_id, self.domain, self.parent_type)
-                _log_case_lookup(self.domain)
+                parent_case, error = self.case_lookups.lookup(search_field, search_id, self.parent_type)
                 if parent_case:
                     return {self.parent_ref: (parent_case.type, parent_case.case_id)}
                 raise exceptions.InvalidParentId(column)
@@ -341,6 +380,46 @@ class _CaseImportRow(object):
         )
 
 
+class _CaseLookups(object):
+    """
+    Results of case lookups by (search field, search id, case type).
+
+    The importer fills this in bulk for each chunk of rows before
+    importing them. Anything not fetched in bulk is looked up on demand.
+    """
+
+    def __init__(self, domain):
+        self.domain = domain
+        self._results = {}
+
+    def prefetch(self, search_field, search_ids, case_type):
+        search_ids = {
+            search_id for search_id in search_ids
+            if search_id and (search_field, search_id, case_type) not in self._results
+        }
+        if not search_ids:
+            return
+        results = bulk_lookup_cases(search_field, search_ids, self.domain, case_type)
+        _log_case_lookup(self.domain)
+        for search_id, result in results.items():
+            self._results[(search_field, search_id, case_type)] = result
+
+    def lookup(self, search_field, search_id, case_type):
+        """Returns a tuple of (case, error) like ``lookup_case``"""
+        key = (search_field, search_id, case_type)
+        if key not in self._results:
+            self._results[key] = lookup_case(search_field, search_id, self.domain, case_type)
+            _log_case_lookup(self.domain)
+        return self._results[key]
+
+    def forget(self, search_ids):
+        for key in [key for key in self._results if key[1] in search_ids]:
+            del self._results[key]
+
+    def clear(self):
+        self._results = {}
+
+
 def _log_case_lookup(domain):
     case_load_counter("case_importer", domain)
 
@@ -526,6 +605,23 @@ class _OwnerAccessor(object):
     def check_owner_id(self, owner_id):
         return cached_function_call(self._check_owner_id, owner_id, self.id_cache)
 
+    def prefetch_owner_ids(self, owner_ids):
+        """Fetch and check owner ids in bulk so that ``check_owner_id``
+        is answered from the cache"""
+        owner_ids = {owner_id for owner_id in owner_ids if owner_id and owner_id not in self.id_cache}
+        if not owner_ids:
+            return
+        owners = get_wrapped_owners(owner_ids)
+        for owner_id in owner_ids:
+            try:
+                cached_function_call(
+                    lambda owner_id: self._check_owner(owners.get(owner_id), 'owner_id'),
+                    owner_id,
+                    self.id_cache,
+                )
+            except CaseRowError:
+                pass
+
     def _check_owner_id(self, owner_id):
         """
         Raises InvalidOwner if the owner cannot own cases.
@@ -0,0 +1,43 @@
+from django.test import SimpleTestCase
+
+from mock import patch
+
+from corehq.apps.case_importer.const import LookupErrors
+from corehq.apps.case_importer.do_import import _CaseLookups
+
+
+@patch('corehq.apps.case_importer.do_import._log_case_lookup')
+class CaseLookupsTest(SimpleTestCase):
+
+    def test_prefetched_lookup(self, _):
+        lookups = _CaseLookups('domain')
+        with patch('corehq.apps.case_importer.do_import.bulk_lookup_cases') as bulk_lookup_cases:
+            bulk_lookup_cases.return_value = {
+                'a': ('case-a', None),
+                'b': (None, LookupErrors.NotFound),
+            }
+            lookups.prefetch('external_id', ['a', 'b', ''], 'person')
+            bulk_lookup_cases.assert_called_once_with('external_id', {'a', 'b'}, 'domain', 'person')
+
+        with patch('corehq.apps.case_importer.do_import.lookup_case') as lookup_case:
+            self.assertEqual(lookups.lookup('external_id', 'a', 'person'), ('case-a', None))
+            self.assertEqual(lookups.lookup('external_id', 'b', 'person'), (None, LookupErrors.NotFound))
+            self.assertFalse(lookup_case.called)
+
+    def test_lookup_not_prefetched(self, _):
+        lookups = _CaseLookups('domain')
+        with patch('corehq.apps.case_importer.do_import.lookup_case') as lookup_case:
+            lookup_case.return_value = ('case-a', None)
+            self.assertEqual(lookups.lookup('case_id', 'a', 'person'), ('case-a', None))
+            self.assertEqual(lookups.lookup('case_id', 'a', 'person'), ('case-a', None))
+            lookup_case.assert_called_once_with('case_id', 'a', 'domain', 'person')
+
+    def test_forget(self, _):
+        lookups = _CaseLookups('domain')
+        with patch('corehq.apps.case_importer.do_import.bulk_lookup_cases') as bulk_lookup_cases:
+            bulk_lookup_cases.return_value = {'a': (None, LookupErrors.NotFound)}
+            lookups.prefetch('external_id', ['a'], 'person')
+        lookups.forget({'a'})
+        with patch('corehq.apps.case_importer.do_import.lookup_case') as lookup_case:
+            lookup_case.return_value = ('case-a', None)
+            self.assertEqual(lookups.lookup('external_id', 'a', 'person'), ('case-a', None))
@@ -1,5 +1,5 @@
 import json
-from collections import OrderedDict, namedtuple
+from collections import OrderedDict, defaultdict, namedtuple
 from contextlib import contextmanager
 
 from celery import states
@@ -171,6 +171,35 @@ def lookup_case(search_field, search_id, domain, case_type):
         return (None, LookupErrors.NotFound)
 
 
+def bulk_lookup_cases(search_field, search_ids, domain, case_type):
+    """
+    Look up the cases for many search ids at once.
+
+    Returns a dict of search_id -> (case, error) with the same result
+    ``lookup_case`` would give for each of the ids.
+    """
+    search_ids = list({search_id for search_id in search_ids if search_id})
+    results = {search_id: (None, LookupErrors.NotFound) for search_id in search_ids}
+    if not search_ids:
+        return results
+
+    case_accessors = CaseAccessors(domain)
+    if search_field == 'case_id':
+        for case in case_accessors.get_cases(search_ids):
+            if case.domain == domain and case.type == case_type:
+                results[case.case_id] = (case, None)
+    elif search_field == EXTERNAL_ID:
+        cases_by_external_id = defaultdict(list)
+        for case in case_accessors.get_cases_by_external_ids(search_ids, case_type=case_type):
+            cases_by_external_id[case.external_id].append(case)
+        for external_id, cases in cases_by_external_id.items():
+            if len(cases) > 1:
+                results[external_id] = (None, LookupErrors.MultipleResults)
+            else:
+                results[external_id] = (cases[0], None)
+    return results
+
+
 def open_spreadsheet_download_ref(filename):
     """
     open a spreadsheet download ref just to test there are no errors opening it
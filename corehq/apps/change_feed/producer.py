@@ -40,29 +40,43 @@ class ChangeProducer(object):
         return self._producer
 
     def send_change(self, topic, change_meta):
-        if settings.USE_KAFKA_SHORTEST_BACKLOG_PARTITIONER:
-            from corehq.apps.change_feed.partitioners import choose_best_partition_for_topic
-            partition = choose_best_partition_for_topic(topic)
-        else:
-            partition = None
-
-        message = change_meta.to_json()
-        message_json_dump = json.dumps(message).encode('utf-8')
-        change_meta._transaction_id = uuid.uuid4().hex
-        try:
-            _audit_log(CHANGE_PRE_SEND, change_meta)
-            future = self.producer.send(topic, message_json_dump, key=change_meta.document_id, partition=partition)
+        self.send_changes(topic, [change_meta])
+
+    def send_changes(self, topic, change_metas):
+        """Send several changes to the same topic. With auto_flush the changes
+        are all sent before waiting for any of them to be acknowledged."""
+        futures = []
+        for change_meta in change_metas:
+            if settings.USE_KAFKA_SHORTEST_BACKLOG_PARTITIONER:
+                from corehq.apps.change_feed.partitioners import choose_best_partition_for_topic
+                partition = choose_best_partition_for_topic(topic)
+            else:
+                partition = None
+
+            message = change_meta.to_json()
+            message_json_dump = json.dumps(message).encode('utf-8')
+            change_meta._transaction_id = uuid.uuid4().hex
+            try:
+                _audit_log(CHANGE_PRE_SEND, change_meta)
+                future = self.producer.send(
+                    topic, message_json_dump, key=change_meta.document_id, partition=partition)
+            except Exception as e:
+                _audit_log('ERROR', change_meta)
+                raise KafkaPublishingError(e)
+            futures.append((change_meta, future))
+
+        for change_meta, future in futures:
             if self.auto_flush:
-                future.get()
-                _audit_log(CHANGE_SENT, change_meta)
-        except Exception as e:
-            _audit_log('ERROR', change_meta)
-            raise KafkaPublishingError(e)
-
-        if not self.auto_flush:
-            on_success = partial(_on_success, change_meta)
-            on_error = partial(_on_error, change_meta)
-            future.add_callback(on_success).add_errback(on_error)
+                try:
+                    future.get()
+                    _audit_log(CHANGE_SENT, change_meta)
+                except Exception as e:
+                    _audit_log('ERROR', change_meta)
+                    raise KafkaPublishingError(e)
+            else:
+                on_success = partial(_on_success, change_meta)
+                on_error = partial(_on_error, change_meta)
+                future.add_callback(on_success).add_errback(on_error)
 
     def flush(self, timeout=None):
         self.producer.flush(timeout=timeout)
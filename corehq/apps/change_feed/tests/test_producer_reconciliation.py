@@ -60,6 +60,22 @@ class TestKafkaAuditLogging(SimpleTestCase):
 
         self._check_logs(logs, meta.document_id, [CHANGE_PRE_SEND, CHANGE_ERROR])
 
+    def test_send_changes_waits_after_sending(self):
+        kafka_producer = ChangeProducer()
+        calls = []
+        future = Future()
+        future.get = Mock(side_effect=lambda: calls.append('get'))
+        kafka_producer.producer.send = Mock(side_effect=lambda *args, **kwargs: calls.append('send') or future)
+
+        metas = [
+            ChangeMeta(document_id=uuid.uuid4().hex, data_source_type='dummy-type', data_source_name='dummy-name')
+            for i in range(3)
+        ]
+        with capture_log_output(KAFKA_AUDIT_LOGGER):
+            kafka_producer.send_changes(topics.CASE, metas)
+
+        self.assertEqual(calls, ['send'] * 3 + ['get'] * 3)
+
     def _test_success(self, auto_flush):
         kafka_producer = ChangeProducer(auto_flush=auto_flush)
         with capture_log_output(KAFKA_AUDIT_LOGGER) as logs:
@@ -1,3 +1,4 @@
+import hashlib
 import re
 from collections import defaultdict
 from copy import deepcopy
@@ -6,7 +7,8 @@ from datetime import date, datetime, time, timedelta
 from django.conf import settings
 from django.contrib.postgres.fields import JSONField
 from django.db import models, transaction
-from django.db.models import Q
+from django.db.models import Exists, OuterRef, Q, TextField
+from django.db.models.expressions import RawSQL
 from django.utils.translation import ugettext_lazy
 
 import jsonfield
@@ -33,7 +35,7 @@ from corehq.apps.app_manager.exceptions import FormNotFoundException
 from corehq.apps.app_manager.models import AdvancedForm
 from corehq.apps.data_interfaces.utils import property_references_parent
 from corehq.apps.es.cases import CaseES
-from corehq.apps.hqcase.utils import update_case
+from corehq.apps.hqcase.utils import bulk_update_cases, update_case
 from corehq.apps.users.util import SYSTEM_USER_ID
 from corehq.form_processor.abstract_models import DEFAULT_PARENT_IDENTIFIER
 from corehq.form_processor.exceptions import CaseNotFound
@@ -82,6 +84,9 @@ from corehq.util.test_utils import unit_testing_only
 ALLOWED_DATE_REGEX = re.compile(r'^\d{4}-\d{2}-\d{2}')
 AUTO_UPDATE_XMLNS = 'http://commcarehq.org/hq_case_update_rule'
 
+# Names that get_case_property() reads from the model rather than case_json
+_CASE_MODEL_PROPERTY_NAMES = {field.name for field in CommCareCaseSQL._meta.fields} | {'_id'}
+
 
 def _try_date_conversion(date_or_string):
     if isinstance(date_or_string, bytes):
@@ -219,15 +224,74 @@ class AutomaticUpdateRule(models.Model):
         date = now - timedelta(days=min_boundary)
         return date
 
+    # returns None if any of the rules has no criteria that can be run in the database,
+    # otherwise a (Q, annotations) tuple selecting a superset of the cases the rules match
+    @classmethod
+    def get_candidate_filter(cls, rules, now):
+        q_expression = None
+        annotations = {}
+        for rule in rules:
+            candidate_filter = rule.get_rule_candidate_filter(now)
+            if candidate_filter is None:
+                return None
+
+            rule_q_expression, rule_annotations = candidate_filter
+            annotations.update(rule_annotations)
+            if q_expression is None:
+                q_expression = rule_q_expression
+            else:
+                q_expression = q_expression | rule_q_expression
+
+        if q_expression is None:
+            return None
+
+        return q_expression, annotations
+
+    def get_rule_candidate_filter(self, now):
+        """
+        Combines the server modified boundary and every criteria definition
+        that can be expressed in SQL. Criteria that can't be expressed are
+        skipped, which only widens the candidate set since criteria_match
+        is still run on every case that is returned.
+        """
+        q_expressions = []
+        annotations = {}
+
+        if self.filter_on_server_modified:
+            q_expressions.append(
+                Q(server_modified_on__lte=now - timedelta(days=self.server_modified_boundary))
+            )
+
+        for criteria in self.memoized_criteria:
+            candidate_filter = criteria.definition.get_candidate_filter(now)
+            if candidate_filter is not None:
+                q_expression, definition_annotations = candidate_filter
+                q_expressions.append(q_expression)
+                annotations.update(definition_annotations)
+
+        if not q_expressions:
+            return None
+
+        q_expression = q_expressions[0]
+        for other in q_expressions[1:]:
+            q_expression = q_expression & other
+
+        return q_expression, annotations
+
     @classmethod
-    def iter_cases(cls, domain, case_type, boundary_date=None, db=None):
+    def iter_cases(cls, domain, case_type, boundary_date=None, db=None, candidate_filter=None):
+        """
+        :param candidate_filter: (optional) a (Q, annotations) tuple from get_candidate_filter.
+        It is only applied for domains on the SQL backend.
+        """
         if should_use_sql_backend(domain):
-            return cls._iter_cases_from_postgres(domain, case_type, boundary_date=boundary_date, db=db)
+            return cls._iter_cases_from_postgres(domain, case_type, boundary_date=boundary_date, db=db,
+                                                 candidate_filter=candidate_filter)
         else:
             return cls._iter_cases_from_es(domain, case_type, boundary_date=boundary_date)
 
     @classmethod
-    def _iter_cases_from_postgres(cls, domain, case_type, boundary_date=None, db=None):
+    def _iter_cases_from_postgres(cls, domain, case_type, boundary_date=None, db=None, candidate_filter=None):
         q_expression = Q(
             domain=domain,
             type=case_type,
@@ -238,11 +302,17 @@ class AutomaticUpdateRule(models.Model):
         if boundary_date:
             q_expression = q_expression & Q(server_modified_on__lte=boundary_date)
 
+        annotate = None
+        if candidate_filter:
+            candidate_q_expression, annotate = candidate_filter
+            q_expression = q_expression & candidate_q_expression
+
         if db:
-            return paginate_query(db, CommCareCaseSQL, q_expression, load_source='auto_update_rule')
+            return paginate_query(db, CommCareCaseSQL, q_expression, annotate=annotate,
+                                  load_source='auto_update_rule')
         else:
             return paginate_query_across_partitioned_databases(
-                CommCareCaseSQL, q_expression, load_source='auto_update_rule'
+                CommCareCaseSQL, q_expression, annotate=annotate, load_source='auto_update_rule'
             )
 
     @classmethod
@@ -312,8 +382,21 @@ class AutomaticUpdateRule(models.Model):
             'create_schedule_instance_definition',
         ))
 
-    def run_rule(self, case, now):
+    @property
+    def can_batch_updates(self):
+        """
+        True when the rule's actions only update the case itself and nothing it
+        reads can be changed by updates to other cases, so its submissions
+        can be deferred to a CaseRuleUpdateBatch.
         """
+        return not self.references_parent_case and all(
+            isinstance(action.definition, UpdateCaseDefinition) for action in self.memoized_actions
+        )
+
+    def run_rule(self, case, now, update_batch=None):
+        """
+        :param update_batch: (optional) a CaseRuleUpdateBatch to add case updates to
+        instead of submitting them, only allowed when can_batch_updates is True.
         :return: CaseRuleActionResult object aggregating the results from all actions.
         """
         if self.deleted:
@@ -325,8 +408,11 @@ class AutomaticUpdateRule(models.Model):
         if not isinstance(case, (CommCareCase, CommCareCaseSQL)) or case.domain != self.domain:
             raise self.RuleError("Invalid case given")
 
+        if update_batch is not None and not self.can_batch_updates:
+            raise self.RuleError("Attempted to batch updates for a rule that can't batch updates")
+
         if self.criteria_match(case, now):
-            return self.run_actions_when_case_matches(case)
+            return self.run_actions_when_case_matches(case, update_batch=update_batch)
         else:
             return self.run_actions_when_case_does_not_match(case)
 
@@ -354,12 +440,12 @@ class AutomaticUpdateRule(models.Model):
 
         return True
 
-    def _run_method_on_action_definitions(self, case, method):
+    def _run_method_on_action_definitions(self, case, method, **kwargs):
         aggregated_result = CaseRuleActionResult()
 
         for action in self.memoized_actions:
             callable_method = getattr(action.definition, method)
-            result = callable_method(case, self)
+            result = callable_method(case, self, **kwargs)
             if not isinstance(result, CaseRuleActionResult):
                 raise TypeError("Expected CaseRuleActionResult")
 
@@ -367,7 +453,9 @@ class AutomaticUpdateRule(models.Model):
 
         return aggregated_result
 
-    def run_actions_when_case_matches(self, case):
+    def run_actions_when_case_matches(self, case, update_batch=None):
+        if update_batch is not None:
+            return self._run_method_on_action_definitions(case, 'when_case_matches', update_batch=update_batch)
         return self._run_method_on_action_definitions(case, 'when_case_matches')
 
     def run_actions_when_case_does_not_match(self, case):
@@ -483,6 +571,14 @@ class CaseRuleCriteriaDefinition(models.Model):
     def matches(self, case, now):
         raise NotImplementedError()
 
+    def get_candidate_filter(self, now):
+        """
+        :return: None if this definition can't be evaluated in SQL, otherwise
+        a (Q, annotations) tuple to apply to CommCareCaseSQL which selects
+        at least every case that matches() would return True for.
+        """
+        return None
+
 
 class MatchPropertyDefinition(CaseRuleCriteriaDefinition):
     # True when today < (the date in property_name + property_value days)
@@ -597,6 +693,48 @@ class MatchPropertyDefinition(CaseRuleCriteriaDefinition):
 
         return False
 
+    def get_candidate_filter(self, now):
+        if '/' in self.property_name or self.property_name in _CASE_MODEL_PROPERTY_NAMES:
+            # parent and host references and model fields aren't read from case_json
+            return None
+
+        alias = 'candidate_prop_%s' % hashlib.md5(self.property_name.encode('utf-8')).hexdigest()[:12]
+        annotations = {
+            alias: RawSQL('case_json ->> %s', (self.property_name,), output_field=TextField()),
+        }
+        has_value = Q(**{'%s__isnull' % alias: False})
+        is_missing = Q(**{'%s__isnull' % alias: True})
+
+        if self.match_type in (self.MATCH_DAYS_BEFORE, self.MATCH_DAYS_AFTER):
+            try:
+                days = int(self.property_value)
+            except (TypeError, ValueError):
+                return None
+
+            # Compare dates as ISO strings, padded by a day either side so that
+            # values with a time or timezone are never excluded. Values which
+            # don't look like ISO dates are left for the python check.
+            cutoff = (now - timedelta(days=days)).date()
+            is_iso_date = Q(**{'%s__regex' % alias: ALLOWED_DATE_REGEX.pattern})
+            if self.match_type == self.MATCH_DAYS_AFTER:
+                in_range = Q(**{'%s__lt' % alias: (cutoff + timedelta(days=2)).isoformat()})
+            else:
+                in_range = Q(**{'%s__gte' % alias: (cutoff - timedelta(days=1)).isoformat()})
+            q_expression = (is_iso_date & in_range) | (has_value & ~is_iso_date)
+        elif self.match_type == self.MATCH_EQUAL and self.property_value is not None:
+            q_expression = Q(**{alias: self.property_value})
+        elif self.match_type == self.MATCH_NOT_EQUAL and self.property_value is not None:
+            q_expression = is_missing | ~Q(**{alias: self.property_value})
+        elif self.match_type == self.MATCH_HAS_VALUE:
+            q_expression = has_value
+        elif self.match_type == self.MATCH_HAS_NO_VALUE:
+            # \W rather than \s since str.strip() treats more characters as whitespace
+            q_expression = is_missing | Q(**{'%s__regex' % alias: r'^\W*$'})
+        else:
+            return None
+
+        return q_expression, annotations
+
     def matches(self, case, now):
         return {
             self.MATCH_DAYS_BEFORE: self.check_days_before,
@@ -648,6 +786,21 @@ class ClosedParentDefinition(CaseRuleCriteriaDefinition):
 
         return False
 
+    def get_candidate_filter(self, now):
+        # The parent may live in another shard, so only the index is checked here
+        alias = 'candidate_index_%s_%s' % (
+            hashlib.md5(self.identifier.encode('utf-8')).hexdigest()[:12],
+            self.relationship_id,
+        )
+        annotations = {
+            alias: Exists(CommCareCaseIndexSQL.objects.filter(
+                case_id=OuterRef('case_id'),
+                identifier=self.identifier,
+                relationship_id=self.relationship_id,
+            )),
+        }
+        return Q(**{alias: True}), annotations
+
 
 class CaseRuleAction(models.Model):
     rule = models.ForeignKey('AutomaticUpdateRule', on_delete=models.PROTECT)
@@ -714,6 +867,13 @@ class CaseRuleActionResult(object):
         self.num_related_closes += result.num_related_closes
         self.num_creates += result.num_creates
 
+    def remove_result(self, result):
+        self.num_updates -= result.num_updates
+        self.num_closes -= result.num_closes
+        self.num_related_updates -= result.num_related_updates
+        self.num_related_closes -= result.num_related_closes
+        self.num_creates -= result.num_creates
+
     @property
     def total_updates(self):
         return (
@@ -791,7 +951,7 @@ class UpdateCaseDefinition(CaseRuleActionDefinition):
 
         self.properties_to_update = result
 
-    def when_case_matches(self, case, rule):
+    def when_case_matches(self, case, rule, update_batch=None):
         cases_to_update = defaultdict(dict)
 
         def _get_case_property_value(current_case, name):
@@ -851,10 +1011,13 @@ class UpdateCaseDefinition(CaseRuleActionDefinition):
         # Update / close the case
         properties = cases_to_update[case.case_id]
         if self.close_case or properties:
-            result = update_case(case.domain, case.case_id, case_properties=properties, close=self.close_case,
-                xmlns=AUTO_UPDATE_XMLNS)
+            if update_batch is not None:
+                update_batch.add(rule, case.case_id, properties, self.close_case)
+            else:
+                result = update_case(case.domain, case.case_id, case_properties=properties,
+                    close=self.close_case, xmlns=AUTO_UPDATE_XMLNS)
 
-            rule.log_submission(result[0].form_id)
+                rule.log_submission(result[0].form_id)
 
             if properties:
                 num_updates += 1
@@ -1177,6 +1340,66 @@ class CaseRuleSubmission(models.Model):
         )
 
 
+class CaseRuleUpdateBatch(object):
+    """
+    Collects the updates made by rules that can batch updates so that they are
+    submitted as one form per rule for up to `chunk_size` cases, and logs the
+    resulting CaseRuleSubmissions in one insert.
+    """
+
+    def __init__(self, domain, chunk_size=100):
+        self.domain = domain
+        self.chunk_size = chunk_size
+        # {rule id: (rule, {case id: (properties, close)})}
+        self.pending = {}
+        # the counts reported for the pending updates
+        self.pending_result = CaseRuleActionResult()
+
+    def __len__(self):
+        return sum(len(updates) for rule, updates in self.pending.values())
+
+    def add(self, rule, case_id, properties, close):
+        rule, updates = self.pending.setdefault(rule.pk, (rule, {}))
+        pending_properties, pending_close = updates.get(case_id, ({}, False))
+        updates[case_id] = (dict(pending_properties, **properties), pending_close or close)
+        if properties:
+            self.pending_result.num_updates += 1
+        if close:
+            self.pending_result.num_closes += 1
+
+    def flush(self):
+        submissions = []
+        for rule, updates in self.pending.values():
+            for chunk in chunked(updates.items(), self.chunk_size):
+                xform, cases = bulk_update_cases(
+                    self.domain,
+                    [(case_id, properties, close) for case_id, (properties, close) in chunk],
+                    device_id=None,
+                    xmlns=AUTO_UPDATE_XMLNS,
+                    user_id=SYSTEM_USER_ID,
+                )
+                submissions.append(CaseRuleSubmission(
+                    domain=self.domain,
+                    rule=rule,
+                    created_on=datetime.utcnow(),
+                    form_id=xform.form_id,
+                ))
+
+        CaseRuleSubmission.objects.bulk_create(submissions)
+        self.pending = {}
+        self.pending_result = CaseRuleActionResult()
+
+    def discard(self):
+        """
+        Drops the pending updates without submitting them.
+        :return: CaseRuleActionResult with the counts that were reported for them
+        """
+        result = self.pending_result
+        self.pending = {}
+        self.pending_result = CaseRuleActionResult()
+        return result
+
+
 class CaseRuleUndoer(object):
 
     def __init__(self, domain, rule_id=None, since=None):
@@ -1258,6 +1481,19 @@ class DomainCaseRuleRun(models.Model):
             ('domain', 'started_on'),
         )
 
+    @classmethod
+    def add_progress(cls, run_id, cases_checked, result):
+        """Adds to the counts of a run that is still in progress"""
+        with CriticalSection(['update-domain-case-rule-run-%s' % run_id]):
+            cls.objects.filter(pk=run_id).update(
+                cases_checked=models.F('cases_checked') + cases_checked,
+                num_updates=models.F('num_updates') + result.num_updates,
+                num_closes=models.F('num_closes') + result.num_closes,
+                num_related_updates=models.F('num_related_updates') + result.num_related_updates,
+                num_related_closes=models.F('num_related_closes') + result.num_related_closes,
+                num_creates=models.F('num_creates') + result.num_creates,
+            )
+
     @classmethod
     def done(cls, run_id, status, cases_checked, result, db=None):
         if not isinstance(result, CaseRuleActionResult):
@@ -9,6 +9,7 @@ from celery.schedules import crontab
 from celery.task import periodic_task, task
 from celery.utils.log import get_task_logger
 
+from dimagi.utils.chunked import chunked
 from dimagi.utils.couch import CriticalSection
 from dimagi.utils.logging import notify_error
 
@@ -17,6 +18,7 @@ from corehq.apps.data_interfaces.models import (
     AutomaticUpdateRule,
     CaseRuleActionResult,
     CaseRuleSubmission,
+    CaseRuleUpdateBatch,
     DomainCaseRuleRun,
 )
 from corehq.apps.data_interfaces.utils import (
@@ -33,7 +35,11 @@ from corehq.form_processor.interfaces.dbaccessors import (
 )
 from corehq.form_processor.utils.general import should_use_sql_backend
 from corehq.sql_db.util import get_db_aliases_for_partitioned_query
-from corehq.toggles import DISABLE_CASE_UPDATE_RULE_SCHEDULED_TASK
+from corehq.toggles import (
+    CASE_UPDATE_RULE_BATCHED_UPDATES,
+    CASE_UPDATE_RULE_CANDIDATE_FILTER,
+    DISABLE_CASE_UPDATE_RULE_SCHEDULED_TASK,
+)
 from corehq.util.decorators import serial_task
 from corehq.util.log import send_HTML_email
 
@@ -43,6 +49,7 @@ from .interfaces import BulkFormManagementInterface, FormManagementMode
 logger = get_task_logger('data_interfaces')
 ONE_HOUR = 60 * 60
 HALT_AFTER = 23 * 60 * 60
+RULE_RUN_BATCH_SIZE = 1000
 
 
 @task(serializer='pickle', ignore_result=True)
@@ -80,7 +87,7 @@ def run_case_update_rules(now=None):
             run_case_update_rules_for_domain.delay(domain, now)
 
 
-def run_rules_for_case(case, rules, now):
+def run_rules_for_case(case, rules, now, update_batch=None):
     aggregated_result = CaseRuleActionResult()
     last_result = None
     for rule in rules:
@@ -90,9 +97,12 @@ def run_rules_for_case(case, rules, now):
                 last_result.num_related_updates > 0 or
                 last_result.num_related_closes > 0
             ):
+                if update_batch:
+                    # the next rule needs to see this rule's updates
+                    update_batch.flush()
                 case = CaseAccessors(case.domain).get_case(case.case_id)
 
-        last_result = rule.run_rule(case, now)
+        last_result = rule.run_rule(case, now, update_batch=update_batch)
         aggregated_result.add_result(last_result)
         if last_result.num_closes > 0:
             break
@@ -143,35 +153,56 @@ def run_case_update_rules_for_domain_and_db(domain, now, run_id, case_type, db=N
     start_run = datetime.utcnow()
 
     last_migration_check_time = None
-    cases_checked = 0
     case_update_result = CaseRuleActionResult()
 
     all_rules = AutomaticUpdateRule.by_domain(domain, AutomaticUpdateRule.WORKFLOW_CASE_UPDATE)
     rules = list(all_rules.filter(case_type=case_type))
 
     boundary_date = AutomaticUpdateRule.get_boundary_date(rules, now)
-    for case in AutomaticUpdateRule.iter_cases(domain, case_type, boundary_date, db=db):
-        migration_in_progress, last_migration_check_time = check_data_migration_in_progress(
-            domain,
-            last_migration_check_time
-        )
-
-        time_elapsed = datetime.utcnow() - start_run
-        if (
-            time_elapsed.seconds > HALT_AFTER or
-            case_update_result.total_updates >= max_allowed_updates or
-            migration_in_progress
-        ):
-            DomainCaseRuleRun.done(run_id, DomainCaseRuleRun.STATUS_HALTED, cases_checked, case_update_result,
-                                   db=db)
-            notify_error("Halting rule run for domain %s and case type %s." % (domain, case_type))
-            return
-
-        case_update_result.add_result(run_rules_for_case(case, rules, now))
-        cases_checked += 1
-
-    run = DomainCaseRuleRun.done(run_id, DomainCaseRuleRun.STATUS_FINISHED, cases_checked, case_update_result,
-                                 db=db)
+    candidate_filter = None
+    if CASE_UPDATE_RULE_CANDIDATE_FILTER.enabled(domain):
+        candidate_filter = AutomaticUpdateRule.get_candidate_filter(rules, now)
+
+    update_batch = None
+    if CASE_UPDATE_RULE_BATCHED_UPDATES.enabled(domain) and all(rule.can_batch_updates for rule in rules):
+        update_batch = CaseRuleUpdateBatch(domain)
+
+    cases = AutomaticUpdateRule.iter_cases(domain, case_type, boundary_date, db=db,
+                                           candidate_filter=candidate_filter)
+    for case_batch in chunked(cases, RULE_RUN_BATCH_SIZE):
+        cases_checked = 0
+        batch_result = CaseRuleActionResult()
+        for case in case_batch:
+            migration_in_progress, last_migration_check_time = check_data_migration_in_progress(
+                domain,
+                last_migration_check_time
+            )
+
+            time_elapsed = datetime.utcnow() - start_run
+            if (
+                time_elapsed.seconds > HALT_AFTER or
+                case_update_result.total_updates + batch_result.total_updates >= max_allowed_updates or
+                migration_in_progress
+            ):
+                if update_batch and migration_in_progress:
+                    # pending updates are dropped during a migration and redone on the next run
+                    batch_result.remove_result(update_batch.discard())
+                elif update_batch:
+                    update_batch.flush()
+                DomainCaseRuleRun.done(run_id, DomainCaseRuleRun.STATUS_HALTED, cases_checked, batch_result,
+                                       db=db)
+                notify_error("Halting rule run for domain %s and case type %s." % (domain, case_type))
+                return
+
+            batch_result.add_result(run_rules_for_case(case, rules, now, update_batch=update_batch))
+            cases_checked += 1
+
+        if update_batch:
+            update_batch.flush()
+        DomainCaseRuleRun.add_progress(run_id, cases_checked, batch_result)
+        case_update_result.add_result(batch_result)
+
+    run = DomainCaseRuleRun.done(run_id, DomainCaseRuleRun.STATUS_FINISHED, 0, CaseRuleActionResult(), db=db)
 
     if run.status == DomainCaseRuleRun.STATUS_FINISHED:
         for rule in rules:
@@ -0,0 +1,123 @@
+from datetime import datetime
+
+from django.db.models import Q
+from django.test import SimpleTestCase
+
+from mock import Mock, PropertyMock, patch
+
+from corehq.apps.data_interfaces.models import (
+    AutomaticUpdateRule,
+    CaseRuleCriteria,
+    ClosedParentDefinition,
+    CustomMatchDefinition,
+    MatchPropertyDefinition,
+)
+
+
+class MatchPropertyCandidateFilterTest(SimpleTestCase):
+    now = datetime(2020, 6, 15, 12, 0)
+
+    def _get_filter(self, property_name, match_type, property_value=None):
+        definition = MatchPropertyDefinition(
+            property_name=property_name,
+            match_type=match_type,
+            property_value=property_value,
+        )
+        return definition.get_candidate_filter(self.now)
+
+    def _get_lookups(self, q_expression):
+        lookups = []
+        for child in q_expression.children:
+            if isinstance(child, Q):
+                lookups.extend(self._get_lookups(child))
+            else:
+                lookups.append(child)
+        return lookups
+
+    def test_equal(self):
+        q_expression, annotations = self._get_filter('status', MatchPropertyDefinition.MATCH_EQUAL, 'active')
+        [alias] = list(annotations)
+        self.assertEqual(self._get_lookups(q_expression), [(alias, 'active')])
+
+    def test_same_property_uses_same_annotation(self):
+        _, annotations1 = self._get_filter('status', MatchPropertyDefinition.MATCH_EQUAL, 'active')
+        _, annotations2 = self._get_filter('status', MatchPropertyDefinition.MATCH_HAS_VALUE)
+        _, annotations3 = self._get_filter('other', MatchPropertyDefinition.MATCH_HAS_VALUE)
+        self.assertEqual(list(annotations1), list(annotations2))
+        self.assertNotEqual(list(annotations1), list(annotations3))
+
+    def test_days_after_pads_cutoff(self):
+        q_expression, annotations = self._get_filter('edd', MatchPropertyDefinition.MATCH_DAYS_AFTER, '30')
+        [alias] = list(annotations)
+        self.assertIn(('%s__lt' % alias, '2020-05-18'), self._get_lookups(q_expression))
+
+    def test_days_before_pads_cutoff(self):
+        q_expression, annotations = self._get_filter('edd', MatchPropertyDefinition.MATCH_DAYS_BEFORE, '30')
+        [alias] = list(annotations)
+        self.assertIn(('%s__gte' % alias, '2020-05-15'), self._get_lookups(q_expression))
+
+    def test_unsupported(self):
+        self.assertIsNone(self._get_filter('parent/status', MatchPropertyDefinition.MATCH_EQUAL, 'a'))
+        self.assertIsNone(self._get_filter('owner_id', MatchPropertyDefinition.MATCH_EQUAL, 'a'))
+        self.assertIsNone(self._get_filter('_id', MatchPropertyDefinition.MATCH_EQUAL, 'a'))
+        self.assertIsNone(self._get_filter('status', MatchPropertyDefinition.MATCH_REGEX, '^a'))
+        self.assertIsNone(self._get_filter('status', MatchPropertyDefinition.MATCH_EQUAL))
+        self.assertIsNone(self._get_filter('edd', MatchPropertyDefinition.MATCH_DAYS_AFTER, 'x'))
+
+    def test_other_definitions(self):
+        self.assertIsNone(CustomMatchDefinition(name='custom').get_candidate_filter(self.now))
+        q_expression, annotations = ClosedParentDefinition().get_candidate_filter(self.now)
+        [alias] = list(annotations)
+        self.assertEqual(self._get_lookups(q_expression), [(alias, True)])
+
+
+class RuleCandidateFilterTest(SimpleTestCase):
+    now = datetime(2020, 6, 15, 12, 0)
+
+    def _get_rule(self, definitions, server_modified_boundary=None):
+        rule = AutomaticUpdateRule(
+            filter_on_server_modified=server_modified_boundary is not None,
+            server_modified_boundary=server_modified_boundary,
+        )
+        criteria = []
+        for definition in definitions:
+            criterion = CaseRuleCriteria()
+            criterion.definition = definition
+            criteria.append(criterion)
+        return rule, criteria
+
+    def _get_rule_candidate_filter(self, definitions, server_modified_boundary=None):
+        rule, criteria = self._get_rule(definitions, server_modified_boundary)
+        with patch.object(AutomaticUpdateRule, 'memoized_criteria', new_callable=PropertyMock) as mock:
+            mock.return_value = criteria
+            return rule.get_rule_candidate_filter(self.now)
+
+    def test_no_supported_criteria(self):
+        self.assertIsNone(self._get_rule_candidate_filter([CustomMatchDefinition(name='custom')]))
+
+    def test_server_modified_only(self):
+        q_expression, annotations = self._get_rule_candidate_filter([], server_modified_boundary=10)
+        self.assertEqual(annotations, {})
+        self.assertEqual(q_expression.children, [('server_modified_on__lte', datetime(2020, 6, 5, 12, 0))])
+
+    def test_unsupported_criteria_are_skipped(self):
+        q_expression, annotations = self._get_rule_candidate_filter([
+            CustomMatchDefinition(name='custom'),
+            MatchPropertyDefinition(property_name='status', match_type='EQUAL', property_value='active'),
+        ], server_modified_boundary=10)
+        self.assertEqual(len(annotations), 1)
+        self.assertEqual(q_expression.connector, Q.AND)
+        self.assertEqual(len(q_expression.children), 2)
+
+    def test_rules_are_combined_with_or(self):
+        rule1 = Mock(get_rule_candidate_filter=Mock(return_value=(Q(a=1), {'x': 1})))
+        rule2 = Mock(get_rule_candidate_filter=Mock(return_value=(Q(b=1), {'y': 1})))
+        q_expression, annotations = AutomaticUpdateRule.get_candidate_filter([rule1, rule2], self.now)
+        self.assertEqual(q_expression.connector, Q.OR)
+        self.assertEqual(annotations, {'x': 1, 'y': 1})
+
+    def test_any_unfiltered_rule_disables_filter(self):
+        rule1 = Mock(get_rule_candidate_filter=Mock(return_value=(Q(a=1), {})))
+        rule2 = Mock(get_rule_candidate_filter=Mock(return_value=None))
+        self.assertIsNone(AutomaticUpdateRule.get_candidate_filter([rule1, rule2], self.now))
+        self.assertIsNone(AutomaticUpdateRule.get_candidate_filter([], self.now))
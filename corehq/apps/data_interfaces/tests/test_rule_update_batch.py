@@ -0,0 +1,85 @@
+from datetime import datetime
+
+from django.test import SimpleTestCase
+
+from mock import Mock, patch
+
+from corehq.apps.data_interfaces.models import (
+    AUTO_UPDATE_XMLNS,
+    CaseRuleActionResult,
+    CaseRuleUpdateBatch,
+)
+from corehq.apps.data_interfaces.tasks import run_rules_for_case
+from corehq.apps.users.util import SYSTEM_USER_ID
+
+
+class CaseRuleUpdateBatchTest(SimpleTestCase):
+
+    def test_updates_to_same_case_are_merged(self):
+        rule = Mock(pk=1)
+        batch = CaseRuleUpdateBatch('domain')
+        batch.add(rule, 'case1', {'a': '1'}, False)
+        batch.add(rule, 'case1', {'b': '2'}, True)
+        batch.add(rule, 'case2', {'a': '1'}, False)
+        self.assertEqual(len(batch), 2)
+        self.assertEqual(batch.pending[1][1]['case1'], ({'a': '1', 'b': '2'}, True))
+
+    @patch('corehq.apps.data_interfaces.models.CaseRuleSubmission.objects')
+    @patch('corehq.apps.data_interfaces.models.bulk_update_cases')
+    def test_flush_submits_one_form_per_rule_and_chunk(self, bulk_update_cases, submission_objects):
+        bulk_update_cases.side_effect = lambda *args, **kwargs: (
+            Mock(form_id=len(bulk_update_cases.mock_calls)),
+            [],
+        )
+        rule1 = Mock(pk=1)
+        rule2 = Mock(pk=2)
+        batch = CaseRuleUpdateBatch('domain', chunk_size=2)
+        for case_id in ['a', 'b', 'c']:
+            batch.add(rule1, case_id, {'p': '1'}, False)
+        batch.add(rule2, 'd', {}, True)
+        batch.flush()
+
+        self.assertEqual(bulk_update_cases.call_count, 3)
+        self.assertEqual(bulk_update_cases.call_args_list[0][0], ('domain', [('a', {'p': '1'}, False),
+                                                                             ('b', {'p': '1'}, False)]))
+        self.assertEqual(bulk_update_cases.call_args_list[0][1]['xmlns'], AUTO_UPDATE_XMLNS)
+        self.assertEqual(bulk_update_cases.call_args_list[0][1]['user_id'], SYSTEM_USER_ID)
+        self.assertEqual(bulk_update_cases.call_args_list[2][0], ('domain', [('d', {}, True)]))
+
+        [submissions], kwargs = submission_objects.bulk_create.call_args
+        self.assertEqual([(s.rule, s.form_id) for s in submissions], [(rule1, 1), (rule1, 2), (rule2, 3)])
+        self.assertEqual(len(batch), 0)
+        self.assertEqual(batch.pending_result, CaseRuleActionResult())
+
+    @patch('corehq.apps.data_interfaces.models.bulk_update_cases')
+    def test_discard_returns_counts_of_dropped_updates(self, bulk_update_cases):
+        rule = Mock(pk=1)
+        batch = CaseRuleUpdateBatch('domain')
+        batch.add(rule, 'case1', {'a': '1'}, False)
+        batch.add(rule, 'case2', {'a': '1'}, True)
+        batch.add(rule, 'case3', {}, True)
+
+        self.assertEqual(batch.discard(), CaseRuleActionResult(num_updates=2, num_closes=2))
+        self.assertEqual(len(batch), 0)
+        self.assertEqual(batch.pending_result, CaseRuleActionResult())
+        batch.flush()
+        bulk_update_cases.assert_not_called()
+
+
+class RunRulesForCaseTest(SimpleTestCase):
+
+    @patch('corehq.apps.data_interfaces.tasks.CaseAccessors')
+    def test_batch_is_flushed_before_next_rule(self, case_accessors):
+        now = datetime.utcnow()
+        case = Mock(domain='domain', case_id='case1')
+        reloaded_case = case_accessors.return_value.get_case.return_value
+        batch = Mock()
+        rule1 = Mock(run_rule=Mock(return_value=CaseRuleActionResult(num_updates=1)))
+        rule2 = Mock(run_rule=Mock(return_value=CaseRuleActionResult()))
+
+        result = run_rules_for_case(case, [rule1, rule2], now, update_batch=batch)
+
+        self.assertEqual(result, CaseRuleActionResult(num_updates=1))
+        batch.flush.assert_called_once_with()
+        rule1.run_rule.assert_called_once_with(case, now, update_batch=batch)
+        rule2.run_rule.assert_called_once_with(reloaded_case, now, update_batch=batch)
@@ -3,8 +3,9 @@ from unittest.mock import patch, Mock
 
 from couchdbkit import ResourceNotFound
 
+from corehq.apps.data_interfaces.interfaces import FormManagementMode
 from corehq.apps.data_interfaces.utils import _get_ids, _validate_record, generate_ids_and_operate_on_payloads, \
-    operate_on_payloads
+    operate_on_payloads, archive_or_restore_forms
 
 
 class TestUtils(TestCase):
@@ -374,3 +375,116 @@ class TestTasks(TestCase):
         self.assertEqual(mock_payload_two.requeue.call_count, 0)
         self.assertEqual(mock_payload_two.save.call_count, 0)
         self.assertEqual(response, expected_response)
+
+
+@patch('corehq.apps.data_interfaces.utils._delete_unfinished_archive_stubs')
+@patch('corehq.form_processor.backends.sql.dbaccessors.FormAccessorSQL.get_forms')
+@patch('corehq.apps.data_interfaces.utils._create_unfinished_archive_stubs')
+@patch('corehq.apps.data_interfaces.utils._get_unfinished_archive_form_ids', return_value=set())
+@patch('casexml.apps.case.cleanup.rebuild_case_from_forms')
+@patch('casexml.apps.case.xform.get_case_ids_from_form')
+@patch('corehq.form_processor.interfaces.processor.FormProcessorInterface')
+@patch('corehq.form_processor.change_publishers.publish_forms_saved')
+@patch('corehq.form_processor.backends.sql.dbaccessors.FormAccessorSQL.set_archived_state_for_forms')
+@patch('corehq.apps.data_interfaces.utils.FormAccessors')
+@patch('corehq.apps.data_interfaces.utils.BULK_FORM_ARCHIVE_PIPELINE')
+@patch('corehq.apps.data_interfaces.utils.should_use_sql_backend', return_value=True)
+class TestBulkArchive(TestCase):
+
+    def _archive(self, mock_FormAccessors, toggle, forms, form_ids):
+        toggle.enabled.return_value = True
+        mock_FormAccessors.return_value.iter_forms.return_value = forms
+        return archive_or_restore_forms('test_domain', 'user_id', 'username', form_ids,
+                                        FormManagementMode(FormManagementMode.ARCHIVE_MODE))
+
+    def test_cases_rebuilt_once(self, should_use_sql_backend, toggle, mock_FormAccessors, set_archived_state,
+                                publish_forms_saved, FormProcessorInterface, get_case_ids_from_form,
+                                rebuild_case_from_forms, get_unfinished, create_stubs, get_forms,
+                                delete_stubs):
+        forms = [
+            Mock(form_id='f1', domain='test_domain', is_archived=False),
+            Mock(form_id='f2', domain='test_domain', is_archived=False),
+            Mock(form_id='f3', domain='test_domain', is_archived=True),
+        ]
+        get_case_ids_from_form.side_effect = lambda form: {'f1': {'c1', 'c2'}, 'f2': {'c2'}}[form.form_id]
+
+        response = self._archive(mock_FormAccessors, toggle, forms, ['f1', 'f2', 'f3', 'f4'])
+
+        set_archived_state.assert_called_once_with(forms[:2], True, 'user_id')
+        publish_forms_saved.assert_called_once_with(forms[:2])
+        self.assertEqual(
+            sorted(call[0][1] for call in rebuild_case_from_forms.call_args_list),
+            ['c1', 'c2'],
+        )
+        create_stubs.assert_called_once_with('test_domain', set(), 'user_id', True)
+        delete_stubs.assert_called_once_with({'f1', 'f2'})
+        self.assertEqual(len(response['messages']['success']), 3)
+        self.assertEqual(len(response['messages']['errors']), 1)
+
+    def test_unfinished_forms_are_finished_on_rerun(self, should_use_sql_backend, toggle, mock_FormAccessors,
+                                                    set_archived_state, publish_forms_saved,
+                                                    FormProcessorInterface, get_case_ids_from_form,
+                                                    rebuild_case_from_forms, get_unfinished, create_stubs,
+                                                    get_forms, delete_stubs):
+        forms = [
+            Mock(form_id='f1', domain='test_domain', is_archived=True),
+            Mock(form_id='f2', domain='test_domain', is_archived=True),
+        ]
+        get_unfinished.return_value = {'f1'}
+        get_case_ids_from_form.side_effect = lambda form: {'f1': {'c1'}, 'f2': {'c2'}}[form.form_id]
+        ledger_processor = FormProcessorInterface.return_value.ledger_processor
+
+        response = self._archive(mock_FormAccessors, toggle, forms, ['f1', 'f2'])
+
+        set_archived_state.assert_not_called()
+        ledger_processor.process_form_archived.assert_called_once_with(forms[0])
+        self.assertEqual([call[0][1] for call in rebuild_case_from_forms.call_args_list], ['c1'])
+        delete_stubs.assert_called_once_with({'f1'})
+        self.assertEqual(len(response['messages']['success']), 2)
+        self.assertEqual(response['messages']['errors'], [])
+
+    def test_failed_batch_creates_stubs(self, should_use_sql_backend, toggle, mock_FormAccessors,
+                                        set_archived_state, publish_forms_saved, FormProcessorInterface,
+                                        get_case_ids_from_form, rebuild_case_from_forms, get_unfinished,
+                                        create_stubs, get_forms, delete_stubs):
+        forms = [
+            Mock(form_id='f1', domain='test_domain', is_archived=False),
+            Mock(form_id='f2', domain='test_domain', is_archived=False),
+        ]
+        set_archived_state.side_effect = Exception('shard down')
+        # only the shard with f1 was updated
+        get_forms.return_value = [
+            Mock(form_id='f1', is_archived=True),
+            Mock(form_id='f2', is_archived=False),
+        ]
+
+        response = self._archive(mock_FormAccessors, toggle, forms, ['f1', 'f2'])
+
+        get_forms.assert_called_once_with(['f1', 'f2'])
+        publish_forms_saved.assert_not_called()
+        rebuild_case_from_forms.assert_not_called()
+        create_stubs.assert_called_once_with('test_domain', {'f1'}, 'user_id', True)
+        delete_stubs.assert_called_once_with(set())
+        self.assertEqual(response['messages']['success'], [])
+        self.assertEqual(len(response['messages']['errors']), 2)
+
+    def test_ledger_error_is_not_an_archive_error(self, should_use_sql_backend, toggle, mock_FormAccessors,
+                                                  set_archived_state, publish_forms_saved,
+                                                  FormProcessorInterface, get_case_ids_from_form,
+                                                  rebuild_case_from_forms, get_unfinished, create_stubs,
+                                                  get_forms, delete_stubs):
+        forms = [
+            Mock(form_id='f1', domain='test_domain', is_archived=False),
+            Mock(form_id='f2', domain='test_domain', is_archived=False),
+        ]
+        get_case_ids_from_form.return_value = set()
+        ledger_processor = FormProcessorInterface.return_value.ledger_processor
+        ledger_processor.process_form_archived.side_effect = [Exception('ledger'), None]
+
+        response = self._archive(mock_FormAccessors, toggle, forms, ['f1', 'f2'])
+
+        self.assertEqual(len(response['messages']['success']), 2)
+        [error] = response['messages']['errors']
+        self.assertIn('could not update its ledgers', error)
+        create_stubs.assert_called_once_with('test_domain', {'f1'}, 'user_id', True)
+        delete_stubs.assert_called_once_with({'f2'})
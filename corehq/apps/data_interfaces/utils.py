@@ -1,3 +1,5 @@
+from datetime import datetime
+
 from django.utils.translation import ugettext as _
 
 from couchdbkit import ResourceNotFound
@@ -6,9 +8,16 @@ from corehq.motech.repeaters.dbaccessors import get_repeat_records_by_payload_id
 from corehq.motech.repeaters.models import RepeatRecord
 from soil import DownloadBase
 
+from dimagi.utils.chunked import chunked
+from dimagi.utils.logging import notify_exception
+
 from corehq.apps.casegroups.models import CommCareCaseGroup
 from corehq.apps.hqcase.utils import get_case_by_identifier
 from corehq.form_processor.interfaces.dbaccessors import FormAccessors
+from corehq.form_processor.utils.general import should_use_sql_backend
+from corehq.toggles import BULK_FORM_ARCHIVE_PIPELINE
+
+BULK_ARCHIVE_CHUNK_SIZE = 100
 
 
 def add_cases_to_case_group(domain, case_group_id, uploaded_data):
@@ -55,34 +64,38 @@ def archive_or_restore_forms(domain, user_id, username, form_ids, archive_or_res
     if task:
         DownloadBase.set_progress(task, 0, len(form_ids))
 
-    for xform in FormAccessors(domain).iter_forms(form_ids):
-        missing_forms.discard(xform.form_id)
+    if should_use_sql_backend(domain) and BULK_FORM_ARCHIVE_PIPELINE.enabled(domain):
+        success_count = _archive_or_restore_forms_in_bulk(
+            domain, user_id, username, form_ids, archive_or_restore, response, missing_forms, task)
+    else:
+        for xform in FormAccessors(domain).iter_forms(form_ids):
+            missing_forms.discard(xform.form_id)
 
-        if xform.domain != domain:
-            response['errors'].append(_("XForm {form_id} does not belong to domain {domain}").format(
-                form_id=xform.form_id, domain=domain))
-            continue
+            if xform.domain != domain:
+                response['errors'].append(_("XForm {form_id} does not belong to domain {domain}").format(
+                    form_id=xform.form_id, domain=domain))
+                continue
 
-        xform_string = _("XForm {form_id} for domain {domain} by user '{username}'").format(
-            form_id=xform.form_id,
-            domain=xform.domain,
-            username=username)
+            xform_string = _("XForm {form_id} for domain {domain} by user '{username}'").format(
+                form_id=xform.form_id,
+                domain=xform.domain,
+                username=username)
 
-        try:
-            if archive_or_restore.is_archive_mode():
-                xform.archive(user_id=user_id)
-                message = _("Successfully archived {form}").format(form=xform_string)
-            else:
-                xform.unarchive(user_id=user_id)
-                message = _("Successfully unarchived {form}").format(form=xform_string)
-            response['success'].append(message)
-            success_count = success_count + 1
-        except Exception as e:
-            response['errors'].append(_("Could not archive {form}: {error}").format(
-                form=xform_string, error=e))
+            try:
+                if archive_or_restore.is_archive_mode():
+                    xform.archive(user_id=user_id)
+                    message = _("Successfully archived {form}").format(form=xform_string)
+                else:
+                    xform.unarchive(user_id=user_id)
+                    message = _("Successfully unarchived {form}").format(form=xform_string)
+                response['success'].append(message)
+                success_count = success_count + 1
+            except Exception as e:
+                response['errors'].append(_("Could not archive {form}: {error}").format(
+                    form=xform_string, error=e))
 
-        if task:
-            DownloadBase.set_progress(task, success_count, len(form_ids))
+            if task:
+                DownloadBase.set_progress(task, success_count, len(form_ids))
 
     for missing_form_id in missing_forms:
         response['errors'].append(
@@ -97,6 +110,164 @@ def archive_or_restore_forms(domain, user_id, username, form_ids, archive_or_res
     return {"messages": response}
 
 
+def _archive_or_restore_forms_in_bulk(domain, user_id, username, form_ids, archive_or_restore, response,
+                                      missing_forms, task=None):
+    """
+    Un/archive forms in SQL batches and rebuild every affected case once at the
+    end, rather than once per form as the xform_archived signal does.
+
+    UnfinishedArchiveStubs are only created at the end of the run, for forms
+    that were un/archived but whose ledgers or cases could not be processed,
+    so that reprocess_archive_stubs never works on forms that this run is
+    still processing. Forms that are already in the target state but still
+    have a stub are finished here too.
+
+    :return: the number of forms that were successfully un/archived
+    """
+    from casexml.apps.case.cleanup import rebuild_case_from_forms
+    from casexml.apps.case.xform import get_case_ids_from_form
+    from corehq.form_processor.backends.sql.dbaccessors import FormAccessorSQL
+    from corehq.form_processor.change_publishers import publish_forms_saved
+    from corehq.form_processor.interfaces.processor import FormProcessorInterface
+    from corehq.form_processor.models import RebuildWithReason
+
+    archive = archive_or_restore.is_archive_mode()
+    if archive:
+        success_text = _("Successfully archived {form}")
+        ledger_error_text = _("Archived {form} but could not update its ledgers: {error}")
+    else:
+        success_text = _("Successfully unarchived {form}")
+        ledger_error_text = _("Unarchived {form} but could not update its ledgers: {error}")
+
+    def _form_string(xform):
+        return _("XForm {form_id} for domain {domain} by user '{username}'").format(
+            form_id=xform.form_id,
+            domain=xform.domain,
+            username=username)
+
+    forms_to_update = []
+    forms_in_state = []
+    for xform in FormAccessors(domain).iter_forms(form_ids):
+        missing_forms.discard(xform.form_id)
+        if xform.domain != domain:
+            response['errors'].append(_("XForm {form_id} does not belong to domain {domain}").format(
+                form_id=xform.form_id, domain=domain))
+        elif xform.is_archived == archive:
+            forms_in_state.append(xform)
+        else:
+            forms_to_update.append(xform)
+
+    # forms left in the target state by an earlier run that did not finish them
+    unfinished_form_ids = _get_unfinished_archive_form_ids([xform.form_id for xform in forms_in_state], archive)
+    forms_to_finish = []
+    for xform in forms_in_state:
+        if xform.form_id in unfinished_form_ids:
+            forms_to_finish.append(xform)
+        else:
+            # nothing to do, same as calling xform.archive() on an archived form
+            response['success'].append(success_text.format(form=_form_string(xform)))
+
+    success_count = len(forms_in_state) - len(forms_to_finish)
+    ledger_processor = FormProcessorInterface(domain).ledger_processor
+    case_ids_by_form_id = {}
+    form_ids_with_errors = set()
+
+    def _finish_forms(forms):
+        publish_forms_saved(forms)
+        for xform in forms:
+            case_ids_by_form_id[xform.form_id] = get_case_ids_from_form(xform)
+            response['success'].append(success_text.format(form=_form_string(xform)))
+            try:
+                if archive:
+                    ledger_processor.process_form_archived(xform)
+                else:
+                    ledger_processor.process_form_unarchived(xform)
+            except Exception as e:
+                form_ids_with_errors.add(xform.form_id)
+                response['errors'].append(ledger_error_text.format(form=_form_string(xform), error=e))
+        return len(forms)
+
+    for forms in chunked(forms_to_finish, BULK_ARCHIVE_CHUNK_SIZE, list):
+        success_count += _finish_forms(forms)
+
+    for forms in chunked(forms_to_update, BULK_ARCHIVE_CHUNK_SIZE, list):
+        try:
+            FormAccessorSQL.set_archived_state_for_forms(forms, archive, user_id)
+        except Exception as e:
+            # some shards may have been updated, leave those forms to reprocess_archive_stubs
+            batch_form_ids = [xform.form_id for xform in forms]
+            form_ids_with_errors.update(
+                xform.form_id for xform in FormAccessorSQL.get_forms(batch_form_ids)
+                if xform.is_archived == archive
+            )
+            for xform in forms:
+                response['errors'].append(_("Could not archive {form}: {error}").format(
+                    form=_form_string(xform), error=e))
+            continue
+
+        success_count += _finish_forms(forms)
+
+        if task:
+            DownloadBase.set_progress(task, success_count, len(form_ids))
+
+    reason = "{} forms {} in bulk by {}".format(
+        len(case_ids_by_form_id), "archived" if archive else "unarchived", username)
+    case_ids_to_rebuild = set().union(*case_ids_by_form_id.values())
+    for case_id in case_ids_to_rebuild:
+        try:
+            rebuild_case_from_forms(domain, case_id, RebuildWithReason(reason=reason))
+        except Exception as e:
+            notify_exception(None, "Error rebuilding case after bulk form archive", details={
+                'domain': domain,
+                'case_id': case_id,
+            })
+            response['errors'].append(_("Could not rebuild case {case_id}: {error}").format(
+                case_id=case_id, error=e))
+            form_ids_with_errors.update(
+                form_id for form_id, case_ids in case_ids_by_form_id.items() if case_id in case_ids
+            )
+
+    _create_unfinished_archive_stubs(domain, form_ids_with_errors, user_id, archive)
+    _delete_unfinished_archive_stubs(set(case_ids_by_form_id) - form_ids_with_errors)
+    return success_count
+
+
+def _get_unfinished_archive_form_ids(form_ids, archive):
+    from couchforms.models import UnfinishedArchiveStub
+    if not form_ids:
+        return set()
+    return set(UnfinishedArchiveStub.objects.filter(
+        xform_id__in=form_ids, archive=archive
+    ).values_list('xform_id', flat=True))
+
+
+def _create_unfinished_archive_stubs(domain, form_ids, user_id, archive):
+    """Create stubs for forms whose archive history was updated but were not finished"""
+    from couchforms.models import UnfinishedArchiveStub
+    if not form_ids:
+        return
+    form_ids = list(form_ids)
+    UnfinishedArchiveStub.objects.filter(xform_id__in=form_ids).delete()
+    UnfinishedArchiveStub.objects.bulk_create([
+        UnfinishedArchiveStub(
+            xform_id=form_id,
+            user_id=user_id,
+            timestamp=datetime.utcnow(),
+            history_updated=True,
+            archive=archive,
+            domain=domain,
+            attempts=0,
+        )
+        for form_id in form_ids
+    ])
+
+
+def _delete_unfinished_archive_stubs(form_ids):
+    from couchforms.models import UnfinishedArchiveStub
+    if form_ids:
+        UnfinishedArchiveStub.objects.filter(xform_id__in=list(form_ids)).delete()
+
+
 def property_references_parent(case_property):
     return isinstance(case_property, str) and (
         case_property.startswith("parent/") or
@@ -0,0 +1,238 @@
+"""
+Columnar intermediate pages for multiprocess exports
+
+A raw export page is a gzipped file of JSON documents. Turning it into
+export rows means parsing every document and walking it once per
+selected column of every selected table. A columnar page stores the
+result of that work: only the values of the selected columns, grouped
+into row groups of ``ROW_GROUP_SIZE`` documents and stored column by
+column. Columns of integers and floats are stored as typed arrays and
+columns with many repeated values are dictionary encoded.
+
+Writers produce XLSX / CSV rows straight from a columnar page, so a page
+whose raw content has not changed since the last run of the same export
+(same page digest and same export configuration) does not need to be
+parsed or processed again. Exports with columns that look up user or case
+names (see ``LOOKUP_TRANSFORMS``) don't use columnar pages, since those
+names can change without the page changing.
+"""
+import gzip
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+from array import array
+
+from soil import DownloadBase
+
+from corehq.apps.export.models.new import ExportRow
+
+COLUMNAR_FORMAT_VERSION = 2
+
+COLUMNAR_CACHE_DIR = os.path.join(tempfile.gettempdir(), 'cchq_export_columnar')
+
+ROW_GROUP_SIZE = 1000
+
+INT_COLUMN = 'i'
+FLOAT_COLUMN = 'f'
+DICT_COLUMN = 'd'
+LIST_COLUMN = 'l'
+
+_INT_MIN = -2 ** 63
+_INT_MAX = 2 ** 63 - 1
+
+
+class ColumnarTable(object):
+    """The rows of one export table in a row group, stored column by column"""
+
+    def __init__(self):
+        self.columns = None
+        self.hyperlink_column_indices = []
+        self.skip_excel_formatting = []
+
+    def __len__(self):
+        return len(self.hyperlink_column_indices)
+
+    def append(self, row):
+        if self.columns is None:
+            self.columns = [[] for _ in row.data]
+        elif len(row.data) != len(self.columns):
+            raise ValueError("Row has {} values, expected {}".format(len(row.data), len(self.columns)))
+        for column, value in zip(self.columns, row.data):
+            column.append(value)
+        self.hyperlink_column_indices.append(tuple(row.hyperlink_column_indices))
+        self.skip_excel_formatting.append(tuple(row.skip_excel_formatting))
+
+    def iter_rows(self):
+        columns = self.columns or []
+        for index, (hyperlinks, skip_formatting) in enumerate(
+                zip(self.hyperlink_column_indices, self.skip_excel_formatting)):
+            yield ExportRow(
+                data=[column[index] for column in columns],
+                hyperlink_column_indices=list(hyperlinks),
+                skip_excel_formatting=list(skip_formatting),
+            )
+
+    def encode(self):
+        return (
+            [encode_column(column) for column in self.columns or []],
+            encode_column(self.hyperlink_column_indices),
+            encode_column(self.skip_excel_formatting),
+        )
+
+    @classmethod
+    def decode(cls, encoded):
+        columns, hyperlinks, skip_formatting = encoded
+        table = cls()
+        table.columns = [decode_column(column) for column in columns]
+        table.hyperlink_column_indices = decode_column(hyperlinks)
+        table.skip_excel_formatting = decode_column(skip_formatting)
+        return table
+
+
+def encode_column(values):
+    """Encode a list of values as compactly as their types allow
+
+    :returns: tuple of (column type, data)
+    """
+    if values and all(type(value) is int and _INT_MIN <= value <= _INT_MAX for value in values):
+        return INT_COLUMN, array('q', values)
+    if values and all(type(value) is float for value in values):
+        return FLOAT_COLUMN, array('d', values)
+    try:
+        # keyed by type too, so that 1, 1.0 and True don't share a code
+        codes_by_key = {}
+        codes = array('L')
+        for value in values:
+            codes.append(codes_by_key.setdefault((type(value), value), len(codes_by_key)))
+    except TypeError:
+        # unhashable values
+        return LIST_COLUMN, values
+    if len(codes_by_key) <= len(values) // 2:
+        return DICT_COLUMN, ([value for value_type, value in codes_by_key], codes)
+    return LIST_COLUMN, values
+
+
+def decode_column(encoded):
+    column_type, data = encoded
+    if column_type in (INT_COLUMN, FLOAT_COLUMN):
+        return data.tolist()
+    if column_type == DICT_COLUMN:
+        values, codes = data
+        return [values[code] for code in codes]
+    return data
+
+
+def get_export_fingerprint(export_instance):
+    """Hash of everything about the export that affects the rows in a page"""
+    config = {
+        'version': COLUMNAR_FORMAT_VERSION,
+        'tables': [table.to_json() for table in export_instance.selected_tables],
+        'split_multiselects': export_instance.split_multiselects,
+        'transform_dates': export_instance.transform_dates,
+    }
+    return hashlib.sha1(json.dumps(config, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def get_columnar_page_path(export_instance, page_digest):
+    """Path of the cached columnar page for a raw page with the given digest"""
+    return os.path.join(
+        COLUMNAR_CACHE_DIR,
+        export_instance.get_id,
+        '{}_{}.gz'.format(get_export_fingerprint(export_instance), page_digest),
+    )
+
+
+def build_columnar_page(export_instance, documents, path, progress_tracker=None):
+    """Extract the rows of all selected tables from the documents and
+    save them as a columnar page at ``path``.
+
+    The page is written to a temporary file first so that a partially
+    written page is never picked up by a later run.
+    """
+    tables = export_instance.selected_tables
+    extractors = [
+        table.get_row_extractor(
+            split_columns=export_instance.split_multiselects,
+            transform_dates=export_instance.transform_dates,
+        )
+        for table in tables
+    ]
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    os.close(fd)
+    try:
+        with gzip.open(temp_path, 'wb') as file:
+            pickle.dump((COLUMNAR_FORMAT_VERSION, documents.count), file)
+            group = _new_row_group(tables)
+            doc_count = 0
+            for row_number, doc in enumerate(documents):
+                for extractor, columnar_table in zip(extractors, group):
+                    for row in extractor.get_rows(doc, row_number):
+                        columnar_table.append(row)
+                doc_count += 1
+                if doc_count % ROW_GROUP_SIZE == 0:
+                    _dump_row_group(file, doc_count, group)
+                    group = _new_row_group(tables)
+                    if progress_tracker:
+                        DownloadBase.set_progress(progress_tracker, doc_count, documents.count)
+            if doc_count % ROW_GROUP_SIZE:
+                _dump_row_group(file, doc_count, group)
+        os.rename(temp_path, path)
+    except Exception:
+        os.remove(temp_path)
+        raise
+
+
+def _new_row_group(tables):
+    return [ColumnarTable() for _ in tables]
+
+
+def _dump_row_group(file, doc_count, group):
+    pickle.dump((doc_count, [table.encode() for table in group]), file, pickle.HIGHEST_PROTOCOL)
+
+
+def iter_row_groups(path):
+    """Yield (number of docs processed, [ColumnarTable, ...]) for each row group"""
+    with gzip.open(path, 'rb') as file:
+        version, total = pickle.load(file)
+        if version != COLUMNAR_FORMAT_VERSION:
+            raise ValueError("Unsupported columnar page version: {}".format(version))
+        while True:
+            try:
+                doc_count, tables = pickle.load(file)
+            except EOFError:
+                return
+            yield doc_count, [ColumnarTable.decode(table) for table in tables]
+
+
+def get_columnar_page_doc_count(path):
+    with gzip.open(path, 'rb') as file:
+        version, total = pickle.load(file)
+    return total
+
+
+def write_columnar_page(writer, export_instance, path, progress_tracker=None):
+    """Write the rows of a columnar page to an open _Writer"""
+    tables = export_instance.selected_tables
+    total = get_columnar_page_doc_count(path)
+    if progress_tracker:
+        DownloadBase.set_progress(progress_tracker, 0, total)
+    for doc_count, columnar_tables in iter_row_groups(path):
+        for table, columnar_table in zip(tables, columnar_tables):
+            writer.write_rows(table, list(columnar_table.iter_rows()))
+        if progress_tracker:
+            DownloadBase.set_progress(progress_tracker, doc_count, total)
+
+
+def prune_columnar_pages(export_id, keep_paths):
+    """Remove cached columnar pages of an export that are not in ``keep_paths``"""
+    export_dir = os.path.join(COLUMNAR_CACHE_DIR, export_id)
+    if not os.path.isdir(export_dir):
+        return
+    keep = {os.path.abspath(path) for path in keep_paths}
+    for filename in os.listdir(export_dir):
+        path = os.path.abspath(os.path.join(export_dir, filename))
+        if path not in keep:
+            os.remove(path)
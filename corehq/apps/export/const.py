@@ -48,6 +48,14 @@ TRANSFORM_FUNCTIONS = {
     CASE_OR_USER_ID_TRANSFORM: case_or_user_id_to_name,
     CASE_CLOSE_TO_BOOLEAN: case_close_to_boolean,
 }
+# Transforms that look up data outside of the exported document, so the
+# rows they produce can change even when the document has not changed
+LOOKUP_TRANSFORMS = {
+    CASE_NAME_TRANSFORM,
+    USERNAME_TRANSFORM,
+    OWNER_ID_TRANSFORM,
+    CASE_OR_USER_ID_TRANSFORM,
+}
 PLAIN_USER_DEFINED_SPLIT_TYPE = 'plain'
 MULTISELCT_USER_DEFINED_SPLIT_TYPE = 'multi-select'
 USER_DEFINED_SPLIT_TYPES = [
@@ -90,6 +98,9 @@ FORM_EXPORT = 'form'
 CASE_EXPORT = 'case'
 SMS_EXPORT = 'sms'
 MAX_EXPORTABLE_ROWS = 100000
+# Excel exports of more documents than this use the streaming XLSX writer
+# (for domains with the STREAMING_XLSX_EXPORTS toggle)
+STREAMING_XLSX_EXPORT_THRESHOLD = 100000
 CASE_SCROLL_SIZE = 10000
 
 # When a question is missing completely from a form/case this should be the value
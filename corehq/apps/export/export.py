@@ -11,7 +11,10 @@ from couchexport.models import Format
 from dimagi.utils.logging import notify_exception
 from soil import DownloadBase
 
-from corehq.apps.export.const import MAX_EXPORTABLE_ROWS
+from corehq.apps.export.const import (
+    MAX_EXPORTABLE_ROWS,
+    STREAMING_XLSX_EXPORT_THRESHOLD,
+)
 from corehq.apps.export.dbaccessors import get_properly_wrapped_export_instance
 from corehq.apps.export.esaccessors import (
     get_case_export_base_query,
@@ -24,7 +27,11 @@ from corehq.apps.export.models.new import (
     SMSExportInstance,
 )
 from corehq.elastic import iter_es_docs_from_query
-from corehq.toggles import PAGINATED_EXPORTS
+from corehq.toggles import (
+    INCREMENTAL_DAILY_SAVED_EXPORTS,
+    PAGINATED_EXPORTS,
+    STREAMING_XLSX_EXPORTS,
+)
 from corehq.util.datadog.gauges import datadog_histogram, datadog_track_errors
 from corehq.util.datadog.utils import DAY_SCALE_TIME_BUCKETS, load_counter
 from corehq.util.files import TransientTempfile, safe_filename
@@ -107,14 +114,26 @@ class _ExportWriter(object):
         :param row: An ExportRow
         """
         return self.writer.write([
-            (table, [FormattedRow(
-                data=row.data,
-                hyperlink_column_indices=row.hyperlink_column_indices,
-                skip_excel_formatting=row.skip_excel_formatting
-                if hasattr(row, 'skip_excel_formatting') else ()
-            )])
+            (table, [self._get_formatted_row(row)])
         ])
 
+    def write_rows(self, table, rows):
+        """
+        Write a block of rows to the given table of the export.
+        :param table: A TableConfiguration
+        :param rows: A list of ExportRows
+        """
+        return self.writer.write_rows(table, [self._get_formatted_row(row) for row in rows])
+
+    @staticmethod
+    def _get_formatted_row(row):
+        return FormattedRow(
+            data=row.data,
+            hyperlink_column_indices=row.hyperlink_column_indices,
+            skip_excel_formatting=row.skip_excel_formatting
+            if hasattr(row, 'skip_excel_formatting') else ()
+        )
+
     def get_preview(self):
         return self.writer.get_preview()
 
@@ -255,6 +274,30 @@ class _PaginatedExportWriter(object):
         :param table: A TableConfiguration
         :param row: An ExportRow
         """
+        self._next_page_if_full(table)
+        self.writer.write([(self._paged_table_index(table), [FormattedRow(data=row.data)])])
+        self.rows_written[table] += 1
+
+    def write_rows(self, table, rows):
+        """
+        Write a block of rows to the given table of the export, splitting
+        it across pages where a page fills up.
+        :param table: A TableConfiguration
+        :param rows: A list of ExportRows
+        """
+        start = 0
+        while start < len(rows):
+            self._next_page_if_full(table)
+            page_space = MAX_EXPORTABLE_ROWS * (self.pages[table] + 1) - self.rows_written[table]
+            block = rows[start:start + page_space]
+            self.writer.write_rows(
+                self._paged_table_index(table),
+                [FormattedRow(data=row.data) for row in block]
+            )
+            self.rows_written[table] += len(block)
+            start += len(block)
+
+    def _next_page_if_full(self, table):
         if self.rows_written[table] >= MAX_EXPORTABLE_ROWS * (self.pages[table] + 1):
             self.pages[table] += 1
             self.writer.add_table(
@@ -263,13 +306,12 @@ class _PaginatedExportWriter(object):
                 table_title=self._get_paginated_table_titles()[self._paged_table_index(table)],
             )
 
-        self.writer.write([(self._paged_table_index(table), [FormattedRow(data=row.data)])])
-        self.rows_written[table] += 1
-
 
-def get_export_writer(export_instances, temp_path, allow_pagination=True):
+def get_export_writer(export_instances, temp_path, allow_pagination=True, doc_count=None):
     """
     Return a new _Writer
+    :param doc_count: Number of documents that will be exported, if known.
+        Large Excel exports use a streaming writer.
     """
     format = Format.XLS_2007
     format_data_in_excel = False
@@ -278,7 +320,13 @@ def get_export_writer(export_instances, temp_path, allow_pagination=True):
         format = export_instances[0].export_format
         format_data_in_excel = export_instances[0].format_data_in_excel
 
-    legacy_writer = get_writer(format, use_formatted_cells=format_data_in_excel)
+    streaming = (
+        format == Format.XLS_2007
+        and doc_count is not None
+        and doc_count > STREAMING_XLSX_EXPORT_THRESHOLD
+        and STREAMING_XLSX_EXPORTS.enabled(export_instances[0].domain)
+    )
+    legacy_writer = get_writer(format, use_formatted_cells=format_data_in_excel, streaming=streaming)
 
     if allow_pagination and PAGINATED_EXPORTS.enabled(export_instances[0].domain):
         writer = _PaginatedExportWriter(legacy_writer, temp_path)
@@ -308,7 +356,10 @@ def get_export_file(export_instances, filters, temp_path, progress_tracker=None)
     """
     Return an export file for the given ExportInstance and list of filters
     """
-    writer = get_export_writer(export_instances, temp_path)
+    doc_count = None
+    if STREAMING_XLSX_EXPORTS.enabled(export_instances[0].domain):
+        doc_count = sum(get_export_size(export_instance, filters) for export_instance in export_instances)
+    writer = get_export_writer(export_instances, temp_path, doc_count=doc_count)
     with writer.open(export_instances):
         for export_instance in export_instances:
             docs = get_export_documents(export_instance, filters)
@@ -354,18 +405,20 @@ def write_export_instance(writer, export_instance, documents, progress_tracker=N
     compute_total = 0
     write_total = 0
     track_load = load_counter(export_instance.type, "export", export_instance.domain)
+    extractors = [
+        (table, table.get_row_extractor(
+            split_columns=export_instance.split_multiselects,
+            transform_dates=export_instance.transform_dates,
+        ))
+        for table in export_instance.selected_tables
+    ]
 
     for row_number, doc in enumerate(documents):
         total_bytes += sys.getsizeof(doc)
-        for table in export_instance.selected_tables:
+        for table, extractor in extractors:
             compute_start = _time_in_milliseconds()
             try:
-                rows = table.get_rows(
-                    doc,
-                    row_number,
-                    split_columns=export_instance.split_multiselects,
-                    transform_dates=export_instance.transform_dates,
-                )
+                rows = extractor.get_rows(doc, row_number)
             except Exception as e:
                 notify_exception(None, "Error exporting doc", details={
                     'domain': export_instance.domain,
@@ -378,10 +431,7 @@ def write_export_instance(writer, export_instance, documents, progress_tracker=N
             compute_total += _time_in_milliseconds() - compute_start
 
             write_start = _time_in_milliseconds()
-            for row in rows:
-                # It might be bad to write one row at a time when you can do more (from a performance perspective)
-                # Regardless, we should handle the batching of rows in the _Writer class, not here.
-                writer.write(table, row)
+            writer.write_rows(table, rows)
             write_total += _time_in_milliseconds() - write_start
 
             total_rows += len(rows)
@@ -474,6 +524,12 @@ def rebuild_export(export_instance, progress_tracker):
     """
     Rebuild the given daily saved ExportInstance
     """
+    if (INCREMENTAL_DAILY_SAVED_EXPORTS.enabled(export_instance.domain)
+            and isinstance(export_instance, (FormExportInstance, CaseExportInstance))):
+        from corehq.apps.export.incremental import rebuild_export_incrementally
+        rebuild_export_incrementally(export_instance, progress_tracker)
+        return
+
     filters = export_instance.get_filters()
     with TransientTempfile() as temp_path:
         export_file = get_export_file([export_instance], filters or [], temp_path, progress_tracker)
@@ -0,0 +1,296 @@
+"""
+Incremental rebuilds of daily saved exports
+
+A full rebuild of a daily saved export fetches and processes every
+document in the export, even when only a small fraction of them changed
+since the last rebuild. An incremental rebuild instead keeps the rows
+that each document produced in the last build (the "row blocks",
+saved as a blob on the export instance next to the export file) and:
+
+  * fetches only the documents modified since the last checkpoint
+    (``server_modified_on``) and extracts their rows
+  * gets the ids of all documents currently in the export so that
+    documents which were deleted or no longer match the filters are
+    dropped
+  * writes a new export file from the previous row blocks of the
+    unchanged documents, followed by the blocks of the changed and new
+    documents (which are spilled to a temporary file rather than held
+    in memory)
+
+The export falls back to a full rebuild (which saves the row blocks for
+the next run) when there is no previous build to start from, when the
+export configuration or filters changed since it (relative date filters
+change every day so those exports are always rebuilt in full), or when
+a large fraction of the documents changed. Exports with columns that
+look up user or case names are always rebuilt in full since those names
+can change without the document changing, and all exports are rebuilt
+in full every ``FULL_REBUILD_INTERVAL`` to pick up documents that were
+indexed too late to be seen as changed.
+"""
+import gzip
+import hashlib
+import heapq
+import json
+import pickle
+from array import array
+from bisect import bisect_left
+from datetime import datetime, timedelta
+
+from couchdbkit import ResourceConflict
+
+from dimagi.utils.chunked import chunked
+from soil import DownloadBase
+
+from corehq.apps.es import filters as es_filters
+from corehq.apps.export.columnar import get_export_fingerprint
+from corehq.apps.export.export import (
+    _get_export_query,
+    get_export_writer,
+)
+from corehq.apps.export.models.new import ExportRow
+from corehq.elastic import iter_es_docs_from_query
+from corehq.util.files import TransientTempfile
+from corehq.util.metrics import metrics_counter
+
+ROW_BLOCKS_VERSION = 1
+
+# Documents are indexed in ES some time after they are modified so the
+# next incremental build starts a while before this one did.
+CHECKPOINT_MARGIN = timedelta(hours=6)
+
+# Documents indexed more than CHECKPOINT_MARGIN late are only picked up by
+# a full rebuild, so rebuild in full at least this often
+FULL_REBUILD_INTERVAL = timedelta(days=7)
+
+# Rebuild in full if more than this fraction of the documents changed
+MAX_CHANGED_FRACTION = 0.5
+
+
+class DocIdSet(object):
+    """
+    Membership test for a large set of document ids using the 64 bit
+    hashes of the ids in a sorted array, which takes a fraction of the
+    memory a set of the ids would.
+    """
+    # ids are hashed and sorted in chunks of this size, which are then
+    # merged, so the ids never all need to be held in a list
+    SORT_CHUNK_SIZE = 1000000
+
+    def __init__(self, doc_ids):
+        sorted_chunks = [
+            array('Q', sorted(_hash_doc_id(doc_id) for doc_id in chunk))
+            for chunk in chunked(doc_ids, self.SORT_CHUNK_SIZE)
+        ]
+        self._hashes = array('Q', heapq.merge(*sorted_chunks))
+
+    def __len__(self):
+        return len(self._hashes)
+
+    def __contains__(self, doc_id):
+        doc_hash = _hash_doc_id(doc_id)
+        index = bisect_left(self._hashes, doc_hash)
+        return index < len(self._hashes) and self._hashes[index] == doc_hash
+
+
+def _hash_doc_id(doc_id):
+    return int.from_bytes(hashlib.md5(doc_id.encode('utf-8')).digest()[:8], 'big')
+
+
+class RowBlockWriter(object):
+    """
+    Writes the rows of each document, for each selected table, to a file
+    """
+
+    def __init__(self, fileobj):
+        self.file = gzip.GzipFile(fileobj=fileobj, mode='wb')
+        pickle.dump(ROW_BLOCKS_VERSION, self.file)
+
+    def write(self, doc_id, rows_by_table):
+        pickle.dump((doc_id, rows_by_table), self.file, pickle.HIGHEST_PROTOCOL)
+
+    def close(self):
+        self.file.close()
+
+
+def iter_row_blocks(fileobj):
+    """Yield (doc_id, rows_by_table) from a file written by RowBlockWriter"""
+    try:
+        with gzip.GzipFile(fileobj=fileobj, mode='rb') as file:
+            version = pickle.load(file)
+            if version != ROW_BLOCKS_VERSION:
+                raise ValueError("Unsupported row blocks version: {}".format(version))
+            while True:
+                try:
+                    yield pickle.load(file)
+                except EOFError:
+                    return
+    finally:
+        fileobj.close()
+
+
+def iter_spliced_blocks(previous_blocks, changed_blocks, changed_ids, current_ids):
+    """
+    Yield (doc_id, rows_by_table) for the new build
+
+    :param previous_blocks: iterable of (doc_id, rows_by_table) of the last build
+    :param changed_blocks: iterable of (doc_id, rows_by_table) for documents
+        modified since the last build, which are yielded after the unchanged ones
+    :param changed_ids: container of the ids of the documents in changed_blocks
+    :param current_ids: container of the ids of all documents in the export
+    """
+    for doc_id, rows_by_table in previous_blocks:
+        if doc_id not in changed_ids and doc_id in current_ids:
+            yield doc_id, rows_by_table
+    for doc_id, rows_by_table in changed_blocks:
+        yield doc_id, rows_by_table
+
+
+def get_incremental_fingerprint(export_instance, filters):
+    """Hash of the export configuration and filters that the row blocks depend on"""
+    filters_json = json.dumps([filter_.to_es_filter() for filter_ in filters], sort_keys=True, default=str)
+    return hashlib.sha1('{}:{}:{}'.format(
+        ROW_BLOCKS_VERSION,
+        get_export_fingerprint(export_instance),
+        filters_json,
+    ).encode('utf-8')).hexdigest()
+
+
+def can_update_incrementally(export_instance, fingerprint):
+    return bool(
+        export_instance.incremental_checkpoint
+        and export_instance.incremental_fingerprint == fingerprint
+        and export_instance.incremental_full_build
+        and export_instance.incremental_full_build > datetime.utcnow() - FULL_REBUILD_INTERVAL
+        and not export_instance.has_lookup_transforms
+        and export_instance.has_file()
+        and export_instance.has_row_blocks()
+    )
+
+
+def rebuild_export_incrementally(export_instance, progress_tracker=None, full=False):
+    """
+    Rebuild the given daily saved ExportInstance, only processing the
+    documents that changed since the last build where possible.
+
+    :param full: Force a full rebuild
+    :returns: True if the export was updated incrementally, False if it was
+        rebuilt in full
+    """
+    started = datetime.utcnow()
+    filters = export_instance.get_filters() or []
+    fingerprint = get_incremental_fingerprint(export_instance, filters)
+    query = _get_export_query(export_instance, filters)
+    extractors = [
+        table.get_row_extractor(
+            split_columns=export_instance.split_multiselects,
+            transform_dates=export_instance.transform_dates,
+        )
+        for table in export_instance.selected_tables
+    ]
+
+    with TransientTempfile() as temp_path, TransientTempfile() as row_blocks_path, \
+            TransientTempfile() as changed_blocks_path:
+        blocks, doc_count, incremental = _get_blocks(
+            export_instance, query, fingerprint, extractors, changed_blocks_path, full=full
+        )
+        writer = get_export_writer([export_instance], temp_path, doc_count=doc_count)
+        with open(row_blocks_path, 'wb') as row_blocks_file:
+            block_writer = RowBlockWriter(row_blocks_file)
+            with writer.open([export_instance]):
+                _write_blocks(
+                    writer, export_instance, extractors, blocks, block_writer, doc_count, progress_tracker
+                )
+            block_writer.close()
+
+        with open(temp_path, 'rb') as payload, open(row_blocks_path, 'rb') as row_blocks:
+            _save_incremental_export(
+                export_instance, payload, row_blocks, started, fingerprint, incremental
+            )
+
+    metrics_counter('commcare.export.incremental_rebuild', tags={
+        'mode': 'incremental' if incremental else 'full',
+    })
+    return incremental
+
+
+def _get_blocks(export_instance, query, fingerprint, extractors, changed_blocks_path, full=False):
+    """
+    :param changed_blocks_path: path of a temporary file to write the row
+        blocks of the changed documents to, which must exist until the
+        returned blocks have been consumed
+    :returns: tuple of (iterable of (doc_id, rows_by_table), number of
+        documents, whether this is an incremental build)
+    """
+    if not full and can_update_incrementally(export_instance, fingerprint):
+        changed_query = query.filter(
+            es_filters.date_range('server_modified_on', gte=export_instance.incremental_checkpoint)
+        )
+        doc_count = query.count()
+        if changed_query.count() <= doc_count * MAX_CHANGED_FRACTION:
+            current_ids = DocIdSet(query.scroll_ids())
+            changed_ids = _write_changed_blocks(extractors, changed_query, changed_blocks_path)
+            previous_blocks = iter_row_blocks(export_instance.get_row_blocks())
+            changed_blocks = iter_row_blocks(open(changed_blocks_path, 'rb'))
+            blocks = iter_spliced_blocks(previous_blocks, changed_blocks, changed_ids, current_ids)
+            return blocks, doc_count, True
+
+    docs = iter_es_docs_from_query(query)
+    blocks = ((doc['_id'], _extract_block(extractors, doc)) for doc in docs)
+    return blocks, docs.count, False
+
+
+def _write_changed_blocks(extractors, changed_query, path):
+    """Write the row blocks of the changed documents to path and return their ids"""
+    changed_ids = []
+    with open(path, 'wb') as changed_blocks_file:
+        block_writer = RowBlockWriter(changed_blocks_file)
+        for doc in iter_es_docs_from_query(changed_query):
+            block_writer.write(doc['_id'], _extract_block(extractors, doc))
+            changed_ids.append(doc['_id'])
+        block_writer.close()
+    return DocIdSet(changed_ids)
+
+
+def _extract_block(extractors, doc):
+    # row numbers are set when the block is written
+    return [[row.data for row in extractor.get_rows(doc, 0)] for extractor in extractors]
+
+
+def _write_blocks(writer, export_instance, extractors, blocks, block_writer, doc_count, progress_tracker):
+    tables = export_instance.selected_tables
+    if progress_tracker:
+        DownloadBase.set_progress(progress_tracker, 0, doc_count)
+
+    for row_number, (doc_id, rows_by_table) in enumerate(blocks):
+        for table, extractor, rows in zip(tables, extractors, rows_by_table):
+            for row_data in rows:
+                extractor.renumber_row(row_data, row_number)
+            writer.write_rows(table, [
+                ExportRow(
+                    data=row_data,
+                    hyperlink_column_indices=extractor.hyperlink_column_indices,
+                    skip_excel_formatting=extractor.skip_excel_formatting,
+                )
+                for row_data in rows
+            ])
+        block_writer.write(doc_id, rows_by_table)
+        if progress_tracker:
+            DownloadBase.set_progress(progress_tracker, row_number + 1, doc_count)
+
+
+def _save_incremental_export(export, payload, row_blocks, started, fingerprint, incremental):
+    if export.last_accessed is None:
+        export.last_accessed = datetime.utcnow()
+    export.last_updated = datetime.utcnow()
+    export.incremental_checkpoint = started - CHECKPOINT_MARGIN
+    export.incremental_fingerprint = fingerprint
+    if not incremental:
+        export.incremental_full_build = started
+
+    try:
+        with export.atomic_blobs():
+            export.set_payload(payload)
+            export.set_row_blocks(row_blocks)
+    except ResourceConflict:
+        # task was executed concurrently, so let first to finish win and abort the rest
+        pass
@@ -18,6 +18,8 @@ class Command(BaseCommand):
             type=int,
             dest='page_size',
             default=100000,
+            help='Number of docs in each page. Smaller pages spread the work more evenly '
+                 'across processes but add more files to the final export.'
         )
         parser.add_argument(
             '--processes',
@@ -26,6 +28,13 @@ class Command(BaseCommand):
             default=multiprocessing.cpu_count() - 1,
             help='Number of parallel processes to run.'
         )
+        parser.add_argument(
+            '--dumpers',
+            type=int,
+            dest='dumpers',
+            default=1,
+            help='Number of slices of the export to dump from ES in parallel.'
+        )
 
     def handle(self, **options):
         if __debug__:
@@ -34,7 +43,8 @@ class Command(BaseCommand):
         export_id = options.pop('export_id')
         page_size = options.pop('page_size')
         processes = options.pop('processes')
+        dumpers = options.pop('dumpers')
 
-        rebuild_export_mutiprocess(export_id, processes, page_size)
+        rebuild_export_mutiprocess(export_id, processes, page_size, dumpers)
 
         self.stdout.write(self.style.SUCCESS('Rebuild Complete'))
@@ -72,6 +72,7 @@ from corehq.apps.export.const import (
     FORM_EXPORT,
     FORM_ID_TO_LINK,
     KNOWN_CASE_PROPERTIES,
+    LOOKUP_TRANSFORMS,
     MISSING_VALUE,
     PLAIN_USER_DEFINED_SPLIT_TYPE,
     PROPERTY_TAG_CASE,
@@ -111,6 +112,7 @@ from corehq.util.timezones.utils import get_timezone_for_domain
 from corehq.util.view_utils import absolute_reverse
 
 DAILY_SAVED_EXPORT_ATTACHMENT_NAME = "payload"
+INCREMENTAL_ROW_BLOCKS_ATTACHMENT_NAME = "row_blocks"
 
 
 ExcelFormatValue = namedtuple('ExcelFormatValue', 'format value')
@@ -284,50 +286,13 @@ class ExportColumn(DocumentSchema):
         Transform the given value with the transform specified in self.item.transform.
         Also transform dates if the transform_dates flag is true.
         """
-
-        # When XML elements have additional attributes in them, the text node is
-        # put inside of the #text key. For example:
-        #
-        # <element id="123">value</element>  -> {'#text': 'value', 'id':'123'}
-        #
-        # Whereas elements without additional attributes just take on the string value:
-        #
-        # <element>value</element>  -> 'value'
-        #
-        # This line ensures that we grab the actual value instead of the dictionary
-        if isinstance(value, dict):
-            if '#text' in value:
-                value = value.get('#text')
-            else:
-                return EMPTY_VALUE
-
-        if transform_dates:
-            value = couch_to_excel_datetime(value, doc)
-        if self.item.transform:
-            value = TRANSFORM_FUNCTIONS[self.item.transform](value, doc)
-        if self.deid_transform:
-            try:
-                value = DEID_TRANSFORM_FUNCTIONS[self.deid_transform](value, doc)
-            except ValueError:
-                # Unable to convert the string to a date
-                pass
-        if value is None:
-            value = MISSING_VALUE
-
-        if isinstance(value, list):
-            def _serialize(str_or_dict):
-                """
-                Serialize old data for scalar questions that were previously a repeat
-
-                This is a total edge case. See https://manage.dimagi.com/default.asp?280549.
-                """
-                if isinstance(str_or_dict, dict):
-                    return ','.join('{}={}'.format(k, v) for k, v in str_or_dict.items())
-                else:
-                    return str_or_dict
-
-            value = ' '.join(_serialize(elem) for elem in value)
-        return value
+        return _transform_value(
+            value,
+            doc,
+            transform_dates,
+            TRANSFORM_FUNCTIONS[self.item.transform] if self.item.transform else None,
+            DEID_TRANSFORM_FUNCTIONS[self.deid_transform] if self.deid_transform else None,
+        )
 
     @staticmethod
     def create_default_from_export_item(table_path, item, app_ids_and_versions, auto_select=True):
@@ -608,6 +573,14 @@ class TableConfiguration(DocumentSchema):
             return index, column
         return None, None
 
+    def get_row_extractor(self, split_columns=False, transform_dates=False):
+        """
+        Return a TableRowExtractor which produces the same rows as get_rows
+        but with the per column work that does not depend on the document
+        done once up front. Use this when processing many documents.
+        """
+        return TableRowExtractor(self, split_columns=split_columns, transform_dates=transform_dates)
+
     @memoized
     def get_hyperlink_column_indices(self, split_columns):
         export_column_index = 0
@@ -649,7 +622,7 @@ class TableConfiguration(DocumentSchema):
             else:
                 next_doc = {}
             if path[0].is_repeat:
-                if type(next_doc) != list:
+                if not isinstance(next_doc, list):
                     # This happens when a repeat group has a single repeat iteration
                     next_doc = [next_doc]
                 new_docs.extend([
@@ -661,6 +634,160 @@ class TableConfiguration(DocumentSchema):
         return TableConfiguration._get_sub_documents_helper(document_id, path[1:], new_docs)
 
 
+class TableRowExtractor(object):
+    """
+    A TableConfiguration compiled for extracting rows from many documents.
+
+    Resolves the sub document path, each selected column's path relative
+    to the table and its transforms, the hyperlink column indices and the
+    RowNumberColumn indices once. Plain ExportColumns and RowNumberColumns
+    are evaluated inline; other column types fall back to their get_value.
+    """
+    _PATH = 'path'
+    _ROW_NUMBER = 'row_number'
+    _OTHER = 'other'
+
+    def __init__(self, table, split_columns=False, transform_dates=False):
+        self.table = table
+        self.path_steps = tuple((node.name, node.is_repeat) for node in table.path)
+        row_index_length = 1 + sum(1 for node in table.path if node.is_repeat)
+
+        self.columns = []
+        self.skip_excel_formatting = []
+        # (index, width) of each RowNumberColumn in a row
+        self.row_number_columns = []
+        col_index = 0
+        for column in table.selected_columns:
+            if isinstance(column, RowNumberColumn):
+                width = 1 + (row_index_length if row_index_length > 1 else 0)
+                self.row_number_columns.append((col_index, width))
+                # we never want to auto-format RowNumberColumn
+                # (always treat as text)
+                self.skip_excel_formatting.extend(range(col_index, col_index + width))
+                self.columns.append((self._ROW_NUMBER, None))
+            else:
+                width = len(column.get_headers(split_column=split_columns))
+                self.columns.append(self._compile_column(column, split_columns, transform_dates))
+            col_index += width
+        self.hyperlink_column_indices = table.get_hyperlink_column_indices(split_columns)
+
+    def _compile_column(self, column, split_columns, transform_dates):
+        base_path = self.table.path
+        if type(column) is not ExportColumn:
+            return self._OTHER, partial(
+                _get_column_value,
+                column.get_value,
+                base_path,
+                split_columns,
+                transform_dates,
+            )
+
+        assert base_path == column.item.path[:len(base_path)], \
+            "ExportItem's path doesn't start with the base_path"
+        return self._PATH, partial(
+            _get_path_value,
+            tuple(node.name for node in column.item.path[len(base_path):]),
+            transform_dates,
+            TRANSFORM_FUNCTIONS[column.item.transform] if column.item.transform else None,
+            DEID_TRANSFORM_FUNCTIONS[column.deid_transform] if column.deid_transform else None,
+        )
+
+    def _get_sub_documents(self, document, row_number):
+        """Same as TableConfiguration._get_sub_documents but iterative,
+        returning (row_index, doc) tuples"""
+        row_docs = [((row_number,), document)]
+        for path_name, is_repeat in self.path_steps:
+            new_docs = []
+            for row_index, doc in row_docs:
+                if isinstance(doc, dict):
+                    next_doc = doc.get(path_name, {})
+                else:
+                    next_doc = {}
+                if is_repeat:
+                    if type(next_doc) != list:
+                        # This happens when a repeat group has a single repeat iteration
+                        next_doc = [next_doc]
+                    new_docs.extend(
+                        (row_index + (new_doc_index,), new_doc)
+                        for new_doc_index, new_doc in enumerate(next_doc)
+                    )
+                elif next_doc:
+                    new_docs.append((row_index, next_doc))
+            row_docs = new_docs
+        return row_docs
+
+    def get_rows(self, document, row_number):
+        """
+        Return a list of ExportRows generated for the given document.
+        See TableConfiguration.get_rows
+        """
+        document_id = document.get('_id')
+        domain = document.get('domain')
+
+        assert domain is not None, 'Form or Case must be associated with domain'
+        assert document_id is not None, 'Form or Case must have an id'
+
+        rows = []
+        for row_index, doc in self._get_sub_documents(document, row_number):
+            row_data = []
+            for kind, get_value in self.columns:
+                if kind is self._PATH:
+                    row_data.append(get_value(doc))
+                    continue
+                if kind is self._ROW_NUMBER:
+                    val = [".".join([str(i) for i in row_index])] + (list(row_index) if len(row_index) > 1 else [])
+                else:
+                    val = get_value(domain, document_id, doc, row_index)
+                if isinstance(val, list):
+                    row_data.extend(val)
+                else:
+                    row_data.append(val)
+            rows.append(ExportRow(
+                data=row_data,
+                hyperlink_column_indices=self.hyperlink_column_indices,
+                skip_excel_formatting=self.skip_excel_formatting,
+            ))
+        return rows
+
+    def renumber_row(self, row_data, row_number):
+        """
+        Change the document row number in the RowNumberColumns of a row
+        extracted by this extractor (in place).
+        """
+        for col_index, width in self.row_number_columns:
+            row_data[col_index] = '.'.join([str(row_number)] + row_data[col_index].split('.')[1:])
+            if width > 1:
+                row_data[col_index + 1] = row_number
+
+
+def _get_path_value(path, transform_dates, transform, deid_transform, doc):
+    value = doc
+    for name in path:
+        if not isinstance(value, dict):
+            value = None
+            break
+        try:
+            value = value[name]
+        except KeyError:
+            value = None
+            break
+    if not path:
+        value = None
+    return _transform_value(value, doc, transform_dates, transform, deid_transform)
+
+
+def _get_column_value(get_value, base_path, split_column, transform_dates, domain, document_id, doc, row_index):
+    return get_value(
+        domain,
+        document_id,
+        doc,
+        base_path,
+        row_index=row_index,
+        split_column=split_column,
+        transform_dates=transform_dates,
+    )
+
+
 class DatePeriod(DocumentSchema):
     period_type = StringProperty(required=True)
     days = IntegerProperty()
@@ -763,6 +890,11 @@ class ExportInstance(BlobMixin, Document):
     last_accessed = DateTimeProperty()
     last_build_duration = IntegerProperty()
 
+    # Incremental daily saved exports, see corehq.apps.export.incremental
+    incremental_checkpoint = DateTimeProperty()
+    incremental_fingerprint = StringProperty()
+    incremental_full_build = DateTimeProperty()
+
     description = StringProperty(default='')
 
     sharing = StringProperty(default=SharingOption.EDIT_AND_EXPORT, choices=SharingOption.CHOICES)
@@ -810,6 +942,19 @@ class ExportInstance(BlobMixin, Document):
                     return True
         return False
 
+    @property
+    def has_lookup_transforms(self):
+        """
+        True if any selected column looks up data outside of the exported
+        documents, e.g. user names or case names. Rows of such an export
+        can't be reused from an earlier run.
+        """
+        return any(
+            column.item.transform in LOOKUP_TRANSFORMS
+            for table in self.selected_tables
+            for column in table.selected_columns
+        )
+
     @property
     def selected_tables(self):
         return [t for t in self.tables if t.selected]
@@ -1068,6 +1213,19 @@ class ExportInstance(BlobMixin, Document):
         """
         return self.fetch_attachment(DAILY_SAVED_EXPORT_ATTACHMENT_NAME, stream=stream)
 
+    def has_row_blocks(self):
+        """
+        Return True if the per-document rows of the last incremental build
+        are saved for this instance.
+        """
+        return INCREMENTAL_ROW_BLOCKS_ATTACHMENT_NAME in self.blobs
+
+    def set_row_blocks(self, row_blocks):
+        self.put_attachment(row_blocks, INCREMENTAL_ROW_BLOCKS_ATTACHMENT_NAME)
+
+    def get_row_blocks(self):
+        return self.fetch_attachment(INCREMENTAL_ROW_BLOCKS_ATTACHMENT_NAME, stream=True)
+
     def copy_export(self):
         export_json = self.to_json()
         del export_json['_id']
@@ -2247,6 +2405,58 @@ class SMSExportDataSchema(ExportDataSchema):
         return SMSExportDataSchema(domain=domain, include_metadata=include_metadata)
 
 
+def _transform_value(value, doc, transform_dates, transform=None, deid_transform=None):
+    """
+    Transform a value extracted from a document for an export column.
+
+    :param transform: one of TRANSFORM_FUNCTIONS or None
+    :param deid_transform: one of DEID_TRANSFORM_FUNCTIONS or None
+    """
+    # When XML elements have additional attributes in them, the text node is
+    # put inside of the #text key. For example:
+    #
+    # <element id="123">value</element>  -> {'#text': 'value', 'id':'123'}
+    #
+    # Whereas elements without additional attributes just take on the string value:
+    #
+    # <element>value</element>  -> 'value'
+    #
+    # This line ensures that we grab the actual value instead of the dictionary
+    if isinstance(value, dict):
+        if '#text' in value:
+            value = value.get('#text')
+        else:
+            return EMPTY_VALUE
+
+    if transform_dates:
+        value = couch_to_excel_datetime(value, doc)
+    if transform:
+        value = transform(value, doc)
+    if deid_transform:
+        try:
+            value = deid_transform(value, doc)
+        except ValueError:
+            # Unable to convert the string to a date
+            pass
+    if value is None:
+        value = MISSING_VALUE
+
+    if isinstance(value, list):
+        def _serialize(str_or_dict):
+            """
+            Serialize old data for scalar questions that were previously a repeat
+
+            This is a total edge case. See https://manage.dimagi.com/default.asp?280549.
+            """
+            if isinstance(str_or_dict, dict):
+                return ','.join('{}={}'.format(k, v) for k, v in str_or_dict.items())
+            else:
+                return str_or_dict
+
+        value = ' '.join(_serialize(elem) for elem in value)
+    return value
+
+
 def _string_path_to_list(path):
     return path if path is None else path[1:].split('/')
 
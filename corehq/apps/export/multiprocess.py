@@ -17,32 +17,59 @@ The export works as follows:
     * Unsuccessful results can be retried
   * Add successful pages to final ZIP archive
   * Add raw data dumps for unsuccessful pages to final ZIP archive
+
+For domains with the EXPORT_COLUMNAR_PAGES toggle the processes first convert
+each raw page into a columnar page (see corehq.apps.export.columnar) which is
+kept between runs. Pages whose raw content has not changed since the last run
+are written straight from the columnar page.
+
+With more than one dumper (see ``run_parallel_multiprocess_exporter``) the
+export query is split into slices by ``server_modified_on`` which are scrolled
+in parallel. Each slice dumps its own pages onto a shared queue so the pool is
+fed as soon as any slice has a page ready, and pages are added to the final
+ZIP archive as they complete rather than in page order at the end. The slices
+only cover documents modified before the export started. Documents modified
+since then are dumped once all slices are done, skipping any that a slice
+already dumped.
 """
 import gzip
+import hashlib
 import json
 import logging
 import multiprocessing
 import os
 import tempfile
+import threading
 import time
 import zipfile
 from collections import namedtuple
-from datetime import timedelta
+from contextlib import nullcontext
+from datetime import datetime, timedelta
 
-from six.moves.queue import Empty
+from six.moves.queue import Empty, Queue
 
 from couchexport.export import get_writer
 from couchexport.writers import ZippedExportWriter
 
+from corehq.apps.export.columnar import (
+    build_columnar_page,
+    get_columnar_page_path,
+    prune_columnar_pages,
+    write_columnar_page,
+)
+from corehq.apps.es import filters as es_filters
 from corehq.apps.export.dbaccessors import get_properly_wrapped_export_instance
 from corehq.apps.export.export import (
+    _get_export_query,
     get_export_documents,
     get_export_size,
     get_export_writer,
     save_export_payload,
     write_export_instance,
 )
-from corehq.elastic import ScanResult
+from corehq.apps.export.incremental import DocIdSet
+from corehq.elastic import ScanResult, iter_es_docs_from_query
+from corehq.toggles import EXPORT_COLUMNAR_PAGES
 from corehq.util.files import safe_filename
 
 TEMP_FILE_PREFIX = 'cchq_export_dump_'
@@ -58,10 +85,11 @@ ProgressValue = namedtuple('ProgressValue', 'page progress total')
 class BaseResult(object):
     success = False
 
-    def __init__(self, page_number, page_path, page_size):
+    def __init__(self, page_number, page_path, page_size, digest=None):
         self.page = page_number
         self.path = page_path
         self.page_size = page_size
+        self.digest = digest
 
 
 class SuccessResult(BaseResult):
@@ -69,14 +97,14 @@ class SuccessResult(BaseResult):
 
 
 class RetryResult(BaseResult):
-    def __init__(self, page_number, page_path, page_size, retry_count):
-        super(RetryResult, self).__init__(page_number, page_path, page_size)
+    def __init__(self, page_number, page_path, page_size, retry_count, digest=None):
+        super(RetryResult, self).__init__(page_number, page_path, page_size, digest)
         self.retry_count = retry_count
 
 
 class QueuedResult(RetryResult):
-    def __init__(self, async_result, page_number, page_path, page_size, retry_count):
-        super(QueuedResult, self).__init__(page_number, page_path, page_size, retry_count)
+    def __init__(self, async_result, page_number, page_path, page_size, retry_count, digest=None):
+        super(QueuedResult, self).__init__(page_number, page_path, page_size, retry_count, digest)
         self.async_result = async_result
 
 
@@ -87,6 +115,7 @@ class OutputPaginator(object):
         self.page = start_page_count
         self.page_size = 0
         self.file = None
+        self.digest = None
 
     def __enter__(self):
         self._new_file()
@@ -98,6 +127,7 @@ class OutputPaginator(object):
         fileobj = tempfile.NamedTemporaryFile(prefix=prefix, mode='wb', delete=False)
         self.path = fileobj.name
         self.file = gzip.GzipFile(fileobj=fileobj)
+        self.digest = hashlib.sha1()
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.file.close()
@@ -113,23 +143,43 @@ class OutputPaginator(object):
 
     def write(self, doc):
         self.page_size += 1
-        self.file.write('{}\n'.format(json.dumps(doc)))
+        line = '{}\n'.format(json.dumps(doc)).encode('utf-8')
+        self.digest.update(line)
+        self.file.write(line)
 
     def get_result(self):
-        return RetryResult(self.page, self.path, self.page_size, 0)
+        return RetryResult(self.page, self.path, self.page_size, 0, self.digest.hexdigest())
 
 
-def rebuild_export_mutiprocess(export_id, num_processes, page_size=100000):
+def rebuild_export_mutiprocess(export_id, num_processes, page_size=100000, num_dumpers=1):
     assert num_processes > 0
+    assert num_dumpers > 0
 
     export_instance = get_properly_wrapped_export_instance(export_id)
     filters = export_instance.get_filters()
     total_docs = get_export_size(export_instance, filters)
-    exporter = MultiprocessExporter(export_instance, total_docs, num_processes)
-    paginator = OutputPaginator(export_id)
+    # columnar pages are reused when a page has not changed, which would
+    # keep stale user and case names from lookup transforms
+    columnar = (
+        EXPORT_COLUMNAR_PAGES.enabled(export_instance.domain)
+        and not export_instance.has_lookup_transforms
+    )
+    exporter = MultiprocessExporter(export_instance, total_docs, num_processes, columnar=columnar)
 
     logger.info('Starting data dump of {} docs'.format(total_docs))
-    run_multiprocess_exporter(exporter, filters, paginator, page_size)
+    if num_dumpers > 1:
+        query = _get_export_query(export_instance, filters)
+        snapshot = datetime.utcnow()
+        query_slices = get_export_query_slices(query, num_dumpers, snapshot)
+        late_query = query.filter(es_filters.date_range('server_modified_on', gte=snapshot))
+        run_parallel_multiprocess_exporter(exporter, query_slices, page_size, late_query)
+    else:
+        paginator = OutputPaginator(export_id)
+        run_multiprocess_exporter(exporter, filters, paginator, page_size)
+    if columnar and not exporter.premature_exit:
+        # this was a full rebuild so pages from earlier runs that were
+        # not used this time are not going to match again
+        prune_columnar_pages(export_id, exporter.columnar_paths)
 
 
 def run_multiprocess_exporter(exporter, filters, paginator, page_size):
@@ -150,7 +200,165 @@ def run_multiprocess_exporter(exporter, filters, paginator, page_size):
     exporter.wait_till_completion()
 
 
-def run_export_with_logging(export_instance, page_number, dump_path, doc_count, attempts):
+def get_export_query_slices(query, num_slices, snapshot):
+    """Split an export query into ``num_slices`` queries on ``server_modified_on``
+    with roughly the same number of documents each, plus one query for
+    documents without ``server_modified_on``.
+
+    Slices are made of whole days of the daily histogram of the field so
+    a single busy day is never split. They only include documents modified
+    before ``snapshot`` so that a document modified while the slices are
+    scrolled can't move from one slice to another.
+    """
+    before_snapshot = es_filters.date_range('server_modified_on', lt=snapshot)
+    result = query.filter(before_snapshot).size(0).date_histogram('modified', 'server_modified_on', 'day').run()
+    counts = [(bucket['key'], bucket['doc_count']) for bucket in result.aggregations.modified.raw_buckets]
+    boundaries = [
+        datetime.utcfromtimestamp(key / 1000)
+        for key in _get_slice_boundaries(counts, num_slices)
+    ]
+    edges = [None] + boundaries + [snapshot]
+    query_slices = [
+        query.filter(es_filters.date_range('server_modified_on', gte=gte, lt=lt))
+        for gte, lt in zip(edges, edges[1:])
+    ]
+    query_slices.append(query.filter(es_filters.missing('server_modified_on')))
+    return query_slices
+
+
+def _get_slice_boundaries(counts, num_slices):
+    """
+    :param counts: list of (bucket key, doc count) in bucket order
+    :returns: the keys of the buckets that start a new slice, at most
+        ``num_slices - 1`` of them
+    """
+    total = sum(count for key, count in counts)
+    target = total / num_slices
+    boundaries = []
+    cumulative = 0
+    for key, count in counts:
+        if cumulative and cumulative >= target * (len(boundaries) + 1) and len(boundaries) < num_slices - 1:
+            boundaries.append(key)
+        cumulative += count
+    return boundaries
+
+
+def run_parallel_multiprocess_exporter(exporter, query_slices, page_size, late_query=None):
+    """Dump each query slice in its own thread and process pages as they
+    become available from any slice.
+
+    Dumping is bound by ES so threads are enough to scroll the slices in
+    parallel, and they leave the pool processes free for the rows.
+
+    :param late_query: Query for documents modified since the slices were
+    made. It is dumped once all slices are done, without the documents that
+    the slices already dumped.
+    """
+    page_queue = Queue()
+    export_id = exporter.export_instance.get_id
+    id_paths = [_get_temp_path() if late_query else None for query in query_slices]
+    dumpers = [
+        threading.Thread(
+            target=_dump_query_slice, args=(export_id, query, page_size, page_queue, id_path), daemon=True
+        )
+        for query, id_path in zip(query_slices, id_paths)
+    ]
+    try:
+        with exporter:
+            for dumper in dumpers:
+                dumper.start()
+            page_number = _process_dumped_pages(exporter, page_queue, len(dumpers), 0)
+
+            if late_query:
+                dumped_ids = DocIdSet(_iter_lines(id_paths))
+                threading.Thread(
+                    target=_dump_query_slice,
+                    args=(export_id, late_query, page_size, page_queue, None, dumped_ids),
+                    daemon=True,
+                ).start()
+                _process_dumped_pages(exporter, page_queue, 1, page_number)
+    finally:
+        for id_path in id_paths:
+            if id_path and os.path.exists(id_path):
+                os.remove(id_path)
+
+    exporter.wait_till_completion()
+
+
+def _process_dumped_pages(exporter, page_queue, num_dumpers, page_number):
+    """Process pages from ``page_queue`` until ``num_dumpers`` are done
+
+    :returns: the number of the last page
+    """
+    running = num_dumpers
+    while running:
+        try:
+            dumped_page = page_queue.get(timeout=5)
+        except Empty:
+            exporter.add_completed_pages()
+            continue
+        if dumped_page is None:
+            running -= 1
+            continue
+        if isinstance(dumped_page, Exception):
+            raise dumped_page
+        page_number += 1
+        logger.info('  Dump page {} complete: {} docs'.format(page_number, dumped_page.page_size))
+        exporter.process_page(RetryResult(
+            page_number, dumped_page.path, dumped_page.page_size, 0, dumped_page.digest
+        ))
+        exporter.add_completed_pages()
+    return page_number
+
+
+def _get_temp_path():
+    fd, path = tempfile.mkstemp(prefix=TEMP_FILE_PREFIX)
+    os.close(fd)
+    return path
+
+
+def _iter_lines(paths):
+    for path in paths:
+        with open(path, 'r', encoding='utf-8') as file:
+            for line in file:
+                yield line.rstrip('\n')
+
+
+def _dump_query_slice(export_id, query, page_size, page_queue, id_path=None, skip_ids=()):
+    """Dump the documents of a query slice to pages and put each one on the
+    queue once its file is closed. Puts None on the queue when done or the
+    exception if the dump failed.
+
+    :param id_path: File to write the ids of the dumped documents to
+    :param skip_ids: Container of ids of documents not to dump
+    """
+    try:
+        paginator = OutputPaginator(export_id)
+        with paginator, (open(id_path, 'w', encoding='utf-8') if id_path else nullcontext()) as id_file:
+            for doc in iter_es_docs_from_query(query):
+                if doc['_id'] in skip_ids:
+                    continue
+                paginator.write(doc)
+                if id_file:
+                    id_file.write(doc['_id'] + '\n')
+                if paginator.page_size == page_size:
+                    dumped_page = paginator.get_result()
+                    paginator.next_page()
+                    page_queue.put(dumped_page)
+            dumped_page = paginator.get_result()
+        if dumped_page.page_size:
+            page_queue.put(dumped_page)
+        else:
+            os.remove(dumped_page.path)
+    except Exception as e:
+        logger.exception('Error dumping export slice')
+        page_queue.put(e)
+    else:
+        page_queue.put(None)
+
+
+def run_export_with_logging(export_instance, page_number, dump_path, doc_count, attempts,
+                            columnar_path=None):
     """Log any exceptions here since logging on the other side of the process queue
     won't show the traceback
     """
@@ -159,7 +367,9 @@ def run_export_with_logging(export_instance, page_number, dump_path, doc_count,
     update_frequency = min(1000, int(doc_count // 10) or 1)
     progress_tracker = LoggingProgressTracker(page_number, progress_queue, update_frequency)
     try:
-        result = run_export(export_instance, page_number, dump_path, doc_count, progress_tracker)
+        result = run_export(
+            export_instance, page_number, dump_path, doc_count, progress_tracker, columnar_path
+        )
         if progress_queue:
             # just to make sure we set progress to 100%
             progress_queue.put(ProgressValue(page_number, doc_count, doc_count))
@@ -170,19 +380,44 @@ def run_export_with_logging(export_instance, page_number, dump_path, doc_count,
         raise
 
 
-def run_export(export_instance, page_number, dump_path, doc_count, progress_tracker=None):
+def run_export(export_instance, page_number, dump_path, doc_count, progress_tracker=None,
+               columnar_path=None):
+    if columnar_path:
+        return _run_columnar_export(
+            export_instance, page_number, dump_path, doc_count, progress_tracker, columnar_path
+        )
     docs = _get_export_documents_from_file(dump_path, doc_count)
     export_file_path = _get_export_file_path(export_instance, docs, progress_tracker)
     return SuccessResult(page_number, export_file_path, doc_count)
 
 
-def _get_export_documents_from_file(dump_path, doc_count):
+def _run_columnar_export(export_instance, page_number, dump_path, doc_count, progress_tracker,
+                         columnar_path):
+    if os.path.exists(columnar_path):
+        logger.info('    Reusing columnar page for page {}'.format(page_number))
+    else:
+        docs = _get_export_documents_from_file(dump_path, doc_count, remove=False)
+        build_columnar_page(export_instance, docs, columnar_path, progress_tracker)
+
+    export_instances = [export_instance]
+    fd, temp_path = tempfile.mkstemp()
+    os.close(fd)
+    writer = get_export_writer(export_instances, temp_path, allow_pagination=False, doc_count=doc_count)
+    with writer.open(export_instances):
+        write_columnar_page(writer, export_instance, columnar_path, progress_tracker)
+    if os.path.exists(dump_path):
+        os.remove(dump_path)
+    return SuccessResult(page_number, writer.path, doc_count)
+
+
+def _get_export_documents_from_file(dump_path, doc_count, remove=True):
     """Mimic the results of an ES scroll query but get results from jsonlines file"""
     def _doc_iter():
         with gzip.open(dump_path) as file:
             for line in file:
                 yield json.loads(line.decode())
-        os.remove(dump_path)
+        if remove:
+            os.remove(dump_path)
 
     return ScanResult(doc_count, _doc_iter())
 
@@ -193,7 +428,7 @@ def _get_export_file_path(export_instance, docs, progress_tracker=None):
     # so TransientTempfile isn't appropriate here
     fd, temp_path = tempfile.mkstemp()
     os.close(fd)
-    writer = get_export_writer(export_instances, temp_path, allow_pagination=False)
+    writer = get_export_writer(export_instances, temp_path, allow_pagination=False, doc_count=docs.count)
     with writer.open(export_instances):
         write_export_instance(writer, export_instance, docs, progress_tracker)
         return writer.path
@@ -227,8 +462,11 @@ class LoggingProgressTracker(object):
 class MultiprocessExporter(object):
     """Helper class to manage multi-process exporting"""
 
-    def __init__(self, export_instance, total_docs, num_processes, existing_archive_path=None, keep_file=False):
+    def __init__(self, export_instance, total_docs, num_processes, existing_archive_path=None, keep_file=False,
+                 columnar=False):
         self.keep_file = keep_file
+        self.columnar = columnar
+        self.columnar_paths = set()
         self.export_instance = export_instance
         self.existing_archive_path = existing_archive_path
         self.results = []
@@ -250,6 +488,7 @@ class MultiprocessExporter(object):
 
         self.is_zip = isinstance(get_writer(export_instance.export_format), ZippedExportWriter)
         self.premature_exit = False
+        self._final_zip = None
 
     def __enter__(self):
         self.start()
@@ -268,12 +507,20 @@ class MultiprocessExporter(object):
                            - page: page number (int)
                            - path: path to raw data dump
                            - page_size: number of docs in raw data dump
+                           - digest: (optional) hash of the raw data dump
         """
         attempts = page_info.retry_count + 1
+        digest = getattr(page_info, 'digest', None)
+        columnar_path = None
+        if self.columnar and digest:
+            columnar_path = get_columnar_page_path(self.export_instance, digest)
+            self.columnar_paths.add(columnar_path)
         self.progress_queue.put(ProgressValue(page_info.page, 0, page_info.page_size))
-        args = self.export_instance, page_info.page, page_info.path, page_info.page_size, attempts
+        args = self.export_instance, page_info.page, page_info.path, page_info.page_size, attempts, columnar_path
         result = self.pool.apply_async(self.export_function, args=args)
-        self.results.append(QueuedResult(result, page_info.page, page_info.path, page_info.page_size, attempts))
+        self.results.append(QueuedResult(
+            result, page_info.page, page_info.path, page_info.page_size, attempts, digest
+        ))
 
     def wait_till_completion(self):
         results = self.get_results()
@@ -289,31 +536,51 @@ class MultiprocessExporter(object):
             while self.results:
                 queued_result = self.results[0]
                 try:
-                    export_results.append(queued_result.async_result.get(timeout=5))
-                    self.results.pop(0)
+                    result = self._get_result(queued_result, retries_per_page, timeout=5)
                 except KeyboardInterrupt:
                     logger.error('Exiting before all results received.')
                     self.premature_exit = True
                     export_results.extend(self.results)
                     return export_results
                 except multiprocessing.TimeoutError:
-                    pass
-                except Exception:
-                    logger.exception(
-                        "Error getting results for page %s after %s tries",
-                        queued_result.page,
-                        queued_result.retry_count
-                    )
-                    self.results.pop(0)
-                    if queued_result.retry_count < retries_per_page:
-                        self.process_page(queued_result)
-                    else:
-                        export_results.append(queued_result)
+                    continue
+                self.results.remove(queued_result)
+                if result:
+                    export_results.append(result)
         finally:
             self.stop()
 
         return export_results
 
+    def add_completed_pages(self, retries_per_page=3):
+        """Add the pages that have finished processing to the final archive
+        without waiting for the pages before them"""
+        for queued_result in [result for result in self.results if result.async_result.ready()]:
+            self.results.remove(queued_result)
+            result = self._get_result(queued_result, retries_per_page)
+            if result:
+                self._add_result_to_zip(self._get_final_zip(), result)
+
+    def _get_result(self, queued_result, retries_per_page, timeout=None):
+        """
+        :returns: the result of the page, the QueuedResult if the page failed
+            too many times or None if it has been queued again
+        """
+        try:
+            return queued_result.async_result.get(timeout=timeout)
+        except multiprocessing.TimeoutError:
+            raise
+        except Exception:
+            logger.exception(
+                "Error getting results for page %s after %s tries",
+                queued_result.page,
+                queued_result.retry_count
+            )
+            if queued_result.retry_count < retries_per_page:
+                self.process_page(queued_result)
+                return None
+            return queued_result
+
     def stop(self):
         self._safe_terminate(self.pool)
         self._safe_terminate(self.progress)
@@ -341,30 +608,37 @@ class MultiprocessExporter(object):
                 compression=zipfile.ZIP_DEFLATED, allowZip64=True
             )
 
+    def _get_final_zip(self):
+        if self._final_zip is None:
+            self._final_zip = self._get_zipfile_for_final_archive()
+        return self._final_zip
+
     def build_final_export(self, export_results):
-        base_name = safe_filename(self.export_instance.name or 'Export')
-        final_zip = self._get_zipfile_for_final_archive()
+        final_zip = self._get_final_zip()
         with final_zip:
-            pages = len(export_results)
             for result in export_results:
-                if not result.success:
-                    logger.error('  Error in page %s so not added to final output', result.page)
-                    if os.path.exists(result.path):
-                        raw_dump_path = result.path
-                        logger.info('    Adding raw dump of page %s to final output', result.page)
-                        destination = '{}/page_{}.json.gz'.format(UNPROCESSED_PAGES_DIR, result.page)
-                        final_zip.write(raw_dump_path, destination, zipfile.ZIP_STORED)
-                        os.remove(raw_dump_path)
-                    continue
-
-                logger.info('  Adding page {} of {} to final file'.format(result.page, pages))
-                if self.is_zip:
-                    _add_compressed_page_to_zip(final_zip, result.page, result.path)
-                else:
-                    final_zip.write(result.path, '{}_{}'.format(base_name, result.page))
-
+                self._add_result_to_zip(final_zip, result)
+        self._final_zip = None
         return final_zip.filename
 
+    def _add_result_to_zip(self, final_zip, result):
+        if not result.success:
+            logger.error('  Error in page %s so not added to final output', result.page)
+            if os.path.exists(result.path):
+                raw_dump_path = result.path
+                logger.info('    Adding raw dump of page %s to final output', result.page)
+                destination = '{}/page_{}.json.gz'.format(UNPROCESSED_PAGES_DIR, result.page)
+                final_zip.write(raw_dump_path, destination, zipfile.ZIP_STORED)
+                os.remove(raw_dump_path)
+            return
+
+        logger.info('  Adding page {} to final file'.format(result.page))
+        if self.is_zip:
+            _add_compressed_page_to_zip(final_zip, result.page, result.path)
+        else:
+            base_name = safe_filename(self.export_instance.name or 'Export')
+            final_zip.write(result.path, '{}_{}'.format(base_name, result.page))
+
     def upload(self, final_path):
         logger.info('Uploading final export')
         with open(final_path, 'rb') as payload:
@@ -387,8 +661,11 @@ def _output_progress(queue, total_docs):
     logger.debug('Starting progress reporting process')
     page_progress = {}
     progress = total_dumped = 0
-    start = time.time()
-    while total_dumped == 0 or progress < total_dumped:
+    start = last_report = time.time()
+    last_progress = 0
+    # with parallel dumpers processing can catch up with dumping before
+    # all the docs are dumped so wait for the expected number of docs too
+    while total_dumped == 0 or progress < max(total_dumped, total_docs):
         try:
             poll_start = time.time()
             while time.time() - poll_start < 20:
@@ -398,8 +675,12 @@ def _output_progress(queue, total_docs):
             pass
         total_dumped = sum(val.total for val in page_progress.values())
         progress = sum(val.progress for val in page_progress.values())
-        elapsed = time.time() - start
+        now = time.time()
+        elapsed = now - start
         docs_per_second = progress / elapsed
+        current_docs_per_second = (progress - last_progress) / (now - last_report)
+        dumped_per_second = total_dumped / elapsed
+        last_report, last_progress = now, progress
         docs_remaining = total_docs - progress
         try:
             time_remaining = docs_remaining / docs_per_second
@@ -411,12 +692,16 @@ def _output_progress(queue, total_docs):
             logger.info(
                 '{progress} of {total} ({percent}%) ({dumped} dumped) processed in {elapsed} '
                 '(Estimated completion in {remaining}) '
-                '(Avg processing rate: {rate} docs per sec)'.format(
+                '(Avg processing rate: {rate} docs per sec) '
+                '(Current processing rate: {current_rate} docs per sec) '
+                '(Avg dump rate: {dump_rate} docs per sec)'.format(
                     progress=progress,
                     total=total_docs,
                     percent=int(progress * 100 // total_docs),
                     dumped=total_dumped,
                     elapsed=elapsed,
                     remaining=time_remaining,
-                    rate=int(docs_per_second)
+                    rate=int(docs_per_second),
+                    current_rate=int(current_docs_per_second),
+                    dump_rate=int(dumped_per_second),
                 ))
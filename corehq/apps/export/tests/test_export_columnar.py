@@ -0,0 +1,194 @@
+import os
+import shutil
+import tempfile
+
+from django.test import SimpleTestCase
+
+from mock import Mock, patch
+
+from corehq.apps.export.columnar import (
+    DICT_COLUMN,
+    FLOAT_COLUMN,
+    INT_COLUMN,
+    LIST_COLUMN,
+    build_columnar_page,
+    decode_column,
+    encode_column,
+    get_columnar_page_path,
+    prune_columnar_pages,
+    write_columnar_page,
+)
+from corehq.apps.export.const import CASE_ID_TO_LINK, USERNAME_TRANSFORM
+from corehq.apps.export.models import (
+    ExportColumn,
+    FormExportInstance,
+    PathNode,
+    RowNumberColumn,
+    ScalarItem,
+    TableConfiguration,
+)
+from corehq.elastic import ScanResult
+
+
+class EncodeColumnTest(SimpleTestCase):
+
+    def _assert_round_trip(self, values, column_type):
+        encoded = encode_column(values)
+        self.assertEqual(encoded[0], column_type)
+        decoded = decode_column(encoded)
+        # compare types too, since 1 == 1.0 == True
+        self.assertEqual([(type(value), value) for value in decoded], [(type(value), value) for value in values])
+
+    def test_int(self):
+        self._assert_round_trip([1, 2, 3], INT_COLUMN)
+
+    def test_bool_is_not_int(self):
+        self._assert_round_trip([True, False, 1], LIST_COLUMN)
+
+    def test_float(self):
+        self._assert_round_trip([1.5, 2.0], FLOAT_COLUMN)
+
+    def test_repeated_values(self):
+        self._assert_round_trip(['a', 'b', 'a', 'a', None, 'b'], DICT_COLUMN)
+
+    def test_distinct_values(self):
+        self._assert_round_trip(['a', 'b', 2, None], LIST_COLUMN)
+
+    def test_mixed_types(self):
+        self._assert_round_trip([1, 1.0, 1, 1, True, 0, 0.0, False, 2.0, 2] * 2, DICT_COLUMN)
+
+    def test_unhashable(self):
+        self._assert_round_trip([['a'], ['a'], ['a']], LIST_COLUMN)
+
+
+class _RowCollector(object):
+
+    def __init__(self):
+        self.rows = []
+
+    def write(self, table, row):
+        self.rows.append((table, row.data, row.hyperlink_column_indices, row.skip_excel_formatting))
+
+    def write_rows(self, table, rows):
+        for row in rows:
+            self.write(table, row)
+
+
+class ColumnarPageTest(SimpleTestCase):
+
+    def setUp(self):
+        self.tables = [
+            TableConfiguration(
+                path=[PathNode(name='form', is_repeat=False)],
+                columns=[
+                    RowNumberColumn(selected=True),
+                    ExportColumn(
+                        item=ScalarItem(path=[PathNode(name='form'), PathNode(name='q1')]),
+                        selected=True,
+                    ),
+                ],
+            ),
+            TableConfiguration(
+                path=[PathNode(name='form', is_repeat=False), PathNode(name='repeat', is_repeat=True)],
+                columns=[
+                    ExportColumn(
+                        item=ScalarItem(path=[
+                            PathNode(name='form'),
+                            PathNode(name='repeat', is_repeat=True),
+                            PathNode(name='q2'),
+                        ]),
+                        selected=True,
+                    ),
+                ],
+            ),
+        ]
+        self.export_instance = Mock(
+            get_id='export-id',
+            selected_tables=self.tables,
+            split_multiselects=False,
+            transform_dates=False,
+        )
+        self.docs = [
+            {
+                '_id': str(i),
+                'domain': 'my-domain',
+                'form': {'q1': i % 2, 'repeat': [{'q2': 'a'}, {'q2': 'b'}][:i % 3]},
+            }
+            for i in range(7)
+        ]
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+
+    def _expected_rows(self):
+        writer = _RowCollector()
+        for row_number, doc in enumerate(self.docs):
+            for table in self.tables:
+                for row in table.get_rows(doc, row_number):
+                    writer.write(table, row)
+        return sorted(writer.rows, key=lambda row: self.tables.index(row[0]))
+
+    @patch('corehq.apps.export.columnar.ROW_GROUP_SIZE', 3)
+    def test_rows_match(self):
+        path = os.path.join(self.dir, 'page.gz')
+        build_columnar_page(self.export_instance, ScanResult(len(self.docs), iter(self.docs)), path)
+        writer = _RowCollector()
+        write_columnar_page(writer, self.export_instance, path)
+        self.assertEqual(
+            sorted(writer.rows, key=lambda row: self.tables.index(row[0])),
+            self._expected_rows(),
+        )
+
+    def test_failed_build_leaves_no_page(self):
+        def _docs():
+            yield self.docs[0]
+            raise ValueError
+
+        path = os.path.join(self.dir, 'page.gz')
+        with self.assertRaises(ValueError):
+            build_columnar_page(self.export_instance, ScanResult(2, _docs()), path)
+        self.assertEqual(os.listdir(self.dir), [])
+
+    def test_page_path_depends_on_export_config(self):
+        with patch('corehq.apps.export.columnar.COLUMNAR_CACHE_DIR', self.dir):
+            path = get_columnar_page_path(self.export_instance, 'abc')
+            self.assertEqual(path, get_columnar_page_path(self.export_instance, 'abc'))
+            self.assertNotEqual(path, get_columnar_page_path(self.export_instance, 'def'))
+            self.export_instance.split_multiselects = True
+            self.assertNotEqual(path, get_columnar_page_path(self.export_instance, 'abc'))
+
+    def test_prune(self):
+        with patch('corehq.apps.export.columnar.COLUMNAR_CACHE_DIR', self.dir):
+            keep = get_columnar_page_path(self.export_instance, 'abc')
+            remove = get_columnar_page_path(self.export_instance, 'def')
+            build_columnar_page(self.export_instance, ScanResult(1, iter(self.docs[:1])), keep)
+            build_columnar_page(self.export_instance, ScanResult(1, iter(self.docs[:1])), remove)
+            prune_columnar_pages('export-id', [keep])
+            self.assertTrue(os.path.exists(keep))
+            self.assertFalse(os.path.exists(remove))
+
+
+class LookupTransformsTest(SimpleTestCase):
+
+    def _get_export_instance(self, transform):
+        return FormExportInstance(tables=[
+            TableConfiguration(
+                selected=True,
+                path=[PathNode(name='form', is_repeat=False)],
+                columns=[
+                    ExportColumn(
+                        item=ScalarItem(
+                            path=[PathNode(name='form'), PathNode(name='meta'), PathNode(name='userID')],
+                            transform=transform,
+                        ),
+                        selected=True,
+                    ),
+                ],
+            ),
+        ])
+
+    def test_lookup_transform(self):
+        self.assertTrue(self._get_export_instance(USERNAME_TRANSFORM).has_lookup_transforms)
+
+    def test_other_transforms(self):
+        self.assertFalse(self._get_export_instance(CASE_ID_TO_LINK).has_lookup_transforms)
+        self.assertFalse(self._get_export_instance(None).has_lookup_transforms)
@@ -0,0 +1,152 @@
+import io
+from datetime import datetime, timedelta
+
+from django.test import SimpleTestCase
+
+from mock import Mock, patch
+
+from corehq.apps.es import filters
+from corehq.apps.export.incremental import (
+    DocIdSet,
+    RowBlockWriter,
+    can_update_incrementally,
+    get_incremental_fingerprint,
+    iter_row_blocks,
+    iter_spliced_blocks,
+)
+from corehq.apps.export.models import (
+    ExportColumn,
+    PathNode,
+    RowNumberColumn,
+    ScalarItem,
+    TableConfiguration,
+)
+
+
+class _Filter(object):
+
+    def __init__(self, es_filter):
+        self.es_filter = es_filter
+
+    def to_es_filter(self):
+        return self.es_filter
+
+
+class DocIdSetTest(SimpleTestCase):
+
+    def test_contains(self):
+        doc_ids = DocIdSet(iter(['a', 'b', 'c']))
+        self.assertEqual(len(doc_ids), 3)
+        self.assertIn('b', doc_ids)
+        self.assertNotIn('d', doc_ids)
+
+    def test_empty(self):
+        self.assertNotIn('a', DocIdSet([]))
+
+    @patch.object(DocIdSet, 'SORT_CHUNK_SIZE', 3)
+    def test_merged_chunks(self):
+        doc_ids = ['id{}'.format(i) for i in range(10)]
+        doc_id_set = DocIdSet(iter(doc_ids))
+        self.assertEqual(len(doc_id_set), 10)
+        self.assertTrue(all(doc_id in doc_id_set for doc_id in doc_ids))
+        self.assertNotIn('id10', doc_id_set)
+
+
+class RowBlocksTest(SimpleTestCase):
+
+    def test_round_trip(self):
+        blocks = [('a', [[['1', 'x']], []]), ('b', [[['2', 'y'], ['3', 'z']], [['w']]])]
+        fileobj = io.BytesIO()
+        writer = RowBlockWriter(fileobj)
+        for doc_id, rows_by_table in blocks:
+            writer.write(doc_id, rows_by_table)
+        writer.close()
+        self.assertEqual(list(iter_row_blocks(io.BytesIO(fileobj.getvalue()))), blocks)
+
+    def test_splice(self):
+        previous = [('a', ['a1']), ('b', ['b1']), ('c', ['c1']), ('d', ['d1'])]
+        changed = [('e', ['e2']), ('b', ['b2'])]
+        current_ids = {'a', 'b', 'd', 'e'}
+        self.assertEqual(
+            list(iter_spliced_blocks(iter(previous), iter(changed), {'b', 'e'}, current_ids)),
+            [('a', ['a1']), ('d', ['d1']), ('e', ['e2']), ('b', ['b2'])],
+        )
+
+
+class IncrementalFingerprintTest(SimpleTestCase):
+
+    def setUp(self):
+        self.export_instance = Mock(
+            selected_tables=[TableConfiguration(path=[], columns=[])],
+            split_multiselects=False,
+            transform_dates=True,
+            incremental_checkpoint=datetime(2020, 1, 1),
+            incremental_full_build=datetime.utcnow() - timedelta(days=1),
+            has_lookup_transforms=False,
+        )
+        self.export_instance.has_file.return_value = True
+        self.export_instance.has_row_blocks.return_value = True
+
+    def test_filters_change_fingerprint(self):
+        fingerprint = get_incremental_fingerprint(self.export_instance, [_Filter(filters.term('a', 'b'))])
+        self.assertEqual(
+            fingerprint,
+            get_incremental_fingerprint(self.export_instance, [_Filter(filters.term('a', 'b'))]),
+        )
+        self.assertNotEqual(
+            fingerprint,
+            get_incremental_fingerprint(self.export_instance, [_Filter(filters.term('a', 'c'))]),
+        )
+
+    def test_can_update_incrementally(self):
+        fingerprint = get_incremental_fingerprint(self.export_instance, [])
+        self.export_instance.incremental_fingerprint = fingerprint
+        self.assertTrue(can_update_incrementally(self.export_instance, fingerprint))
+
+        self.export_instance.transform_dates = False
+        self.assertFalse(can_update_incrementally(
+            self.export_instance, get_incremental_fingerprint(self.export_instance, [])
+        ))
+
+    def test_periodic_full_rebuild(self):
+        fingerprint = get_incremental_fingerprint(self.export_instance, [])
+        self.export_instance.incremental_fingerprint = fingerprint
+        self.export_instance.incremental_full_build = datetime.utcnow() - timedelta(days=8)
+        self.assertFalse(can_update_incrementally(self.export_instance, fingerprint))
+
+    def test_lookup_transforms(self):
+        fingerprint = get_incremental_fingerprint(self.export_instance, [])
+        self.export_instance.incremental_fingerprint = fingerprint
+        self.export_instance.has_lookup_transforms = True
+        self.assertFalse(can_update_incrementally(self.export_instance, fingerprint))
+
+    def test_no_previous_build(self):
+        fingerprint = get_incremental_fingerprint(self.export_instance, [])
+        self.export_instance.incremental_fingerprint = fingerprint
+        self.export_instance.has_row_blocks.return_value = False
+        self.assertFalse(can_update_incrementally(self.export_instance, fingerprint))
+
+
+class RenumberRowTest(SimpleTestCase):
+
+    def test_renumber(self):
+        table = TableConfiguration(
+            path=[PathNode(name='form'), PathNode(name='repeat', is_repeat=True)],
+            columns=[
+                RowNumberColumn(selected=True, repeat=1),
+                ExportColumn(
+                    item=ScalarItem(path=[
+                        PathNode(name='form'),
+                        PathNode(name='repeat', is_repeat=True),
+                        PathNode(name='q'),
+                    ]),
+                    selected=True,
+                ),
+            ],
+        )
+        doc = {'_id': 'a', 'domain': 'd', 'form': {'repeat': [{'q': 'x'}, {'q': 'y'}]}}
+        extractor = table.get_row_extractor()
+        rows = [row.data for row in extractor.get_rows(doc, 0)]
+        for row_data in rows:
+            extractor.renumber_row(row_data, 7)
+        self.assertEqual(rows, [row.data for row in extractor.get_rows(doc, 7)])
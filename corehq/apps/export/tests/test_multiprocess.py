@@ -0,0 +1,94 @@
+import gzip
+import json
+import os
+import tempfile
+
+from django.test import SimpleTestCase
+
+from mock import Mock, patch
+from six.moves.queue import Queue
+
+from corehq.apps.export.multiprocess import (
+    MultiprocessExporter,
+    _dump_query_slice,
+    _get_slice_boundaries,
+)
+
+
+class SliceBoundariesTest(SimpleTestCase):
+
+    def test_even(self):
+        counts = [(1, 10), (2, 10), (3, 10), (4, 10)]
+        self.assertEqual(_get_slice_boundaries(counts, 2), [3])
+        self.assertEqual(_get_slice_boundaries(counts, 4), [2, 3, 4])
+
+    def test_skewed(self):
+        counts = [(1, 100), (2, 1), (3, 1)]
+        self.assertEqual(_get_slice_boundaries(counts, 3), [2, 3])
+
+    def test_single_bucket(self):
+        self.assertEqual(_get_slice_boundaries([(1, 10)], 4), [])
+
+    def test_empty(self):
+        self.assertEqual(_get_slice_boundaries([], 4), [])
+
+
+class AddCompletedPagesTest(SimpleTestCase):
+
+    def _queued_result(self, page, ready, result=None, error=None):
+        async_result = Mock()
+        async_result.ready.return_value = ready
+        if error:
+            async_result.get.side_effect = error
+        else:
+            async_result.get.return_value = result
+        return Mock(async_result=async_result, page=page, retry_count=1)
+
+    def test_add_completed_pages(self):
+        exporter = MultiprocessExporter.__new__(MultiprocessExporter)
+        done = Mock(success=True)
+        exporter.results = [
+            self._queued_result(1, ready=False),
+            self._queued_result(2, ready=True, result=done),
+            self._queued_result(3, ready=True, error=ValueError),
+        ]
+        exporter._final_zip = final_zip = Mock()
+        exporter.process_page = Mock()
+        exporter._add_result_to_zip = Mock()
+
+        exporter.add_completed_pages()
+
+        self.assertEqual([result.page for result in exporter.results], [1])
+        exporter._add_result_to_zip.assert_called_once_with(final_zip, done)
+        self.assertEqual(exporter.process_page.call_args[0][0].page, 3)
+
+
+class DumpQuerySliceTest(SimpleTestCase):
+
+    def setUp(self):
+        fd, self.id_path = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.remove, self.id_path)
+
+    def _dump(self, docs, **kwargs):
+        page_queue = Queue()
+        with patch('corehq.apps.export.multiprocess.iter_es_docs_from_query', return_value=iter(docs)):
+            _dump_query_slice('export-id', Mock(), 2, page_queue, **kwargs)
+        pages = []
+        while True:
+            dumped_page = page_queue.get_nowait()
+            if dumped_page is None:
+                return pages
+            self.addCleanup(os.remove, dumped_page.path)
+            with gzip.open(dumped_page.path, 'rb') as file:
+                pages.append([json.loads(line)['_id'] for line in file])
+
+    def test_dump(self):
+        docs = [{'_id': doc_id} for doc_id in 'abc']
+        self.assertEqual(self._dump(docs, id_path=self.id_path), [['a', 'b'], ['c']])
+        with open(self.id_path, encoding='utf-8') as file:
+            self.assertEqual(file.read().split(), ['a', 'b', 'c'])
+
+    def test_skip_ids(self):
+        docs = [{'_id': doc_id} for doc_id in 'abc']
+        self.assertEqual(self._dump(docs, skip_ids={'b'}), [['a', 'c']])
@@ -5,9 +5,12 @@ from corehq.apps.export.models import (
     DocRow,
     ExportColumn,
     ExportRow,
+    MultipleChoiceItem,
+    Option,
     PathNode,
     RowNumberColumn,
     ScalarItem,
+    SplitExportColumn,
     TableConfiguration,
 )
 
@@ -336,3 +339,95 @@ class TableConfigurationGetRowsTest(SimpleTestCase):
         self.assertEqual(
             [row.data for row in table_configuration.get_rows(submission, 0)], []
         )
+
+
+class TableRowExtractorTest(SimpleTestCase):
+
+    def setUp(self):
+        self.table = TableConfiguration(
+            path=[PathNode(name='form'), PathNode(name='repeat1', is_repeat=True)],
+            columns=[
+                RowNumberColumn(selected=True),
+                ExportColumn(
+                    item=ScalarItem(path=[
+                        PathNode(name='form'),
+                        PathNode(name='repeat1', is_repeat=True),
+                        PathNode(name='q1'),
+                    ]),
+                    selected=True,
+                ),
+                SplitExportColumn(
+                    item=MultipleChoiceItem(
+                        path=[
+                            PathNode(name='form'),
+                            PathNode(name='repeat1', is_repeat=True),
+                            PathNode(name='choice'),
+                        ],
+                        options=[Option(value='a'), Option(value='b')],
+                    ),
+                    selected=True,
+                ),
+                ExportColumn(
+                    item=ScalarItem(path=[
+                        PathNode(name='form'),
+                        PathNode(name='repeat1', is_repeat=True),
+                        PathNode(name='group'),
+                        PathNode(name='date'),
+                    ]),
+                    selected=True,
+                ),
+                ExportColumn(
+                    item=ScalarItem(path=[
+                        PathNode(name='form'),
+                        PathNode(name='repeat1', is_repeat=True),
+                        PathNode(name='unselected'),
+                    ]),
+                    selected=False,
+                ),
+            ],
+        )
+        self.docs = [
+            {
+                'domain': 'my-domain',
+                '_id': '1234',
+                'form': {
+                    'repeat1': [
+                        {'q1': 'foo', 'choice': 'a c', 'group': {'date': '2020-01-02'}},
+                        {'q1': {'#text': 'bar', 'id': '1'}, 'group': 'not a dict'},
+                        {'q1': {'no': 'text'}, 'choice': 'b'},
+                        'not a dict',
+                    ]
+                },
+            },
+            {
+                'domain': 'my-domain',
+                '_id': '5678',
+                'form': {'repeat1': {'q1': ['x', {'y': 'z'}], 'group': {'date': None}}},
+            },
+            {'domain': 'my-domain', '_id': '9999', 'form': {}},
+        ]
+
+    def _assert_same_rows(self, split_columns, transform_dates):
+        extractor = self.table.get_row_extractor(split_columns=split_columns, transform_dates=transform_dates)
+        for row_number, doc in enumerate(self.docs):
+            expected = self.table.get_rows(
+                doc, row_number, split_columns=split_columns, transform_dates=transform_dates
+            )
+            actual = extractor.get_rows(doc, row_number)
+            self.assertEqual(
+                [(row.data, row.hyperlink_column_indices, row.skip_excel_formatting) for row in actual],
+                [(row.data, row.hyperlink_column_indices, row.skip_excel_formatting) for row in expected],
+            )
+
+    def test_same_rows(self):
+        self._assert_same_rows(split_columns=False, transform_dates=False)
+
+    def test_same_rows_split_columns(self):
+        self._assert_same_rows(split_columns=True, transform_dates=False)
+
+    def test_same_rows_transform_dates(self):
+        self._assert_same_rows(split_columns=True, transform_dates=True)
+
+    def test_static_indices(self):
+        extractor = self.table.get_row_extractor(split_columns=True)
+        self.assertEqual(extractor.skip_excel_formatting, [0, 1, 2])
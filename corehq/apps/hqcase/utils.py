@@ -209,7 +209,7 @@ def update_case(domain, case_id, case_properties=None, close=False,
     )
 
 
-def bulk_update_cases(domain, case_changes, device_id):
+def bulk_update_cases(domain, case_changes, device_id, xmlns=None, user_id=None):
     """
     Updates or closes a list of cases (or both) by submitting a form.
     domain - the cases' domain
@@ -219,12 +219,14 @@ def bulk_update_cases(domain, case_changes, device_id):
                           to ignore case updates, leave this argument out
         close - True to close the case, False otherwise
     device_id - see submit_case_blocks device_id docs
+    xmlns - pass in an xmlns to use it instead of the default
+    user_id - see submit_case_blocks
     """
     case_blocks = []
     for case_id, case_properties, close in case_changes:
         case_block = _get_update_or_close_case_block(case_id, case_properties, close)
         case_blocks.append(case_block.as_text())
-    return submit_case_blocks(case_blocks, domain, device_id=device_id)
+    return submit_case_blocks(case_blocks, domain, user_id=user_id, xmlns=xmlns, device_id=device_id)
 
 
 def resave_case(domain, case, send_post_save_signal=True):
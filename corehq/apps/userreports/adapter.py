@@ -88,9 +88,9 @@ class IndicatorAdapter(object):
         """
         raise NotImplementedError
 
-    def get_all_values(self, doc, eval_context=None):
+    def get_all_values(self, doc, eval_context=None, evaluator=None):
         "Gets all the values from a document to save"
-        return self.config.get_all_values(doc, eval_context)
+        return self.config.get_all_values(doc, eval_context, evaluator)
 
     def bulk_delete(self, docs):
         for doc in docs:
@@ -182,6 +182,10 @@ class IndicatorAdapterLoadTracker(object):
         self._track_load(len(rows))
         self.adapter.save_rows(rows)
 
+    def bulk_load_rows(self, rows):
+        self._track_load(len(rows))
+        self.adapter.bulk_load_rows(rows)
+
     def delete(self, doc):
         self._track_load()
         self.adapter.delete(doc)
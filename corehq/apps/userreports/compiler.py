@@ -0,0 +1,479 @@
+"""Compiled evaluation of data source configurations
+
+Expressions, filters and indicators built by their factories are trees
+of spec objects which are evaluated node by node for every document.
+Each node redoes (slow) jsonobject attribute lookups and builds its
+datatype transform on every call. The functions in this module turn
+those trees into flat closures with everything that does not depend on
+the document resolved up front.
+
+Node types without a compiler are called as they are, so compiled
+output is always identical to the tree it was compiled from. Use
+``DifferentialDataSourceEvaluator`` to check that on live data.
+
+Data sources compiled with a shared ``EvaluationPlan`` also share
+identical property lookups and property value filters. Each of those is
+evaluated once per document and the result is reused by every data
+source that needs it.
+"""
+from collections import Counter
+
+from corehq.apps.userreports.expressions.getters import (
+    safe_recursive_lookup,
+    transform_from_datatype,
+)
+from corehq.apps.userreports.expressions.specs import (
+    ArrayIndexExpressionSpec,
+    CoalesceExpressionSpec,
+    ConditionalExpressionSpec,
+    ConstantGetterSpec,
+    IdentityExpressionSpec,
+    NamedExpressionSpec,
+    PropertyNameGetterSpec,
+    PropertyPathGetterSpec,
+    RootDocExpressionSpec,
+    SwitchExpressionSpec,
+)
+from corehq.apps.userreports.filters import (
+    ANDFilter,
+    NamedFilter,
+    NOTFilter,
+    ORFilter,
+    SinglePropertyValueFilter,
+)
+from corehq.apps.userreports.indicators import (
+    BooleanIndicator,
+    ColumnValue,
+    CompoundIndicator,
+    RawIndicator,
+)
+from corehq.apps.userreports.specs import EvaluationContext
+from corehq.util.metrics import metrics_counter
+from corehq.util.soft_assert import soft_assert
+
+_assert_same = soft_assert(notify_admins=True)
+
+
+class ExpressionCompiler(object):
+    """Compiles expressions, filters and indicators into closures
+
+    A compiler instance should be used for all expressions of a single
+    data source so named expressions are compiled once and shared.
+    """
+
+    def __init__(self, plan=None):
+        self.plan = plan
+        self._named_expressions = {}
+
+    def compile_expression(self, expression):
+        compiler = self.expression_compilers.get(type(expression))
+        if compiler is None:
+            return expression
+        return self._share(expression, compiler(self, expression))
+
+    def compile_filter(self, filter_):
+        compiler = self.filter_compilers.get(type(filter_))
+        if compiler is None:
+            return filter_
+        return self._share(filter_, compiler(self, filter_))
+
+    def _share(self, node, compiled):
+        if self.plan is None:
+            return compiled
+        key = get_plan_key(node)
+        if key is None:
+            return compiled
+        return self.plan.share(key, compiled)
+
+    def compile_indicator(self, indicator):
+        """Compile indicator into a list of emitters
+
+        :returns: A list of `(column, value_fn)` pairs. `column` is `None`
+        if `value_fn` returns a list of `ColumnValue`s rather than a
+        single value.
+        """
+        if isinstance(indicator, CompoundIndicator):
+            return [emitter
+                for sub_indicator in indicator.indicators
+                for emitter in self.compile_indicator(sub_indicator)]
+        if isinstance(indicator, BooleanIndicator):
+            filter_fn = self.compile_filter(indicator.filter)
+            return [(indicator.column, lambda item, context: 1 if filter_fn(item, context) else 0)]
+        if isinstance(indicator, RawIndicator):
+            return [(indicator.column, self.compile_expression(indicator.getter))]
+        return [(None, indicator.get_values)]
+
+    def _identity(self, expression):
+        return lambda item, context=None: item
+
+    def _constant(self, expression):
+        constant = expression.constant
+        return lambda item, context=None: constant
+
+    def _property_name(self, expression):
+        transform = transform_from_datatype(expression.datatype)
+        name_expression = expression._property_name_expression
+        if isinstance(name_expression, ConstantGetterSpec):
+            property_name = name_expression.constant
+
+            def property_name_getter(item, context=None):
+                return transform(item.get(property_name) if isinstance(item, dict) else None)
+        else:
+            name_fn = self.compile_expression(name_expression)
+
+            def property_name_getter(item, context=None):
+                return transform(item.get(name_fn(item, context)) if isinstance(item, dict) else None)
+        return property_name_getter
+
+    def _property_path(self, expression):
+        transform = transform_from_datatype(expression.datatype)
+        property_path = list(expression.property_path)
+
+        def property_path_getter(item, context=None):
+            return transform(safe_recursive_lookup(item, property_path))
+        return property_path_getter
+
+    def _named(self, expression):
+        name = expression.name
+        if name in self._named_expressions:
+            return self._named_expressions[name]
+        expression_fn = self.compile_expression(expression._context.named_expressions[name])
+        key_prefix = 'named_expression-{}-'.format(name)
+
+        def named_getter(item, context=None):
+            # same cache key as NamedExpressionSpec
+            key = key_prefix + str(id(item))
+            if context and context.exists_in_cache(key):
+                return context.get_cache_value(key)
+            result = expression_fn(item, context)
+            if context:
+                context.set_iteration_cache_value(key, result)
+            return result
+
+        self._named_expressions[name] = named_getter
+        return named_getter
+
+    def _conditional(self, expression):
+        test_fn = self.compile_filter(expression._test_function)
+        true_fn = self.compile_expression(expression._true_expression)
+        false_fn = self.compile_expression(expression._false_expression)
+
+        def conditional(item, context=None):
+            if test_fn(item, context):
+                return true_fn(item, context)
+            return false_fn(item, context)
+        return conditional
+
+    def _switch(self, expression):
+        switch_fn = self.compile_expression(expression._switch_on_expression)
+        cases = [(case, self.compile_expression(expression._case_expressions[case]))
+                 for case in expression.cases]
+        default_fn = self.compile_expression(expression._default_expression)
+
+        def switch(item, context=None):
+            switch_value = switch_fn(item, context)
+            for case, case_fn in cases:
+                if switch_value == case:
+                    return case_fn(item, context)
+            return default_fn(item, context)
+        return switch
+
+    def _array_index(self, expression):
+        array_fn = self.compile_expression(expression._array_expression)
+        index_fn = self.compile_expression(expression._index_expression)
+
+        def array_index(item, context=None):
+            array_value = array_fn(item, context)
+            if not isinstance(array_value, list):
+                return None
+            index_value = index_fn(item, context)
+            if not isinstance(index_value, int):
+                return None
+            try:
+                return array_value[index_value]
+            except IndexError:
+                return None
+        return array_index
+
+    def _root_doc(self, expression):
+        expression_fn = self.compile_expression(expression._expression_fn)
+
+        def root_doc(item, context=None):
+            if context is None:
+                return None
+            return expression_fn(context.root_doc, context)
+        return root_doc
+
+    def _coalesce(self, expression):
+        expression_fn = self.compile_expression(expression._expression)
+        default_fn = self.compile_expression(expression._default_expression)
+
+        def coalesce(item, context=None):
+            expression_value = expression_fn(item, context)
+            default_value = default_fn(item, context)
+            if expression_value is None or expression_value == '':
+                return default_value
+            return expression_value
+        return coalesce
+
+    def _and(self, filter_):
+        filter_fns = [self.compile_filter(f) for f in filter_.filters]
+        return lambda item, context=None: all(f(item, context) for f in filter_fns)
+
+    def _or(self, filter_):
+        filter_fns = [self.compile_filter(f) for f in filter_.filters]
+        return lambda item, context=None: any(f(item, context) for f in filter_fns)
+
+    def _not(self, filter_):
+        filter_fn = self.compile_filter(filter_._filter)
+        return lambda item, context=None: not filter_fn(item, context)
+
+    def _single_property_value(self, filter_):
+        expression_fn = self.compile_expression(filter_.expression)
+        operator = filter_.operator
+        reference_fn = self.compile_expression(filter_.reference_expression)
+        return lambda item, context=None: operator(expression_fn(item, context), reference_fn(item, context))
+
+    def _named_filter(self, filter_):
+        return self.compile_filter(filter_.filter)
+
+    expression_compilers = {
+        IdentityExpressionSpec: _identity,
+        ConstantGetterSpec: _constant,
+        PropertyNameGetterSpec: _property_name,
+        PropertyPathGetterSpec: _property_path,
+        NamedExpressionSpec: _named,
+        ConditionalExpressionSpec: _conditional,
+        SwitchExpressionSpec: _switch,
+        ArrayIndexExpressionSpec: _array_index,
+        RootDocExpressionSpec: _root_doc,
+        CoalesceExpressionSpec: _coalesce,
+    }
+
+    filter_compilers = {
+        ANDFilter: _and,
+        ORFilter: _or,
+        NOTFilter: _not,
+        SinglePropertyValueFilter: _single_property_value,
+        NamedFilter: _named_filter,
+    }
+
+
+def get_plan_key(node):
+    """Get a key identifying the output of an expression or filter
+
+    Two nodes with the same key return the same value for any document.
+    Only simple nodes that do not depend on the data source they were
+    built for have a key.
+
+    :returns: A hashable key or `None`
+    """
+    if isinstance(node, ConstantGetterSpec):
+        return ('constant', type(node.constant).__name__, repr(node.constant))
+    if isinstance(node, PropertyNameGetterSpec):
+        if isinstance(node._property_name_expression, ConstantGetterSpec):
+            return ('property_name', repr(node._property_name_expression.constant), node.datatype)
+        return None
+    if isinstance(node, PropertyPathGetterSpec):
+        return ('property_path', tuple(node.property_path), node.datatype)
+    if isinstance(node, SinglePropertyValueFilter):
+        expression_key = get_plan_key(node.expression)
+        reference_key = get_plan_key(node.reference_expression)
+        if expression_key is None or reference_key is None:
+            return None
+        # get_operator wraps operators in a new function for each filter
+        operator_key = (node.operator.__name__, hasattr(node.operator, '__wrapped__'))
+        return ('single_property_value', expression_key, operator_key, reference_key)
+    return None
+
+
+class EvaluationPlan(object):
+    """Shares identical expressions between compiled data sources
+
+    Shared expressions cache their result in the evaluation context when
+    they are evaluated against the root document, so all data sources
+    processing a document must use the same `EvaluationContext`.
+    """
+
+    def __init__(self):
+        self._shared = {}
+        self._references = Counter()
+
+    @property
+    def shared_count(self):
+        """Number of expressions used by more than one data source node"""
+        return sum(1 for count in self._references.values() if count > 1)
+
+    def share(self, key, compiled):
+        self._references[key] += 1
+        if key in self._shared:
+            return self._shared[key]
+        if key[0] == 'constant':
+            # cheaper to evaluate than to look up
+            self._shared[key] = compiled
+            return compiled
+
+        cache_key = ('evaluation_plan', key)
+
+        def shared(item, context=None):
+            if context is None or item is not context.root_doc:
+                return compiled(item, context)
+            try:
+                return context.cache[cache_key]
+            except KeyError:
+                value = context.cache[cache_key] = compiled(item, context)
+                return value
+
+        self._shared[key] = shared
+        return shared
+
+    def get_evaluator(self, config):
+        return CompiledDataSourceEvaluator(config, plan=self)
+
+
+class DataSourceEvaluator(object):
+    """Evaluates the filter and indicators of a data source for documents"""
+
+    def __init__(self, config):
+        self.config = config
+
+    def filter(self, document, eval_context):
+        raise NotImplementedError
+
+    def get_values(self, item, eval_context):
+        raise NotImplementedError
+
+    def get_base_items(self, document, eval_context):
+        raise NotImplementedError
+
+    def get_items(self, document, eval_context):
+        if self.filter(document, eval_context):
+            if not self.config.base_item_expression:
+                return [document]
+            else:
+                result = self.get_base_items(document, eval_context)
+                if result is None:
+                    return []
+                elif isinstance(result, list):
+                    return result
+                else:
+                    return [result]
+        else:
+            return []
+
+    def get_rows(self, document, eval_context):
+        rows = []
+        for item in self.get_items(document, eval_context):
+            rows.append(self.get_values(item, eval_context))
+            eval_context.increment_iteration()
+        return rows
+
+
+class InterpretedDataSourceEvaluator(DataSourceEvaluator):
+    """Evaluates the expression trees of the data source directly"""
+
+    def filter(self, document, eval_context):
+        return self.config._get_main_filter()(document, eval_context)
+
+    def get_values(self, item, eval_context):
+        return self.config.indicators.get_values(item, eval_context)
+
+    def get_base_items(self, document, eval_context):
+        return self.config.parsed_expression(document, eval_context)
+
+
+class CompiledDataSourceEvaluator(DataSourceEvaluator):
+    """Evaluates compiled versions of the data source expression trees"""
+
+    def __init__(self, config, plan=None):
+        super(CompiledDataSourceEvaluator, self).__init__(config)
+        compiler = ExpressionCompiler(plan)
+        self._filter = compiler.compile_filter(config._get_main_filter())
+        self._emitters = compiler.compile_indicator(config.indicators)
+        self._base_item_expression = (
+            compiler.compile_expression(config.parsed_expression)
+            if config.base_item_expression else None
+        )
+
+    def filter(self, document, eval_context):
+        return self._filter(document, eval_context)
+
+    def get_values(self, item, eval_context):
+        values = []
+        for column, value_fn in self._emitters:
+            if column is None:
+                values.extend(value_fn(item, eval_context))
+            else:
+                values.append(ColumnValue(column, value_fn(item, eval_context)))
+        return values
+
+    def get_base_items(self, document, eval_context):
+        return self._base_item_expression(document, eval_context)
+
+
+class DifferentialDataSourceEvaluator(DataSourceEvaluator):
+    """Evaluates both ways and reports differences
+
+    The interpreted result is always returned. The compiled evaluator
+    gets its own evaluation context so cached values are not shared.
+    """
+
+    def __init__(self, config):
+        super(DifferentialDataSourceEvaluator, self).__init__(config)
+        self.control = InterpretedDataSourceEvaluator(config)
+        self.candidate = CompiledDataSourceEvaluator(config)
+
+    def filter(self, document, eval_context):
+        result = self.control.filter(document, eval_context)
+        self._compare('filter', document, result,
+                      lambda: self.candidate.filter(document, _copy_context(eval_context)))
+        return result
+
+    def get_base_items(self, document, eval_context):
+        result = self.control.get_base_items(document, eval_context)
+        self._compare('base_items', document, result,
+                      lambda: self.candidate.get_base_items(document, _copy_context(eval_context)))
+        return result
+
+    def get_values(self, item, eval_context):
+        candidate_context = _copy_context(eval_context)
+        result = self.control.get_values(item, eval_context)
+        self._compare('values', eval_context.root_doc or item, _rows_to_tuples([result]),
+                      lambda: _rows_to_tuples([self.candidate.get_values(item, candidate_context)]))
+        return result
+
+    def get_rows(self, document, eval_context):
+        candidate_context = _copy_context(eval_context)
+        result = self.control.get_rows(document, eval_context)
+        self._compare('rows', document, _rows_to_tuples(result),
+                      lambda: _rows_to_tuples(self.candidate.get_rows(document, candidate_context)))
+        return result
+
+    def _compare(self, name, document, control_value, get_candidate_value):
+        try:
+            candidate_value = get_candidate_value()
+        except Exception as err:
+            candidate_value = err
+        is_match = control_value == candidate_value
+        metrics_counter('commcare.ucr.compiled_evaluator.comparisons', tags={
+            'config_id': self.config._id,
+            'type': name,
+            'result': 'match' if is_match else 'mismatch',
+        })
+        _assert_same(is_match, "Compiled UCR evaluation mismatch", {
+            'config_id': self.config._id,
+            'doc_id': document.get('_id'),
+            'type': name,
+            'control': repr(control_value),
+            'candidate': repr(candidate_value),
+        })
+
+
+def _copy_context(eval_context):
+    context = EvaluationContext(eval_context.root_doc, eval_context.iteration)
+    context.inserted_timestamp = eval_context.inserted_timestamp
+    return context
+
+
+def _rows_to_tuples(rows):
+    return [[(value.column.id, value.value) for value in row] for row in rows]
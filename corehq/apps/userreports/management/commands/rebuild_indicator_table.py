@@ -12,12 +12,24 @@ class Command(BaseCommand):
                             help='Rebuild table in place (preserve existing data)')
         parser.add_argument('--initiated-by', action='store', required=True, dest='initiated',
                             help='Who initiated the rebuild (for sending email notifications)')
+        parser.add_argument('--processes', type=int, dest='processes', default=1,
+                            help='Number of parallel processes to rebuild the table with')
+        parser.add_argument('--resume', action='store_true', dest='resume', default=False,
+                            help='Resume a parallel rebuild. Use the same number of processes.')
 
     def handle(self, indicator_config_id, **options):
         if options['in_place']:
             tasks.rebuild_indicators_in_place(
                 indicator_config_id, options['initiated'], source='rebuild_indicator_table'
             )
+        elif options['processes'] > 1:
+            tasks.rebuild_indicators_in_parallel(
+                indicator_config_id,
+                options['processes'],
+                initiated_by=options['initiated'],
+                source='rebuild_indicator_table',
+                resume=options['resume'],
+            )
         else:
             tasks.rebuild_indicators(
                 indicator_config_id,
@@ -46,6 +46,11 @@ from corehq.apps.cachehq.mixins import (
 from corehq.apps.userreports.app_manager.data_source_meta import (
     REPORT_BUILDER_DATA_SOURCE_TYPE_VALUES,
 )
+from corehq.apps.userreports.compiler import (
+    CompiledDataSourceEvaluator,
+    DifferentialDataSourceEvaluator,
+    InterpretedDataSourceEvaluator,
+)
 from corehq.apps.userreports.const import (
     DATA_SOURCE_TYPE_AGGREGATE,
     DATA_SOURCE_TYPE_STANDARD,
@@ -86,6 +91,10 @@ from corehq.apps.userreports.util import (
 )
 from corehq.pillows.utils import get_deleted_doc_types
 from corehq.sql_db.connections import UCR_ENGINE_ID, connection_manager
+from corehq.toggles import (
+    UCR_COMPILED_EXPRESSIONS,
+    UCR_COMPILED_EXPRESSIONS_DIFFERENTIAL,
+)
 from corehq.util.couch import DocumentNotFound, get_document_or_not_found
 from corehq.util.quickcache import quickcache
 
@@ -165,6 +174,10 @@ class DataSourceBuildInformation(DocumentSchema):
     finished_in_place = BooleanProperty(default=False)
     initiated_in_place = DateTimeProperty()
     rebuilt_asynchronously = BooleanProperty(default=False)
+    # Number of partitions of the most recent parallel build and the
+    # indexes of the partitions that have been completed.
+    partitions = IntegerProperty()
+    completed_partitions = ListProperty(int)
 
 
 class DataSourceMeta(DocumentSchema):
@@ -260,8 +273,7 @@ class DataSourceConfiguration(CachedCouchDocumentMixin, Document, AbstractUCRDat
         if eval_context is None:
             eval_context = EvaluationContext(document)
 
-        filter_fn = self._get_main_filter()
-        return filter_fn(document, eval_context)
+        return self.evaluator.filter(document, eval_context)
 
     def deleted_filter(self, document):
         filter_fn = self._get_deleted_filter()
@@ -444,23 +456,24 @@ class DataSourceConfiguration(CachedCouchDocumentMixin, Document, AbstractUCRDat
         return self.columns_by_id.get(column_id)
 
     def get_items(self, document, eval_context=None):
-        if self.filter(document, eval_context):
-            if not self.base_item_expression:
-                return [document]
-            else:
-                result = self.parsed_expression(document, eval_context)
-                if result is None:
-                    return []
-                elif isinstance(result, list):
-                    return result
-                else:
-                    return [result]
-        else:
-            return []
+        if eval_context is None:
+            eval_context = EvaluationContext(document)
+
+        return self.evaluator.get_items(document, eval_context)
 
-    def get_all_values(self, doc, eval_context=None):
+    @property
+    @memoized
+    def evaluator(self):
+        if UCR_COMPILED_EXPRESSIONS_DIFFERENTIAL.enabled(self.domain):
+            return DifferentialDataSourceEvaluator(self)
+        if UCR_COMPILED_EXPRESSIONS.enabled(self.domain):
+            return CompiledDataSourceEvaluator(self)
+        return InterpretedDataSourceEvaluator(self)
+
+    def get_all_values(self, doc, eval_context=None, evaluator=None):
         if not eval_context:
             eval_context = EvaluationContext(doc)
+        evaluator = evaluator or self.evaluator
 
         if self.has_validations:
             try:
@@ -479,13 +492,7 @@ class DataSourceConfiguration(CachedCouchDocumentMixin, Document, AbstractUCRDat
                     )
                 return []
 
-        rows = []
-        for item in self.get_items(doc, eval_context):
-            indicators = self.indicators.get_values(item, eval_context)
-            rows.append(indicators)
-            eval_context.increment_iteration()
-
-        return rows
+        return evaluator.get_rows(doc, eval_context)
 
     def get_report_count(self):
         """
@@ -20,6 +20,7 @@ from corehq.apps.change_feed.consumer.feed import (
 )
 from corehq.apps.change_feed.topics import LOCATION as LOCATION_TOPIC
 from corehq.apps.domain.dbaccessors import get_domain_ids_by_names
+from corehq.apps.userreports.compiler import EvaluationPlan
 from corehq.apps.userreports.const import KAFKA_TOPICS
 from corehq.apps.userreports.data_source_providers import (
     DynamicDataSourceProvider,
@@ -42,6 +43,10 @@ from corehq.apps.userreports.sql import get_metadata
 from corehq.apps.userreports.tasks import rebuild_indicators
 from corehq.apps.userreports.util import get_indicator_adapter
 from corehq.sql_db.connections import connection_manager
+from corehq.toggles import (
+    UCR_COMPILED_EXPRESSIONS,
+    UCR_COMPILED_EXPRESSIONS_DIFFERENTIAL,
+)
 from corehq.util.datadog.gauges import datadog_bucket_timer, datadog_histogram
 from corehq.util.soft_assert import soft_assert
 from corehq.util.timer import TimingContext
@@ -265,6 +270,10 @@ class ConfigurableReportPillowProcessor(ConfigurableReportTableManagerMixin, Bul
 
     domain_timing_context = Counter()
 
+    def bootstrap(self, configs=None):
+        super(ConfigurableReportPillowProcessor, self).bootstrap(configs)
+        self.evaluators_by_domain = {}
+
     @time_ucr_process_change
     def _save_doc_to_table(self, domain, table, doc, eval_context):
         # best effort will swallow errors in the table
@@ -308,6 +317,7 @@ class ConfigurableReportPillowProcessor(ConfigurableReportTableManagerMixin, Bul
         with self._datadog_timing('extract'):
             retry_changes, docs = bulk_fetch_changes_docs(to_update, domain)
         change_exceptions = []
+        evaluators = self._get_evaluators(domain)
 
         with self._datadog_timing('single_batch_transform'):
             for doc in docs:
@@ -316,13 +326,16 @@ class ConfigurableReportPillowProcessor(ConfigurableReportTableManagerMixin, Bul
                 eval_context = EvaluationContext(doc)
                 with self._datadog_timing('single_doc_transform'):
                     for adapter in adapters:
+                        evaluator = evaluators.get(adapter.config._id) or adapter.config.evaluator
                         with self._datadog_timing('transform', adapter.config._id):
-                            if adapter.config.filter(doc, eval_context):
+                            if evaluator.filter(doc, eval_context):
                                 if adapter.run_asynchronous:
                                     async_configs_by_doc_id[doc['_id']].append(adapter.config._id)
                                 else:
                                     try:
-                                        rows_to_save_by_adapter[adapter].extend(adapter.get_all_values(doc, eval_context))
+                                        rows_to_save_by_adapter[adapter].extend(
+                                            adapter.get_all_values(doc, eval_context, evaluator)
+                                        )
                                     except Exception as e:
                                         change_exceptions.append((change, e))
                                     eval_context.reset_iteration()
@@ -365,6 +378,25 @@ class ConfigurableReportPillowProcessor(ConfigurableReportTableManagerMixin, Bul
 
         return retry_changes, change_exceptions
 
+    def _get_evaluators(self, domain):
+        """Get evaluators for the domain's data sources by config ID
+
+        When compiled expressions are enabled the data sources share an
+        evaluation plan so expressions they have in common are only
+        evaluated once per document. The evaluation context must be
+        shared by all data sources for that to work.
+        """
+        if domain not in self.evaluators_by_domain:
+            evaluators = {}
+            if (UCR_COMPILED_EXPRESSIONS.enabled(domain)
+                    and not UCR_COMPILED_EXPRESSIONS_DIFFERENTIAL.enabled(domain)):
+                plan = EvaluationPlan()
+                for adapter in self.table_adapters_by_domain[domain]:
+                    evaluators[adapter.config._id] = plan.get_evaluator(adapter.config)
+                datadog_histogram('commcare.ucr.evaluation_plan.shared_expressions', plan.shared_count)
+            self.evaluators_by_domain[domain] = evaluators
+        return self.evaluators_by_domain[domain]
+
     def _datadog_timing(self, step, config_id=None):
         tags = [
             'action:{}'.format(step),
@@ -1,5 +1,9 @@
+import hashlib
 import logging
 from collections import defaultdict
+from datetime import datetime
+
+from django.db.models import Q
 
 import attr
 from alembic.autogenerate import compare_metadata
@@ -14,9 +18,23 @@ from fluff.signals import (
 )
 
 from corehq.apps.userreports.models import id_is_static
+from corehq.form_processor.backends.sql.dbaccessors import (
+    CaseReindexAccessor,
+    iter_all_ids,
+)
+from corehq.form_processor.models import XFormInstanceSQL
+from corehq.form_processor.utils.general import should_use_sql_backend
+from corehq.sql_db.util import (
+    get_db_aliases_for_partitioned_query,
+    paginate_query,
+)
 
 logger = logging.getLogger(__name__)
 
+BULK_LOAD_TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+CASE_DOC_TYPE = 'CommCareCase'
+FORM_DOC_TYPE = 'XFormInstance'
+
 
 def get_redis_key_for_config(config):
     if id_is_static(config._id):
@@ -28,10 +46,13 @@ def get_redis_key_for_config(config):
 
 class DataSourceResumeHelper(object):
 
-    def __init__(self, config):
+    def __init__(self, config, partition=None):
         self.config = config
         self._client = get_redis_client().client.get_client()
         self._key = get_redis_key_for_config(config)
+        if partition is not None:
+            self._key = '{}:{}'.format(self._key, partition.key)
+        self._bulk_load_key = '{}:bulk_load'.format(self._key)
 
     def get_completed_case_type_or_xmlns(self):
         return self._client.lrange(self._key, 0, -1)
@@ -39,11 +60,91 @@ class DataSourceResumeHelper(object):
     def add_completed_case_type_or_xmlns(self, case_type_or_xmlns):
         self._client.rpush(self._key, case_type_or_xmlns)
 
+    def set_bulk_load_started(self, timestamp):
+        """Record that the rebuild is loading rows into a staging table"""
+        self._client.set(self._bulk_load_key, timestamp.strftime(BULK_LOAD_TIMESTAMP_FORMAT))
+
+    def get_bulk_load_started(self):
+        """Start time of the bulk load rebuild or None if not bulk loading"""
+        timestamp = self._client.get(self._bulk_load_key)
+        if timestamp is None:
+            return None
+        if isinstance(timestamp, bytes):
+            timestamp = timestamp.decode('utf-8')
+        return datetime.strptime(timestamp, BULK_LOAD_TIMESTAMP_FORMAT)
+
     def clear_resume_info(self):
-        self._client.delete(self._key)
+        self._client.delete(self._key, self._bulk_load_key)
 
     def has_resume_info(self):
-        return self._client.exists(self._key)
+        return bool(self._client.exists(self._key) or self._client.exists(self._bulk_load_key))
+
+
+@attr.s(frozen=True)
+class RebuildPartition(object):
+    """A share of the documents of a data source for a parallel rebuild
+
+    Partitions either have a list of database aliases to get documents
+    from, or split the document IDs by their hash.
+    """
+    index = attr.ib()
+    count = attr.ib()
+    db_aliases = attr.ib(default=None)
+
+    @property
+    def key(self):
+        return 'partition-{}-of-{}'.format(self.index, self.count)
+
+    def __str__(self):
+        return self.key
+
+    def iter_document_ids(self, config, document_store, case_type_or_xmlns):
+        if self.db_aliases is not None:
+            return _iter_document_ids_in_dbs(config, case_type_or_xmlns, self.db_aliases)
+        return (
+            doc_id for doc_id in document_store.iter_document_ids()
+            if _get_id_partition(doc_id, self.count) == self.index
+        )
+
+
+def get_rebuild_partitions(config, num_partitions):
+    """Split a data source's documents into at most `num_partitions` partitions"""
+    if _is_sharded_sql_doc_type(config):
+        db_aliases = get_db_aliases_for_partitioned_query()
+        num_partitions = min(num_partitions, len(db_aliases))
+        return [
+            RebuildPartition(index, num_partitions, db_aliases[index::num_partitions])
+            for index in range(num_partitions)
+        ]
+    return [RebuildPartition(index, num_partitions) for index in range(num_partitions)]
+
+
+def _is_sharded_sql_doc_type(config):
+    return (
+        config.referenced_doc_type in (CASE_DOC_TYPE, FORM_DOC_TYPE)
+        and should_use_sql_backend(config.domain)
+    )
+
+
+def _get_id_partition(doc_id, num_partitions):
+    return int(hashlib.md5(doc_id.encode('utf-8')).hexdigest(), 16) % num_partitions
+
+
+def _iter_document_ids_in_dbs(config, case_type_or_xmlns, db_aliases):
+    if config.referenced_doc_type == CASE_DOC_TYPE:
+        accessor = CaseReindexAccessor(
+            config.domain, case_type=case_type_or_xmlns, limit_db_aliases=db_aliases
+        )
+        yield from iter_all_ids(accessor)
+    else:
+        # same filters as FormAccessorSQL.iter_form_ids_by_xmlns
+        q_expr = Q(domain=config.domain) & Q(state=XFormInstanceSQL.NORMAL)
+        if case_type_or_xmlns:
+            q_expr &= Q(xmlns=case_type_or_xmlns)
+        for db_alias in db_aliases:
+            for form_id in paginate_query(db_alias, XFormInstanceSQL, q_expr, values=['form_id'],
+                                          load_source='build_indicators'):
+                yield form_id[0]
 
 
 @attr.s
@@ -1,4 +1,5 @@
 import hashlib
+import io
 import itertools
 import logging
 
@@ -11,6 +12,8 @@ from sqlalchemy.exc import ProgrammingError, OperationalError
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.schema import Index, PrimaryKeyConstraint
 
+from dimagi.utils.couch import get_redis_client
+
 from corehq.apps.userreports.adapter import IndicatorAdapter
 from corehq.apps.userreports.exceptions import (
     ColumnNotFoundError,
@@ -18,6 +21,10 @@ from corehq.apps.userreports.exceptions import (
     translate_programming_error,
 )
 from corehq.apps.userreports.sql.columns import column_to_sql
+from corehq.apps.userreports.sql.util import (
+    format_copy_row,
+    get_staging_table_name,
+)
 from corehq.apps.userreports.util import get_table_name
 from corehq.sql_db.connections import connection_manager
 from corehq.util.soft_assert import soft_assert
@@ -127,6 +134,203 @@ class IndicatorSqlAdapter(IndicatorAdapter):
             table.drop(connection, checkfirst=True)
             get_metadata(self.engine_id).remove(table)
 
+    def supports_bulk_load(self):
+        """Return True if the table can be rebuilt with ``bulk_load_rows``
+
+        Distributed tables can not be swapped in by renaming them.
+        """
+        return not self.config.sql_settings.citus_config.distribution_type
+
+    @property
+    def staging_table_name(self):
+        return get_staging_table_name(self.get_table().name)
+
+    @memoized
+    def get_staging_table(self):
+        """Staging table for bulk loading, with indexes and primary key"""
+        return get_indicator_table(
+            self.config, sqlalchemy.MetaData(), override_table_name=self.staging_table_name
+        )
+
+    @property
+    def staging_table_exists(self):
+        return self.engine.has_table(self.staging_table_name)
+
+    def start_bulk_load(self):
+        """Create an empty staging table without any indexes or constraints
+
+        The live table is left in place (and created if it does not exist)
+        so reports and the change feed keep working while rows are loaded.
+        """
+        self.session_helper.Session.remove()
+        staging_table = self.get_staging_table()
+        unindexed_table = sqlalchemy.Table(
+            staging_table.name,
+            sqlalchemy.MetaData(),
+            *[sqlalchemy.Column(column.name, column.type, nullable=True) for column in staging_table.columns]
+        )
+        try:
+            with self.engine.begin() as connection:
+                unindexed_table.drop(connection, checkfirst=True)
+                unindexed_table.create(connection)
+                self.get_table().create(connection, checkfirst=True)
+        except (ProgrammingError, OperationalError) as e:
+            raise TableRebuildError('problem creating staging table for UCR table {}: {}'.format(self.config, e))
+        self._get_redis_client().delete(self._bulk_load_deleted_key)
+
+    def bulk_load_rows(self, rows):
+        """Append rows to the staging table using ``COPY FROM STDIN``"""
+        if not rows:
+            return
+
+        column_names = [column.name for column in self.get_staging_table().columns]
+        buffer = io.StringIO()
+        for row in rows:
+            values_by_name = {
+                i.column.database_column_name.decode('utf-8'): i.value for i in row
+            }
+            buffer.write(format_copy_row([values_by_name.get(name) for name in column_names]))
+        buffer.seek(0)
+
+        sql = 'COPY "{}" ({}) FROM STDIN'.format(
+            self.staging_table_name,
+            ', '.join('"{}"'.format(name) for name in column_names),
+        )
+        connection = self.engine.raw_connection()
+        try:
+            with connection.cursor() as cursor:
+                cursor.copy_expert(sql, buffer)
+            connection.commit()
+        finally:
+            connection.close()
+
+    def finish_bulk_load(self, build_started, deduplicate=False):
+        """Index the staging table and swap it in for the live table
+
+        :param build_started: Time the rows started being loaded.
+        :param deduplicate: Remove duplicate staged rows before adding the
+        primary key. Needed when a failed build was resumed, since rows for
+        the documents loaded before the failure are loaded again.
+        :returns: IDs of documents that need to be saved again. These are
+        documents that the change feed saved to the live table since
+        ``build_started``, whose staged rows may be out of date, and
+        documents whose staged rows could not be given a primary key.
+        """
+        self.session_helper.Session.remove()
+        table = self.get_table()
+        staging_table = self.get_staging_table()
+        try:
+            with self.engine.begin() as connection:
+                if deduplicate:
+                    self._delete_duplicate_staged_rows(connection)
+                invalid_doc_ids = self._delete_invalid_staged_rows(connection)
+                connection.execute('ALTER TABLE "{}" ADD CONSTRAINT "{}" PRIMARY KEY ({})'.format(
+                    staging_table.name,
+                    _get_primary_key_name(staging_table.name),
+                    ', '.join('"{}"'.format(column) for column in self.config.pk_columns),
+                ))
+                for index in staging_table.indexes:
+                    index.create(connection)
+
+            with self.engine.begin() as connection:
+                connection.execute('LOCK TABLE "{}" IN ACCESS EXCLUSIVE MODE'.format(table.name))
+                changed_doc_ids = self._get_doc_ids_inserted_since(connection, build_started)
+                connection.execute('DROP TABLE "{}"'.format(table.name))
+                connection.execute('ALTER TABLE "{}" RENAME TO "{}"'.format(staging_table.name, table.name))
+                # give the indexes the names they would have if the table had been created by get_table()
+                connection.execute('ALTER TABLE "{}" RENAME CONSTRAINT "{}" TO "{}"'.format(
+                    table.name, _get_primary_key_name(staging_table.name), _get_primary_key_name(table.name)
+                ))
+                preparer = connection.dialect.identifier_preparer
+                index_names = {
+                    _get_index_columns(index): preparer.format_constraint(index) for index in table.indexes
+                }
+                for index in staging_table.indexes:
+                    connection.execute('ALTER INDEX {} RENAME TO {}'.format(
+                        preparer.format_constraint(index), index_names[_get_index_columns(index)]
+                    ))
+                # documents deleted while the rows were being loaded
+                # were only deleted from the old table
+                deleted_doc_ids = self._get_doc_ids_deleted_during_bulk_load()
+                if deleted_doc_ids:
+                    connection.execute(table.delete().where(table.c.doc_id.in_(deleted_doc_ids)))
+        except (ProgrammingError, OperationalError) as e:
+            raise TableRebuildError('problem swapping in staging table for UCR table {}: {}'.format(
+                self.config, e
+            ))
+        self._get_redis_client().delete(self._bulk_load_deleted_key)
+        return changed_doc_ids + list(set(invalid_doc_ids) - set(changed_doc_ids))
+
+    def _delete_duplicate_staged_rows(self, connection):
+        connection.execute("""
+            DELETE FROM "{staging}" a USING "{staging}" b
+            WHERE a.ctid < b.ctid AND a.doc_id = b.doc_id AND {pk_match}
+        """.format(
+            staging=self.staging_table_name,
+            pk_match=' AND '.join('a."{0}" = b."{0}"'.format(column) for column in self.config.pk_columns),
+        ))
+
+    def _delete_invalid_staged_rows(self, connection):
+        """Delete the staged rows of documents that would violate the primary key
+
+        The staging table has no constraints while rows are loaded, so
+        rows with a NULL or duplicate primary key are only found now.
+        Saving these documents again reports the error for each of them,
+        as ``save_rows`` would have done without the bulk load.
+
+        :returns: IDs of the documents whose rows were deleted
+        """
+        pk_columns = ', '.join('"{}"'.format(column) for column in self.config.pk_columns)
+        result = connection.execute("""
+            SELECT doc_id FROM "{staging}" WHERE {pk_is_null}
+            UNION
+            SELECT doc_id FROM "{staging}" WHERE ({pk_columns}) IN (
+                SELECT {pk_columns} FROM "{staging}" GROUP BY {pk_columns} HAVING COUNT(*) > 1
+            )
+        """.format(
+            staging=self.staging_table_name,
+            pk_columns=pk_columns,
+            pk_is_null=' OR '.join('"{}" IS NULL'.format(column) for column in self.config.pk_columns),
+        ))
+        doc_ids = [row[0] for row in result]
+        if doc_ids:
+            staging_table = self.get_staging_table()
+            connection.execute(staging_table.delete().where(staging_table.c.doc_id.in_(doc_ids)))
+        return doc_ids
+
+    @property
+    def _bulk_load_deleted_key(self):
+        return 'ucr_bulk_load_deleted:{}:{}'.format(self.engine_id, self.staging_table_name)
+
+    @staticmethod
+    def _get_redis_client():
+        return get_redis_client().client.get_client()
+
+    def _record_deleted_during_bulk_load(self, doc_ids):
+        """Remember documents deleted while rows are loaded into the staging
+        table, since their rows may already have been loaded"""
+        if doc_ids and self.supports_bulk_load() and self.staging_table_exists:
+            self._get_redis_client().sadd(self._bulk_load_deleted_key, *doc_ids)
+
+    def _get_doc_ids_deleted_during_bulk_load(self):
+        return [
+            doc_id.decode('utf-8') if isinstance(doc_id, bytes) else doc_id
+            for doc_id in self._get_redis_client().smembers(self._bulk_load_deleted_key)
+        ]
+
+    def _get_doc_ids_inserted_since(self, connection, timestamp):
+        # the live table has the schema from before the rebuild
+        live_columns = {column['name'] for column in sqlalchemy.inspect(connection).get_columns(
+            self.get_table().name
+        )}
+        if 'inserted_at' not in live_columns:
+            return []
+        result = connection.execute(
+            'SELECT DISTINCT doc_id FROM "{}" WHERE inserted_at >= %(timestamp)s'.format(self.get_table().name),
+            timestamp=timestamp,
+        )
+        return [row[0] for row in result]
+
     @unit_testing_only
     def clear_table(self):
         table = self.get_table()
@@ -265,6 +469,7 @@ class IndicatorSqlAdapter(IndicatorAdapter):
         delete = table.delete(table.c.doc_id.in_(doc_ids))
         with self.session_context() as session:
             session.execute(delete)
+        self._record_deleted_during_bulk_load(doc_ids)
 
     def _citus_bulk_delete(self, docs, column):
         """
@@ -352,8 +557,12 @@ class MultiDBSqlAdapter(object):
         for adapter in self.all_adapters:
             adapter.save(doc, eval_context)
 
-    def get_all_values(self, doc, eval_context=None):
-        return self.config.get_all_values(doc, eval_context)
+    def get_all_values(self, doc, eval_context=None, evaluator=None):
+        return self.config.get_all_values(doc, eval_context, evaluator)
+
+    def supports_bulk_load(self):
+        # staging tables are only swapped in on the main database
+        return len(self.all_adapters) == 1 and self.main_adapter.supports_bulk_load()
 
     @property
     def run_asynchronous(self):
@@ -467,6 +676,15 @@ def _custom_index_name(table_name, column_ids):
     return "{}_{}".format(base_name[:50], base_hash[:5])
 
 
+def _get_primary_key_name(table_name):
+    # the name PostgreSQL gives an unnamed primary key
+    return '{}_pkey'.format(table_name)
+
+
+def _get_index_columns(index):
+    return tuple(column.name for column in index.columns)
+
+
 def rebuild_table(engine, table):
     with engine.begin() as connection:
         table.drop(connection, checkfirst=True)
@@ -32,3 +32,44 @@ def decode_column_name(column):
     if isinstance(column_name, bytes):
         column_name = column_name.decode('utf-8')
     return column_name
+
+
+def get_staging_table_name(table_name):
+    """Name of the table used to bulk load a rebuild of `table_name`"""
+    return 'ucr_staging_{}'.format(hashlib.sha1(table_name.encode('utf-8')).hexdigest()[:16])
+
+
+_COPY_ESCAPES = str.maketrans({
+    '\\': '\\\\',
+    '\t': '\\t',
+    '\n': '\\n',
+    '\r': '\\r',
+})
+
+
+def format_copy_value(value):
+    """Format a value for PostgreSQL ``COPY ... FROM STDIN`` text format"""
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, (list, tuple)):
+        value = _format_array_literal(value)
+    elif hasattr(value, 'isoformat'):
+        value = value.isoformat()
+    elif isinstance(value, bytes):
+        value = value.decode('utf-8')
+    return str(value).translate(_COPY_ESCAPES)
+
+
+def _format_array_literal(values):
+    def _element(value):
+        if value is None:
+            return 'NULL'
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"')
+        return '"{}"'.format(value)
+    return '{{{}}}'.format(','.join(_element(value) for value in values))
+
+
+def format_copy_row(values):
+    return '\t'.join(format_copy_value(value) for value in values) + '\n'
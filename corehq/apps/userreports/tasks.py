@@ -1,7 +1,9 @@
 import logging
+import multiprocessing
 from collections import defaultdict
 from datetime import datetime, timedelta
 
+from django import db
 from django.conf import settings
 from django.db import DatabaseError, InternalError, transaction
 from django.db.models import Count, Min
@@ -48,7 +50,10 @@ from corehq.apps.userreports.models import (
     get_report_config,
     id_is_static,
 )
-from corehq.apps.userreports.rebuild import DataSourceResumeHelper
+from corehq.apps.userreports.rebuild import (
+    DataSourceResumeHelper,
+    get_rebuild_partitions,
+)
 from corehq.apps.userreports.reports.data_source import (
     ConfigurableReportDataSource,
 )
@@ -73,9 +78,13 @@ def _get_config_by_id(indicator_config_id):
         return DataSourceConfiguration.get(indicator_config_id)
 
 
-def _build_indicators(config, document_store, relevant_ids):
+def _build_indicators(config, document_store, relevant_ids, bulk_load=False):
     adapter = get_indicator_adapter(config, raise_errors=True, load_source='build_indicators')
 
+    if bulk_load:
+        _bulk_load_indicators(adapter, document_store, relevant_ids)
+        return
+
     for doc in document_store.iter_documents(relevant_ids):
         if config.asynchronous:
             AsyncIndicator.update_record(
@@ -86,6 +95,25 @@ def _build_indicators(config, document_store, relevant_ids):
             adapter.best_effort_save(doc)
 
 
+def _bulk_load_indicators(adapter, document_store, relevant_ids):
+    rows = []
+    for doc in document_store.iter_documents(relevant_ids):
+        try:
+            rows.extend(adapter.get_all_values(doc))
+        except Exception as e:
+            adapter.handle_exception(doc, e)
+    adapter.bulk_load_rows(rows)
+
+
+def _should_bulk_load(config, adapter, limit):
+    return (
+        limit == -1
+        and not config.asynchronous
+        and toggles.UCR_BULK_LOAD_REBUILDS.enabled(config.domain)
+        and adapter.supports_bulk_load()
+    )
+
+
 @task(serializer='pickle', queue=UCR_CELERY_QUEUE, ignore_result=True)
 def rebuild_indicators(indicator_config_id, initiated_by=None, limit=-1, source=None, engine_id=None):
     config = _get_config_by_id(indicator_config_id)
@@ -115,8 +143,20 @@ def rebuild_indicators(indicator_config_id, initiated_by=None, limit=-1, source=
             config.save()
 
         skip_log = bool(limit > 0)  # don't store log for temporary report builder UCRs
-        adapter.rebuild_table(initiated_by=initiated_by, source=source, skip_log=skip_log)
-        _iteratively_build_table(config, limit=limit)
+        if _should_bulk_load(config, adapter, limit):
+            # rows are loaded into a staging table which replaces the
+            # current table once it is complete
+            adapter.log_table_rebuild(initiated_by, source, skip=skip_log)
+            resume_helper = DataSourceResumeHelper(config)
+            resume_helper.clear_resume_info()
+            resume_helper.set_bulk_load_started(datetime.utcnow())
+            adapter.start_bulk_load()
+            _iteratively_build_table(config, resume_helper)
+        else:
+            # any previous build is discarded with the table
+            DataSourceResumeHelper(config).clear_resume_info()
+            adapter.rebuild_table(initiated_by=initiated_by, source=source, skip_log=skip_log)
+            _iteratively_build_table(config, limit=limit)
 
 
 @task(serializer='pickle', queue=UCR_CELERY_QUEUE, ignore_result=True)
@@ -150,15 +190,49 @@ def resume_building_indicators(indicator_config_id, initiated_by=None):
             initiated_by=initiated_by,
             source='resume_building_indicators',
         )
-        _iteratively_build_table(config, resume_helper)
+        _iteratively_build_table(config, resume_helper, resumed=True)
 
 
-def _iteratively_build_table(config, resume_helper=None, in_place=False, limit=-1):
+def _finish_bulk_load(config, bulk_load_started, resumed):
+    adapter = get_indicator_adapter(config, raise_errors=True, load_source='build_indicators')
+    changed_doc_ids = adapter.finish_bulk_load(bulk_load_started, deduplicate=resumed)
+    if changed_doc_ids:
+        # documents saved by the change feed while the rows were being
+        # loaded went to the old table, and documents whose rows broke the
+        # primary key were left out, so save them again one at a time
+        document_store = get_document_store_for_doc_type(
+            config.domain, config.referenced_doc_type, load_source="build_indicators",
+        )
+        for doc_ids in chunked(changed_doc_ids, ID_CHUNK_SIZE):
+            _build_indicators(config, document_store, list(doc_ids))
+
+
+def _iteratively_build_table(config, resume_helper=None, in_place=False, limit=-1, resumed=False):
     resume_helper = resume_helper or DataSourceResumeHelper(config)
-    indicator_config_id = config._id
+    bulk_load_started = resume_helper.get_bulk_load_started()
+    bulk_load = bulk_load_started is not None and not in_place
+
+    _build_remaining_case_types_or_xmlns(config, resume_helper, limit=limit, bulk_load=bulk_load)
+
+    if bulk_load:
+        _finish_bulk_load(config, bulk_load_started, resumed)
+
+    resume_helper.clear_resume_info()
+    _mark_build_finished(config, in_place)
+
+
+def _build_remaining_case_types_or_xmlns(config, resume_helper, limit=-1, bulk_load=False, partition=None):
+    """Build rows for each case type or xmlns not yet completed by `resume_helper`
+
+    :param partition: A `RebuildPartition` to only build its share of the documents
+    """
     case_type_or_xmlns_list = config.get_case_type_or_xmlns_filter()
     completed_ct_xmlns = resume_helper.get_completed_case_type_or_xmlns()
     if completed_ct_xmlns:
+        completed_ct_xmlns = {
+            ct_xmlns.decode('utf-8') if isinstance(ct_xmlns, bytes) else ct_xmlns
+            for ct_xmlns in completed_ct_xmlns
+        }
         case_type_or_xmlns_list = [
             case_type_or_xmlns
             for case_type_or_xmlns in case_type_or_xmlns_list
@@ -172,38 +246,144 @@ def _iteratively_build_table(config, resume_helper=None, in_place=False, limit=-
             case_type_or_xmlns=case_type_or_xmlns,
             load_source="build_indicators",
         )
+        if partition:
+            document_ids = partition.iter_document_ids(config, document_store, case_type_or_xmlns)
+        else:
+            document_ids = document_store.iter_document_ids()
 
-        for i, relevant_id in enumerate(document_store.iter_document_ids()):
+        for i, relevant_id in enumerate(document_ids):
             if i >= limit > -1:
                 break
             relevant_ids.append(relevant_id)
             if len(relevant_ids) >= ID_CHUNK_SIZE:
-                _build_indicators(config, document_store, relevant_ids)
+                _build_indicators(config, document_store, relevant_ids, bulk_load)
                 relevant_ids = []
 
         if relevant_ids:
-            _build_indicators(config, document_store, relevant_ids)
+            _build_indicators(config, document_store, relevant_ids, bulk_load)
 
         resume_helper.add_completed_case_type_or_xmlns(case_type_or_xmlns)
 
-    resume_helper.clear_resume_info()
-    if not id_is_static(indicator_config_id):
+
+def _mark_build_finished(config, in_place=False):
+    if id_is_static(config._id):
+        return
+    if in_place:
+        config.meta.build.finished_in_place = True
+    else:
+        config.meta.build.finished = True
+    try:
+        config.save()
+    except ResourceConflict:
+        current_config = DataSourceConfiguration.get(config._id)
+        # check that a new build has not yet started
         if in_place:
-            config.meta.build.finished_in_place = True
+            if config.meta.build.initiated_in_place == current_config.meta.build.initiated_in_place:
+                current_config.meta.build.finished_in_place = True
         else:
-            config.meta.build.finished = True
-        try:
+            if config.meta.build.initiated == current_config.meta.build.initiated:
+                current_config.meta.build.finished = True
+        current_config.save()
+
+
+def rebuild_indicators_in_parallel(indicator_config_id, num_processes, initiated_by=None, source=None,
+                                   resume=False):
+    """Rebuild a data source using multiple processes
+
+    The documents are split into partitions (by database shard where
+    possible), each of which is built by its own process with its own
+    resume checkpoint. This can't be run from a celery worker since
+    celery worker processes can't have child processes.
+
+    :param resume: Continue a previous parallel rebuild of the data
+    source. `num_processes` must be the same as for that rebuild.
+    """
+    config = _get_config_by_id(indicator_config_id)
+    adapter = get_indicator_adapter(config)
+    partitions = get_rebuild_partitions(config, num_processes)
+    resume_helper = DataSourceResumeHelper(config)
+
+    if resume:
+        adapter.log_table_build(initiated_by=initiated_by, source=source)
+    else:
+        for partition in partitions:
+            DataSourceResumeHelper(config, partition).clear_resume_info()
+        resume_helper.clear_resume_info()
+        if not id_is_static(indicator_config_id):
+            config.meta.build.initiated = datetime.utcnow()
+            config.meta.build.finished = False
+            config.meta.build.rebuilt_asynchronously = False
             config.save()
-        except ResourceConflict:
-            current_config = DataSourceConfiguration.get(config._id)
-            # check that a new build has not yet started
-            if in_place:
-                if config.meta.build.initiated_in_place == current_config.meta.build.initiated_in_place:
-                    current_config.meta.build.finished_in_place = True
-            else:
-                if config.meta.build.initiated == current_config.meta.build.initiated:
-                    current_config.meta.build.finished = True
+        if _should_bulk_load(config, adapter, limit=-1):
+            adapter.log_table_rebuild(initiated_by, source)
+            resume_helper.set_bulk_load_started(datetime.utcnow())
+            adapter.start_bulk_load()
+        else:
+            adapter.rebuild_table(initiated_by=initiated_by, source=source)
+
+    bulk_load_started = resume_helper.get_bulk_load_started()
+    completed_partitions = _set_build_partitions(config, len(partitions), resume)
+    remaining_partitions = [
+        partition for partition in partitions if partition.index not in completed_partitions
+    ]
+
+    # connections can't be shared with the child processes
+    db.connections.close_all()
+    with multiprocessing.Pool(max(len(remaining_partitions), 1)) as pool:
+        work = [
+            (indicator_config_id, partition, bulk_load_started is not None)
+            for partition in remaining_partitions
+        ]
+        for partition in pool.imap_unordered(_build_partition, work):
+            celery_task_logger.info("Finished building %s for %s", partition, indicator_config_id)
+            _add_completed_build_partition(config, partition)
+
+    if bulk_load_started:
+        _finish_bulk_load(config, bulk_load_started, resumed=resume)
+
+    for partition in partitions:
+        DataSourceResumeHelper(config, partition).clear_resume_info()
+    resume_helper.clear_resume_info()
+    _mark_build_finished(config)
+
+
+def _build_partition(args):
+    indicator_config_id, partition, bulk_load = args
+    config = _get_config_by_id(indicator_config_id)
+    resume_helper = DataSourceResumeHelper(config, partition)
+    _build_remaining_case_types_or_xmlns(config, resume_helper, bulk_load=bulk_load, partition=partition)
+    return partition
+
+
+def _set_build_partitions(config, num_partitions, resume=False):
+    """
+    :returns: The indexes of the partitions that a resumed build has
+    already completed
+    """
+    if id_is_static(config._id):
+        return set()
+    if not resume or config.meta.build.partitions != num_partitions:
+        config.meta.build.completed_partitions = []
+    config.meta.build.partitions = num_partitions
+    config.save()
+    return set(config.meta.build.completed_partitions)
+
+
+def _add_completed_build_partition(config, partition):
+    if id_is_static(config._id):
+        return
+    for attempt in range(3):
+        current_config = DataSourceConfiguration.get(config._id)
+        if current_config.meta.build.initiated != config.meta.build.initiated:
+            # a new build has started
+            return
+        current_config.meta.build.completed_partitions.append(partition.index)
+        try:
             current_config.save()
+        except ResourceConflict:
+            continue
+        else:
+            return
 
 
 @task(serializer='pickle', queue=UCR_CELERY_QUEUE)
@@ -0,0 +1,109 @@
+from datetime import datetime, timedelta
+
+from django.test import TestCase
+
+import sqlalchemy
+
+from corehq.apps.userreports.models import SQLColumnIndexes
+from corehq.apps.userreports.tests.utils import (
+    get_sample_data_source,
+    get_sample_doc_and_indicators,
+)
+from corehq.apps.userreports.util import get_indicator_adapter
+
+
+class BulkLoadRebuildTest(TestCase):
+
+    def setUp(self):
+        super(BulkLoadRebuildTest, self).setUp()
+        self.config = get_sample_data_source()
+        self.config.sql_column_indexes = [SQLColumnIndexes(column_ids=['owner'])]
+        self.config.save()
+        self.adapter = get_indicator_adapter(self.config)
+        self.adapter.build_table()
+
+    def tearDown(self):
+        self.adapter.drop_table()
+        if self.adapter.staging_table_exists:
+            with self.adapter.engine.begin() as connection:
+                self.adapter.get_staging_table().drop(connection)
+        self.config.delete()
+        super(BulkLoadRebuildTest, self).tearDown()
+
+    def _doc_ids(self):
+        return {row.doc_id for row in self.adapter.get_query_object()}
+
+    def _index_names(self):
+        inspector = sqlalchemy.inspect(self.adapter.engine)
+        table_name = self.adapter.get_table().name
+        return (
+            inspector.get_pk_constraint(table_name)['name'],
+            sorted(index['name'] for index in inspector.get_indexes(table_name)),
+        )
+
+    def _bulk_load(self, docs):
+        self.adapter.start_bulk_load()
+        self.adapter.bulk_load_rows([row for doc in docs for row in self.adapter.get_all_values(doc)])
+        return self.adapter.finish_bulk_load(datetime.utcnow())
+
+    def test_bulk_load(self):
+        old_doc, _ = get_sample_doc_and_indicators()
+        self.adapter.save(old_doc)
+        build_started = datetime.utcnow()
+
+        self.adapter.start_bulk_load()
+        docs = [get_sample_doc_and_indicators()[0] for i in range(3)]
+        rows = [row for doc in docs for row in self.adapter.get_all_values(doc)]
+        self.adapter.bulk_load_rows(rows)
+        # the live table is untouched until the swap
+        self.assertEqual(self._doc_ids(), {old_doc['_id']})
+
+        changed_doc_ids = self.adapter.finish_bulk_load(build_started)
+        self.assertEqual(changed_doc_ids, [])
+        self.assertEqual(self._doc_ids(), {doc['_id'] for doc in docs})
+        self.assertFalse(self.adapter.staging_table_exists)
+
+    def test_bulk_load_resumed(self):
+        self.adapter.start_bulk_load()
+        doc, _ = get_sample_doc_and_indicators()
+        rows = self.adapter.get_all_values(doc)
+        self.adapter.bulk_load_rows(rows)
+        self.adapter.bulk_load_rows(rows)
+
+        self.adapter.finish_bulk_load(datetime.utcnow(), deduplicate=True)
+        self.assertEqual(self.adapter.get_query_object().count(), 1)
+
+    def test_changed_during_bulk_load(self):
+        build_started = datetime.utcnow() - timedelta(minutes=1)
+        self.adapter.start_bulk_load()
+        doc, _ = get_sample_doc_and_indicators()
+        self.adapter.save(doc)
+        self.assertEqual(self.adapter.finish_bulk_load(build_started), [doc['_id']])
+
+    def test_index_names(self):
+        index_names = self._index_names()
+        self._bulk_load([get_sample_doc_and_indicators()[0]])
+        self.assertEqual(self._index_names(), index_names)
+
+        # the staging indexes of the first build don't get in the way of the next one
+        doc, _ = get_sample_doc_and_indicators()
+        self._bulk_load([doc])
+        self.assertEqual(self._index_names(), index_names)
+        self.assertEqual(self._doc_ids(), {doc['_id']})
+
+    def test_duplicate_rows_are_saved_again(self):
+        doc, _ = get_sample_doc_and_indicators()
+        other_doc, _ = get_sample_doc_and_indicators()
+        self.assertEqual(self._bulk_load([doc, doc, other_doc]), [doc['_id']])
+        self.assertEqual(self._doc_ids(), {other_doc['_id']})
+
+    def test_deleted_during_bulk_load(self):
+        doc, _ = get_sample_doc_and_indicators()
+        other_doc, _ = get_sample_doc_and_indicators()
+        self.adapter.save(doc)
+
+        self.adapter.start_bulk_load()
+        self.adapter.bulk_load_rows(self.adapter.get_all_values(doc) + self.adapter.get_all_values(other_doc))
+        self.adapter.delete(doc)
+        self.adapter.finish_bulk_load(datetime.utcnow())
+        self.assertEqual(self._doc_ids(), {other_doc['_id']})
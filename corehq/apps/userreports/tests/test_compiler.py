@@ -0,0 +1,321 @@
+import datetime
+
+from django.test import SimpleTestCase
+
+from mock import patch
+
+from corehq.apps.userreports.compiler import (
+    CompiledDataSourceEvaluator,
+    DifferentialDataSourceEvaluator,
+    EvaluationPlan,
+    ExpressionCompiler,
+    InterpretedDataSourceEvaluator,
+)
+from corehq.apps.userreports.expressions.factory import ExpressionFactory
+from corehq.apps.userreports.filters.factory import FilterFactory
+from corehq.apps.userreports.models import DataSourceConfiguration
+from corehq.apps.userreports.specs import EvaluationContext, FactoryContext
+from corehq.apps.userreports.tests.utils import (
+    get_sample_data_source,
+    get_sample_doc_and_indicators,
+)
+from corehq.util.test_utils import flag_enabled
+
+
+def _rows(rows):
+    return [[(value.column.id, value.value) for value in row] for row in rows]
+
+
+def _get_base_item_config():
+    return DataSourceConfiguration(
+        domain='test',
+        referenced_doc_type='CommCareCase',
+        table_id='test',
+        base_item_expression={'type': 'property_name', 'property_name': 'children'},
+        configured_indicators=[{
+            'type': 'expression',
+            'column_id': 'name',
+            'datatype': 'string',
+            'expression': {'type': 'property_name', 'property_name': 'name'},
+        }, {
+            'type': 'expression',
+            'column_id': 'iteration',
+            'datatype': 'integer',
+            'expression': {'type': 'base_iteration_number'},
+        }],
+    )
+
+
+class ExpressionCompilerTest(SimpleTestCase):
+
+    def _compare_expression(self, spec, items, context=None):
+        expression = ExpressionFactory.from_spec(spec, context)
+        compiled = ExpressionCompiler().compile_expression(expression)
+        for item in items:
+            self.assertEqual(
+                expression(item, EvaluationContext(item)),
+                compiled(item, EvaluationContext(item)),
+            )
+
+    def test_property_name(self):
+        self._compare_expression(
+            {'type': 'property_name', 'property_name': 'age', 'datatype': 'integer'},
+            [{'age': '3'}, {'age': 'x'}, {}, 'not a dict'],
+        )
+
+    def test_dynamic_property_name(self):
+        self._compare_expression(
+            {
+                'type': 'property_name',
+                'property_name': {'type': 'property_name', 'property_name': 'prop'},
+            },
+            [{'prop': 'a', 'a': 'b'}, {'prop': 'c'}],
+        )
+
+    def test_property_path(self):
+        self._compare_expression(
+            {'type': 'property_path', 'property_path': ['child', 'age'], 'datatype': 'decimal'},
+            [{'child': {'age': '1.5'}}, {'child': None}, {}],
+        )
+
+    def test_conditional(self):
+        self._compare_expression(
+            {
+                'type': 'conditional',
+                'test': {
+                    'type': 'boolean_expression',
+                    'expression': {'type': 'property_name', 'property_name': 'age', 'datatype': 'integer'},
+                    'operator': 'gt',
+                    'property_value': 21,
+                },
+                'expression_if_true': 'legal',
+                'expression_if_false': 'underage',
+            },
+            [{'age': 30}, {'age': 10}],
+        )
+
+    def test_switch_coalesce_array_index(self):
+        self._compare_expression(
+            {
+                'type': 'switch',
+                'switch_on': {
+                    'type': 'coalesce',
+                    'expression': {'type': 'property_name', 'property_name': 'kind'},
+                    'default_expression': 'other',
+                },
+                'cases': {
+                    'list': {
+                        'type': 'array_index',
+                        'array_expression': {'type': 'property_name', 'property_name': 'items'},
+                        'index_expression': 1,
+                    },
+                },
+                'default': {'type': 'identity'},
+            },
+            [{'kind': 'list', 'items': [1, 2]}, {'kind': 'list', 'items': [1]}, {'kind': ''}],
+        )
+
+    def test_root_doc(self):
+        expression = ExpressionFactory.from_spec({
+            'type': 'root_doc',
+            'expression': {'type': 'property_name', 'property_name': 'name'},
+        })
+        compiled = ExpressionCompiler().compile_expression(expression)
+        root = {'name': 'root'}
+        self.assertEqual(compiled({}, EvaluationContext(root)), 'root')
+        self.assertIsNone(compiled({}))
+
+    def test_named_expression_cached(self):
+        context = FactoryContext({
+            'three': ExpressionFactory.from_spec({'type': 'property_name', 'property_name': 'three'}),
+        }, {})
+        expression = ExpressionFactory.from_spec({'type': 'named', 'name': 'three'}, context)
+        compiler = ExpressionCompiler()
+        compiled = compiler.compile_expression(expression)
+        self.assertIs(compiled, compiler.compile_expression(expression))
+
+        item = {'three': 'a'}
+        eval_context = EvaluationContext(item)
+        self.assertEqual(compiled(item, eval_context), 'a')
+        item['three'] = 'b'
+        self.assertEqual(compiled(item, eval_context), 'a')
+        eval_context.increment_iteration()
+        self.assertEqual(compiled(item, eval_context), 'b')
+
+    def test_uncompiled_expression_is_called(self):
+        expression = ExpressionFactory.from_spec({
+            'type': 'concatenate_strings',
+            'expressions': ['a', {'type': 'property_name', 'property_name': 'b'}],
+            'separator': '-',
+        })
+        compiled = ExpressionCompiler().compile_expression(expression)
+        self.assertIs(compiled, expression)
+
+    def test_filters(self):
+        filter_ = FilterFactory.from_spec({
+            'type': 'and',
+            'filters': [
+                {'type': 'property_match', 'property_name': 'type', 'property_value': 'ticket'},
+                {
+                    'type': 'not',
+                    'filter': {
+                        'type': 'or',
+                        'filters': [
+                            {'type': 'property_match', 'property_name': 'closed', 'property_value': True},
+                            {
+                                'type': 'boolean_expression',
+                                'expression': {'type': 'property_name', 'property_name': 'priority'},
+                                'operator': 'in',
+                                'property_value': ['low', 'none'],
+                            },
+                        ],
+                    },
+                },
+            ],
+        })
+        compiled = ExpressionCompiler().compile_filter(filter_)
+        for item in [
+            {'type': 'ticket'},
+            {'type': 'ticket', 'closed': True},
+            {'type': 'ticket', 'priority': 'low'},
+            {'type': 'bug'},
+        ]:
+            self.assertEqual(filter_(item, EvaluationContext(item)), compiled(item, EvaluationContext(item)))
+
+
+class DataSourceEvaluatorTest(SimpleTestCase):
+
+    def setUp(self):
+        self.config = get_sample_data_source()
+
+    @patch('corehq.apps.userreports.specs.datetime')
+    def test_compiled_rows_match(self, datetime_mock):
+        datetime_mock.utcnow.return_value = datetime.datetime(2015, 4, 24, 12, 30, 8, 24886)
+        sample_doc, _ = get_sample_doc_and_indicators()
+        interpreted = InterpretedDataSourceEvaluator(self.config)
+        compiled = CompiledDataSourceEvaluator(self.config)
+        self.assertEqual(
+            _rows(interpreted.get_rows(sample_doc, EvaluationContext(sample_doc))),
+            _rows(compiled.get_rows(sample_doc, EvaluationContext(sample_doc))),
+        )
+
+    def test_compiled_filter_match(self):
+        compiled = CompiledDataSourceEvaluator(self.config)
+        for document in [
+            dict(doc_type="NotCommCareCase", domain='user-reports', type='ticket'),
+            dict(doc_type="CommCareCase", domain='not-user-reports', type='ticket'),
+            dict(doc_type="CommCareCase", domain='user-reports', type='ticket'),
+        ]:
+            self.assertEqual(
+                self.config.filter(document),
+                compiled.filter(document, EvaluationContext(document)),
+            )
+
+    def test_compiled_base_item_expression(self):
+        config = _get_base_item_config()
+        doc = {'_id': 'a', 'doc_type': 'CommCareCase', 'domain': 'test',
+               'children': [{'name': 'x'}, {'name': 'y'}]}
+        rows = CompiledDataSourceEvaluator(config).get_rows(doc, EvaluationContext(doc))
+        self.assertEqual(
+            [[value for column, value in row if column in ('name', 'iteration')] for row in _rows(rows)],
+            [['x', 0], ['y', 1]],
+        )
+
+    @patch('corehq.apps.userreports.compiler._assert_same')
+    def test_differential_base_item_expression(self, assert_same):
+        evaluator = DifferentialDataSourceEvaluator(_get_base_item_config())
+        doc = {'_id': 'a', 'doc_type': 'CommCareCase', 'domain': 'test',
+               'children': [{'name': 'x'}, {'name': 'y'}]}
+        eval_context = EvaluationContext(doc)
+
+        items = evaluator.get_items(doc, eval_context)
+        self.assertEqual(items, [{'name': 'x'}, {'name': 'y'}])
+        values = evaluator.get_values(items[0], eval_context)
+        self.assertIn(('name', 'x'), _rows([values])[0])
+
+        compared = [call[0][2]['type'] for call in assert_same.call_args_list]
+        self.assertEqual(compared, ['filter', 'base_items', 'values'])
+        self.assertTrue(all(call[0][0] for call in assert_same.call_args_list))
+
+    @flag_enabled('UCR_COMPILED_EXPRESSIONS')
+    def test_toggle_selects_compiled(self):
+        self.assertIsInstance(self.config.evaluator, CompiledDataSourceEvaluator)
+
+    def test_default_is_interpreted(self):
+        self.assertIsInstance(self.config.evaluator, InterpretedDataSourceEvaluator)
+
+    @patch('corehq.apps.userreports.compiler._assert_same')
+    def test_differential_reports_mismatch(self, assert_same):
+        evaluator = DifferentialDataSourceEvaluator(self.config)
+        evaluator.candidate.filter = lambda document, eval_context: False
+        document = dict(doc_type="CommCareCase", domain='user-reports', type='ticket')
+        self.assertTrue(evaluator.filter(document, EvaluationContext(document)))
+        is_match = assert_same.call_args[0][0]
+        self.assertFalse(is_match)
+
+
+class EvaluationPlanTest(SimpleTestCase):
+
+    def test_shared_expressions(self):
+        plan = EvaluationPlan()
+        compiler = ExpressionCompiler(plan)
+        spec = {'type': 'property_name', 'property_name': 'age', 'datatype': 'integer'}
+        first = compiler.compile_expression(ExpressionFactory.from_spec(spec))
+        second = ExpressionCompiler(plan).compile_expression(ExpressionFactory.from_spec(spec))
+        self.assertIs(first, second)
+        self.assertEqual(plan.shared_count, 1)
+
+    def test_different_expressions_not_shared(self):
+        plan = EvaluationPlan()
+        first = ExpressionCompiler(plan).compile_expression(ExpressionFactory.from_spec(
+            {'type': 'property_name', 'property_name': 'age', 'datatype': 'integer'}
+        ))
+        second = ExpressionCompiler(plan).compile_expression(ExpressionFactory.from_spec(
+            {'type': 'property_name', 'property_name': 'age', 'datatype': 'string'}
+        ))
+        self.assertIsNot(first, second)
+        self.assertEqual(plan.shared_count, 0)
+
+    def test_evaluated_once_per_document(self):
+        plan = EvaluationPlan()
+        spec = {
+            'type': 'boolean_expression',
+            'expression': {'type': 'property_name', 'property_name': 'type'},
+            'operator': 'eq',
+            'property_value': 'ticket',
+        }
+        compiled = ExpressionCompiler(plan).compile_filter(FilterFactory.from_spec(spec))
+        doc = {'type': 'ticket'}
+        eval_context = EvaluationContext(doc)
+        self.assertTrue(compiled(doc, eval_context))
+        doc['type'] = 'bug'
+        self.assertTrue(compiled(doc, eval_context))
+        self.assertFalse(compiled(doc, EvaluationContext(doc)))
+
+    def test_not_cached_for_base_items(self):
+        plan = EvaluationPlan()
+        compiled = ExpressionCompiler(plan).compile_expression(ExpressionFactory.from_spec(
+            {'type': 'property_name', 'property_name': 'name'}
+        ))
+        doc = {'name': 'doc'}
+        eval_context = EvaluationContext(doc)
+        self.assertEqual(compiled(doc, eval_context), 'doc')
+        self.assertEqual(compiled({'name': 'item'}, eval_context), 'item')
+
+    @patch('corehq.apps.userreports.specs.datetime')
+    def test_planned_data_sources_match(self, datetime_mock):
+        datetime_mock.utcnow.return_value = datetime.datetime(2015, 4, 24, 12, 30, 8, 24886)
+        configs = [get_sample_data_source(), get_sample_data_source()]
+        plan = EvaluationPlan()
+        evaluators = [plan.get_evaluator(config) for config in configs]
+        self.assertGreater(plan.shared_count, 0)
+
+        sample_doc, _ = get_sample_doc_and_indicators()
+        expected = _rows(InterpretedDataSourceEvaluator(configs[0]).get_rows(
+            sample_doc, EvaluationContext(sample_doc)
+        ))
+        eval_context = EvaluationContext(sample_doc)
+        for evaluator in evaluators:
+            self.assertTrue(evaluator.filter(sample_doc, eval_context))
+            self.assertEqual(_rows(evaluator.get_rows(sample_doc, eval_context)), expected)
+            eval_context.reset_iteration()
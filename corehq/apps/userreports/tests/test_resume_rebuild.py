@@ -1,6 +1,15 @@
+from datetime import datetime
+
 from django.test import SimpleTestCase
 
-from corehq.apps.userreports.rebuild import DataSourceResumeHelper
+from mock import Mock, patch
+
+from corehq.apps.userreports.rebuild import (
+    DataSourceResumeHelper,
+    RebuildPartition,
+    get_rebuild_partitions,
+)
+from corehq.apps.userreports.tasks import _set_build_partitions
 from corehq.apps.userreports.tests.utils import get_sample_data_source
 
 
@@ -41,3 +50,78 @@ class DataSourceResumeBuildTest(SimpleTestCase):
     def test_has_resume_info_true(self):
         self._resume_helper.add_completed_case_type_or_xmlns('type1')
         self.assertEqual(True, self._resume_helper.has_resume_info())
+
+    def test_bulk_load_started(self):
+        self.assertIsNone(self._resume_helper.get_bulk_load_started())
+        started = datetime(2020, 1, 2, 3, 4, 5)
+        self._resume_helper.set_bulk_load_started(started)
+        self.assertEqual(started, self._resume_helper.get_bulk_load_started())
+        self.assertEqual(True, self._resume_helper.has_resume_info())
+
+        self._resume_helper.clear_resume_info()
+        self.assertIsNone(self._resume_helper.get_bulk_load_started())
+
+    def test_partition_checkpoints_are_separate(self):
+        partition_helper = DataSourceResumeHelper(self._data_source, RebuildPartition(0, 2))
+        partition_helper.clear_resume_info()
+        partition_helper.add_completed_case_type_or_xmlns('type1')
+        self.assertEqual(False, self._resume_helper.has_resume_info())
+        self.assertEqual(True, partition_helper.has_resume_info())
+        partition_helper.clear_resume_info()
+
+
+class RebuildPartitionTest(SimpleTestCase):
+
+    def setUp(self):
+        self.config = get_sample_data_source()
+
+    @patch('corehq.apps.userreports.rebuild.should_use_sql_backend', return_value=True)
+    @patch('corehq.apps.userreports.rebuild.get_db_aliases_for_partitioned_query',
+           return_value=['p1', 'p2', 'p3', 'p4', 'p5'])
+    def test_partition_by_db(self, *args):
+        partitions = get_rebuild_partitions(self.config, 2)
+        self.assertEqual(
+            [partition.db_aliases for partition in partitions],
+            [['p1', 'p3', 'p5'], ['p2', 'p4']],
+        )
+
+    @patch('corehq.apps.userreports.rebuild.should_use_sql_backend', return_value=True)
+    @patch('corehq.apps.userreports.rebuild.get_db_aliases_for_partitioned_query', return_value=['p1', 'p2'])
+    def test_no_more_partitions_than_dbs(self, *args):
+        self.assertEqual(len(get_rebuild_partitions(self.config, 8)), 2)
+
+    @patch('corehq.apps.userreports.rebuild.should_use_sql_backend', return_value=False)
+    def test_partition_by_id(self, *args):
+        doc_ids = ['id{}'.format(i) for i in range(100)]
+        document_store = Mock(iter_document_ids=lambda: iter(doc_ids))
+        partitions = get_rebuild_partitions(self.config, 3)
+        self.assertTrue(all(partition.db_aliases is None for partition in partitions))
+
+        partitioned_ids = [
+            list(partition.iter_document_ids(self.config, document_store, None))
+            for partition in partitions
+        ]
+        self.assertEqual(sorted(sum(partitioned_ids, [])), sorted(doc_ids))
+        self.assertTrue(all(partitioned_ids))
+
+
+@patch('corehq.apps.userreports.models.DataSourceConfiguration.save')
+class SetBuildPartitionsTest(SimpleTestCase):
+
+    def setUp(self):
+        self.config = get_sample_data_source()
+        self.config._id = 'data-source-id'
+        self.config.meta.build.partitions = 3
+        self.config.meta.build.completed_partitions = [0, 2]
+
+    def test_new_build(self, save):
+        self.assertEqual(_set_build_partitions(self.config, 3), set())
+        self.assertEqual(self.config.meta.build.completed_partitions, [])
+
+    def test_resume(self, save):
+        self.assertEqual(_set_build_partitions(self.config, 3, resume=True), {0, 2})
+        self.assertEqual(self.config.meta.build.completed_partitions, [0, 2])
+
+    def test_resume_with_different_partitions(self, save):
+        self.assertEqual(_set_build_partitions(self.config, 2, resume=True), set())
+        self.assertEqual(self.config.meta.build.partitions, 2)
@@ -1,6 +1,9 @@
+from datetime import date, datetime
+
 from django.test import SimpleTestCase
 
 from corehq.apps.userreports.sql import get_column_name
+from corehq.apps.userreports.sql.util import format_copy_row, format_copy_value
 from corehq.apps.userreports.util import (
     UCR_TABLE_PREFIX,
     get_table_name,
@@ -82,3 +85,25 @@ class UtilitiesTestCase(SimpleTestCase):
             column_name,
             '_be_a_bunch_longer_than_sixty_three_characters_6174b354_decimal',
         )
+
+
+class FormatCopyValueTest(SimpleTestCase):
+
+    def test_null(self):
+        self.assertEqual(format_copy_value(None), '\\N')
+
+    def test_escapes(self):
+        self.assertEqual(format_copy_value('a\tb\nc\\d'), 'a\\tb\\nc\\\\d')
+
+    def test_dates(self):
+        self.assertEqual(format_copy_value(date(2020, 1, 2)), '2020-01-02')
+        self.assertEqual(format_copy_value(datetime(2020, 1, 2, 3, 4, 5)), '2020-01-02T03:04:05')
+
+    def test_bool(self):
+        self.assertEqual(format_copy_value(True), 't')
+
+    def test_array(self):
+        self.assertEqual(format_copy_value(['a', 'b"c', None]), '{"a","b\\\\"c",NULL}')
+
+    def test_row(self):
+        self.assertEqual(format_copy_row(['a', 1, None]), 'a\t1\t\\N\n')
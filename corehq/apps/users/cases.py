@@ -2,6 +2,8 @@ import numbers
 
 from couchdbkit import ResourceNotFound
 
+from dimagi.utils.couch.bulk import get_docs
+
 from corehq.apps.groups.models import Group
 from corehq.apps.locations.models import SQLLocation
 from corehq.apps.users.models import CommCareUser, CouchUser, WebUser
@@ -56,6 +58,31 @@ def get_wrapped_owner(owner_id, support_deleted=False):
     return None
 
 
+def get_wrapped_owners(owner_ids):
+    """
+    Bulk version of ``get_wrapped_owner``.
+
+    Returns a dict of owner_id -> wrapped location, user or group for
+    each of the ids that is a known owner type.
+    """
+    owner_ids = [owner_id for owner_id in set(owner_ids) if owner_id and isinstance(owner_id, str)]
+    owners = {
+        location.location_id: location
+        for location in SQLLocation.objects.filter(location_id__in=owner_ids)
+    }
+    doc_classes = {
+        'CommCareUser': CommCareUser,
+        'WebUser': WebUser,
+        'Group': Group,
+    }
+    remaining_ids = [owner_id for owner_id in owner_ids if owner_id not in owners]
+    for owner_doc in get_docs(user_db(), remaining_ids):
+        cls = doc_classes.get(owner_doc['doc_type'])
+        if cls:
+            owners[owner_doc['_id']] = cls.wrap(owner_doc)
+    return owners
+
+
 def get_owning_users(owner_id):
     """
     Given an owner ID, get a list of the owning users, regardless of whether
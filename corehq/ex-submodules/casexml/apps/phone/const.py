@@ -13,9 +13,18 @@ INITIAL_ASYNC_TIMEOUT_THRESHOLD = 10
 # to see if the task is done.
 ASYNC_RETRY_AFTER = 5
 
+# streamed restore content is sent to the client in chunks of this size (in bytes)
+STREAMING_RESTORE_CHUNK_SIZE = 64 * 1024
+# max number of chunks buffered between the producer and the response
+STREAMING_RESTORE_QUEUE_SIZE = 16
+
 ASYNC_RESTORE_CACHE_KEY_PREFIX = "async-restore-task"
 RESTORE_CACHE_KEY_PREFIX = "ota-restore"
 
 # case sync algorithms
 CLEAN_OWNERS = 'clean_owners'
 LIVEQUERY = 'livequery'
+
+# bounds for the process-local cache of serialized case XML fragments
+CASE_FRAGMENT_CACHE_MAX_ITEMS = 100000
+CASE_FRAGMENT_CACHE_MAX_BYTES = 256 * 1024 * 1024  # 256MB
@@ -0,0 +1,118 @@
+"""Reusable serialized case XML fragments for livequery restores
+
+Rendering a case to XML is the most CPU intensive part of compiling a
+restore response for users with many cases, and most of those cases
+have not changed since the last time they were rendered. A rendered
+fragment only depends on the case (as of its last server modification),
+the required sync actions and the restore version, so it can be reused
+by every restore that needs the same case in the same state.
+
+The cache is process-local and bounded by both item count and total
+size in bytes. Least recently used fragments are evicted first.
+"""
+from collections import OrderedDict
+
+from casexml.apps.phone.const import (
+    CASE_FRAGMENT_CACHE_MAX_BYTES,
+    CASE_FRAGMENT_CACHE_MAX_ITEMS,
+)
+from casexml.apps.phone.data_providers.case.load_testing import (
+    get_xml_for_response,
+)
+from casexml.apps.phone.xml import get_case_element, tostring
+from corehq.toggles import LIVEQUERY_CASE_FRAGMENT_CACHE
+
+
+class CaseFragmentCache(object):
+    """Bounded least-recently-used cache of case XML fragments (bytes)"""
+
+    def __init__(self, max_items=CASE_FRAGMENT_CACHE_MAX_ITEMS,
+                 max_bytes=CASE_FRAGMENT_CACHE_MAX_BYTES):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key):
+        try:
+            self._data.move_to_end(key)
+        except KeyError:
+            return None
+        return self._data[key]
+
+    def set(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+        old = self._data.pop(key, None)
+        if old is not None:
+            self.size -= len(old)
+        self._data[key] = value
+        self.size += len(value)
+        while len(self._data) > self.max_items or self.size > self.max_bytes:
+            ignore, evicted = self._data.popitem(last=False)
+            self.size -= len(evicted)
+            self.evictions += 1
+
+    def clear(self):
+        self._data.clear()
+        self.size = 0
+
+
+class FragmentCacheStats(object):
+    """Per-restore fragment cache counters"""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+    def __repr__(self):
+        return "FragmentCacheStats(hits={}, misses={})".format(self.hits, self.misses)
+
+
+_fragment_cache = CaseFragmentCache()
+
+
+def get_fragment_key(case, required_updates, version):
+    """Get fragment cache key for the given case sync update
+
+    :returns: A hashable key or `None` if the case cannot be cached.
+    """
+    if not case.server_modified_on:
+        return None
+    return (
+        case.case_id,
+        case.server_modified_on.isoformat(),
+        version,
+        tuple(required_updates),
+    )
+
+
+def get_xml_for_updates(updates, restore_state):
+    """Get serialized case XML elements for a list of `CaseSyncUpdate`s
+
+    Uses cached fragments where possible and records hits and misses
+    on `restore_state.case_fragment_stats`.
+    """
+    if (restore_state.loadtest_factor > 1
+            or not LIVEQUERY_CASE_FRAGMENT_CACHE.enabled(restore_state.domain)):
+        for update in updates:
+            yield from get_xml_for_response(update, restore_state)
+        return
+
+    stats = restore_state.case_fragment_stats
+    version = restore_state.version
+    for update in updates:
+        key = get_fragment_key(update.case, update.required_updates, version)
+        xml = _fragment_cache.get(key) if key is not None else None
+        if xml is None:
+            stats.misses += 1
+            xml = tostring(get_case_element(update.case, update.required_updates, version))
+            if key is not None:
+                _fragment_cache.set(key, xml)
+        else:
+            stats.hits += 1
+        yield xml
@@ -28,15 +28,19 @@ from itertools import chain, islice
 
 from casexml.apps.case.const import CASE_INDEX_EXTENSION as EXTENSION
 from casexml.apps.phone.const import ASYNC_RETRY_AFTER
-from casexml.apps.phone.data_providers.case.load_testing import (
-    get_xml_for_response,
+from casexml.apps.phone.data_providers.case.fragments import (
+    get_xml_for_updates,
 )
 from casexml.apps.phone.data_providers.case.stock import get_stock_payload
 from casexml.apps.phone.data_providers.case.utils import get_case_sync_updates
 from casexml.apps.phone.tasks import ASYNC_RESTORE_SENT
 from corehq.form_processor.interfaces.dbaccessors import CaseAccessors
 from corehq.sql_db.routers import read_from_plproxy_standbys
-from corehq.toggles import LIVEQUERY_READ_FROM_STANDBYS, NAMESPACE_USER
+from corehq.toggles import (
+    LIVEQUERY_READ_FROM_STANDBYS,
+    LIVEQUERY_RECURSIVE_INDICES,
+    NAMESPACE_USER,
+)
 from corehq.util.datadog.utils import case_load_counter
 
 
@@ -198,6 +202,8 @@ def do_livequery(timing_context, restore_state, response, async_task=None):
     IGNORE = object()
     debug = logging.getLogger(__name__).debug
     accessor = CaseAccessors(restore_state.domain)
+    if LIVEQUERY_RECURSIVE_INDICES.enabled(restore_state.domain):
+        accessor = PrefetchClosureCaseAccessor(accessor, timing_context)
 
     # case graph data structures
     live_ids = set()
@@ -300,6 +306,90 @@ class PrefetchIndexCaseAccessor(object):
         return self.accessor.get_cases(case_ids, **kw)
 
 
+class PrefetchClosureCaseAccessor(object):
+    """Case accessor that loads the entire related case graph up front
+
+    The first call to `get_related_indices` fetches all indices
+    reachable from the given case ids with a recursive query on each
+    shard. Another round is only needed when an index references a case
+    on a different shard. The closed and deleted status of every case in
+    the graph is then fetched in a single query. Subsequent
+    `get_related_indices` and `get_closed_and_deleted_ids` calls made
+    while walking the graph are answered from memory, and return the
+    same results as the equivalent database queries.
+    """
+
+    def __init__(self, accessor, timing_context):
+        self.domain = accessor.domain
+        self.accessor = accessor
+        self.timing_context = timing_context
+        self.indices_by_case = None
+
+    def __getattr__(self, name):
+        return getattr(self.accessor, name)
+
+    def get_related_indices(self, case_ids, exclude_indices):
+        if self.indices_by_case is None:
+            self._load_closure(case_ids)
+        result = []
+        seen = set(exclude_indices)
+        for case_id in case_ids:
+            # parent and host cases
+            for index in self.indices_by_case[case_id]:
+                key = _index_key(index)
+                if key not in seen:
+                    seen.add(key)
+                    result.append(index)
+            # open extension cases
+            for index in self.extensions_by_host[case_id]:
+                key = _index_key(index)
+                if key not in seen and index.case_id not in self.closed_or_deleted:
+                    seen.add(key)
+                    result.append(index)
+        return result
+
+    def get_closed_and_deleted_ids(self, case_ids):
+        unknown_ids = [case_id for case_id in case_ids if case_id not in self.graph_ids]
+        result = [(case_id,) + self.closed_or_deleted[case_id]
+            for case_id in case_ids
+            if case_id in self.closed_or_deleted]
+        if unknown_ids:
+            result.extend(self.accessor.get_closed_and_deleted_ids(unknown_ids))
+        return result
+
+    def _load_closure(self, case_ids):
+        indices = {}
+        queried_ids = set()
+        next_ids = set(case_ids)
+        while next_ids:
+            with self.timing_context("get_related_indices_closure({} cases)".format(len(next_ids))):
+                related = self.accessor.get_related_indices_closure(list(next_ids), indices)
+            queried_ids.update(next_ids)
+            for index in related:
+                indices[_index_key(index)] = index
+            next_ids = {case_id
+                for index in related
+                for case_id in [index.case_id, index.referenced_id]
+                if case_id not in queried_ids}
+
+        self.indices_by_case = defaultdict(list)
+        self.extensions_by_host = defaultdict(list)
+        for index in indices.values():
+            self.indices_by_case[index.case_id].append(index)
+            if index.relationship == EXTENSION:
+                self.extensions_by_host[index.referenced_id].append(index)
+        self.graph_ids = queried_ids
+
+        with self.timing_context("get_closed_and_deleted_ids({} cases)".format(len(queried_ids))):
+            rows = self.accessor.get_closed_and_deleted_ids(list(queried_ids))
+        self.closed_or_deleted = {case_id: (closed, deleted)
+            for case_id, closed, deleted in rows}
+
+
+def _index_key(index):
+    return '{} {}'.format(index.case_id, index.identifier)
+
+
 def batch_cases(accessor, case_ids):
     def take(n, iterable):
         # https://docs.python.org/2/library/itertools.html#recipes
@@ -348,9 +438,7 @@ def compile_response(timing_context, restore_state, response, batches, update_pr
                 restore_state.domain, cases, restore_state.last_sync_log)
 
         with timing_context("get_xml_for_response (%s updates)" % len(updates)):
-            response.extend(item
-                for update in updates
-                for item in get_xml_for_response(update, restore_state))
+            response.extend(get_xml_for_updates(updates, restore_state))
 
         done += len(cases)
         update_progress(done)
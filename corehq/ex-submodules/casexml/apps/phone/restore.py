@@ -1,7 +1,9 @@
 import logging
 import os
+import queue
 import shutil
 import tempfile
+import threading
 import uuid
 from io import BytesIO
 from uuid import uuid4
@@ -14,9 +16,11 @@ from celery.exceptions import TimeoutError
 from celery.result import AsyncResult
 from django.http import HttpResponse, StreamingHttpResponse
 from django.conf import settings
+from django.db import connections
 from django.utils.text import slugify
 
 from casexml.apps.phone.data_providers import get_element_providers, get_async_providers
+from casexml.apps.phone.data_providers.case.fragments import FragmentCacheStats
 from casexml.apps.phone.exceptions import (
     InvalidSyncLogException, SyncLogUserMismatch,
     BadStateException, RestoreException
@@ -24,9 +28,10 @@ from casexml.apps.phone.exceptions import (
 from casexml.apps.phone.restore_caching import AsyncRestoreTaskIdCache, RestorePayloadPathCache
 from casexml.apps.phone.tasks import get_async_restore_payload, ASYNC_RESTORE_SENT
 from casexml.apps.phone.utils import get_cached_items_with_count
-from corehq.toggles import EXTENSION_CASES_SYNC_ENABLED, LIVEQUERY_SYNC
+from corehq.toggles import EXTENSION_CASES_SYNC_ENABLED, LIVEQUERY_SYNC, STREAMING_RESTORE
 from corehq.util.datadog.utils import bucket_value, maybe_add_domain_tag
 from corehq.util.metrics import metrics_counter, metrics_histogram
+from corehq.util.global_request.api import get_request, set_request
 from corehq.util.timer import TimingContext
 from memoized import memoized
 from casexml.apps.phone.models import (
@@ -51,6 +56,8 @@ from casexml.apps.phone.const import (
     ASYNC_RETRY_AFTER,
     CLEAN_OWNERS,
     LIVEQUERY,
+    STREAMING_RESTORE_CHUNK_SIZE,
+    STREAMING_RESTORE_QUEUE_SIZE,
 )
 from casexml.apps.phone.xml import get_sync_element, get_progress_element
 from corehq.blobs import CODES, get_blob_db
@@ -155,6 +162,142 @@ class RestoreContent(object):
             raise
 
 
+class StreamingRestoreContent(RestoreContent):
+    """Restore content that is written to `stream` as it is produced
+
+    The item count is not known until all content has been produced,
+    so it cannot be included in a streamed response.
+    """
+
+    def __init__(self, username, stream):
+        super(StreamingRestoreContent, self).__init__(username, items=False)
+        self.stream = stream
+
+    def __enter__(self):
+        self.response_body = self.stream
+        self.stream.write(self.start_tag_template % {
+            b"items": b'',
+            b"username": self.username.encode("utf8"),
+            b"nature": ResponseNature.OTA_RESTORE_SUCCESS.encode("utf8"),
+        })
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+    def finish(self):
+        self.stream.write(self.closing_tag)
+        self.stream.flush()
+
+
+class RestoreStream(object):
+    """Write-only file-like object that hands content to a consumer in chunks
+
+    All content is also written to `self.fileobj` so the full payload
+    can be cached once it is complete.
+    """
+
+    def __init__(self, chunks, aborted, chunk_size=STREAMING_RESTORE_CHUNK_SIZE):
+        self.chunks = chunks
+        self.aborted = aborted
+        self.chunk_size = chunk_size
+        self.buffer = []
+        self.buffer_size = 0
+        self.fileobj = tempfile.TemporaryFile('w+b')
+
+    def write(self, data):
+        self.fileobj.write(data)
+        self.buffer.append(data)
+        self.buffer_size += len(data)
+        if self.buffer_size >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.put(b''.join(self.buffer))
+            self.buffer = []
+            self.buffer_size = 0
+
+    def put(self, item):
+        while True:
+            if self.aborted.is_set():
+                raise RestoreStreamAborted()
+            try:
+                self.chunks.put(item, timeout=1)
+                return
+            except queue.Full:
+                pass
+
+    def close(self):
+        self.fileobj.close()
+
+
+class RestoreStreamAborted(Exception):
+    pass
+
+
+class StreamingRestoreResponse(object):
+    """Restore response that is sent to the client while it is generated
+
+    Content is generated by `RestoreConfig.generate_streaming_payload` in
+    a producer thread and passed to the response iterator through a
+    bounded queue, so the client starts receiving bytes as soon as the
+    first chunk is ready and a slow client applies back pressure to the
+    producer.
+    """
+
+    def __init__(self, config):
+        self.config = config
+
+    def get_http_response(self):
+        response = StreamingHttpResponse(
+            self.iter_content(),
+            content_type="text/xml; charset=utf-8",
+            status=200,
+        )
+        return response
+
+    def iter_content(self):
+        chunks = queue.Queue(maxsize=STREAMING_RESTORE_QUEUE_SIZE)
+        aborted = threading.Event()
+        producer = threading.Thread(
+            target=self._produce,
+            args=(chunks, aborted, get_request()),
+            name="restore-stream-{}".format(self.config.restore_user.username),
+        )
+        producer.daemon = True
+        producer.start()
+        try:
+            while True:
+                chunk = chunks.get()
+                if chunk is None:
+                    break
+                if isinstance(chunk, Exception):
+                    raise chunk
+                yield chunk
+        finally:
+            aborted.set()
+            producer.join()
+
+    def _produce(self, chunks, aborted, request):
+        set_request(request)
+        stream = RestoreStream(chunks, aborted)
+        try:
+            self.config.generate_streaming_payload(stream)
+            stream.put(None)
+        except RestoreStreamAborted:
+            logger.info("restore stream aborted for %s", self.config.restore_user.username)
+        except Exception as err:
+            logger.exception("error streaming restore for %s", self.config.restore_user.username)
+            try:
+                stream.put(err)
+            except RestoreStreamAborted:
+                pass
+        finally:
+            stream.close()
+            connections.close_all()
+
+
 class RestoreResponse(object):
 
     def __init__(self, fileobj):
@@ -356,6 +499,7 @@ class RestoreState(object):
         self.restore_user = restore_user
         self.params = params
         self.provider_log = {}  # individual data providers can log stuff here
+        self.case_fragment_stats = FragmentCacheStats()
         # get set in the start_sync() function
         self.start_time = None
         self.duration = None
@@ -557,10 +701,13 @@ class RestoreConfig(object):
 
     def get_response(self):
         is_async = self.is_async
+        is_streaming = False
         try:
             with self.timing_context:
                 payload = self.get_payload()
             response = payload.get_http_response()
+            # streamed responses record timing when the stream is complete
+            is_streaming = isinstance(payload, StreamingRestoreResponse)
         except RestoreException as e:
             logger.exception("%s error during restore submitted by %s: %s" %
                               (type(e).__name__, self.restore_user.username, str(e)))
@@ -571,7 +718,7 @@ class RestoreConfig(object):
             )
             response = HttpResponse(response, content_type="text/xml; charset=utf-8",
                                     status=412)  # precondition failed
-        if not is_async:
+        if not (is_async or is_streaming):
             self._record_timing(response.status_code)
         return response
 
@@ -593,11 +740,21 @@ class RestoreConfig(object):
         # Start new sync
         if self.is_async:
             response = self._get_asynchronous_payload()
+        elif self.is_streaming:
+            response = StreamingRestoreResponse(self)
         else:
             response = self.generate_payload()
 
         return response
 
+    @property
+    def is_streaming(self):
+        return (
+            not self.is_async
+            and not self.params.include_item_count
+            and STREAMING_RESTORE.enabled(self.domain)
+        )
+
     def validate(self):
         try:
             self.restore_state.validate_state()
@@ -636,6 +793,30 @@ class RestoreConfig(object):
             raise
         return response
 
+    def generate_streaming_payload(self, stream):
+        """Generate restore content, writing it to `stream` as it is produced
+
+        The request timer has already stopped by the time the response
+        is being streamed, so generation is timed with a new context.
+        The sync log is saved before the closing tag is written so it
+        exists by the time the client has received the full payload.
+
+        :param stream: A `RestoreStream`. Its `fileobj` is used to
+        cache the complete payload if necessary.
+        """
+        self.timing_context = TimingContext(self.timing_context.root.name)
+        with self.timing_context:
+            self.restore_state.start_sync()
+            username = self.restore_user.username
+            with StreamingRestoreContent(username, stream) as content:
+                self._extend_restore_content(content)
+                self.restore_state.finish_sync()
+                content.finish()
+            stream.fileobj.seek(0)
+            self.set_cached_payload_if_necessary(
+                stream.fileobj, self.restore_state.duration, False)
+        self._record_timing(200)
+
     def _get_asynchronous_payload(self):
         new_task = False
         # fetch the task from celery
@@ -690,15 +871,17 @@ class RestoreConfig(object):
         username = self.restore_user.username
         count_items = self.params.include_item_count
         with RestoreContent(username, count_items) as content:
-            for provider in get_element_providers(self.timing_context):
-                with self.timing_context(provider.__class__.__name__):
-                    content.extend(provider.get_elements(self.restore_state))
+            self._extend_restore_content(content, async_task)
+            return content.get_fileobj()
 
-            for provider in get_async_providers(self.timing_context, async_task):
-                with self.timing_context(provider.__class__.__name__):
-                    provider.extend_response(self.restore_state, content)
+    def _extend_restore_content(self, content, async_task=None):
+        for provider in get_element_providers(self.timing_context):
+            with self.timing_context(provider.__class__.__name__):
+                content.extend(provider.get_elements(self.restore_state))
 
-            return content.get_fileobj()
+        for provider in get_async_providers(self.timing_context, async_task):
+            with self.timing_context(provider.__class__.__name__):
+                provider.extend_response(self.restore_state, content)
 
     def set_cached_payload_if_necessary(self, fileobj, duration, is_async):
         # must cache if the duration was longer than the threshold
@@ -789,6 +972,13 @@ class RestoreConfig(object):
 
         tags['type'] = 'sync' if self.params.sync_log_id else 'restore'
 
+        fragment_stats = self.restore_state.case_fragment_stats
+        if fragment_stats.hits or fragment_stats.misses:
+            metrics_counter('commcare.restores.case_fragment_cache.hits',
+                            fragment_stats.hits, tags=tags)
+            metrics_counter('commcare.restores.case_fragment_cache.misses',
+                            fragment_stats.misses, tags=tags)
+
         if settings.ENTERPRISE_MODE and self.params.app and self.params.app.copy_of:
             app_name = slugify(self.params.app.name)
             tags['app'] = '{}-{}'.format(app_name, self.params.app.version)
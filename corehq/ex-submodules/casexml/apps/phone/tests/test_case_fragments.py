@@ -0,0 +1,75 @@
+from datetime import datetime
+
+from django.test import SimpleTestCase
+
+from casexml.apps.case.models import CommCareCase
+from casexml.apps.phone.data_providers.case.fragments import (
+    CaseFragmentCache,
+    get_fragment_key,
+)
+
+
+class TestCaseFragmentCache(SimpleTestCase):
+
+    def test_get_missing(self):
+        cache = CaseFragmentCache()
+        self.assertIsNone(cache.get('a'))
+
+    def test_evict_by_count(self):
+        cache = CaseFragmentCache(max_items=2)
+        cache.set('a', b'<a/>')
+        cache.set('b', b'<b/>')
+        cache.get('a')
+        cache.set('c', b'<c/>')
+        self.assertEqual(cache.get('a'), b'<a/>')
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), b'<c/>')
+        self.assertEqual(cache.evictions, 1)
+
+    def test_evict_by_size(self):
+        cache = CaseFragmentCache(max_bytes=10)
+        cache.set('a', b'12345')
+        cache.set('b', b'12345')
+        cache.set('c', b'123')
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.size, 8)
+
+    def test_replace_value(self):
+        cache = CaseFragmentCache()
+        cache.set('a', b'12345')
+        cache.set('a', b'123')
+        self.assertEqual(cache.get('a'), b'123')
+        self.assertEqual(cache.size, 3)
+
+    def test_oversize_value_is_not_cached(self):
+        cache = CaseFragmentCache(max_bytes=4)
+        cache.set('a', b'12345')
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.size, 0)
+
+
+class TestGetFragmentKey(SimpleTestCase):
+
+    def _case(self, **kw):
+        case = CommCareCase(**kw)
+        case._id = 'abc'
+        return case
+
+    def test_key_changes_with_modified_on(self):
+        case = self._case(server_modified_on=datetime(2020, 1, 1))
+        key1 = get_fragment_key(case, ['create', 'update'], '2.0')
+        case.server_modified_on = datetime(2020, 1, 2)
+        key2 = get_fragment_key(case, ['create', 'update'], '2.0')
+        self.assertNotEqual(key1, key2)
+
+    def test_key_changes_with_updates(self):
+        case = self._case(server_modified_on=datetime(2020, 1, 1))
+        self.assertNotEqual(
+            get_fragment_key(case, ['create', 'update'], '2.0'),
+            get_fragment_key(case, ['update'], '2.0'),
+        )
+
+    def test_no_modified_on(self):
+        case = self._case()
+        self.assertIsNone(get_fragment_key(case, ['update'], '2.0'))
@@ -1,3 +1,6 @@
+import queue
+import threading
+
 import six
 from django.test import TestCase
 from django.test.testcases import SimpleTestCase
@@ -9,7 +12,12 @@ from casexml.apps.case.tests.util import (
     delete_all_sync_logs,
 )
 from casexml.apps.case.mock import CaseBlock
-from casexml.apps.phone.restore import RestoreContent
+from casexml.apps.phone.restore import (
+    RestoreContent,
+    RestoreStream,
+    RestoreStreamAborted,
+    StreamingRestoreContent,
+)
 from casexml.apps.phone.tests.utils import create_restore_user
 from casexml.apps.phone.utils import MockDevice
 
@@ -75,3 +83,30 @@ class TestRestoreContent(SimpleTestCase):
             response.append(body.encode('utf-8'))
             with response.get_fileobj() as fileobj:
                 self.assertEqual(expected, fileobj.read().decode('utf-8'))
+
+    def test_streaming(self):
+        user = 'user1'
+        body = '<elem>data0</elem>'
+        expected = self._expected(user, body * 3)
+        chunks = queue.Queue()
+        stream = RestoreStream(chunks, threading.Event(), chunk_size=10)
+        with StreamingRestoreContent(user, stream) as response:
+            response.extend([body.encode('utf-8')] * 3)
+            response.finish()
+        streamed = []
+        while not chunks.empty():
+            streamed.append(chunks.get())
+        self.assertGreater(len(streamed), 1)
+        self.assertEqual(expected, b''.join(streamed).decode('utf-8'))
+        stream.fileobj.seek(0)
+        self.assertEqual(expected, stream.fileobj.read().decode('utf-8'))
+        stream.close()
+
+    def test_streaming_aborted(self):
+        aborted = threading.Event()
+        stream = RestoreStream(queue.Queue(), aborted, chunk_size=1)
+        aborted.set()
+        with self.assertRaises(RestoreStreamAborted):
+            with StreamingRestoreContent('user1', stream):
+                pass
+        stream.close()
@@ -1066,6 +1066,12 @@ class LiveQueryExtensionCasesSyncTokenUpdatesSQL(LiveQueryExtensionCasesSyncToke
     pass
 
 
+@flag_enabled('LIVEQUERY_RECURSIVE_INDICES')
+@use_sql_backend
+class LiveQueryRecursiveIndicesExtensionCasesSyncTokenUpdatesSQL(LiveQueryExtensionCasesSyncTokenUpdates):
+    pass
+
+
 class ExtensionCasesFirstSync(BaseSyncTest):
 
     def setUp(self):
@@ -1848,6 +1854,12 @@ class LiveQueryMultiUserSyncTestSQL(LiveQueryMultiUserSyncTest):
     pass
 
 
+@flag_enabled('LIVEQUERY_RECURSIVE_INDICES')
+@use_sql_backend
+class LiveQueryRecursiveIndicesMultiUserSyncTestSQL(LiveQueryMultiUserSyncTest):
+    pass
+
+
 class SteadyStateExtensionSyncTest(BaseSyncTest):
     """
     Test that doing multiple clean syncs with extensions does what we think it will
@@ -2010,6 +2022,12 @@ class LiveQuerySteadyStateExtensionSyncTestSQL(LiveQuerySteadyStateExtensionSync
     pass
 
 
+@flag_enabled('LIVEQUERY_RECURSIVE_INDICES')
+@use_sql_backend
+class LiveQueryRecursiveIndicesSteadyStateExtensionSyncTestSQL(LiveQuerySteadyStateExtensionSyncTest):
+    pass
+
+
 class SyncTokenReprocessingTest(BaseSyncTest):
     """
     Tests sync token logic for fixing itself when it gets into a bad state.
@@ -7,8 +7,10 @@ from couchexport.models import Format
 from couchexport import writers
 
 
-def get_writer(format, use_formatted_cells=False):
+def get_writer(format, use_formatted_cells=False, streaming=False):
     if format == Format.XLS_2007:
+        if streaming:
+            return writers.StreamingExcel2007ExportWriter(use_formatted_cells=use_formatted_cells)
         return writers.Excel2007ExportWriter(use_formatted_cells=use_formatted_cells)
     try:
         return {
@@ -1,18 +1,22 @@
 from codecs import BOM_UTF8
 from contextlib import closing
+import datetime
 import io
 import os
 
 from django.test import SimpleTestCase
 from lxml import html, etree
+import openpyxl
 from mock import patch, Mock
 
-from couchexport.export import export_from_tables
+from couchexport.export import FormattedRow, export_from_tables
 from couchexport.models import Format
 from couchexport.writers import (
     MAX_XLS_COLUMNS,
     CsvFileWriter,
     PythonDictWriter,
+    StreamingExcel2007ExportWriter,
+    UnzippedCsvExportWriter,
     XlsLengthException,
     ZippedExportWriter,
 )
@@ -83,6 +87,20 @@ class CsvFileWriterTests(SimpleTestCase):
         file_start = writer.get_file().read(6)
         self.assertEqual(file_start, BOM_UTF8 + b'100')
 
+    def test_write_rows_matches_write_row(self):
+        rows = [['hám', b'sp\xc3\xa1m', 1], [None, 'a,b', 'c"d']]
+        single = CsvFileWriter()
+        single.open('Spam')
+        for row in rows:
+            single.write_row([col if col is not None else '' for col in row])
+        single.finish()
+
+        batched = CsvFileWriter()
+        batched.open('Spam')
+        batched.write_rows(rows)
+        batched.finish()
+        self.assertEqual(batched.get_file().read(), single.get_file().read())
+
 
 class HtmlExportWriterTests(SimpleTestCase):
 
@@ -121,6 +139,86 @@ class Excel2007ExportWriterTests(SimpleTestCase):
         export_from_tables(tables, file_, format_)
 
 
+class WriteRowsTest(SimpleTestCase):
+
+    def _export(self, writer, rows, batched):
+        file_ = io.BytesIO()
+        writer.open([('table', [['a', 'b']])], file_)
+        if batched:
+            writer.write_rows('table', rows)
+        else:
+            writer.write([('table', rows)])
+        writer.close()
+        return writer
+
+    def test_on_disk_writer(self):
+        rows = [['x', None], [b'y', 2]]
+        single = self._export(UnzippedCsvExportWriter(), rows, batched=False)
+        batched = self._export(UnzippedCsvExportWriter(), rows, batched=True)
+        self.assertEqual(batched.file.getvalue(), single.file.getvalue())
+
+    def test_in_memory_writer(self):
+        rows = [['x', None], ['y', 2]]
+        writer = self._export(PythonDictWriter(), rows, batched=True)
+        self.assertEqual(writer.get_preview()[0]['rows'], [['x', None], ['y', 2]])
+
+
+class StreamingExcel2007ExportWriterTests(SimpleTestCase):
+
+    def _export(self, writer, rows, headers=('a', 'b', 'c')):
+        file_ = io.BytesIO()
+        writer.open([('table', [list(headers)])], file_, table_titles={'table': 'My <table>'})
+        writer.write_rows('table', rows)
+        writer.close()
+        file_.seek(0)
+        return openpyxl.load_workbook(file_)
+
+    def _values(self, sheet):
+        return [[cell.value for cell in row] for row in sheet.iter_rows()]
+
+    def test_values(self):
+        for use_shared_strings in (False, True):
+            workbook = self._export(
+                StreamingExcel2007ExportWriter(use_shared_strings=use_shared_strings),
+                [['x & <y>', 1, 2.5], [b'b\xc3\xa1', None, ' spaced ']],
+            )
+            self.assertEqual(workbook.sheetnames, ['My <table>'])
+            self.assertEqual(self._values(workbook.active), [
+                ['a', 'b', 'c'],
+                ['x & <y>', 1, 2.5],
+                ['bá', None, ' spaced '],
+            ])
+
+    def test_formatted_cells(self):
+        workbook = self._export(
+            StreamingExcel2007ExportWriter(use_formatted_cells=True),
+            [FormattedRow(['12', '2020-01-02', 'true'], skip_excel_formatting=[0])],
+        )
+        row = list(workbook.active.iter_rows())[1]
+        self.assertEqual(row[0].value, '12')
+        self.assertEqual(row[1].value, datetime.datetime(2020, 1, 2))
+        self.assertEqual(row[1].number_format, 'yyyy-mm-dd')
+        self.assertIs(row[2].value, True)
+
+    def test_format_as_text(self):
+        workbook = self._export(StreamingExcel2007ExportWriter(format_as_text=True), [['1', 2, 3]])
+        self.assertEqual(list(workbook.active.iter_rows())[1][0].number_format, '@')
+
+    def test_hyperlinks(self):
+        workbook = self._export(
+            StreamingExcel2007ExportWriter(),
+            [FormattedRow(['http://example.com/?a=1&b=2', 'x', ''], hyperlink_column_indices=[0, 2])],
+        )
+        row = list(workbook.active.iter_rows())[1]
+        self.assertEqual(row[0].hyperlink.target, 'http://example.com/?a=1&b=2')
+        self.assertIsNone(row[2].hyperlink)
+
+    @patch('couchexport.writers.MAX_XLSX_ROWS', 2)
+    def test_max_rows(self):
+        with self.assertRaises(XlsLengthException):
+            self._export(StreamingExcel2007ExportWriter(), [['1', '2', '3'], ['4', '5', '6']])
+
+
 class Excel2003ExportWriterTests(SimpleTestCase):
 
     def test_data_length(self):
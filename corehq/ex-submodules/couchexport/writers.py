@@ -1,6 +1,7 @@
 import io
 from base64 import b64decode
 from codecs import BOM_UTF8
+import datetime
 import os
 import re
 import tempfile
@@ -9,6 +10,7 @@ import csv
 import json
 import bz2
 from collections import OrderedDict
+from xml.sax.saxutils import escape, quoteattr
 import openpyxl
 
 from django.template.loader import render_to_string, get_template
@@ -18,10 +20,13 @@ import xlwt
 from couchexport.models import Format
 from openpyxl.styles import numbers
 from openpyxl.cell import WriteOnlyCell
+from openpyxl.utils import get_column_letter
+from openpyxl.utils.datetime import to_excel
 
 from couchexport.util import get_excel_format_value, get_legacy_excel_safe_value
 
 MAX_XLS_COLUMNS = 256
+MAX_XLSX_ROWS = 1048576
 
 
 class XlsLengthException(Exception):
@@ -62,6 +67,9 @@ class UniqueHeaderGenerator(object):
 
 
 class ExportFileWriter(object):
+    # True if write_rows/write_row can be given the raw values of a row
+    # (including None and bytes) rather than values converted by OnDiskExportWriter
+    accepts_raw_values = False
 
     def __init__(self):
         self.name = None
@@ -96,6 +104,10 @@ class ExportFileWriter(object):
     def write_row(self, row):
         raise NotImplementedError
 
+    def write_rows(self, rows):
+        for row in rows:
+            self.write_row(row)
+
     def _end_file(self):
         pass
 
@@ -111,6 +123,8 @@ class ExportFileWriter(object):
 
 
 class CsvFileWriter(ExportFileWriter):
+    # csv writes None as an empty string and bytes are decoded below
+    accepts_raw_values = True
 
     def _open(self):
         # Excel needs UTF8-encoded CSVs to start with the UTF-8 byte-order mark (FB 163268)
@@ -125,6 +139,15 @@ class CsvFileWriter(ExportFileWriter):
         ])
         self._file.write(buffer.getvalue().encode('utf-8'))
 
+    def write_rows(self, rows):
+        buffer = io.StringIO()
+        csvwriter = csv.writer(buffer, csv.excel)
+        csvwriter.writerows(
+            [col.decode('utf-8') if isinstance(col, bytes) else col for col in row]
+            for row in rows
+        )
+        self._file.write(buffer.getvalue().encode('utf-8'))
+
 
 class PartialHtmlFileWriter(ExportFileWriter):
 
@@ -242,6 +265,16 @@ class ExportWriter(object):
         """
         return self._write_row(table_index, row)
 
+    def write_rows(self, table_index, rows):
+        """
+        Write a block of rows to a single table.
+
+        Unlike write() this does not rewrite row ids, so it is meant for
+        plain rows (lists or FormattedRows without ids).
+        """
+        assert self._isopen
+        return self._write_rows(table_index, rows)
+
     def close(self):
         """
         Close any open file references, do any cleanup.
@@ -259,6 +292,10 @@ class ExportWriter(object):
     def _write_row(self, sheet_index, row):
         raise NotImplementedError
 
+    def _write_rows(self, sheet_index, rows):
+        for row in rows:
+            self._write_row(sheet_index, row)
+
     def _close(self):
         raise NotImplementedError
 
@@ -298,6 +335,14 @@ class OnDiskExportWriter(ExportWriter):
         row = list(map(_transform, row))
         self.tables[sheet_index].write_row(row)
 
+    def _write_rows(self, sheet_index, rows):
+        writer = self.tables[sheet_index]
+        if writer.accepts_raw_values:
+            writer.write_rows(rows)
+        else:
+            for row in rows:
+                self._write_row(sheet_index, row)
+
     def _close(self):
         """
         Close any open file references, do any cleanup.
@@ -381,33 +426,35 @@ class Excel2007ExportWriter(ExportWriter):
         self.table_indices[table_index] = 0
 
     def _write_row(self, sheet_index, row):
+        self._write_rows(sheet_index, [row])
+
+    def _write_rows(self, sheet_index, rows):
         from couchexport.export import FormattedRow
         sheet = self.tables[sheet_index]
-
-        cells = []
-        for col_ind, val in enumerate(row):
-            skip_formatting_on_row = (isinstance(row, FormattedRow)
-                                      and col_ind in row.skip_excel_formatting)
-
-            if (self.use_formatted_cells
-                    and not skip_formatting_on_row
-                    and not self.format_as_text):
-                excel_format, val_fmt = get_excel_format_value(val)
-                cell = WriteOnlyCell(sheet, val_fmt)
-                cell.number_format = excel_format
-            else:
-                cell = WriteOnlyCell(sheet, get_legacy_excel_safe_value(val))
-                if self.format_as_text:
-                    cell.number_format = numbers.FORMAT_TEXT
-
-            cells.append(cell)
-
-        if isinstance(row, FormattedRow):
-            for hyperlink_column_index in row.hyperlink_column_indices:
-                cells[hyperlink_column_index].hyperlink = cells[hyperlink_column_index].value
-                cells[hyperlink_column_index].style = 'Hyperlink'
-
-        sheet.append(cells)
+        format_cells = self.use_formatted_cells and not self.format_as_text
+
+        for row in rows:
+            is_formatted_row = isinstance(row, FormattedRow)
+            skip_excel_formatting = row.skip_excel_formatting if is_formatted_row else ()
+            cells = []
+            for col_ind, val in enumerate(row):
+                if format_cells and col_ind not in skip_excel_formatting:
+                    excel_format, val_fmt = get_excel_format_value(val)
+                    cell = WriteOnlyCell(sheet, val_fmt)
+                    cell.number_format = excel_format
+                else:
+                    cell = WriteOnlyCell(sheet, get_legacy_excel_safe_value(val))
+                    if self.format_as_text:
+                        cell.number_format = numbers.FORMAT_TEXT
+
+                cells.append(cell)
+
+            if is_formatted_row:
+                for hyperlink_column_index in row.hyperlink_column_indices:
+                    cells[hyperlink_column_index].hyperlink = cells[hyperlink_column_index].value
+                    cells[hyperlink_column_index].style = 'Hyperlink'
+
+            sheet.append(cells)
 
     def _close(self):
         """
@@ -416,6 +463,318 @@ class Excel2007ExportWriter(ExportWriter):
         self.book.save(self.file)
 
 
+class _StreamingSheet(object):
+    """
+    A sheet of a StreamingExcel2007ExportWriter. The XML of its rows and its
+    hyperlinks are written to temporary files as they come in.
+    """
+
+    def __init__(self, title):
+        self.title = title
+        self.row_count = 0
+        self.hyperlink_count = 0
+        fd, self.rows_path = tempfile.mkstemp()
+        self.rows_file = os.fdopen(fd, 'w+', encoding='utf-8')
+        fd, self.hyperlinks_path = tempfile.mkstemp()
+        self.hyperlinks_file = os.fdopen(fd, 'w+', encoding='utf-8')
+
+    def add_hyperlink(self, ref, target):
+        self.hyperlink_count += 1
+        self.hyperlinks_file.write(json.dumps([ref, str(target)]) + '\n')
+
+    def iter_hyperlinks(self):
+        self.hyperlinks_file.seek(0)
+        for line in self.hyperlinks_file:
+            yield json.loads(line)
+
+    def close(self):
+        for file_, path in [(self.rows_file, self.rows_path), (self.hyperlinks_file, self.hyperlinks_path)]:
+            file_.close()
+            os.remove(path)
+
+
+class StreamingExcel2007ExportWriter(ExportWriter):
+    """
+    XLSX writer whose memory use does not grow with the number of rows.
+
+    Unlike Excel2007ExportWriter this does not use openpyxl workbook state.
+    The XML of each sheet is written to a temporary file as rows come in,
+    and the files are streamed into the XLSX archive on close. Strings are
+    written inline unless ``use_shared_strings`` is set, in which case the
+    distinct strings are kept in memory (smaller files, but memory grows
+    with the number of distinct strings).
+    """
+    format = Format.XLS_2007
+    max_table_name_size = 31
+
+    _main_ns = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+    _rel_ns = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+    _package_rel_ns = 'http://schemas.openxmlformats.org/package/2006/relationships'
+    _first_custom_number_format_id = 164
+
+    def __init__(self, format_as_text=False, use_formatted_cells=False, use_shared_strings=False):
+        super(StreamingExcel2007ExportWriter, self).__init__()
+        self.format_as_text = format_as_text
+        self.use_formatted_cells = use_formatted_cells
+        self.use_shared_strings = use_shared_strings
+
+    def _init(self):
+        self.tables = OrderedDict()
+        self.shared_strings = {}
+        # (number format, is hyperlink) -> index in cellXfs
+        self.cell_styles = {(None, False): 0}
+        self.custom_number_formats = {}
+        self.column_letters = []
+
+    def _init_table(self, table_index, table_title):
+        self.tables[table_index] = _StreamingSheet(table_title)
+
+    def _write_row(self, sheet_index, row):
+        self._write_rows(sheet_index, [row])
+
+    def _write_rows(self, sheet_index, rows):
+        from couchexport.export import FormattedRow
+        sheet = self.tables[sheet_index]
+        format_cells = self.use_formatted_cells and not self.format_as_text
+        unformatted_number_format = numbers.FORMAT_TEXT if self.format_as_text else None
+
+        parts = []
+        for row in rows:
+            if sheet.row_count >= MAX_XLSX_ROWS:
+                raise XlsLengthException()
+            sheet.row_count += 1
+            row_number = str(sheet.row_count)
+            is_formatted_row = isinstance(row, FormattedRow)
+            skip_excel_formatting = row.skip_excel_formatting if is_formatted_row else ()
+            hyperlink_column_indices = row.hyperlink_column_indices if is_formatted_row else ()
+
+            parts.append('<row r="{}">'.format(row_number))
+            for col_ind, val in enumerate(row):
+                if format_cells and col_ind not in skip_excel_formatting:
+                    number_format, val = get_excel_format_value(val)
+                else:
+                    number_format, val = unformatted_number_format, get_legacy_excel_safe_value(val)
+                ref = self._get_column_letter(col_ind) + row_number
+                is_hyperlink = col_ind in hyperlink_column_indices
+                if is_hyperlink and val not in (None, ''):
+                    sheet.add_hyperlink(ref, val)
+                parts.append(self._get_cell_xml(ref, val, self._get_cell_style(number_format, is_hyperlink)))
+            parts.append('</row>')
+        sheet.rows_file.write(''.join(parts))
+
+    def _get_column_letter(self, col_ind):
+        while len(self.column_letters) <= col_ind:
+            self.column_letters.append(get_column_letter(len(self.column_letters) + 1))
+        return self.column_letters[col_ind]
+
+    def _get_cell_style(self, number_format, is_hyperlink):
+        key = (number_format, is_hyperlink)
+        try:
+            return self.cell_styles[key]
+        except KeyError:
+            self.cell_styles[key] = len(self.cell_styles)
+            return self.cell_styles[key]
+
+    def _get_cell_xml(self, ref, val, style):
+        style_attr = ' s="{}"'.format(style) if style else ''
+        if val is None or val == '':
+            return '<c r="{}"{}/>'.format(ref, style_attr)
+        if isinstance(val, bool):
+            return '<c r="{}"{} t="b"><v>{}</v></c>'.format(ref, style_attr, int(val))
+        if isinstance(val, (int, float)):
+            return '<c r="{}"{}><v>{}</v></c>'.format(ref, style_attr, val)
+        if isinstance(val, (datetime.datetime, datetime.date, datetime.time)):
+            return '<c r="{}"{}><v>{}</v></c>'.format(ref, style_attr, to_excel(val))
+        val = str(val)
+        if self.use_shared_strings:
+            index = self.shared_strings.setdefault(val, len(self.shared_strings))
+            return '<c r="{}"{} t="s"><v>{}</v></c>'.format(ref, style_attr, index)
+        return '<c r="{}"{} t="inlineStr"><is><t xml:space="preserve">{}</t></is></c>'.format(
+            ref, style_attr, escape(val)
+        )
+
+    def _get_number_format_id(self, number_format):
+        if number_format is None:
+            return 0
+        for format_id, builtin_format in numbers.BUILTIN_FORMATS.items():
+            if builtin_format == number_format:
+                return format_id
+        return self.custom_number_formats.setdefault(
+            number_format, self._first_custom_number_format_id + len(self.custom_number_formats)
+        )
+
+    def _close(self):
+        try:
+            with zipfile.ZipFile(self.file, 'w', zipfile.ZIP_DEFLATED, allowZip64=True) as archive:
+                archive.writestr('[Content_Types].xml', self._get_content_types_xml())
+                archive.writestr('_rels/.rels', self._get_package_rels_xml())
+                archive.writestr('xl/workbook.xml', self._get_workbook_xml())
+                archive.writestr('xl/_rels/workbook.xml.rels', self._get_workbook_rels_xml())
+                for sheet_number, sheet in enumerate(self.tables.values(), 1):
+                    with archive.open('xl/worksheets/sheet{}.xml'.format(sheet_number), 'w',
+                                      force_zip64=True) as sheet_file:
+                        self._write_sheet_xml(sheet, sheet_file)
+                    if sheet.hyperlink_count:
+                        with archive.open('xl/worksheets/_rels/sheet{}.xml.rels'.format(sheet_number), 'w',
+                                          force_zip64=True) as rels_file:
+                            self._write_sheet_rels_xml(sheet, rels_file)
+                archive.writestr('xl/styles.xml', self._get_styles_xml())
+                if self.use_shared_strings:
+                    with archive.open('xl/sharedStrings.xml', 'w', force_zip64=True) as strings_file:
+                        self._write_shared_strings_xml(strings_file)
+        finally:
+            for sheet in self.tables.values():
+                sheet.close()
+
+    def _write_sheet_xml(self, sheet, output):
+        output.write(
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            '<worksheet xmlns="{}" xmlns:r="{}"><sheetData>'.format(self._main_ns, self._rel_ns).encode('utf-8')
+        )
+        sheet.rows_file.seek(0)
+        while True:
+            chunk = sheet.rows_file.read(1024 * 1024)
+            if not chunk:
+                break
+            output.write(chunk.encode('utf-8'))
+        output.write(b'</sheetData>')
+        if sheet.hyperlink_count:
+            output.write(b'<hyperlinks>')
+            for rel_number, (ref, target) in enumerate(sheet.iter_hyperlinks(), 1):
+                output.write('<hyperlink ref="{}" r:id="rId{}"/>'.format(ref, rel_number).encode('utf-8'))
+            output.write(b'</hyperlinks>')
+        output.write(b'</worksheet>')
+
+    def _write_sheet_rels_xml(self, sheet, output):
+        output.write(
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            '<Relationships xmlns="{}">'.format(self._package_rel_ns).encode('utf-8')
+        )
+        for rel_number, (ref, target) in enumerate(sheet.iter_hyperlinks(), 1):
+            output.write(
+                '<Relationship Id="rId{}" Type="{}/hyperlink" Target={} TargetMode="External"/>'.format(
+                    rel_number, self._rel_ns, quoteattr(target)
+                ).encode('utf-8')
+            )
+        output.write(b'</Relationships>')
+
+    def _write_shared_strings_xml(self, output):
+        output.write(
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            '<sst xmlns="{}" uniqueCount="{}">'.format(self._main_ns, len(self.shared_strings)).encode('utf-8')
+        )
+        # dicts keep insertion order, which is the index order
+        for value in self.shared_strings:
+            output.write('<si><t xml:space="preserve">{}</t></si>'.format(escape(value)).encode('utf-8'))
+        output.write(b'</sst>')
+
+    def _get_content_types_xml(self):
+        overrides = [
+            ('/xl/workbook.xml', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml'),
+            ('/xl/styles.xml', 'application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml'),
+        ]
+        overrides.extend(
+            ('/xl/worksheets/sheet{}.xml'.format(sheet_number),
+             'application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml')
+            for sheet_number in range(1, len(self.tables) + 1)
+        )
+        if self.use_shared_strings:
+            overrides.append(
+                ('/xl/sharedStrings.xml',
+                 'application/vnd.openxmlformats-officedocument.spreadsheetml.sharedStrings+xml')
+            )
+        return (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            '{}</Types>'
+        ).format(''.join(
+            '<Override PartName="{}" ContentType="{}"/>'.format(part, content_type)
+            for part, content_type in overrides
+        ))
+
+    def _get_package_rels_xml(self):
+        return (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            '<Relationships xmlns="{}">'
+            '<Relationship Id="rId1" Type="{}/officeDocument" Target="xl/workbook.xml"/>'
+            '</Relationships>'
+        ).format(self._package_rel_ns, self._rel_ns)
+
+    def _get_workbook_xml(self):
+        sheets = ''.join(
+            '<sheet name={} sheetId="{}" r:id="rId{}"/>'.format(quoteattr(sheet.title), sheet_number, sheet_number)
+            for sheet_number, sheet in enumerate(self.tables.values(), 1)
+        )
+        return (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            '<workbook xmlns="{}" xmlns:r="{}"><sheets>{}</sheets></workbook>'
+        ).format(self._main_ns, self._rel_ns, sheets)
+
+    def _get_workbook_rels_xml(self):
+        rels = [
+            ('worksheet', 'worksheets/sheet{}.xml'.format(sheet_number))
+            for sheet_number in range(1, len(self.tables) + 1)
+        ]
+        rels.append(('styles', 'styles.xml'))
+        if self.use_shared_strings:
+            rels.append(('sharedStrings', 'sharedStrings.xml'))
+        return (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            '<Relationships xmlns="{}">{}</Relationships>'
+        ).format(self._package_rel_ns, ''.join(
+            '<Relationship Id="rId{}" Type="{}/{}" Target="{}"/>'.format(
+                rel_number, self._rel_ns, rel_type, target
+            )
+            for rel_number, (rel_type, target) in enumerate(rels, 1)
+        ))
+
+    def _get_styles_xml(self):
+        cell_xfs = []
+        for (number_format, is_hyperlink), index in sorted(self.cell_styles.items(), key=lambda item: item[1]):
+            font_id = 1 if is_hyperlink else 0
+            cell_xfs.append(
+                '<xf numFmtId="{}" fontId="{}" fillId="0" borderId="0" xfId="{}"{}/>'.format(
+                    self._get_number_format_id(number_format),
+                    font_id,
+                    font_id,
+                    ' applyNumberFormat="1"' if number_format is not None else '',
+                )
+            )
+        number_formats = ''
+        if self.custom_number_formats:
+            number_formats = '<numFmts count="{}">{}</numFmts>'.format(
+                len(self.custom_number_formats),
+                ''.join(
+                    '<numFmt numFmtId="{}" formatCode={}/>'.format(format_id, quoteattr(number_format))
+                    for number_format, format_id in self.custom_number_formats.items()
+                )
+            )
+        return (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            '<styleSheet xmlns="{ns}">{number_formats}'
+            '<fonts count="2">'
+            '<font><sz val="11"/><name val="Calibri"/><family val="2"/></font>'
+            '<font><u/><sz val="11"/><color rgb="FF0563C1"/><name val="Calibri"/><family val="2"/></font>'
+            '</fonts>'
+            '<fills count="2"><fill><patternFill patternType="none"/></fill>'
+            '<fill><patternFill patternType="gray125"/></fill></fills>'
+            '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+            '<cellStyleXfs count="2"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/>'
+            '<xf numFmtId="0" fontId="1" fillId="0" borderId="0"/></cellStyleXfs>'
+            '<cellXfs count="{xf_count}">{cell_xfs}</cellXfs>'
+            '<cellStyles count="2"><cellStyle name="Normal" xfId="0" builtinId="0"/>'
+            '<cellStyle name="Hyperlink" xfId="1" builtinId="8"/></cellStyles>'
+            '</styleSheet>'
+        ).format(
+            ns=self._main_ns,
+            number_formats=number_formats,
+            xf_count=len(cell_xfs),
+            cell_xfs=''.join(cell_xfs),
+        )
+
+
 class Excel2003ExportWriter(ExportWriter):
     format = Format.XLS
     max_table_name_size = 31
@@ -2,10 +2,13 @@ import requests
 import six
 
 
-def simple_post(data, url, content_type="text/xml", timeout=60, headers=None, auth=None, verify=None):
+def simple_post(data, url, content_type="text/xml", timeout=60, headers=None, auth=None, verify=None,
+                session=None):
     """
     POST with a cleaner API, and return the actual HTTPResponse object, so
     that error codes can be interpreted.
+
+    Pass a requests Session as ``session`` to reuse its connections.
     """
     if isinstance(data, six.text_type):
         data = data.encode('utf-8')  # can't pass unicode to http request posts
@@ -25,4 +28,4 @@ def simple_post(data, url, content_type="text/xml", timeout=60, headers=None, au
     if verify is not None:
         kwargs["verify"] = verify
 
-    return requests.post(url, data, **kwargs)
+    return (session or requests).post(url, data, **kwargs)
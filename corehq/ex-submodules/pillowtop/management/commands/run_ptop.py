@@ -79,6 +79,14 @@ class Command(BaseCommand):
                  "It's expected that there will only be one process for each number running at once",
         )
 
+        parser.add_argument(
+            '--parallel-batch-processors',
+            action='store_true',
+            dest='parallel_batch_processors',
+            default=False,
+            help="Run the batch processors of the pillow concurrently on each chunk of changes",
+        )
+
     def handle(self, **options):
         run_all = options['run_all']
         list_all = options['list_all']
@@ -88,6 +96,7 @@ class Command(BaseCommand):
         num_processes = options['num_processes']
         process_number = options['process_number']
         processor_chunk_size = options['processor_chunk_size']
+        parallel_batch_processors = options['parallel_batch_processors']
         assert 0 <= process_number < num_processes
         assert processor_chunk_size
         if list_all:
@@ -113,6 +122,7 @@ class Command(BaseCommand):
 
         elif not run_all and not pillow_key and pillow_name:
             pillow = get_pillow_by_name(pillow_name, num_processes=num_processes, process_num=process_number, processor_chunk_size=processor_chunk_size)
+            pillow.parallel_batch_processors = parallel_batch_processors
             start_pillow(pillow)
             sys.exit()
         elif list_checkpoints:
@@ -1,5 +1,6 @@
 from abc import ABCMeta, abstractproperty, abstractmethod
 from collections import Counter
+from concurrent import futures
 from datetime import datetime
 
 from django.conf import settings
@@ -15,7 +16,7 @@ from dimagi.utils.logging import notify_exception
 from kafka.common import TopicPartition
 from pillowtop.const import CHECKPOINT_MIN_WAIT
 from pillowtop.dao.exceptions import DocumentMissingError
-from pillowtop.utils import force_seq_int
+from pillowtop.utils import bulk_fetch_changes_docs, force_seq_int
 from pillowtop.exceptions import PillowtopCheckpointReset
 from pillowtop.logger import pillow_logging
 
@@ -53,6 +54,11 @@ class PillowBase(metaclass=ABCMeta):
     retry_errors = True
     # this will be the batch size for processors that support batch processing
     processor_chunk_size = 0
+    # set to true to run batch processors concurrently on each chunk
+    parallel_batch_processors = False
+    # set to true to bulk load documents for each chunk once, before
+    # they are processed, and share them between all processors
+    prefetch_documents = False
 
     @abstractproperty
     def pillow_id(self):
@@ -123,6 +129,14 @@ class PillowBase(metaclass=ABCMeta):
         else:
             return []
 
+    @property
+    @memoized
+    def batch_processor_pool(self):
+        return futures.ThreadPoolExecutor(
+            max_workers=len(self.batch_processors),
+            thread_name_prefix='{}-batch'.format(self.get_name()),
+        )
+
     @property
     @memoized
     def serial_processors(self):
@@ -192,46 +206,97 @@ class PillowBase(metaclass=ABCMeta):
 
             If there is an exception in chunked processing, falls back
             to serial processing.
-        """
-        processing_time = 0
-
-        def reprocess_serially(chunk, processor):
-            for change in chunk:
-                self.process_with_error_handling(change, processor)
 
-        for processor in self.batch_processors:
-            if not changes_chunk:
-                return set(), 0
+            If `parallel_batch_processors` is set the batch processors
+            process the chunk concurrently in a thread pool. Serial
+            processing (and the checkpoint update done by the caller)
+            only starts once all of them have finished.
+        """
+        if not changes_chunk:
+            return set(), 0
 
-            changes_chunk = self._deduplicate_changes(changes_chunk)
+        changes_chunk = self._deduplicate_changes(changes_chunk)
+        processing_time = 0
+        if self.prefetch_documents:
+            processing_time += self._prefetch_documents(changes_chunk)
+        if self.parallel_batch_processors and len(self.batch_processors) > 1:
             timer = TimingContext()
             with timer:
-                try:
-                    retry_changes, change_exceptions = processor.process_changes_chunk(changes_chunk)
-                except Exception as ex:
-                    notify_exception(
-                        None,
-                        "{pillow_name} Error in processing changes chunk: {ex}".format(
-                            pillow_name=self.get_name(),
-                            ex=ex
-                        ),
-                        details={
-                            'change_ids': [c.id for c in changes_chunk]
-                        })
-                    self._record_batch_exception_in_datadog(processor)
-                    # fall back to processing one by one
-                    reprocess_serially(changes_chunk, processor)
-                else:
-                    # fall back to processing one by one for failed changes
-                    for change, exception in change_exceptions:
-                        handle_pillow_error(self, change, exception)
-                    reprocess_serially(retry_changes, processor)
-                processing_time += timer.duration
+                pending = [
+                    self.batch_processor_pool.submit(self._batch_process_on_processor, processor, changes_chunk)
+                    for processor in self.batch_processors
+                ]
+                futures.wait(pending)
+                for future in pending:
+                    future.result()  # re-raise unhandled errors
+            processing_time += timer.duration
+        else:
+            processing_time += sum(
+                self._batch_process_on_processor(processor, changes_chunk)
+                for processor in self.batch_processors
+            )
         # process on serial_processors
         for change in changes_chunk:
             processing_time += self.process_with_error_handling(change)
         self._record_datadog_metrics(changes_chunk, processing_time)
 
+    def _prefetch_documents(self, changes_chunk):
+        """
+        Bulk load documents for all changes in the chunk, one query per
+            document store, and set them on the changes so processors do
+            not fetch them again. Missing documents are left unset so
+            processors can handle them as before.
+
+        :returns: prefetch time in seconds
+        """
+        timer = TimingContext()
+        with timer:
+            try:
+                bulk_fetch_changes_docs([change for change in changes_chunk if change.metadata])
+            except Exception as ex:
+                # processors will fetch the documents themselves
+                notify_exception(None, "{pillow_name} Error prefetching documents: {ex}".format(
+                    pillow_name=self.get_name(),
+                    ex=ex,
+                ))
+        self._record_batch_processor_timing_in_datadog('DocumentPrefetch', timer.duration)
+        return timer.duration
+
+    def _batch_process_on_processor(self, processor, changes_chunk):
+        """
+        Process chunk on a single batch processor
+
+        :returns: processing time in seconds
+        """
+        def reprocess_serially(chunk, processor):
+            for change in chunk:
+                self.process_with_error_handling(change, processor)
+
+        timer = TimingContext()
+        with timer:
+            try:
+                retry_changes, change_exceptions = processor.process_changes_chunk(changes_chunk)
+            except Exception as ex:
+                notify_exception(
+                    None,
+                    "{pillow_name} Error in processing changes chunk: {ex}".format(
+                        pillow_name=self.get_name(),
+                        ex=ex
+                    ),
+                    details={
+                        'change_ids': [c.id for c in changes_chunk]
+                    })
+                self._record_batch_exception_in_datadog(processor)
+                # fall back to processing one by one
+                reprocess_serially(changes_chunk, processor)
+            else:
+                # fall back to processing one by one for failed changes
+                for change, exception in change_exceptions:
+                    handle_pillow_error(self, change, exception)
+                reprocess_serially(retry_changes, processor)
+        self._record_batch_processor_timing_in_datadog(processor.__class__.__name__, timer.duration)
+        return timer.duration
+
     def process_with_error_handling(self, change, processor=None):
         # process given change on all serial processors or given processor.
         # Tracks success/fail in datadog but not the timer metric, caller updates that
@@ -342,6 +407,15 @@ class PillowBase(metaclass=ABCMeta):
                 'processor': processor.__class__.__name__ if processor else "all_processors",
             })
 
+    def _record_batch_processor_timing_in_datadog(self, processor_name, processing_time):
+        tags = {
+            'pillow_name': self.get_name(),
+            'processor': processor_name,
+            'mode': 'parallel' if self.parallel_batch_processors else 'chunked',
+        }
+        metrics_counter('commcare.change_feed.batch_processor.processing_time.total', processing_time, tags=tags)
+        metrics_counter('commcare.change_feed.batch_processor.processing_time.count', tags=tags)
+
     def _record_change_success_in_datadog(self, change, processor):
         self.__record_change_metric_in_datadog('commcare.change_feed.changes.success', change, processor)
 
@@ -416,11 +490,14 @@ class ConstructedPillow(PillowBase):
     """
 
     def __init__(self, name, checkpoint, change_feed, processor,
-                 change_processed_event_handler=None, processor_chunk_size=0):
+                 change_processed_event_handler=None, processor_chunk_size=0,
+                 parallel_batch_processors=False, prefetch_documents=False):
         self._name = name
         self._checkpoint = checkpoint
         self._change_feed = change_feed
         self.processor_chunk_size = processor_chunk_size
+        self.parallel_batch_processors = parallel_batch_processors
+        self.prefetch_documents = prefetch_documents
         if isinstance(processor, list):
             self.processors = processor
         else:
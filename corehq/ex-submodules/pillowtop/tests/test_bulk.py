@@ -9,8 +9,9 @@ from casexml.apps.case.signals import case_post_save
 from corehq.util.es.interface import ElasticsearchInterface
 from pillowtop.es_utils import initialize_index_and_mapping
 from pillowtop.feed.interface import Change, ChangeMeta
-from pillowtop.pillow.interface import PillowBase
+from pillowtop.pillow.interface import ConstructedPillow, PillowBase
 from pillowtop.processors.elastic import BulkElasticProcessor
+from pillowtop.processors.interface import BulkPillowProcessor, PillowProcessor
 from pillowtop.tests.utils import TEST_INDEX_INFO
 from pillowtop.utils import bulk_fetch_changes_docs, get_errors_with_ids
 
@@ -52,6 +53,101 @@ class BulkTest(SimpleTestCase):
         self.assertEqual([(1, 'e1'), (2, 'e2')], errors)
 
 
+class ChunkProcessingTestMixin(object):
+
+    def _get_pillow(self, processors, parallel):
+        return ConstructedPillow(
+            name='test-parallel-pillow',
+            checkpoint=Mock(),
+            change_feed=Mock(),
+            processor=processors,
+            processor_chunk_size=10,
+            parallel_batch_processors=parallel,
+        )
+
+    def _get_changes(self):
+        return [
+            Change(doc_id, i, metadata=ChangeMeta(
+                document_id=doc_id, data_source_type='sql', data_source_name='test'))
+            for i, doc_id in enumerate(['a', 'b', 'c'])
+        ]
+
+
+class ParallelBatchProcessorsTest(ChunkProcessingTestMixin, SimpleTestCase):
+
+    def _test_process_chunk(self, parallel):
+        calls = []
+
+        class BatchProcessor(BulkPillowProcessor):
+            def process_change(self, change):
+                raise AssertionError("unexpected serial processing")
+
+            def process_changes_chunk(self, changes_chunk):
+                calls.append(('batch', [change.id for change in changes_chunk]))
+                return [], []
+
+        class SerialProcessor(PillowProcessor):
+            def process_change(self, change):
+                calls.append(('serial', change.id))
+
+        pillow = self._get_pillow([BatchProcessor(), BatchProcessor(), SerialProcessor()], parallel)
+        pillow._batch_process_with_error_handling(self._get_changes())
+        self.assertEqual(calls, [
+            ('batch', ['a', 'b', 'c']),
+            ('batch', ['a', 'b', 'c']),
+            ('serial', 'a'),
+            ('serial', 'b'),
+            ('serial', 'c'),
+        ])
+
+    def test_process_chunk(self):
+        self._test_process_chunk(parallel=False)
+
+    def test_process_chunk_in_parallel(self):
+        self._test_process_chunk(parallel=True)
+
+    def test_parallel_fallback_to_serial(self):
+        processed = []
+
+        class FailingProcessor(BulkPillowProcessor):
+            def process_change(self, change):
+                processed.append(change.id)
+
+            def process_changes_chunk(self, changes_chunk):
+                raise Exception("chunk failed")
+
+        pillow = self._get_pillow([FailingProcessor(), FailingProcessor()], parallel=True)
+        with patch('pillowtop.pillow.interface.notify_exception'):
+            pillow._batch_process_with_error_handling(self._get_changes())
+        self.assertEqual(sorted(processed), ['a', 'a', 'b', 'b', 'c', 'c'])
+
+
+class PrefetchDocumentsTest(ChunkProcessingTestMixin, SimpleTestCase):
+
+    def test_prefetch_documents(self):
+        document_store = Mock()
+        document_store.iter_documents.side_effect = lambda ids: [{'_id': id_} for id_ in ids]
+        changes = self._get_changes()
+        for change in changes:
+            change.document_store = document_store
+        seen_docs = []
+
+        class BatchProcessor(BulkPillowProcessor):
+            def process_change(self, change):
+                raise AssertionError("unexpected serial processing")
+
+            def process_changes_chunk(self, changes_chunk):
+                _, docs = bulk_fetch_changes_docs(changes_chunk)
+                seen_docs.append(sorted(doc['_id'] for doc in docs))
+                return [], []
+
+        pillow = self._get_pillow([BatchProcessor(), BatchProcessor()], parallel=True)
+        pillow.prefetch_documents = True
+        pillow._batch_process_with_error_handling(changes)
+        document_store.iter_documents.assert_called_once_with(['a', 'b', 'c'])
+        self.assertEqual(seen_docs, [['a', 'b', 'c'], ['a', 'b', 'c']])
+
+
 @use_sql_backend
 class TestBulkDocOperations(TestCase):
     @classmethod
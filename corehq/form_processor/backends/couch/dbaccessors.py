@@ -20,6 +20,7 @@ from corehq.apps.hqcase.dbaccessors import (
     get_closed_case_ids,
     get_case_ids_in_domain_by_owner,
     get_cases_in_domain_by_external_id,
+    get_cases_in_domain_by_external_ids,
     get_deleted_case_ids_by_owner,
     get_all_case_owner_ids)
 from corehq.apps.hqcase.utils import get_case_by_domain_hq_user_id
@@ -174,6 +175,28 @@ class CaseAccessorCouch(AbstractCaseAccessor):
     def get_related_indices(domain, case_ids, exclude_indices):
         return get_related_indices(domain, case_ids, exclude_indices)
 
+    @staticmethod
+    def get_related_indices_closure(domain, case_ids, exclude_indices):
+        """Get related index records, following them recursively
+
+        WARNING this is inefficient (better version in SQL).
+        """
+        exclude_indices = set(exclude_indices)
+        seen_ids = set(case_ids)
+        next_ids = list(case_ids)
+        result = []
+        while next_ids:
+            related = get_related_indices(domain, next_ids, exclude_indices)
+            next_ids = []
+            for index in related:
+                exclude_indices.add("{} {}".format(index.case_id, index.identifier))
+                result.append(index)
+                for case_id in [index.case_id, index.referenced_id]:
+                    if case_id not in seen_ids:
+                        seen_ids.add(case_id)
+                        next_ids.append(case_id)
+        return result
+
     @staticmethod
     def get_closed_and_deleted_ids(domain, case_ids):
         """Get the subset of given list of case ids that are closed or deleted
@@ -270,6 +293,13 @@ class CaseAccessorCouch(AbstractCaseAccessor):
             return [case for case in cases if case.type == case_type]
         return cases
 
+    @staticmethod
+    def get_cases_by_external_ids(domain, external_ids, case_type=None):
+        cases = get_cases_in_domain_by_external_ids(domain, external_ids)
+        if case_type:
+            return [case for case in cases if case.type == case_type]
+        return cases
+
     @staticmethod
     def soft_delete_cases(domain, case_ids, deletion_date=None, deletion_id=None):
         return _soft_delete(CommCareCase.get_db(), case_ids, deletion_date, deletion_id)
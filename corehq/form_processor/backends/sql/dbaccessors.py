@@ -603,6 +603,23 @@ class FormAccessorSQL(AbstractFormAccessor):
                            [case_ids, form_id, archive])
         form.state = XFormInstanceSQL.ARCHIVED if archive else XFormInstanceSQL.NORMAL
 
+    @staticmethod
+    def set_archived_state_for_forms(forms, archive, user_id):
+        """Un/archive a batch of forms without running the ARCHIVE_FORM system
+        action or signals. The caller is responsible for rebuilding the
+        affected cases and ledgers and for publishing the form changes.
+        """
+        from casexml.apps.case.xform import get_case_ids_from_form
+        form_ids = [form.form_id for form in forms]
+        case_ids = list({case_id for form in forms for case_id in get_case_ids_from_form(form)})
+        with XFormInstanceSQL.get_plproxy_cursor() as cursor:
+            cursor.execute('SELECT archive_unarchive_forms(%s, %s, %s)', [form_ids, user_id, archive])
+            if case_ids:
+                cursor.execute('SELECT revoke_restore_case_transactions_for_forms(%s, %s, %s)',
+                               [case_ids, form_ids, archive])
+        for form in forms:
+            form.state = XFormInstanceSQL.ARCHIVED if archive else XFormInstanceSQL.NORMAL
+
     @staticmethod
     def save_new_form(form):
         """
@@ -1062,6 +1079,15 @@ class CaseAccessorSQL(AbstractCaseAccessor):
             'SELECT * FROM get_related_indices(%s, %s, %s)',
             [domain, case_ids, list(exclude_indices)]))
 
+    @staticmethod
+    def get_related_indices_closure(domain, case_ids, exclude_indices):
+        assert isinstance(case_ids, list), case_ids
+        if not case_ids:
+            return []
+        return list(CommCareCaseIndexSQL.objects.plproxy_raw(
+            'SELECT * FROM get_related_indices_closure(%s, %s, %s)',
+            [domain, case_ids, list(exclude_indices)]))
+
     @staticmethod
     def get_closed_and_deleted_ids(domain, case_ids):
         assert isinstance(case_ids, list), case_ids
@@ -1140,6 +1166,21 @@ class CaseAccessorSQL(AbstractCaseAccessor):
             [domain, external_id, case_type]
         ))
 
+    @staticmethod
+    def get_cases_by_external_ids(domain, external_ids, case_type=None):
+        """Get the cases for many external ids with one query per shard"""
+        cases = []
+        for db_name in get_db_aliases_for_partitioned_query():
+            query = CommCareCaseSQL.objects.using(db_name).filter(
+                domain=domain,
+                external_id__in=external_ids,
+                deleted=False,
+            )
+            if case_type:
+                query = query.filter(type=case_type)
+            cases.extend(query)
+        return cases
+
     @staticmethod
     def get_case_by_domain_hq_user_id(domain, user_id, case_type):
         try:
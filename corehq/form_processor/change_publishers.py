@@ -8,6 +8,10 @@ def publish_form_saved(form):
     producer.send_change(topics.FORM_SQL, change_meta_from_sql_form(form))
 
 
+def publish_forms_saved(forms):
+    producer.send_changes(topics.FORM_SQL, [change_meta_from_sql_form(form) for form in forms])
+
+
 def change_meta_from_sql_form(form):
     return ChangeMeta(
         document_id=form.form_id,
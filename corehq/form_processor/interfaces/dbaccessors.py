@@ -363,6 +363,11 @@ class AbstractCaseAccessor(metaclass=ABCMeta):
     def get_cases_by_external_id(domain, external_id, case_type=None):
         raise NotImplementedError
 
+    @staticmethod
+    @abstractmethod
+    def get_cases_by_external_ids(domain, external_ids, case_type=None):
+        raise NotImplementedError
+
     @staticmethod
     @abstractmethod
     def soft_delete_cases(domain, case_ids, deletion_date=None, deletion_id=None):
@@ -452,6 +457,21 @@ class CaseAccessors(object):
         """
         return self.db_accessor.get_related_indices(self.domain, case_ids, exclude_indices)
 
+    def get_related_indices_closure(self, case_ids, exclude_indices):
+        """Get indices (forward and reverse) reachable from the given case ids
+
+        Like `get_related_indices`, but related indices are followed
+        recursively. In the SQL backend the traversal is done within
+        each shard, so indices that reference cases on other shards may
+        need to be followed with a subsequent call.
+
+        :param case_ids: A list of case ids.
+        :param exclude_indices: A set or dict of index id strings with
+        the format ``'<index.case_id> <index.identifier>'``.
+        :returns: A list of CommCareCaseIndex-like objects.
+        """
+        return self.db_accessor.get_related_indices_closure(self.domain, case_ids, exclude_indices)
+
     def get_closed_and_deleted_ids(self, case_ids):
         """Get the subset of given list of case ids that are closed or deleted
 
@@ -495,6 +515,9 @@ class CaseAccessors(object):
     def get_cases_by_external_id(self, external_id, case_type=None):
         return self.db_accessor.get_cases_by_external_id(self.domain, external_id, case_type)
 
+    def get_cases_by_external_ids(self, external_ids, case_type=None):
+        return self.db_accessor.get_cases_by_external_ids(self.domain, external_ids, case_type)
+
     def soft_delete_cases(self, case_ids, deletion_date=None, deletion_id=None):
         return self.db_accessor.soft_delete_cases(self.domain, case_ids, deletion_date, deletion_id)
 
@@ -2,6 +2,7 @@ from corehq.apps.domain_migration_flags.api import any_migrations_in_progress
 from corehq.messaging.scheduling.scheduling_partitioned.dbaccessors import (
     get_active_schedule_instance_ids,
     get_active_case_schedule_instance_ids,
+    get_due_schedule_instance_ids_by_schedule,
 )
 from corehq.messaging.scheduling.scheduling_partitioned.models import (
     AlertScheduleInstance,
@@ -14,11 +15,14 @@ from corehq.messaging.scheduling.tasks import (
     handle_timed_schedule_instance,
     handle_case_alert_schedule_instance,
     handle_case_timed_schedule_instance,
+    handle_schedule_instance_batch,
 )
 from corehq.sql_db.util import handle_connection_failure, get_default_and_partitioned_db_aliases
 from datetime import datetime
+from dimagi.utils.chunked import chunked
 from dimagi.utils.couch import get_redis_lock
 from dimagi.utils.logging import notify_exception
+from django.conf import settings
 from django.core.management.base import BaseCommand
 from time import sleep
 
@@ -65,6 +69,10 @@ class Command(BaseCommand):
 
     @handle_connection_failure(get_db_aliases=get_default_and_partitioned_db_aliases)
     def create_tasks(self):
+        if settings.SCHEDULE_INSTANCE_BATCHED_QUEUE:
+            self.create_batch_tasks()
+            return
+
         for cls in (AlertScheduleInstance, TimedScheduleInstance):
             for domain, schedule_instance_id, next_event_due in get_active_schedule_instance_ids(
                     cls, datetime.utcnow()):
@@ -88,6 +96,33 @@ class Command(BaseCommand):
                 if enqueue_lock.acquire(blocking=False):
                     self.get_task(cls).delay(case_id, schedule_instance_id)
 
+    def create_batch_tasks(self):
+        """
+        Queries the partitioned databases concurrently, and spawns one task
+        per batch of due schedule instances of the same schedule, so that
+        the schedule's content is loaded once for the batch. Tasks are
+        spawned for each database as soon as its query has finished.
+        """
+        for cls in (AlertScheduleInstance, TimedScheduleInstance,
+                    CaseAlertScheduleInstance, CaseTimedScheduleInstance):
+            for due_instances in get_due_schedule_instance_ids_by_schedule(cls, datetime.utcnow()):
+                self.create_batch_tasks_for_db(cls, due_instances)
+
+    def create_batch_tasks_for_db(self, cls, due_instances):
+        for (domain, schedule_id), instances in due_instances.items():
+            if skip_domain(domain):
+                continue
+
+            # Each schedule instance is claimed using the same lock as above,
+            # so it is not also enqueued by another process.
+            claimed = [
+                (case_id, schedule_instance_id)
+                for case_id, schedule_instance_id, next_event_due in instances
+                if self.get_enqueue_lock(cls, schedule_instance_id, next_event_due).acquire(blocking=False)
+            ]
+            for batch in chunked(claimed, settings.SCHEDULE_INSTANCE_BATCH_SIZE, list):
+                handle_schedule_instance_batch.delay(cls, domain, batch)
+
     def handle(self, **options):
         while True:
             try:
@@ -1,9 +1,16 @@
+from collections import defaultdict
+from concurrent import futures
 from uuid import UUID
 
+from django.db import connections
 from django.db.models import Q
 
+from django_bulk_update.helper import bulk_update as bulk_update_helper
+
 from corehq.sql_db.util import (
+    get_db_alias_for_partitioned_doc,
     get_db_aliases_for_partitioned_query,
+    paginate_query,
     paginate_query_across_partitioned_databases,
 )
 from corehq.util.datadog.utils import load_counter_for_model
@@ -145,6 +152,119 @@ def get_active_case_schedule_instance_ids(cls, due_before, due_after=None):
         yield (domain, case_id, schedule_instance_id, next_event_due)
 
 
+def get_due_schedule_instance_ids_by_schedule(cls, due_before):
+    """
+    Queries all partitioned databases concurrently for active instances
+    of ``cls`` that are due, and yields the instances from each database
+    as soon as its query has finished.
+
+    :return: a generator of dicts, one per database, of
+    {(domain, schedule_id): [(case_id, schedule_instance_id, next_event_due), ...]},
+    where case_id is None for AlertScheduleInstances and TimedScheduleInstances
+    """
+    from corehq.messaging.scheduling.scheduling_partitioned.models import (
+        AlertScheduleInstance,
+        TimedScheduleInstance,
+        CaseAlertScheduleInstance,
+        CaseTimedScheduleInstance,
+    )
+
+    if cls in (AlertScheduleInstance, CaseAlertScheduleInstance):
+        schedule_id_field = 'alert_schedule_id'
+    elif cls in (TimedScheduleInstance, CaseTimedScheduleInstance):
+        schedule_id_field = 'timed_schedule_id'
+    else:
+        raise TypeError("Unexpected class: %s" % cls)
+
+    q_expression = Q(active=True, next_event_due__lte=due_before)
+    load_source = 'get_due_schedule_instance_ids_by_schedule'
+
+    def get_rows(db_name):
+        """
+        :return: (domain, case_id, schedule_instance_id, next_event_due, schedule_id) tuples
+        """
+        if cls in (CaseAlertScheduleInstance, CaseTimedScheduleInstance):
+            return _paginate_query(db_name, cls, q_expression, load_source, extra_values=[schedule_id_field])
+
+        rows = paginate_query(
+            db_name,
+            cls,
+            q_expression,
+            values=['domain', 'schedule_instance_id', 'next_event_due', schedule_id_field],
+            load_source=load_source,
+        )
+        return (
+            (domain, None, schedule_instance_id, next_event_due, schedule_id)
+            for domain, schedule_instance_id, next_event_due, schedule_id in rows
+        )
+
+    def get_instances_by_schedule(db_name):
+        try:
+            result = defaultdict(list)
+            for domain, case_id, schedule_instance_id, next_event_due, schedule_id in get_rows(db_name):
+                result[(domain, schedule_id)].append((case_id, schedule_instance_id, next_event_due))
+            return result
+        finally:
+            # Each thread has its own connections
+            connections[db_name].close()
+
+    db_names = get_db_aliases_for_partitioned_query()
+    with futures.ThreadPoolExecutor(max_workers=len(db_names)) as executor:
+        for future in futures.as_completed([executor.submit(get_instances_by_schedule, db_name)
+                                            for db_name in db_names]):
+            yield future.result()
+
+
+def get_schedule_instances_by_id(cls, schedule_instance_ids):
+    """
+    Loads the given AlertScheduleInstances or TimedScheduleInstances
+    with one query per partitioned database
+    """
+    from corehq.messaging.scheduling.scheduling_partitioned.models import (
+        AlertScheduleInstance,
+        TimedScheduleInstance,
+    )
+
+    if cls not in (AlertScheduleInstance, TimedScheduleInstance):
+        raise TypeError("Expected AlertScheduleInstance or TimedScheduleInstance")
+
+    ids_by_db = defaultdict(list)
+    for schedule_instance_id in schedule_instance_ids:
+        _validate_uuid(schedule_instance_id)
+        ids_by_db[get_db_alias_for_partitioned_doc(schedule_instance_id)].append(schedule_instance_id)
+
+    result = []
+    for db_name, ids in ids_by_db.items():
+        result.extend(cls.objects.using(db_name).filter(schedule_instance_id__in=ids))
+    return result
+
+
+def get_case_schedule_instances_by_id(cls, case_and_schedule_instance_ids):
+    """
+    Loads the given CaseAlertScheduleInstances or
+    CaseTimedScheduleInstances with one query per partitioned database
+
+    :param case_and_schedule_instance_ids: a list of (case_id, schedule_instance_id) tuples
+    """
+    from corehq.messaging.scheduling.scheduling_partitioned.models import (
+        CaseAlertScheduleInstance,
+        CaseTimedScheduleInstance,
+    )
+
+    if cls not in (CaseAlertScheduleInstance, CaseTimedScheduleInstance):
+        raise TypeError("Expected CaseAlertScheduleInstance or CaseTimedScheduleInstance")
+
+    ids_by_db = defaultdict(list)
+    for case_id, schedule_instance_id in case_and_schedule_instance_ids:
+        _validate_uuid(schedule_instance_id)
+        ids_by_db[get_db_alias_for_partitioned_doc(case_id)].append(schedule_instance_id)
+
+    result = []
+    for db_name, ids in ids_by_db.items():
+        result.extend(cls.objects.using(db_name).filter(schedule_instance_id__in=ids))
+    return result
+
+
 def _paginate_query_across_partitioned_databases(model_class, q_expression, load_source):
     """Optimized version of the generic paginate_query_across_partitioned_databases for case schedules
 
@@ -170,13 +290,13 @@ def _paginate_query_across_partitioned_databases(model_class, q_expression, load
             yield row
 
 
-def _paginate_query(db_name, model_class, q_expression, load_source, query_size=5000):
+def _paginate_query(db_name, model_class, q_expression, load_source, query_size=5000, extra_values=()):
     track_load = load_counter_for_model(model_class)(load_source, None, extra_tags=['db:{}'.format(db_name)])
     sort_cols = ('active', 'next_event_due')
 
     # active is always set to true in the queryset's q_expression so we
     # don't need to include it here or filter it further later
-    return_values = ['pk', 'domain', 'case_id', 'schedule_instance_id', 'next_event_due']
+    return_values = ['pk', 'domain', 'case_id', 'schedule_instance_id', 'next_event_due'] + list(extra_values)
 
     qs = (
         model_class.objects.using(db_name)
@@ -244,6 +364,67 @@ def get_timed_schedule_instances_for_schedule(schedule):
     )
 
 
+def get_alert_schedule_instances_for_schedule_by_db(schedule):
+    """
+    Like get_alert_schedule_instances_for_schedule, but loads all of
+    the schedule's instances with one query per partitioned database
+    """
+    from corehq.messaging.scheduling.models import AlertSchedule
+    from corehq.messaging.scheduling.scheduling_partitioned.models import AlertScheduleInstance
+
+    _validate_class(schedule, AlertSchedule)
+    return _get_instances_by_db(AlertScheduleInstance, Q(alert_schedule_id=schedule.schedule_id))
+
+
+def get_timed_schedule_instances_for_schedule_by_db(schedule):
+    """
+    Like get_timed_schedule_instances_for_schedule, but loads all of
+    the schedule's instances with one query per partitioned database
+    """
+    from corehq.messaging.scheduling.models import TimedSchedule
+    from corehq.messaging.scheduling.scheduling_partitioned.models import TimedScheduleInstance
+
+    _validate_class(schedule, TimedSchedule)
+    return _get_instances_by_db(TimedScheduleInstance, Q(timed_schedule_id=schedule.schedule_id))
+
+
+def _get_instances_by_db(cls, q_expression):
+    result = []
+    for db_name in get_db_aliases_for_partitioned_query():
+        result.extend(cls.objects.using(db_name).filter(q_expression))
+    return result
+
+
+def bulk_save_schedule_instances(to_create, to_update, to_delete, batch_size=1000):
+    """
+    Creates, updates and deletes AlertScheduleInstances and
+    TimedScheduleInstances with a few queries per partitioned database
+    """
+    from corehq.messaging.scheduling.scheduling_partitioned.models import (
+        AlertScheduleInstance,
+        TimedScheduleInstance,
+    )
+
+    def group_by_class_and_db(instances):
+        result = defaultdict(list)
+        for instance in instances:
+            _validate_class(instance, (AlertScheduleInstance, TimedScheduleInstance))
+            _validate_uuid(instance.schedule_instance_id)
+            result[(type(instance), instance.db)].append(instance)
+        return result
+
+    for (cls, db_name), instances in group_by_class_and_db(to_delete).items():
+        ids = [instance.schedule_instance_id for instance in instances]
+        for start in range(0, len(ids), batch_size):
+            cls.objects.using(db_name).filter(schedule_instance_id__in=ids[start:start + batch_size]).delete()
+
+    for (cls, db_name), instances in group_by_class_and_db(to_create).items():
+        cls.objects.using(db_name).bulk_create(instances, batch_size=batch_size)
+
+    for (cls, db_name), instances in group_by_class_and_db(to_update).items():
+        bulk_update_helper(instances, using=db_name, batch_size=batch_size)
+
+
 def get_case_alert_schedule_instances_for_schedule_id(case_id, schedule_id):
     from corehq.messaging.scheduling.scheduling_partitioned.models import CaseAlertScheduleInstance
     return CaseAlertScheduleInstance.objects.partitioned_query(case_id).filter(
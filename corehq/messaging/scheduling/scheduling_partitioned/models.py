@@ -50,6 +50,9 @@ class ScheduleInstance(PartitionedModel):
     RECIPIENT_TYPE_USER_GROUP = 'Group'
     RECIPIENT_TYPE_LOCATION = 'Location'
 
+    # See preload_schedule()
+    _preloaded_schedule = None
+
     class Meta(object):
         abstract = True
         index_together = (
@@ -369,8 +372,18 @@ class ScheduleInstance(PartitionedModel):
         This is named with a memoized_ prefix to be clear that it should only be used
         when the schedule is not changing.
         """
+        if self._preloaded_schedule is not None:
+            return self._preloaded_schedule
+
         return self.schedule
 
+    def preload_schedule(self, schedule):
+        """
+        Use an already loaded schedule as memoized_schedule, so that a batch of
+        instances for the same schedule share its events and content.
+        """
+        self._preloaded_schedule = schedule
+
     def additional_deactivation_condition_reached(self):
         """
         Subclasses can override this to provide additional checks under
@@ -524,14 +537,29 @@ class CaseScheduleInstanceMixin(object):
     RECIPIENT_TYPE_ALL_CHILD_CASES = 'AllChildCases'
     RECIPIENT_TYPE_CUSTOM = 'CustomRecipient'
 
+    # See preload_case()
+    _case_is_preloaded = False
+    _preloaded_case = None
+
     @property
     @memoized
     def case(self):
+        if self._case_is_preloaded:
+            return self._preloaded_case
+
         try:
             return CaseAccessors(self.domain).get_case(self.case_id)
         except CaseNotFound:
             return None
 
+    def preload_case(self, case):
+        """
+        Use an already loaded case, or None if the case was not found, so that
+        the cases for a batch of instances can be loaded with one query.
+        """
+        self._case_is_preloaded = True
+        self._preloaded_case = case
+
     @property
     @memoized
     def case_owner(self):
@@ -1,11 +1,15 @@
 from corehq.form_processor.tests.utils import partitioned
+from corehq.messaging.scheduling.scheduling_partitioned.dbaccessors import (
+    _paginate_query,
+    get_case_schedule_instances_by_id,
+)
 from corehq.messaging.scheduling.scheduling_partitioned.models import (
     CaseScheduleInstanceMixin,
     CaseAlertScheduleInstance,
     CaseTimedScheduleInstance,
 )
 from corehq.messaging.scheduling.tasks import delete_schedule_instances_for_cases
-from corehq.sql_db.util import paginate_query_across_partitioned_databases
+from corehq.sql_db.util import get_db_alias_for_partitioned_doc, paginate_query_across_partitioned_databases
 from datetime import datetime, date
 from django.db.models import Q
 from django.test import TestCase
@@ -18,7 +22,7 @@ class SchedulingDBAccessorsTest(TestCase):
     domain = 'scheduling-dbaccessors-test'
     domain_2 = domain + '-x'
 
-    def create_case_alert_schedule_instance(self, domain, case_id):
+    def create_case_alert_schedule_instance(self, domain, case_id, schedule_id=None):
         instance = CaseAlertScheduleInstance(
             domain=domain,
             recipient_type=CaseScheduleInstanceMixin.RECIPIENT_TYPE_SELF,
@@ -26,12 +30,13 @@ class SchedulingDBAccessorsTest(TestCase):
             schedule_iteration_num=1,
             next_event_due=datetime(2018, 7, 1),
             active=True,
-            alert_schedule_id=uuid.uuid4(),
+            alert_schedule_id=schedule_id or uuid.uuid4(),
             case_id=case_id,
             rule_id=1,
         )
         instance.save()
         self.addCleanup(instance.delete)
+        return instance
 
     def create_case_timed_schedule_instance(self, domain, case_id):
         instance = CaseTimedScheduleInstance(
@@ -48,6 +53,7 @@ class SchedulingDBAccessorsTest(TestCase):
         )
         instance.save()
         self.addCleanup(instance.delete)
+        return instance
 
     def get_case_schedule_instances_for_domain(self, domain):
         instances = list(paginate_query_across_partitioned_databases(CaseAlertScheduleInstance, Q(domain=domain)))
@@ -79,3 +85,37 @@ class SchedulingDBAccessorsTest(TestCase):
 
         for instance in self.get_case_schedule_instances_for_domain(self.domain):
             self.assertEqual(instance.case_id, case_id_3)
+
+    def test_get_case_schedule_instances_by_id(self):
+        case_id_1 = uuid.uuid4().hex
+        case_id_2 = uuid.uuid4().hex
+        instance_1 = self.create_case_timed_schedule_instance(self.domain, case_id_1)
+        instance_2 = self.create_case_timed_schedule_instance(self.domain, case_id_2)
+        self.create_case_timed_schedule_instance(self.domain, case_id_2)
+
+        instances = get_case_schedule_instances_by_id(CaseTimedScheduleInstance, [
+            (case_id_1, instance_1.schedule_instance_id),
+            (case_id_2, instance_2.schedule_instance_id),
+        ])
+
+        self.assertEqual(
+            {instance.schedule_instance_id for instance in instances},
+            {instance_1.schedule_instance_id, instance_2.schedule_instance_id},
+        )
+
+    def test_paginate_query_extra_values(self):
+        case_id = uuid.uuid4().hex
+        schedule_id = uuid.uuid4()
+        instance = self.create_case_alert_schedule_instance(self.domain, case_id, schedule_id=schedule_id)
+
+        rows = list(_paginate_query(
+            get_db_alias_for_partitioned_doc(case_id),
+            CaseAlertScheduleInstance,
+            Q(active=True, domain=self.domain, next_event_due__lte=datetime(2018, 7, 2)),
+            'test',
+            extra_values=['alert_schedule_id'],
+        ))
+
+        self.assertEqual(rows, [
+            (self.domain, case_id, instance.schedule_instance_id, datetime(2018, 7, 1), schedule_id),
+        ])
@@ -16,7 +16,9 @@ from corehq.messaging.scheduling.scheduling_partitioned.dbaccessors import (
     delete_alert_schedule_instance,
     delete_timed_schedule_instance,
     get_alert_schedule_instances_for_schedule,
+    get_alert_schedule_instances_for_schedule_by_db,
     get_timed_schedule_instances_for_schedule,
+    get_timed_schedule_instances_for_schedule_by_db,
     get_alert_schedule_instance,
     save_alert_schedule_instance,
     get_timed_schedule_instance,
@@ -29,10 +31,18 @@ from corehq.messaging.scheduling.scheduling_partitioned.dbaccessors import (
     delete_alert_schedule_instances_for_schedule,
     delete_timed_schedule_instances_for_schedule,
     delete_schedule_instances_by_case_id,
+    bulk_save_schedule_instances,
+    get_schedule_instances_by_id,
+    get_case_schedule_instances_by_id,
 )
+from corehq.form_processor.interfaces.dbaccessors import CaseAccessors
+from corehq import toggles
 from corehq.util.celery_utils import no_result_task
+from corehq.util.metrics import metrics_histogram
+from corehq.util.timer import TimingContext
 from datetime import datetime
 from dimagi.utils.couch import CriticalSection
+from dimagi.utils.logging import notify_exception
 from django.conf import settings
 
 
@@ -123,34 +133,61 @@ class ScheduleInstanceRefresher(object):
         else:
             raise TypeError("Unexpected type: %s" % type(instance))
 
-    def refresh(self):
-        # A list of (instance, needs_saving) tuples representing the final version
-        # of the refreshed instances and whether or not each one needs to be saved
-        # at the end of processing. We should avoid saving instances that didn't
-        # change to prevent churn on the database tables.
-        refreshed_list = []
+    def get_changes(self):
+        """
+        Works out the refreshed instances without saving anything.
+
+        :return: a (to_create, to_update, to_delete) tuple of lists of
+        instances. Instances that didn't change are left out, to prevent
+        churn on the database tables.
+        """
+        to_create = []
+        to_update = []
+        to_delete = []
 
         for recipient_type_and_id in self.new_recipients:
             recipient_type, recipient_id = recipient_type_and_id
 
             if recipient_type_and_id not in self.existing_instances:
-                refreshed_list.append(
-                    (self.create_new_instance_for_recipient(recipient_type, recipient_id), True)
-                )
+                instance = self.create_new_instance_for_recipient(recipient_type, recipient_id)
+                instance.check_active_flag_against_schedule()
+                to_create.append(instance)
 
         for recipient_type_and_id, instance in self.existing_instances.items():
             if recipient_type_and_id in self.new_recipients:
                 needs_saving = self.handle_existing_instance(instance)
-                refreshed_list.append((instance, needs_saving))
+                if instance.check_active_flag_against_schedule():
+                    needs_saving = True
+
+                if needs_saving:
+                    to_update.append(instance)
             else:
-                self.delete_instance(instance)
+                to_delete.append(instance)
+
+        return to_create, to_update, to_delete
+
+    def refresh(self):
+        to_create, to_update, to_delete = self.get_changes()
+
+        for instance in to_delete:
+            self.delete_instance(instance)
 
-        for instance, needs_saving in refreshed_list:
-            if instance.check_active_flag_against_schedule():
-                needs_saving = True
+        for instance in to_create + to_update:
+            self.save_instance(instance)
 
-            if needs_saving:
-                self.save_instance(instance)
+    def refresh_in_bulk(self, timer):
+        """
+        Like refresh(), but saves the changes with a few queries per
+        partitioned database instead of one query per instance. Only
+        supported for AlertScheduleInstances and TimedScheduleInstances.
+
+        :param timer: a started TimingContext to time the steps with
+        """
+        with timer('diff'):
+            to_create, to_update, to_delete = self.get_changes()
+
+        with timer('save'):
+            bulk_save_schedule_instances(to_create, to_update, to_delete)
 
 
 class AlertScheduleInstanceRefresher(ScheduleInstanceRefresher):
@@ -295,11 +332,23 @@ def refresh_alert_schedule_instances(schedule_id, recipients):
     """
     with CriticalSection(['refresh-alert-schedule-instances-for-%s' % schedule_id.hex], timeout=5 * 60):
         schedule = AlertSchedule.objects.get(schedule_id=schedule_id)
-        AlertScheduleInstanceRefresher(
-            schedule,
-            recipients,
-            get_alert_schedule_instances_for_schedule(schedule)
-        ).refresh()
+        if toggles.BULK_SCHEDULE_INSTANCE_REFRESH.enabled(schedule.domain):
+            timer = TimingContext('refresh_alert_schedule_instances')
+            with timer:
+                with timer('load'):
+                    existing_instances = get_alert_schedule_instances_for_schedule_by_db(schedule)
+                AlertScheduleInstanceRefresher(
+                    schedule,
+                    recipients,
+                    existing_instances
+                ).refresh_in_bulk(timer)
+            _report_refresh_timing(schedule.domain, timer)
+        else:
+            AlertScheduleInstanceRefresher(
+                schedule,
+                recipients,
+                get_alert_schedule_instances_for_schedule(schedule)
+            ).refresh()
 
 
 @task(serializer='pickle', queue=settings.CELERY_REMINDER_RULE_QUEUE, ignore_result=True)
@@ -312,12 +361,34 @@ def refresh_timed_schedule_instances(schedule_id, recipients, start_date=None):
     """
     with CriticalSection(['refresh-timed-schedule-instances-for-%s' % schedule_id.hex], timeout=5 * 60):
         schedule = TimedSchedule.objects.get(schedule_id=schedule_id)
-        TimedScheduleInstanceRefresher(
-            schedule,
-            recipients,
-            get_timed_schedule_instances_for_schedule(schedule),
-            start_date=start_date
-        ).refresh()
+        if toggles.BULK_SCHEDULE_INSTANCE_REFRESH.enabled(schedule.domain):
+            timer = TimingContext('refresh_timed_schedule_instances')
+            with timer:
+                with timer('load'):
+                    existing_instances = get_timed_schedule_instances_for_schedule_by_db(schedule)
+                TimedScheduleInstanceRefresher(
+                    schedule,
+                    recipients,
+                    existing_instances,
+                    start_date=start_date
+                ).refresh_in_bulk(timer)
+            _report_refresh_timing(schedule.domain, timer)
+        else:
+            TimedScheduleInstanceRefresher(
+                schedule,
+                recipients,
+                get_timed_schedule_instances_for_schedule(schedule),
+                start_date=start_date
+            ).refresh()
+
+
+def _report_refresh_timing(domain, timer):
+    for step in timer.to_list():
+        metrics_histogram(
+            'commcare.scheduling.refresh_schedule_instances.duration', step.duration,
+            bucket_tag='duration', buckets=[1, 10, 60, 300, 900], bucket_unit='s',
+            tags={'domain': domain, 'refresh': timer.root.name, 'step': step.name},
+        )
 
 
 @no_result_task(serializer='pickle', queue=settings.CELERY_REMINDER_RULE_QUEUE, acks_late=True,
@@ -504,6 +575,105 @@ def handle_case_timed_schedule_instance(case_id, schedule_instance_id):
         _handle_schedule_instance(instance, save_case_schedule_instance)
 
 
+def _get_lock_key(instance):
+    # Use the same lock keys as the tasks which handle one schedule instance at a time
+    from corehq.messaging.tasks import get_sync_key
+    if isinstance(instance, AlertScheduleInstance):
+        return 'handle-alert-schedule-instance-%s' % instance.schedule_instance_id.hex
+    elif isinstance(instance, TimedScheduleInstance):
+        return 'handle-timed-schedule-instance-%s' % instance.schedule_instance_id.hex
+    elif isinstance(instance, CaseScheduleInstanceMixin):
+        return get_sync_key(instance.case_id)
+    else:
+        raise TypeError("Unexpected class: %s" % type(instance))
+
+
+def _reload_schedule_instance(instance):
+    """
+    :return: the current version of the given schedule instance, or None if
+    it was deleted
+    """
+    cls = type(instance)
+    try:
+        if cls is AlertScheduleInstance:
+            return get_alert_schedule_instance(instance.schedule_instance_id)
+        elif cls is TimedScheduleInstance:
+            return get_timed_schedule_instance(instance.schedule_instance_id)
+        else:
+            return get_case_schedule_instance(cls, instance.case_id, instance.schedule_instance_id)
+    except cls.DoesNotExist:
+        return None
+
+
+def _get_batch_instances(cls, domain, instance_ids):
+    if cls in (AlertScheduleInstance, TimedScheduleInstance):
+        return get_schedule_instances_by_id(
+            cls, [schedule_instance_id for case_id, schedule_instance_id in instance_ids]
+        )
+
+    instances = get_case_schedule_instances_by_id(cls, instance_ids)
+    cases = {
+        case.case_id: case
+        for case in CaseAccessors(domain).get_cases(list({instance.case_id for instance in instances}))
+    }
+    for instance in instances:
+        instance.preload_case(cases.get(instance.case_id))
+    return instances
+
+
+@no_result_task(serializer='pickle', queue='reminder_queue')
+def handle_schedule_instance_batch(cls, domain, instance_ids):
+    """
+    Handles a batch of due schedule instances of the same schedule.
+    The schedule, and with it its events and content, is loaded once
+    for the batch, and for case schedule instances the cases are loaded
+    with one query.
+
+    Each instance is locked, and reloaded, only while it is handled, so
+    that a slow batch doesn't outlive its locks.
+
+    :param cls: AlertScheduleInstance, TimedScheduleInstance,
+    CaseAlertScheduleInstance or CaseTimedScheduleInstance
+    :param instance_ids: a list of (case_id, schedule_instance_id) tuples,
+    where case_id is None for AlertScheduleInstances and TimedScheduleInstances
+    """
+    save_function, broadcast_class = {
+        AlertScheduleInstance: (save_alert_schedule_instance, ImmediateBroadcast),
+        TimedScheduleInstance: (save_timed_schedule_instance, ScheduledBroadcast),
+        CaseAlertScheduleInstance: (save_case_schedule_instance, None),
+        CaseTimedScheduleInstance: (save_case_schedule_instance, None),
+    }[cls]
+
+    instances = _get_batch_instances(cls, domain, instance_ids)
+    if not instances:
+        return
+
+    schedule = instances[0].memoized_schedule
+    handled = False
+    for preloaded_instance in instances:
+        try:
+            with CriticalSection([_get_lock_key(preloaded_instance)], timeout=5 * 60):
+                # The instance may have changed since the batch was loaded
+                instance = _reload_schedule_instance(preloaded_instance)
+                if instance is None:
+                    continue
+
+                instance.preload_schedule(schedule)
+                if isinstance(instance, CaseScheduleInstanceMixin):
+                    instance.preload_case(preloaded_instance.case)
+                if _handle_schedule_instance(instance, save_function):
+                    handled = True
+        except Exception:
+            # Don't let one instance hold up the rest of the batch
+            notify_exception(None, "Error handling schedule instance in batch", details={
+                'domain': domain,
+                'schedule_instance_id': preloaded_instance.schedule_instance_id,
+            })
+
+    if handled and broadcast_class:
+        update_broadcast_last_sent_timestamp(broadcast_class, schedule.schedule_id)
+
+
 @no_result_task(serializer='pickle', queue='background_queue', acks_late=True)
 def delete_schedule_instances_for_cases(domain, case_ids):
     for case_id in case_ids:
@@ -0,0 +1,138 @@
+import uuid
+from datetime import datetime
+
+from django.test import SimpleTestCase, override_settings
+
+from mock import Mock, patch
+
+from corehq.messaging.management.commands.queue_schedule_instances import Command
+from corehq.messaging.scheduling.models import ScheduledBroadcast
+from corehq.messaging.scheduling.scheduling_partitioned.models import (
+    CaseTimedScheduleInstance,
+    TimedScheduleInstance,
+)
+from corehq.messaging.scheduling.tasks import (
+    _get_batch_instances,
+    handle_schedule_instance_batch,
+)
+
+COMMAND_MODULE = 'corehq.messaging.management.commands.queue_schedule_instances'
+
+
+class ScheduleInstanceBatchTaskTest(SimpleTestCase):
+
+    @patch('corehq.messaging.scheduling.scheduling_partitioned.models.CaseAccessors')
+    @patch('corehq.messaging.scheduling.tasks.CaseAccessors')
+    @patch('corehq.messaging.scheduling.tasks.get_case_schedule_instances_by_id')
+    def test_cases_are_preloaded(self, get_instances, case_accessors, models_case_accessors):
+        instance_ids = [('case1', uuid.uuid4()), ('case2', uuid.uuid4())]
+        instance_1 = CaseTimedScheduleInstance(domain='domain', case_id='case1')
+        instance_2 = CaseTimedScheduleInstance(domain='domain', case_id='case2')
+        get_instances.return_value = [instance_1, instance_2]
+        case_1 = Mock(case_id='case1')
+        case_accessors.return_value.get_cases.return_value = [case_1]
+
+        instances = _get_batch_instances(CaseTimedScheduleInstance, 'domain', instance_ids)
+
+        self.assertEqual(instances, [instance_1, instance_2])
+        get_instances.assert_called_once_with(CaseTimedScheduleInstance, instance_ids)
+        [case_ids], kwargs = case_accessors.return_value.get_cases.call_args
+        self.assertEqual(sorted(case_ids), ['case1', 'case2'])
+        self.assertIs(instance_1.case, case_1)
+        # a case that was not found is not looked up again
+        self.assertIsNone(instance_2.case)
+        models_case_accessors.assert_not_called()
+
+    @patch('corehq.messaging.scheduling.tasks.notify_exception')
+    @patch('corehq.messaging.scheduling.tasks.update_broadcast_last_sent_timestamp')
+    @patch('corehq.messaging.scheduling.tasks._handle_schedule_instance')
+    @patch('corehq.messaging.scheduling.tasks._reload_schedule_instance', side_effect=lambda instance: instance)
+    @patch('corehq.messaging.scheduling.tasks._get_lock_key', side_effect=lambda instance: instance.lock_key)
+    @patch('corehq.messaging.scheduling.tasks._get_batch_instances')
+    @patch('corehq.messaging.scheduling.tasks.CriticalSection')
+    def test_error_does_not_stop_the_batch(self, critical_section, get_batch_instances, get_lock_key,
+                                           reload_instance, handle_instance, update_timestamp, notify_exception):
+        instances = [Mock(lock_key='a'), Mock(lock_key='b'), Mock(lock_key='c')]
+        get_batch_instances.return_value = instances
+        handle_instance.side_effect = [Exception('Boom!'), True, False]
+        schedule = instances[0].memoized_schedule
+
+        handle_schedule_instance_batch(TimedScheduleInstance, 'domain', [(None, uuid.uuid4())] * 3)
+
+        # each instance is locked only while it is handled
+        self.assertEqual([call[0][0] for call in critical_section.call_args_list], [['a'], ['b'], ['c']])
+        self.assertEqual([call[0][0] for call in handle_instance.call_args_list], instances)
+        for instance in instances:
+            instance.preload_schedule.assert_called_once_with(schedule)
+        notify_exception.assert_called_once()
+        update_timestamp.assert_called_once_with(ScheduledBroadcast, schedule.schedule_id)
+
+    @patch('corehq.messaging.scheduling.tasks.update_broadcast_last_sent_timestamp')
+    @patch('corehq.messaging.scheduling.tasks._handle_schedule_instance')
+    @patch('corehq.messaging.scheduling.tasks.get_case_schedule_instance')
+    @patch('corehq.messaging.scheduling.tasks._get_batch_instances')
+    @patch('corehq.messaging.scheduling.tasks.CriticalSection')
+    def test_instances_are_reloaded_under_lock(self, critical_section, get_batch_instances, get_instance,
+                                               handle_instance, update_timestamp):
+        id_1, id_2 = uuid.uuid4(), uuid.uuid4()
+        instance_1 = CaseTimedScheduleInstance(domain='domain', case_id='case1', schedule_instance_id=id_1)
+        instance_2 = CaseTimedScheduleInstance(domain='domain', case_id='case2', schedule_instance_id=id_2)
+        case_1 = Mock(case_id='case1')
+        instance_1.preload_case(case_1)
+        get_batch_instances.return_value = [instance_1, instance_2]
+        reloaded_1 = CaseTimedScheduleInstance(domain='domain', case_id='case1', schedule_instance_id=id_1)
+        get_instance.side_effect = [reloaded_1, CaseTimedScheduleInstance.DoesNotExist]
+        schedule = Mock()
+
+        with patch.object(CaseTimedScheduleInstance, 'memoized_schedule', schedule):
+            handle_schedule_instance_batch(CaseTimedScheduleInstance, 'domain', [('case1', id_1), ('case2', id_2)])
+
+        self.assertEqual(get_instance.call_count, 2)
+        # the instance that was deleted in the meantime is skipped
+        [[[handled_instance, save_function], kwargs]] = handle_instance.call_args_list
+        self.assertIs(handled_instance, reloaded_1)
+        self.assertIs(handled_instance.case, case_1)
+        update_timestamp.assert_not_called()
+
+
+class CreateBatchTasksTest(SimpleTestCase):
+
+    @override_settings(SCHEDULE_INSTANCE_BATCH_SIZE=2)
+    @patch(COMMAND_MODULE + '.handle_schedule_instance_batch')
+    @patch(COMMAND_MODULE + '.skip_domain', side_effect=lambda domain: domain == 'migrating')
+    @patch(COMMAND_MODULE + '.get_due_schedule_instance_ids_by_schedule')
+    @patch.object(Command, 'get_enqueue_lock')
+    def test_create_batch_tasks(self, get_enqueue_lock, get_due_instances, skip_domain, batch_task):
+        due = datetime(2020, 1, 1)
+        ids = [uuid.uuid4() for __ in range(5)]
+        already_queued = ids[1]
+
+        def get_due(cls, due_before):
+            if cls is not CaseTimedScheduleInstance:
+                return iter([])
+            # one dict per partitioned database
+            return iter([
+                {
+                    ('domain', 'schedule'): [
+                        ('case0', ids[0], due),
+                        ('case1', ids[1], due),
+                        ('case2', ids[2], due),
+                    ],
+                    ('migrating', 'schedule'): [('case3', ids[3], due)],
+                },
+                {
+                    ('domain', 'schedule'): [('case4', ids[4], due)],
+                },
+            ])
+
+        get_due_instances.side_effect = get_due
+        get_enqueue_lock.side_effect = lambda cls, schedule_instance_id, next_event_due: Mock(
+            acquire=Mock(return_value=schedule_instance_id != already_queued)
+        )
+
+        Command().create_batch_tasks()
+
+        self.assertEqual([call[0] for call in batch_task.delay.call_args_list], [
+            (CaseTimedScheduleInstance, 'domain', [('case0', ids[0]), ('case2', ids[2])]),
+            (CaseTimedScheduleInstance, 'domain', [('case4', ids[4])]),
+        ])
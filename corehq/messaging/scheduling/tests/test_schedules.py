@@ -30,10 +30,13 @@ from corehq.messaging.scheduling.models import (
 from corehq.messaging.scheduling.tasks import (
     refresh_alert_schedule_instances,
     refresh_timed_schedule_instances,
+    handle_schedule_instance_batch,
 )
+from corehq.util.test_utils import flag_enabled
 from datetime import datetime, date, time
+import uuid
 from django.test import TestCase
-from mock import patch
+from mock import PropertyMock, patch
 
 
 class BaseScheduleTest(TestCase):
@@ -432,6 +435,120 @@ class DeleteScheduleInstancesTest(BaseScheduleTest):
         self.assertEqual(self.count(get_timed_schedule_instances_for_schedule(self.timed_schedule_2)), 0)
 
 
+@partitioned
+@flag_enabled('BULK_SCHEDULE_INSTANCE_REFRESH')
+class BulkRefreshScheduleInstancesTest(BaseScheduleTest):
+
+    def setUp(self):
+        super(BulkRefreshScheduleInstancesTest, self).setUp()
+        self.alert_schedule = AlertSchedule.create_simple_alert(self.domain, SMSContent())
+        self.schedule = TimedSchedule.create_simple_daily_schedule(
+            self.domain,
+            TimedEvent(time=time(12, 0)),
+            SMSContent(),
+            total_iterations=2,
+        )
+
+    def tearDown(self):
+        delete_alert_schedule_instances_for_schedule(AlertScheduleInstance, self.alert_schedule.schedule_id)
+        self.alert_schedule.delete()
+        delete_timed_schedule_instances_for_schedule(TimedScheduleInstance, self.schedule.schedule_id)
+        self.schedule.delete()
+        super(BulkRefreshScheduleInstancesTest, self).tearDown()
+
+    def get_recipient_ids(self, instances):
+        return sorted(instance.recipient_id for instance in instances)
+
+    def test_alert_schedule(self):
+        refresh_alert_schedule_instances(
+            self.alert_schedule.schedule_id,
+            (('CommCareUser', self.user1.get_id), ('CommCareUser', self.user2.get_id))
+        )
+        self.assertEqual(
+            self.get_recipient_ids(get_alert_schedule_instances_for_schedule(self.alert_schedule)),
+            sorted([self.user1.get_id, self.user2.get_id])
+        )
+
+        refresh_alert_schedule_instances(
+            self.alert_schedule.schedule_id,
+            (('CommCareUser', self.user2.get_id),)
+        )
+        self.assertEqual(
+            self.get_recipient_ids(get_alert_schedule_instances_for_schedule(self.alert_schedule)),
+            [self.user2.get_id]
+        )
+
+    @patch('corehq.messaging.scheduling.util.utcnow')
+    def test_timed_schedule_start_date_change(self, utcnow_patch):
+        utcnow_patch.return_value = datetime(2017, 3, 16, 6, 0)
+        refresh_timed_schedule_instances(
+            self.schedule.schedule_id,
+            (('CommCareUser', self.user1.get_id), ('CommCareUser', self.user2.get_id)),
+            start_date=date(2017, 3, 16)
+        )
+        refresh_timed_schedule_instances(
+            self.schedule.schedule_id,
+            (('CommCareUser', self.user1.get_id),),
+            start_date=date(2017, 3, 17)
+        )
+        [instance] = get_timed_schedule_instances_for_schedule(self.schedule)
+        self.assertTimedScheduleInstance(instance, 0, 1, datetime(2017, 3, 17, 16, 0), True, date(2017, 3, 17),
+            self.user1)
+
+
+@partitioned
+@patch('corehq.messaging.scheduling.models.content.SMSContent.send')
+@patch('corehq.messaging.scheduling.util.utcnow')
+class ScheduleInstanceBatchTest(BaseScheduleTest):
+
+    def setUp(self):
+        super(ScheduleInstanceBatchTest, self).setUp()
+        self.schedule = TimedSchedule.create_simple_daily_schedule(
+            self.domain,
+            TimedEvent(time=time(12, 0)),
+            SMSContent(),
+            total_iterations=2,
+        )
+
+    def tearDown(self):
+        delete_timed_schedule_instances_for_schedule(TimedScheduleInstance, self.schedule.schedule_id)
+        self.schedule.delete()
+        super(ScheduleInstanceBatchTest, self).tearDown()
+
+    def test_handle_batch(self, utcnow_patch, send_patch):
+        utcnow_patch.return_value = datetime(2017, 3, 16, 6, 0)
+        refresh_timed_schedule_instances(
+            self.schedule.schedule_id,
+            (('CommCareUser', self.user1.get_id), ('CommCareUser', self.user2.get_id)),
+            start_date=date(2017, 3, 16)
+        )
+        instance_ids = [
+            (None, instance.schedule_instance_id)
+            for instance in get_timed_schedule_instances_for_schedule(self.schedule)
+        ]
+
+        utcnow_patch.return_value = datetime(2017, 3, 16, 16, 1)
+        with patch('corehq.messaging.scheduling.scheduling_partitioned.models.TimedScheduleInstance.schedule',
+                   new_callable=PropertyMock) as schedule_patch:
+            schedule_patch.return_value = self.schedule
+            handle_schedule_instance_batch(TimedScheduleInstance, self.domain, instance_ids)
+
+        # The schedule is loaded once for the whole batch
+        self.assertEqual(schedule_patch.call_count, 1)
+        self.assertEqual(send_patch.call_count, 2)
+        instances = sorted(get_timed_schedule_instances_for_schedule(self.schedule),
+                           key=lambda instance: instance.recipient_id)
+        self.assertEqual(len(instances), 2)
+        for instance in instances:
+            self.assertEqual(instance.schedule_iteration_num, 2)
+            self.assertEqual(instance.next_event_due, datetime(2017, 3, 17, 16, 0))
+            self.assertTrue(instance.active)
+
+    def test_missing_instances_are_skipped(self, utcnow_patch, send_patch):
+        handle_schedule_instance_batch(TimedScheduleInstance, self.domain, [(None, uuid.uuid4())])
+        send_patch.assert_not_called()
+
+
 @partitioned
 @patch('corehq.messaging.scheduling.models.content.SMSContent.send')
 @patch('corehq.messaging.scheduling.util.utcnow')
@@ -0,0 +1,180 @@
+"""
+Sends many repeat records at once.
+
+Most of the time spent sending a repeat record goes to waiting for the
+remote server. ``AsyncRepeatRecordSender`` uses an asyncio event loop to
+keep many requests in flight from one worker, with limits on the number
+of concurrent requests in total and to each host. Repeat records are
+claimed in batches, and more are claimed whenever requests finish, so
+the number of requests in flight stays near the limit.
+
+Only the HTTP requests run concurrently, in a thread pool. Payloads are
+generated, and attempts are recorded by ``Repeater.handle_response()``,
+in the event loop's thread, so Couch and database access stays in the
+worker's own thread.
+"""
+import asyncio
+import logging
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from functools import partial
+from urllib.parse import urlparse
+
+from requests.exceptions import ConnectionError, Timeout
+
+from dimagi.utils.post import simple_post
+
+from .const import (
+    ASYNC_DELIVERY_MAX_REQUESTS,
+    ASYNC_DELIVERY_PER_HOST_LIMIT,
+    POST_TIMEOUT,
+)
+from .exceptions import RequestConnectionError
+from .models import (
+    Repeater,
+    log_repeater_error_in_datadog,
+    log_repeater_timeout_in_datadog,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncRepeatRecordSender(object):
+
+    def __init__(self, max_requests=ASYNC_DELIVERY_MAX_REQUESTS,
+                 per_host_limit=ASYNC_DELIVERY_PER_HOST_LIMIT, timeout=POST_TIMEOUT):
+        """
+        :param max_requests: The number of requests that can be in
+            flight at once, across all hosts
+        :param per_host_limit: The number of requests that can be in
+            flight at once to the same host
+        :param timeout: The Requests timeout of each request
+        """
+        self.max_requests = max_requests
+        self.per_host_limit = per_host_limit
+        self.timeout = timeout
+
+    @staticmethod
+    def can_send(repeater):
+        """
+        Repeaters that send requests their own way, or send batches,
+        need to be sent with ``RepeatRecord.fire()`` or
+        ``RepeatRecord.fire_batch()`` instead.
+        """
+        return (
+            type(repeater).send_request is Repeater.send_request
+            and type(repeater).fire_for_record is Repeater.fire_for_record
+            and not repeater.supports_batching
+        )
+
+    def send(self, repeat_records):
+        """
+        Send ``repeat_records`` and save an attempt on each of them.
+        Returns when they have all been sent.
+        """
+        if not repeat_records:
+            return
+        batches = [repeat_records]
+        self.send_batches(lambda: [batches.pop()] if batches else [])
+
+    def send_batches(self, claim_batches, batch_sent=None, stop_time=None):
+        """
+        Keep sending batches of repeat records, claiming more as requests
+        finish, until ``claim_batches`` has nothing left and every request
+        has finished. No more batches are claimed after ``stop_time``.
+
+        :param claim_batches: Called whenever there are fewer than
+            ``max_requests`` repeat records in flight. Returns a list of
+            batches (lists of repeat records) to send.
+        :param batch_sent: (optional) Called with each batch once an
+            attempt has been saved on all of its repeat records.
+        :param stop_time: (optional) A UTC datetime.
+        """
+        loop = asyncio.new_event_loop()
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_requests) as executor:
+                loop.run_until_complete(
+                    self._send_batches(loop, executor, claim_batches, batch_sent, stop_time)
+                )
+        finally:
+            loop.close()
+
+    async def _send_batches(self, loop, executor, claim_batches, batch_sent, stop_time):
+        limits = _RequestLimits(self.max_requests, self.per_host_limit)
+        in_flight = {}
+        while True:
+            while (
+                sum(in_flight.values()) < self.max_requests
+                and (stop_time is None or datetime.utcnow() < stop_time)
+            ):
+                batches = claim_batches()
+                if not batches:
+                    break
+                for batch in batches:
+                    task = loop.create_task(self._send_batch(loop, executor, limits, batch, batch_sent))
+                    in_flight[task] = len(batch)
+            if not in_flight:
+                return
+            done, __ = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                del in_flight[task]
+
+    async def _send_batch(self, loop, executor, limits, repeat_records, batch_sent):
+        results = await asyncio.gather(*[
+            self._send(loop, executor, limits, repeat_record)
+            for repeat_record in repeat_records
+        ], return_exceptions=True)
+        for repeat_record, result in zip(repeat_records, results):
+            if isinstance(result, Exception):
+                logger.error('Failed to process repeat record: {}'.format(repeat_record._id), exc_info=result)
+        if batch_sent is not None:
+            try:
+                batch_sent(repeat_records)
+            except Exception:
+                logger.exception('Failed to record the result of a batch of repeat records')
+
+    async def _send(self, loop, executor, limits, repeat_record):
+        repeater = repeat_record.repeater
+        repeat_record.overall_tries += 1
+        try:
+            payload = repeater.get_payload(repeat_record)
+            url = repeater.get_url(repeat_record)
+            headers = repeater.get_headers(repeat_record)
+        except Exception as e:
+            # As in RepeatRecord.fire(), a payload that can't be
+            # generated cancels the repeat record
+            log_repeater_error_in_datadog(repeat_record.domain, status_code=None,
+                                          repeater_type=repeat_record.repeater_type)
+            attempt = repeat_record.handle_payload_exception(e)
+        else:
+            post = partial(simple_post, payload, url, headers=headers, timeout=self.timeout,
+                           auth=repeater.get_auth(), verify=repeater.verify, session=repeater.get_session())
+            # The request only starts once it has a thread, so requests'
+            # own timeout is the time spent on the request itself
+            async with limits.for_host(urlparse(url or '').netloc), limits.total:
+                try:
+                    result = await loop.run_in_executor(executor, post)
+                except (Timeout, ConnectionError) as error:
+                    log_repeater_timeout_in_datadog(repeater.domain)
+                    result = RequestConnectionError(error)
+                except Exception as e:
+                    result = e
+            attempt = repeater.handle_response(result, repeat_record)
+        repeat_record.add_attempt(attempt)
+        repeat_record.save()
+
+
+class _RequestLimits(object):
+    """
+    The semaphores that limit requests in flight. A request takes its
+    host's semaphore first, so that requests waiting on a busy host
+    don't hold up requests to other hosts.
+    """
+
+    def __init__(self, max_requests, per_host_limit):
+        self.total = asyncio.Semaphore(max_requests)
+        self._hosts = defaultdict(partial(asyncio.Semaphore, per_host_limit))
+
+    def for_host(self, host):
+        return self._hosts[host]
@@ -12,6 +12,26 @@ RECORD_SUCCESS_STATE = 'SUCCESS'
 RECORD_FAILURE_STATE = 'FAIL'
 RECORD_CANCELLED_STATE = 'CANCELLED'
 
+# Used when settings.USE_SQL_REPEAT_RECORD_QUEUE is True
+REPEAT_RECORD_QUEUE_BATCH_SIZE = 100
+# How long a claimed batch is hidden from other workers
+REPEAT_RECORD_QUEUE_LEASE = timedelta(minutes=30)
+# How long a worker keeps claiming batches for a repeater before exiting
+PROCESS_REPEATER_QUEUE_TIME_LIMIT = timedelta(minutes=10)
+# Back-off for a repeater when a whole batch fails, doubled for each failed batch
+MIN_REPEATER_BACKOFF = timedelta(minutes=5)
+MAX_REPEATER_BACKOFF = timedelta(days=1)
+
+# Responses to a batch request that mean the receiver rejected (some of) the
+# payloads, so the repeat records are sent again one at a time
+BATCH_REJECTED_STATUS_CODES = (400, 413, 422)
+
+# Used when settings.REPEAT_RECORD_ASYNC_DELIVERY is True
+ASYNC_DELIVERY_MAX_REQUESTS = 100
+ASYNC_DELIVERY_PER_HOST_LIMIT = 10
+# Held by the deliver_repeat_records_async task, so that only one runs at a time
+ASYNC_DELIVERY_KEY = 'deliver-repeat-records-async'
+
 REPEATER_CLASSES = (
     'corehq.motech.repeaters.models.FormRepeater',
     'corehq.motech.repeaters.models.CaseRepeater',
@@ -0,0 +1,49 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+
+from dimagi.utils.chunked import chunked
+
+from corehq.motech.repeaters.dbaccessors import iterate_repeat_records
+from corehq.motech.repeaters.models import (
+    Repeater,
+    RepeaterQueueState,
+    RepeatRecordQueueEntry,
+)
+
+
+class Command(BaseCommand):
+    help = """
+    Copy all repeaters and all waiting repeat records from Couch to the SQL
+    repeat record queue. Run this after setting USE_SQL_REPEAT_RECORD_QUEUE;
+    records saved after that are kept in sync automatically. Safe to rerun.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunksize', type=int, default=1000)
+
+    def handle(self, chunksize, **options):
+        repeaters = Repeater.get_db().view('repeaters/repeaters', reduce=False, include_docs=True)
+        for row in repeaters:
+            RepeaterQueueState.update_from_repeater(Repeater.wrap(row['doc']))
+
+        added = 0
+        far_future = datetime.datetime(9999, 1, 1)
+        for records in chunked(iterate_repeat_records(far_future), chunksize):
+            existing = set(RepeatRecordQueueEntry.objects.filter(
+                record_id__in=[record.get_id for record in records]
+            ).values_list('record_id', flat=True))
+            new_entries = [
+                RepeatRecordQueueEntry(
+                    record_id=record.get_id,
+                    domain=record.domain,
+                    repeater_id=record.repeater_id,
+                    state=record.state,
+                    next_check=record.next_check,
+                )
+                for record in records
+                if record.get_id not in existing and record.state in RepeatRecordQueueEntry.QUEUED_STATES
+            ]
+            RepeatRecordQueueEntry.objects.bulk_create(new_entries)
+            added += len(new_entries)
+            print("Added {} repeat records to the queue".format(added))
@@ -0,0 +1,39 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('repeaters', '0001_adjust_auth_field_format'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RepeaterQueueState',
+            fields=[
+                ('repeater_id', models.CharField(max_length=126, primary_key=True, serialize=False)),
+                ('domain', models.CharField(max_length=126)),
+                ('paused', models.BooleanField(default=False)),
+                ('is_deleted', models.BooleanField(default=False)),
+                ('max_workers', models.PositiveSmallIntegerField(default=1)),
+                ('failure_streak', models.PositiveIntegerField(default=0)),
+                ('backoff_until', models.DateTimeField(null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='RepeatRecordQueueEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('record_id', models.CharField(max_length=126, unique=True)),
+                ('domain', models.CharField(max_length=126)),
+                ('repeater_id', models.CharField(max_length=126)),
+                ('state', models.CharField(max_length=16)),
+                ('next_check', models.DateTimeField()),
+                ('claim_id', models.CharField(max_length=32, null=True)),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='repeatrecordqueueentry',
+            index_together={('next_check', 'repeater_id', 'state')},
+        ),
+    ]
@@ -64,13 +64,18 @@ class.
 
 """
 import re
+import uuid
 import warnings
 from datetime import datetime, timedelta
+from functools import lru_cache
 from urllib.parse import parse_qsl, urlencode, urlparse, urlunparse
 
+from django.conf import settings
+from django.db import models, transaction
 from django.utils.translation import ugettext_lazy as _
 
 from couchdbkit.exceptions import ResourceConflict, ResourceNotFound
+import requests
 from memoized import memoized
 from requests.auth import HTTPBasicAuth, HTTPDigestAuth
 from requests.exceptions import ConnectionError, Timeout
@@ -118,13 +123,17 @@ from corehq.util.metrics import metrics_counter
 from corehq.util.quickcache import quickcache
 
 from .const import (
+    BATCH_REJECTED_STATUS_CODES,
+    MAX_REPEATER_BACKOFF,
     MAX_RETRY_WAIT,
+    MIN_REPEATER_BACKOFF,
     MIN_RETRY_WAIT,
     POST_TIMEOUT,
     RECORD_CANCELLED_STATE,
     RECORD_FAILURE_STATE,
     RECORD_PENDING_STATE,
     RECORD_SUCCESS_STATE,
+    REPEAT_RECORD_QUEUE_LEASE,
 )
 from .dbaccessors import (
     get_cancelled_repeat_record_count,
@@ -184,6 +193,10 @@ class Repeater(QuickCachedDocumentMixin, Document):
     friendly_name = _("Data")
     paused = BooleanProperty(default=False)
 
+    # The number of repeat records to send in one request, if the
+    # payload generator supports batching
+    batch_size = IntegerProperty(default=1)
+
     payload_generator_classes = ()
 
     _has_config = False
@@ -192,6 +205,11 @@ class Repeater(QuickCachedDocumentMixin, Document):
         url = "@".join((self.username, self.url)) if self.username else self.url
         return f"<{self.__class__.__name__} {self._id} {url}>"
 
+    def save(self, *args, **kwargs):
+        super(Repeater, self).save(*args, **kwargs)
+        if settings.USE_SQL_REPEAT_RECORD_QUEUE:
+            RepeaterQueueState.update_from_repeater(self)
+
     @classmethod
     def available_for_domain(cls, domain):
         """Returns whether this repeater can be used by a particular domain
@@ -372,14 +390,53 @@ class Repeater(QuickCachedDocumentMixin, Document):
     def notify_addresses(self):
         return [addr for addr in re.split('[, ]+', self.notify_addresses_str) if addr]
 
+    @property
+    def supports_batching(self):
+        return (
+            self.batch_size > 1
+            and self.generator.supports_batching
+            and type(self).send_request is Repeater.send_request
+            and self.get_batch_url() is not None
+        )
+
+    def get_session(self):
+        return _get_repeater_session(self.get_id)
+
     def send_request(self, repeat_record, payload):
         headers = self.get_headers(repeat_record)
         auth = self.get_auth()
         url = self.get_url(repeat_record)
-        return simple_post(payload, url, headers=headers, timeout=POST_TIMEOUT, auth=auth, verify=self.verify)
+        return simple_post(payload, url, headers=headers, timeout=POST_TIMEOUT, auth=auth, verify=self.verify,
+                           session=self.get_session())
+
+    def get_batch_url(self):
+        """
+        The URL that batches of repeat records are sent to, or None if the
+        URL depends on the repeat record, in which case repeat records are
+        not batched.
+        """
+        if type(self).get_url is not Repeater.get_url:
+            return None
+        return self.url
+
+    def get_batch_headers(self):
+        """
+        The headers of a batch request. These are the payload generator's
+        headers only. Headers that describe a single repeat record, like
+        "received-on" and "server-modified-on", are not sent; the receiver
+        gets those dates from each item of the batch payload.
+        """
+        return self.generator.get_headers()
+
+    def send_batch_request(self, payload):
+        return simple_post(payload, self.get_batch_url(), headers=self.get_batch_headers(), timeout=POST_TIMEOUT,
+                           auth=self.get_auth(), verify=self.verify, session=self.get_session())
 
     def fire_for_record(self, repeat_record):
         payload = self.get_payload(repeat_record)
+        return self._fire_payload(repeat_record, payload)
+
+    def _fire_payload(self, repeat_record, payload):
         try:
             response = self.send_request(repeat_record, payload)
         except (Timeout, ConnectionError) as error:
@@ -390,6 +447,37 @@ class Repeater(QuickCachedDocumentMixin, Document):
         else:
             return self.handle_response(response, repeat_record)
 
+    def fire_for_records(self, repeat_records, payloads):
+        """
+        Send the payloads of several repeat records in one request.
+
+        If the receiver rejects the payload of the batch (e.g. with a 400 or
+        422 response), the repeat records are sent again one at a time, so
+        that one bad payload does not fail the others. Any other error
+        response (e.g. 429 or 5xx) fails all of the repeat records, so that
+        they are retried later.
+
+        Returns a RepeatRecordAttempt for each repeat record, in order.
+        """
+        payload = self.generator.get_batch_payload(payloads)
+        try:
+            response = self.send_batch_request(payload)
+        except (Timeout, ConnectionError) as error:
+            log_repeater_timeout_in_datadog(self.domain)
+            results = [RequestConnectionError(error)] * len(repeat_records)
+        except Exception as e:
+            results = [e] * len(repeat_records)
+        else:
+            if response.status_code in BATCH_REJECTED_STATUS_CODES:
+                return [self._fire_payload(repeat_record, payload)
+                        for repeat_record, payload in zip(repeat_records, payloads)]
+            elif not 200 <= response.status_code < 300:
+                results = [response] * len(repeat_records)
+            else:
+                results = self.generator.get_batch_results(response, repeat_records)
+        return [self.handle_response(result, repeat_record)
+                for result, repeat_record in zip(results, repeat_records)]
+
     def handle_response(self, result, repeat_record):
         """
         route the result to the success, failure, or exception handlers
@@ -462,6 +550,12 @@ class FormRepeater(Repeater):
             url_parts[4] = urlencode(query)
             return urlunparse(url_parts)
 
+    def get_batch_url(self):
+        # the app_id param depends on the repeat record
+        if self.include_app_id_param or type(self).get_url is not FormRepeater.get_url:
+            return None
+        return self.url
+
     def get_headers(self, repeat_record):
         headers = super(FormRepeater, self).get_headers(repeat_record)
         headers.update({
@@ -649,6 +743,11 @@ class RepeatRecord(Document):
     def record_id(self):
         return self._id
 
+    def save(self, *args, **kwargs):
+        super(RepeatRecord, self).save(*args, **kwargs)
+        if settings.USE_SQL_REPEAT_RECORD_QUEUE:
+            RepeatRecordQueueEntry.update_from_record(self)
+
     @classmethod
     def wrap(cls, data):
         should_bootstrap_attempts = ('attempts' not in data)
@@ -782,6 +881,36 @@ class RepeatRecord(Document):
                 self.add_attempt(attempt)
                 self.save()
 
+    @classmethod
+    def fire_batch(cls, repeater, repeat_records):
+        """
+        Send repeat records that belong to ``repeater`` in one request.
+        Repeat records whose payloads can't be generated are cancelled,
+        as they are by ``fire()``.
+        """
+        to_send = []
+        payloads = []
+        for repeat_record in repeat_records:
+            if not repeat_record.try_now():
+                continue
+            repeat_record.overall_tries += 1
+            try:
+                payloads.append(repeater.get_payload(repeat_record))
+            except Exception as e:
+                log_repeater_error_in_datadog(repeat_record.domain, status_code=None,
+                                              repeater_type=repeat_record.repeater_type)
+                repeat_record.add_attempt(repeat_record.handle_payload_exception(e))
+                repeat_record.save()
+            else:
+                to_send.append(repeat_record)
+        if not to_send:
+            return
+
+        attempts = repeater.fire_for_records(to_send, payloads)
+        for repeat_record, attempt in zip(to_send, attempts):
+            repeat_record.add_attempt(attempt)
+            repeat_record.save()
+
     @staticmethod
     def _format_response(response):
         if not _is_response(response):
@@ -885,6 +1014,160 @@ class RepeatRecord(Document):
         self.next_check = datetime.utcnow()
 
 
+class RepeaterQueueState(models.Model):
+    """
+    The Repeater fields that the repeat record queue filters on, copied
+    from Couch when a repeater is saved, plus the repeater's concurrency
+    limit and back-off.
+    """
+    repeater_id = models.CharField(max_length=126, primary_key=True)
+    domain = models.CharField(max_length=126)
+    paused = models.BooleanField(default=False)
+    is_deleted = models.BooleanField(default=False)
+
+    # The number of batches of this repeater's records that may be sent at once
+    max_workers = models.PositiveSmallIntegerField(default=1)
+
+    # The number of batches in a row in which every record failed
+    failure_streak = models.PositiveIntegerField(default=0)
+    backoff_until = models.DateTimeField(null=True)
+
+    @classmethod
+    def update_from_repeater(cls, repeater):
+        cls.objects.update_or_create(repeater_id=repeater.get_id, defaults={
+            'domain': repeater.domain,
+            'paused': repeater.paused,
+            'is_deleted': repeater.doc_type.endswith(DELETED),
+        })
+
+    @classmethod
+    def get_active(cls, now):
+        return cls.objects.filter(
+            models.Q(backoff_until__isnull=True) | models.Q(backoff_until__lte=now),
+            paused=False,
+            is_deleted=False,
+        )
+
+    def record_batch_result(self, any_succeeded, now):
+        if any_succeeded:
+            self.failure_streak = 0
+            self.backoff_until = None
+        else:
+            self.failure_streak += 1
+            backoff = MIN_REPEATER_BACKOFF * 2 ** (self.failure_streak - 1)
+            self.backoff_until = now + min(backoff, MAX_REPEATER_BACKOFF)
+        self.save(update_fields=['failure_streak', 'backoff_until'])
+
+
+class RepeatRecordQueueEntry(models.Model):
+    """
+    A RepeatRecord that is waiting to be sent. Entries are kept in sync
+    with Couch when records are saved, and are deleted once a record has
+    succeeded or been cancelled.
+    """
+    QUEUED_STATES = (RECORD_PENDING_STATE, RECORD_FAILURE_STATE)
+
+    record_id = models.CharField(max_length=126, unique=True)
+    domain = models.CharField(max_length=126)
+    repeater_id = models.CharField(max_length=126)
+    state = models.CharField(max_length=16)
+    next_check = models.DateTimeField()
+
+    # Set while the record is in a batch claimed by a worker
+    claim_id = models.CharField(max_length=32, null=True)
+
+    class Meta(object):
+        index_together = (
+            ('next_check', 'repeater_id', 'state'),
+        )
+
+    @classmethod
+    def update_from_record(cls, repeat_record):
+        if (
+            repeat_record.state in cls.QUEUED_STATES and
+            repeat_record.next_check and
+            not repeat_record.doc_type.endswith(DELETED)
+        ):
+            cls.objects.update_or_create(record_id=repeat_record.get_id, defaults={
+                'domain': repeat_record.domain,
+                'repeater_id': repeat_record.repeater_id,
+                'state': repeat_record.state,
+                'next_check': repeat_record.next_check,
+                'claim_id': None,
+            })
+        else:
+            cls.objects.filter(record_id=repeat_record.get_id).delete()
+
+    @classmethod
+    def get_due(cls, now):
+        return cls.objects.filter(next_check__lte=now, state__in=cls.QUEUED_STATES)
+
+    @classmethod
+    def get_due_repeaters(cls, now):
+        """
+        :return: (repeater_id, max_workers) for each active repeater with due records
+        """
+        return list(
+            RepeaterQueueState.get_active(now)
+            .filter(repeater_id__in=cls.get_due(now).values('repeater_id'))
+            .values_list('repeater_id', 'max_workers')
+        )
+
+    @classmethod
+    def claim_batch(cls, repeater_id, batch_size, now=None):
+        """
+        Claim up to `batch_size` due records for a repeater. The records
+        are hidden from other workers until they are saved or until
+        REPEAT_RECORD_QUEUE_LEASE has passed.
+
+        :return: a list of RepeatRecord ids, which is empty if the repeater
+        is paused, deleted or backing off, or if it already has
+        `max_workers` batches in flight.
+        """
+        now = now or datetime.utcnow()
+        with transaction.atomic():
+            # Locking the repeater's row makes claims for the same repeater
+            # take turns, so that in-flight batches are counted correctly
+            try:
+                state = RepeaterQueueState.get_active(now).select_for_update().get(repeater_id=repeater_id)
+            except RepeaterQueueState.DoesNotExist:
+                return []
+
+            in_flight = (
+                cls.objects
+                .filter(repeater_id=repeater_id, claim_id__isnull=False, next_check__gt=now)
+                .values('claim_id').distinct().count()
+            )
+            if in_flight >= state.max_workers:
+                return []
+
+            ids = list(
+                cls.get_due(now)
+                .filter(repeater_id=repeater_id)
+                .select_for_update(skip_locked=True)
+                .order_by('next_check')
+                .values_list('id', flat=True)[:batch_size]
+            )
+            if not ids:
+                return []
+
+            claim_id = uuid.uuid4().hex
+            cls.objects.filter(id__in=ids).update(
+                claim_id=claim_id,
+                next_check=now + REPEAT_RECORD_QUEUE_LEASE,
+            )
+            return list(cls.objects.filter(id__in=ids).values_list('record_id', flat=True))
+
+
+@lru_cache(maxsize=100)
+def _get_repeater_session(repeater_id):
+    """
+    Returns a requests Session for a repeater, so that the connections
+    to its receiver are kept alive between requests in this process
+    """
+    return requests.Session()
+
+
 def _get_retry_interval(last_checked, now):
     """
     Returns a timedelta between MIN_RETRY_WAIT and MAX_RETRY_WAIT that
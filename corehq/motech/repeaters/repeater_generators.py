@@ -31,6 +31,10 @@ class BasePayloadGenerator(object):
     # if you ever change format_name, add the old format_name here for backwards compatability
     deprecated_format_names = ()
 
+    # Whether the payloads of several repeat records can be sent in one
+    # request. See get_batch_payload() and get_batch_results()
+    supports_batching = False
+
     def __init__(self, repeater):
         self.repeater = repeater
 
@@ -48,6 +52,21 @@ class BasePayloadGenerator(object):
     def get_headers(self):
         return {'Content-Type': self.content_type}
 
+    def get_batch_payload(self, payloads):
+        """
+        Combine the payloads of several repeat records into the body of
+        a single request
+        """
+        raise NotImplementedError()
+
+    def get_batch_results(self, response, repeat_records):
+        """
+        Map the response to a batch request onto the repeat records that
+        were sent in it. Returns one result per repeat record, in order,
+        to be passed to ``Repeater.handle_response()``.
+        """
+        return [response] * len(repeat_records)
+
     def get_test_payload(self, domain):
         return (
             "<?xml version='1.0' ?>"
@@ -76,6 +95,50 @@ class BasePayloadGenerator(object):
         return True
 
 
+class BatchItemResponse(namedtuple('BatchItemResponse', 'status_code reason text')):
+    """
+    The part of a batch response that applies to one repeat record. It
+    has the attributes of a Requests response that repeaters use.
+    """
+
+    @classmethod
+    def from_item(cls, item, response):
+        status_code = response.status_code
+        if isinstance(item, dict):
+            status = item.get('status')
+            if isinstance(status, int) and not isinstance(status, bool):
+                status_code = status
+            text = json.dumps(item)
+        else:
+            text = str(item)
+        return cls(status_code=status_code, reason=response.reason, text=text)
+
+
+class JsonBatchPayloadMixin(object):
+    """
+    Sends batches of JSON payloads as a JSON array.
+
+    If the receiver responds with a JSON array that has one item for
+    each payload, the "status" of each item is used as the status code
+    of its repeat record. Otherwise the status of the response applies
+    to every repeat record in the batch.
+    """
+    supports_batching = True
+
+    def get_batch_payload(self, payloads):
+        return '[{}]'.format(','.join(payloads))
+
+    def get_batch_results(self, response, repeat_records):
+        if 200 <= response.status_code < 300:
+            try:
+                items = response.json()
+            except ValueError:
+                items = None
+            if isinstance(items, list) and len(items) == len(repeat_records):
+                return [BatchItemResponse.from_item(item, response) for item in items]
+        return super(JsonBatchPayloadMixin, self).get_batch_results(response, repeat_records)
+
+
 FormatInfo = namedtuple('FormatInfo', 'name label generator_class')
 
 
@@ -238,7 +301,7 @@ class CaseRepeaterXMLPayloadGenerator(BasePayloadGenerator):
         ).as_text()
 
 
-class CaseRepeaterJsonPayloadGenerator(BasePayloadGenerator):
+class CaseRepeaterJsonPayloadGenerator(JsonBatchPayloadMixin, BasePayloadGenerator):
     format_name = 'case_json'
     format_label = _('JSON')
 
@@ -292,7 +355,7 @@ class ShortFormRepeaterJsonPayloadGenerator(BasePayloadGenerator):
         })
 
 
-class FormRepeaterJsonPayloadGenerator(BasePayloadGenerator):
+class FormRepeaterJsonPayloadGenerator(JsonBatchPayloadMixin, BasePayloadGenerator):
 
     format_name = 'form_json'
     format_label = _('JSON')
@@ -1,3 +1,4 @@
+from collections import Counter
 from datetime import datetime, timedelta
 
 from django.conf import settings
@@ -5,18 +6,24 @@ from django.conf import settings
 from celery.schedules import crontab
 from celery.task import periodic_task, task
 from celery.utils.log import get_task_logger
+from couchdbkit.exceptions import ResourceNotFound
 
 from corehq.util.metrics import metrics_gauge_task, metrics_counter
+from dimagi.utils.chunked import chunked
 from dimagi.utils.couch import get_redis_lock
+from dimagi.utils.couch.database import iter_docs
 from dimagi.utils.couch.undo import DELETED_SUFFIX
 
 from corehq.apps.accounting.utils import domain_has_privilege
 from corehq.motech.models import RequestLog
 from corehq.motech.repeaters.const import (
+    ASYNC_DELIVERY_KEY,
     CHECK_REPEATERS_INTERVAL,
     CHECK_REPEATERS_KEY,
+    PROCESS_REPEATER_QUEUE_TIME_LIMIT,
     RECORD_FAILURE_STATE,
     RECORD_PENDING_STATE,
+    REPEAT_RECORD_QUEUE_BATCH_SIZE,
 )
 from corehq.motech.repeaters.dbaccessors import (
     get_overdue_repeat_record_count,
@@ -60,6 +67,10 @@ def clean_logs():
     queue=settings.CELERY_PERIODIC_QUEUE,
 )
 def check_repeaters():
+    if settings.USE_SQL_REPEAT_RECORD_QUEUE:
+        # records are sent by dispatch_repeat_record_queue instead
+        return
+
     start = datetime.utcnow()
     six_hours_sec = 6 * 60 * 60
     six_hours_later = start + timedelta(seconds=six_hours_sec)
@@ -90,8 +101,221 @@ def check_repeaters():
         check_repeater_lock.release()
 
 
+@periodic_task(
+    run_every=crontab(),  # every minute
+    queue=settings.CELERY_PERIODIC_QUEUE,
+)
+def dispatch_repeat_record_queue():
+    """
+    Start workers for every active repeater that has due repeat records,
+    up to the repeater's concurrency limit. Workers that can't claim a
+    batch exit straight away, so it is safe to start more than needed.
+
+    With async delivery, only repeaters that the async sender can't send
+    get workers of their own.
+    """
+    if not settings.USE_SQL_REPEAT_RECORD_QUEUE:
+        return
+
+    from corehq.motech.repeaters.models import RepeatRecordQueueEntry
+    due_repeaters = RepeatRecordQueueEntry.get_due_repeaters(datetime.utcnow())
+    if settings.REPEAT_RECORD_ASYNC_DELIVERY:
+        # exits straight away if one is already running
+        deliver_repeat_records_async.delay()
+        due_repeaters = [
+            (repeater_id, max_workers) for repeater_id, max_workers in due_repeaters
+            if not _can_send_async(repeater_id)
+        ]
+
+    for repeater_id, max_workers in due_repeaters:
+        for __ in range(max_workers):
+            process_repeater_queue.delay(repeater_id)
+
+
+@task(queue=settings.CELERY_REPEAT_RECORD_QUEUE, ignore_result=True)
+def process_repeater_queue(repeater_id):
+    """
+    Claim and send batches of a repeater's due records until there are
+    none left, the repeater starts backing off, or the time limit is hit.
+    """
+    from corehq.motech.repeaters.models import RepeatRecordQueueEntry
+    start = datetime.utcnow()
+    while datetime.utcnow() - start < PROCESS_REPEATER_QUEUE_TIME_LIMIT:
+        record_ids = RepeatRecordQueueEntry.claim_batch(repeater_id, REPEAT_RECORD_QUEUE_BATCH_SIZE)
+        if not record_ids:
+            return
+
+        repeat_records = _get_claimed_repeat_records(record_ids)
+        num_attempts = [len(repeat_record.attempts) for repeat_record in repeat_records]
+        _fire_repeat_records(repeat_records)
+        metrics_counter("commcare.repeaters.queue.processed", len(repeat_records))
+
+        if not _record_batch_result(repeater_id, repeat_records, num_attempts):
+            return
+
+
+@task(queue=settings.CELERY_REPEAT_RECORD_QUEUE, ignore_result=True)
+def deliver_repeat_records_async():
+    """
+    Send due repeat records concurrently until there are none left or the
+    time limit is hit. Only one of these tasks runs at a time; the others
+    exit straight away.
+    """
+    # Long enough for the requests in flight at the time limit to finish
+    lock_timeout = int((PROCESS_REPEATER_QUEUE_TIME_LIMIT + timedelta(minutes=5)).total_seconds())
+    lock = get_redis_lock(ASYNC_DELIVERY_KEY, timeout=lock_timeout, name=ASYNC_DELIVERY_KEY)
+    if not lock.acquire(blocking=False):
+        return
+
+    try:
+        _deliver_repeat_records_async()
+    finally:
+        lock.release()
+
+
+def _deliver_repeat_records_async():
+    """
+    Whenever requests finish, claims a batch for every due repeater that
+    has fewer batches in flight than its concurrency limit, so that the
+    sender is kept full instead of waiting for a whole round to finish.
+
+    Repeaters that the async sender can't send are left to
+    ``process_repeater_queue``, so that they don't hold up the event loop.
+    """
+    from corehq.motech.repeaters.async_delivery import AsyncRepeatRecordSender
+    from corehq.motech.repeaters.models import RepeatRecordQueueEntry
+    sender = AsyncRepeatRecordSender()
+    batches_in_flight = Counter()
+    claimed = {}
+
+    def batch_done(repeater_id, repeat_records, num_attempts):
+        metrics_counter("commcare.repeaters.queue.processed", len(repeat_records))
+        _record_batch_result(repeater_id, repeat_records, num_attempts)
+
+    def claim_batches():
+        batches = []
+        for repeater_id, max_workers in RepeatRecordQueueEntry.get_due_repeaters(datetime.utcnow()):
+            if batches_in_flight[repeater_id] >= max_workers or not _can_send_async(repeater_id):
+                continue
+            record_ids = RepeatRecordQueueEntry.claim_batch(repeater_id, REPEAT_RECORD_QUEUE_BATCH_SIZE)
+            if not record_ids:
+                continue
+
+            repeat_records = _get_claimed_repeat_records(record_ids)
+            num_attempts = [len(repeat_record.attempts) for repeat_record in repeat_records]
+            ready = [repeat_record for repeat_record in repeat_records if _is_ready_to_fire(repeat_record)]
+            if ready:
+                batches_in_flight[repeater_id] += 1
+                claimed[id(ready)] = (repeater_id, repeat_records, num_attempts)
+                batches.append(ready)
+            else:
+                batch_done(repeater_id, repeat_records, num_attempts)
+        return batches
+
+    def batch_sent(ready):
+        repeater_id, repeat_records, num_attempts = claimed.pop(id(ready))
+        batches_in_flight[repeater_id] -= 1
+        batch_done(repeater_id, repeat_records, num_attempts)
+
+    sender.send_batches(claim_batches, batch_sent,
+                        stop_time=datetime.utcnow() + PROCESS_REPEATER_QUEUE_TIME_LIMIT)
+
+
+def _can_send_async(repeater_id):
+    from corehq.motech.repeaters.async_delivery import AsyncRepeatRecordSender
+    from corehq.motech.repeaters.models import Repeater
+    try:
+        repeater = Repeater.get(repeater_id)
+    except ResourceNotFound:
+        # process_repeater_queue deals with the records of missing repeaters
+        return False
+    return AsyncRepeatRecordSender.can_send(repeater)
+
+
+def _get_claimed_repeat_records(record_ids):
+    """
+    Returns the RepeatRecords for claimed queue entries, and drops the
+    entries of records that no longer exist
+    """
+    from corehq.motech.repeaters.models import RepeatRecord, RepeatRecordQueueEntry
+    repeat_records = [RepeatRecord.wrap(doc) for doc in iter_docs(RepeatRecord.get_db(), record_ids)]
+    missing_ids = set(record_ids) - {repeat_record.get_id for repeat_record in repeat_records}
+    if missing_ids:
+        RepeatRecordQueueEntry.objects.filter(record_id__in=missing_ids).delete()
+    return repeat_records
+
+
+def _record_batch_result(repeater_id, repeat_records, num_attempts):
+    """
+    Updates the repeater's back-off from the attempts made on a batch.
+    Returns False if the repeater is now backing off.
+    """
+    from corehq.motech.repeaters.models import RepeaterQueueState
+    attempted = False
+    succeeded = False
+    for repeat_record, count in zip(repeat_records, num_attempts):
+        if len(repeat_record.attempts) > count:
+            attempted = True
+            succeeded = succeeded or repeat_record.succeeded
+
+    if attempted:
+        state = RepeaterQueueState.objects.get(repeater_id=repeater_id)
+        state.record_batch_result(succeeded, datetime.utcnow())
+        if not succeeded:
+            metrics_counter("commcare.repeaters.queue.backoff")
+            return False
+    return True
+
+
+def _fire_repeat_records(repeat_records):
+    """
+    Send repeat records that belong to the same repeater, in batches if
+    the repeater supports it
+    """
+    _fire_ready_repeat_records([
+        repeat_record for repeat_record in repeat_records if _is_ready_to_fire(repeat_record)
+    ])
+
+
+def _fire_ready_repeat_records(ready):
+    from corehq.motech.repeaters.models import RepeatRecord
+    if not ready:
+        return
+
+    repeater = ready[0].repeater
+    if repeater.supports_batching:
+        for batch in chunked(ready, repeater.batch_size, list):
+            try:
+                RepeatRecord.fire_batch(repeater, batch)
+            except Exception:
+                logging.exception('Failed to process repeat records: {}'.format(
+                    ', '.join(repeat_record._id for repeat_record in batch)))
+    else:
+        for repeat_record in ready:
+            try:
+                repeat_record.fire()
+            except Exception:
+                logging.exception('Failed to process repeat record: {}'.format(repeat_record._id))
+
+
 @task(serializer='pickle', queue=settings.CELERY_REPEAT_RECORD_QUEUE)
 def process_repeat_record(repeat_record):
+    _process_repeat_record(repeat_record)
+
+
+def _process_repeat_record(repeat_record):
+    if _is_ready_to_fire(repeat_record):
+        try:
+            repeat_record.fire()
+        except Exception:
+            logging.exception('Failed to process repeat record: {}'.format(repeat_record._id))
+
+
+def _is_ready_to_fire(repeat_record):
+    """
+    Returns True if ``repeat_record`` should be sent now. Cancels,
+    postpones or retires it first if necessary.
+    """
 
     # A RepeatRecord should ideally never get into this state, as the
     # domain_has_privilege check is also triggered in the create_repeat_records
@@ -110,30 +334,31 @@ def process_repeat_record(repeat_record):
     ):
         repeat_record.cancel()
         repeat_record.save()
-        return
+        return False
     if repeat_record.cancelled:
-        return
+        return False
 
     repeater = repeat_record.repeater
     if not repeater:
         repeat_record.cancel()
         repeat_record.save()
-        return
+        return False
 
     try:
         if repeater.paused:
             # postpone repeat record by 1 day so that these don't get picked in each cycle and
             # thus clogging the queue with repeat records with paused repeater
             repeat_record.postpone_by(timedelta(days=1))
-            return
+            return False
         if repeater.doc_type.endswith(DELETED_SUFFIX):
             if not repeat_record.doc_type.endswith(DELETED_SUFFIX):
                 repeat_record.doc_type += DELETED_SUFFIX
                 repeat_record.save()
-        elif repeat_record.state == RECORD_PENDING_STATE or repeat_record.state == RECORD_FAILURE_STATE:
-                repeat_record.fire()
+            return False
     except Exception:
         logging.exception('Failed to process repeat record: {}'.format(repeat_record._id))
+        return False
+    return repeat_record.state == RECORD_PENDING_STATE or repeat_record.state == RECORD_FAILURE_STATE
 
 
 repeaters_overdue = metrics_gauge_task(
@@ -0,0 +1,133 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.test import SimpleTestCase
+
+from mock import Mock, patch
+
+from corehq.motech.dhis2.repeaters import Dhis2Repeater
+from corehq.motech.repeaters.async_delivery import AsyncRepeatRecordSender
+from corehq.motech.repeaters.exceptions import RequestConnectionError
+from corehq.motech.repeaters.models import CaseRepeater
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    Responds 200 to /ok, 500 to /fail, and 200 after a second to /slow
+    """
+    lock = threading.Lock()
+    in_flight = 0
+    max_in_flight = 0
+
+    def do_POST(self):
+        cls = type(self)
+        with cls.lock:
+            cls.in_flight += 1
+            cls.max_in_flight = max(cls.max_in_flight, cls.in_flight)
+        try:
+            self.rfile.read(int(self.headers['Content-Length']))
+            time.sleep(1 if self.path == '/slow' else 0.05)
+            self.send_response(500 if self.path == '/fail' else 200)
+            self.end_headers()
+            self.wfile.write(b'{}')
+        finally:
+            with cls.lock:
+                cls.in_flight -= 1
+
+    def log_message(self, *args):
+        pass
+
+
+@patch.object(CaseRepeater, 'payload_doc', Mock())
+@patch.object(CaseRepeater, 'get_payload', Mock(return_value='{}'))
+class AsyncRepeatRecordSenderTest(SimpleTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+        cls.server.daemon_threads = True
+        cls.base_url = 'http://127.0.0.1:{}'.format(cls.server.server_port)
+        cls.server_thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.server_thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        StubHandler.max_in_flight = 0
+
+    def _get_repeat_records(self, path, count):
+        repeater = CaseRepeater(_id='repeater' + path, domain='domain', url=self.base_url + path,
+                                format='case_json')
+        return [Mock(_id='record{}'.format(i), repeater=repeater, overall_tries=0) for i in range(count)]
+
+    def test_attempts_are_recorded(self):
+        succeeded = self._get_repeat_records('/ok', 2)
+        failed = self._get_repeat_records('/fail', 2)
+        AsyncRepeatRecordSender().send(succeeded + failed)
+
+        for repeat_record in succeeded:
+            [response], kwargs = repeat_record.handle_success.call_args
+            self.assertEqual(response.status_code, 200)
+            repeat_record.add_attempt.assert_called_once_with(repeat_record.handle_success.return_value)
+            repeat_record.save.assert_called_once_with()
+        for repeat_record in failed:
+            [response], kwargs = repeat_record.handle_failure.call_args
+            self.assertEqual(response.status_code, 500)
+        self.assertEqual([r.overall_tries for r in succeeded + failed], [1, 1, 1, 1])
+
+    def test_per_host_limit(self):
+        repeat_records = self._get_repeat_records('/ok', 8)
+        AsyncRepeatRecordSender(per_host_limit=2).send(repeat_records)
+        self.assertLessEqual(StubHandler.max_in_flight, 2)
+        for repeat_record in repeat_records:
+            repeat_record.handle_success.assert_called_once()
+
+    def test_total_limit(self):
+        repeat_records = self._get_repeat_records('/ok', 8)
+        AsyncRepeatRecordSender(max_requests=2, per_host_limit=10).send(repeat_records)
+        self.assertLessEqual(StubHandler.max_in_flight, 2)
+        for repeat_record in repeat_records:
+            repeat_record.handle_success.assert_called_once()
+
+    def test_batches_are_claimed_as_requests_finish(self):
+        batches = [self._get_repeat_records('/ok', 2) for __ in range(5)]
+        to_claim = list(batches)
+        sent = []
+        sent_when_claimed = []
+
+        def claim_batches():
+            sent_when_claimed.append(len(sent))
+            return [to_claim.pop(0)] if to_claim else []
+
+        AsyncRepeatRecordSender(max_requests=4).send_batches(claim_batches, sent.append)
+
+        self.assertEqual(sorted(map(id, sent)), sorted(map(id, batches)))
+        self.assertLessEqual(StubHandler.max_in_flight, 4)
+        # two batches fill the sender, and the rest are claimed one at a
+        # time as earlier batches finish
+        self.assertEqual(sent_when_claimed[:2], [0, 0])
+        self.assertTrue(all(0 < count < 5 for count in sent_when_claimed[2:5]))
+
+    def test_timeout(self):
+        [repeat_record] = self._get_repeat_records('/slow', 1)
+        AsyncRepeatRecordSender(timeout=0.2).send([repeat_record])
+        [error], kwargs = repeat_record.handle_exception.call_args
+        self.assertIsInstance(error, RequestConnectionError)
+
+    def test_payload_errors_cancel_the_record(self):
+        [repeat_record] = self._get_repeat_records('/ok', 1)
+        with patch.object(CaseRepeater, 'get_payload', side_effect=Exception('Boom!')), \
+                patch('corehq.motech.repeaters.async_delivery.log_repeater_error_in_datadog'):
+            AsyncRepeatRecordSender().send([repeat_record])
+        repeat_record.add_attempt.assert_called_once_with(repeat_record.handle_payload_exception.return_value)
+
+    def test_can_send(self):
+        self.assertTrue(AsyncRepeatRecordSender.can_send(CaseRepeater(format='case_json')))
+        self.assertFalse(AsyncRepeatRecordSender.can_send(CaseRepeater(format='case_json', batch_size=10)))
+        self.assertFalse(AsyncRepeatRecordSender.can_send(Dhis2Repeater()))
@@ -0,0 +1,139 @@
+import json
+
+from django.test import SimpleTestCase
+
+from mock import Mock, patch
+from requests.exceptions import Timeout
+
+from corehq.motech.repeaters.models import CaseRepeater, FormRepeater, RepeatRecord
+from corehq.motech.repeaters.repeater_generators import (
+    BatchItemResponse,
+    CaseRepeaterJsonPayloadGenerator,
+)
+
+
+def _response(status_code, body):
+    response = Mock(status_code=status_code, reason='reason')
+    response.json.return_value = body
+    return response
+
+
+class JsonBatchPayloadTest(SimpleTestCase):
+
+    def setUp(self):
+        self.generator = CaseRepeaterJsonPayloadGenerator(Mock())
+
+    def test_batch_payload(self):
+        payloads = [json.dumps({'case_id': 'a'}), json.dumps({'case_id': 'b'})]
+        self.assertEqual(json.loads(self.generator.get_batch_payload(payloads)),
+                         [{'case_id': 'a'}, {'case_id': 'b'}])
+
+    def test_per_item_results(self):
+        response = _response(200, [{'status': 201}, {'status': 400, 'error': 'bad'}])
+        first, second = self.generator.get_batch_results(response, ['r1', 'r2'])
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(second, BatchItemResponse(400, 'reason', json.dumps({'status': 400, 'error': 'bad'})))
+
+    def test_response_applies_to_all(self):
+        for response in [
+            _response(200, {'ok': True}),
+            _response(200, [{'status': 201}]),
+            _response(500, [{'status': 201}, {'status': 201}]),
+        ]:
+            self.assertEqual(self.generator.get_batch_results(response, ['r1', 'r2']), [response, response])
+
+    def test_status_that_is_not_an_int(self):
+        response = _response(200, [{'status': 'ok'}, {'status': True}, {'status': None}])
+        results = self.generator.get_batch_results(response, ['r1', 'r2', 'r3'])
+        self.assertEqual([result.status_code for result in results], [200, 200, 200])
+
+
+@patch.object(CaseRepeater, 'payload_doc', Mock())
+class FireForRecordsTest(SimpleTestCase):
+
+    def setUp(self):
+        self.repeater = CaseRepeater(_id='repeater', domain='domain', url='https://example.com/',
+                                     format='case_json', batch_size=10)
+        self.repeat_records = [Mock(), Mock()]
+
+    def test_supports_batching(self):
+        self.assertTrue(self.repeater.supports_batching)
+        self.assertFalse(CaseRepeater(format='case_json').supports_batching)
+        self.assertFalse(CaseRepeater(format='case_xml', batch_size=10).supports_batching)
+
+    def test_record_dependent_urls_are_not_batched(self):
+        self.assertFalse(FormRepeater(url='https://example.com/', format='form_json',
+                                      batch_size=10).supports_batching)
+        form_repeater = FormRepeater(url='https://example.com/', format='form_json', batch_size=10,
+                                     include_app_id_param=False)
+        self.assertTrue(form_repeater.supports_batching)
+        self.assertEqual(form_repeater.get_batch_url(), 'https://example.com/')
+
+        class CustomUrlRepeater(CaseRepeater):
+            def get_url(self, repeat_record):
+                return self.url + repeat_record.payload_id
+
+        self.assertFalse(CustomUrlRepeater(url='https://example.com/', format='case_json',
+                                           batch_size=10).supports_batching)
+
+    def test_one_request_per_batch(self):
+        with patch('corehq.motech.repeaters.models.simple_post') as simple_post:
+            simple_post.return_value = _response(200, [{'status': 200}, {'status': 409}])
+            attempts = self.repeater.fire_for_records(self.repeat_records, ['{"a": 1}', '{"b": 2}'])
+
+        simple_post.assert_called_once()
+        args, kwargs = simple_post.call_args
+        self.assertEqual(args, ('[{"a": 1},{"b": 2}]', 'https://example.com/'))
+        self.assertIs(kwargs['session'], self.repeater.get_session())
+        self.assertEqual(kwargs['headers'], {'Content-Type': 'application/json'})
+        first, second = self.repeat_records
+        self.assertEqual(attempts, [first.handle_success.return_value, second.handle_failure.return_value])
+
+    def test_rejected_batch_is_sent_one_at_a_time(self):
+        with patch('corehq.motech.repeaters.models.simple_post') as simple_post, \
+                patch.object(CaseRepeater, 'get_headers', return_value={}):
+            simple_post.side_effect = [
+                _response(400, {'error': 'bad request'}),
+                _response(200, None),
+                _response(400, None),
+            ]
+            attempts = self.repeater.fire_for_records(self.repeat_records, ['{"a": 1}', '{"b": 2}'])
+
+        self.assertEqual([call[0][0] for call in simple_post.call_args_list],
+                         ['[{"a": 1},{"b": 2}]', '{"a": 1}', '{"b": 2}'])
+        first, second = self.repeat_records
+        self.assertEqual(attempts, [first.handle_success.return_value, second.handle_failure.return_value])
+
+    def test_server_error_fails_all(self):
+        for status_code in (429, 503):
+            repeat_records = [Mock(), Mock()]
+            with patch('corehq.motech.repeaters.models.simple_post') as simple_post, \
+                    patch.object(CaseRepeater, 'get_headers', return_value={}):
+                response = _response(status_code, None)
+                simple_post.return_value = response
+                self.repeater.fire_for_records(repeat_records, ['{"a": 1}', '{"b": 2}'])
+
+            simple_post.assert_called_once()
+            for repeat_record in repeat_records:
+                repeat_record.handle_failure.assert_called_once_with(response)
+
+    def test_connection_error_fails_all(self):
+        with patch('corehq.motech.repeaters.models.simple_post', side_effect=Timeout), \
+                patch('corehq.motech.repeaters.models.log_repeater_timeout_in_datadog'):
+            self.repeater.fire_for_records(self.repeat_records, ['{}', '{}'])
+        for repeat_record in self.repeat_records:
+            repeat_record.handle_exception.assert_called_once()
+
+    def test_fire_batch_skips_records_without_payloads(self):
+        repeater = Mock()
+        repeater.get_payload.side_effect = [Exception('Boom!'), '{}']
+        repeater.fire_for_records.return_value = ['attempt']
+        repeat_records = [Mock(overall_tries=0), Mock(overall_tries=0)]
+        with patch('corehq.motech.repeaters.models.log_repeater_error_in_datadog'):
+            RepeatRecord.fire_batch(repeater, repeat_records)
+
+        failed, sent = repeat_records
+        repeater.fire_for_records.assert_called_once_with([sent], ['{}'])
+        failed.add_attempt.assert_called_once_with(failed.handle_payload_exception.return_value)
+        sent.add_attempt.assert_called_once_with('attempt')
+        self.assertEqual([r.overall_tries for r in repeat_records], [1, 1])
@@ -0,0 +1,199 @@
+from datetime import datetime, timedelta
+
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from mock import Mock, call, patch
+
+from corehq.motech.repeaters.const import (
+    MAX_REPEATER_BACKOFF,
+    MIN_REPEATER_BACKOFF,
+    RECORD_FAILURE_STATE,
+    RECORD_PENDING_STATE,
+    RECORD_SUCCESS_STATE,
+    REPEAT_RECORD_QUEUE_LEASE,
+)
+from corehq.motech.repeaters.models import (
+    CaseRepeater,
+    RepeaterQueueState,
+    RepeatRecordQueueEntry,
+)
+from corehq.motech.repeaters.tasks import (
+    deliver_repeat_records_async,
+    dispatch_repeat_record_queue,
+    process_repeater_queue,
+)
+
+DOMAIN = 'repeat-record-queue'
+
+
+class ClaimBatchTest(TestCase):
+
+    def setUp(self):
+        self.now = datetime.utcnow()
+        RepeaterQueueState.objects.create(repeater_id='active', domain=DOMAIN)
+        RepeaterQueueState.objects.create(repeater_id='paused', domain=DOMAIN, paused=True)
+        RepeaterQueueState.objects.create(repeater_id='deleted', domain=DOMAIN, is_deleted=True)
+        RepeaterQueueState.objects.create(repeater_id='backing-off', domain=DOMAIN,
+                                          backoff_until=self.now + timedelta(minutes=5))
+        for repeater_id in ['active', 'paused', 'deleted', 'backing-off']:
+            for i in range(3):
+                self._add_entry(repeater_id, '{}-{}'.format(repeater_id, i), self.now - timedelta(minutes=i))
+        self._add_entry('active', 'not-due', self.now + timedelta(hours=1))
+
+    def _add_entry(self, repeater_id, record_id, next_check, state=RECORD_PENDING_STATE):
+        RepeatRecordQueueEntry.objects.create(
+            record_id=record_id,
+            domain=DOMAIN,
+            repeater_id=repeater_id,
+            state=state,
+            next_check=next_check,
+        )
+
+    def test_due_repeaters(self):
+        self.assertEqual(RepeatRecordQueueEntry.get_due_repeaters(self.now), [('active', 1)])
+
+    def test_inactive_repeaters_are_skipped(self):
+        for repeater_id in ['paused', 'deleted', 'backing-off', 'unknown']:
+            self.assertEqual(RepeatRecordQueueEntry.claim_batch(repeater_id, 10, self.now), [])
+
+    def test_claim_oldest_first(self):
+        record_ids = RepeatRecordQueueEntry.claim_batch('active', 2, self.now)
+        self.assertEqual(sorted(record_ids), ['active-1', 'active-2'])
+        entry = RepeatRecordQueueEntry.objects.get(record_id='active-1')
+        self.assertEqual(entry.next_check, self.now + REPEAT_RECORD_QUEUE_LEASE)
+        self.assertIsNotNone(entry.claim_id)
+
+    def test_concurrency_limit(self):
+        self.assertEqual(len(RepeatRecordQueueEntry.claim_batch('active', 1, self.now)), 1)
+        self.assertEqual(RepeatRecordQueueEntry.claim_batch('active', 1, self.now), [])
+
+        RepeaterQueueState.objects.filter(repeater_id='active').update(max_workers=2)
+        self.assertEqual(len(RepeatRecordQueueEntry.claim_batch('active', 1, self.now)), 1)
+
+    def test_expired_claims_are_reclaimed(self):
+        self.assertEqual(len(RepeatRecordQueueEntry.claim_batch('active', 3, self.now)), 3)
+        later = self.now + REPEAT_RECORD_QUEUE_LEASE + timedelta(seconds=1)
+        self.assertEqual(len(RepeatRecordQueueEntry.claim_batch('active', 3, later)), 3)
+
+    def test_update_from_record(self):
+        record = Mock(get_id='active-0', domain=DOMAIN, repeater_id='active', state=RECORD_FAILURE_STATE,
+                      next_check=self.now + timedelta(hours=3), doc_type='RepeatRecord')
+        RepeatRecordQueueEntry.claim_batch('active', 3, self.now)
+        RepeatRecordQueueEntry.update_from_record(record)
+        entry = RepeatRecordQueueEntry.objects.get(record_id='active-0')
+        self.assertEqual((entry.state, entry.next_check, entry.claim_id),
+                         (RECORD_FAILURE_STATE, record.next_check, None))
+
+        record.state = RECORD_SUCCESS_STATE
+        RepeatRecordQueueEntry.update_from_record(record)
+        self.assertFalse(RepeatRecordQueueEntry.objects.filter(record_id='active-0').exists())
+
+
+class RepeaterBackoffTest(SimpleTestCase):
+
+    @patch.object(RepeaterQueueState, 'save')
+    def test_backoff_doubles_up_to_max(self, save):
+        now = datetime.utcnow()
+        state = RepeaterQueueState(repeater_id='r')
+        state.record_batch_result(False, now)
+        self.assertEqual(state.backoff_until, now + MIN_REPEATER_BACKOFF)
+        state.record_batch_result(False, now)
+        self.assertEqual(state.backoff_until, now + MIN_REPEATER_BACKOFF * 2)
+        for __ in range(20):
+            state.record_batch_result(False, now)
+        self.assertEqual(state.backoff_until, now + MAX_REPEATER_BACKOFF)
+
+        state.record_batch_result(True, now)
+        self.assertEqual((state.failure_streak, state.backoff_until), (0, None))
+
+
+class ProcessRepeaterQueueTest(SimpleTestCase):
+
+    @patch('corehq.motech.repeaters.tasks._fire_repeat_records')
+    @patch('corehq.motech.repeaters.tasks.iter_docs')
+    @patch.object(RepeatRecordQueueEntry, 'claim_batch')
+    @patch.object(RepeaterQueueState, 'objects')
+    @patch('corehq.motech.repeaters.models.RepeatRecord.get_db')
+    def test_stops_when_batch_fails(self, get_db, state_objects, claim_batch, iter_docs, fire):
+        claim_batch.return_value = ['r1']
+        iter_docs.return_value = [{'_id': 'r1', 'doc_type': 'RepeatRecord', 'domain': DOMAIN, 'attempts': []}]
+
+        def _fail(repeat_records):
+            for repeat_record in repeat_records:
+                repeat_record.attempts.append(Mock())
+        fire.side_effect = _fail
+
+        process_repeater_queue('repeater')
+
+        self.assertEqual(claim_batch.call_count, 1)
+        state_objects.get.return_value.record_batch_result.assert_called_once()
+        self.assertFalse(state_objects.get.return_value.record_batch_result.call_args[0][0])
+
+
+class DeliverRepeatRecordsAsyncTest(SimpleTestCase):
+
+    @patch('corehq.motech.repeaters.tasks._deliver_repeat_records_async')
+    @patch('corehq.motech.repeaters.tasks.get_redis_lock')
+    def test_only_one_runs_at_a_time(self, get_redis_lock, deliver):
+        get_redis_lock.return_value.acquire.return_value = False
+        deliver_repeat_records_async()
+        deliver.assert_not_called()
+
+        get_redis_lock.return_value.acquire.return_value = True
+        deliver_repeat_records_async()
+        deliver.assert_called_once_with()
+        get_redis_lock.return_value.release.assert_called_once_with()
+
+    @patch('corehq.motech.repeaters.async_delivery.AsyncRepeatRecordSender.send_batches')
+    @patch('corehq.motech.repeaters.tasks._record_batch_result')
+    @patch('corehq.motech.repeaters.tasks._is_ready_to_fire', return_value=True)
+    @patch('corehq.motech.repeaters.tasks._get_claimed_repeat_records')
+    @patch('corehq.motech.repeaters.tasks._can_send_async', return_value=True)
+    @patch.object(RepeatRecordQueueEntry, 'claim_batch')
+    @patch.object(RepeatRecordQueueEntry, 'get_due_repeaters', return_value=[('repeater', 1)])
+    @patch('corehq.motech.repeaters.tasks.get_redis_lock')
+    def test_claims_up_to_the_repeater_limit(self, get_redis_lock, get_due_repeaters, claim_batch,
+                                             can_send_async, get_claimed_repeat_records, is_ready_to_fire,
+                                             record_batch_result, send_batches):
+        claim_batch.return_value = ['r1']
+        repeat_record = Mock(attempts=[], repeater=CaseRepeater(format='case_json'))
+        get_claimed_repeat_records.side_effect = lambda record_ids: [repeat_record]
+
+        deliver_repeat_records_async()
+        [claim_batches, batch_sent], kwargs = send_batches.call_args
+
+        [batch] = claim_batches()
+        self.assertEqual(batch, [repeat_record])
+        # the repeater's only worker is busy
+        self.assertEqual(claim_batches(), [])
+        self.assertEqual(claim_batch.call_count, 1)
+
+        batch_sent(batch)
+        record_batch_result.assert_called_once_with('repeater', [repeat_record], [0])
+        self.assertEqual(len(claim_batches()), 1)
+
+    @patch('corehq.motech.repeaters.async_delivery.AsyncRepeatRecordSender.send_batches')
+    @patch('corehq.motech.repeaters.tasks._can_send_async', return_value=False)
+    @patch.object(RepeatRecordQueueEntry, 'claim_batch')
+    @patch.object(RepeatRecordQueueEntry, 'get_due_repeaters', return_value=[('repeater', 1)])
+    @patch('corehq.motech.repeaters.tasks.get_redis_lock')
+    def test_skips_repeaters_that_cannot_be_sent_async(self, get_redis_lock, get_due_repeaters,
+                                                       claim_batch, can_send_async, send_batches):
+        deliver_repeat_records_async()
+        [claim_batches, batch_sent], kwargs = send_batches.call_args
+
+        self.assertEqual(claim_batches(), [])
+        claim_batch.assert_not_called()
+
+    @override_settings(USE_SQL_REPEAT_RECORD_QUEUE=True, REPEAT_RECORD_ASYNC_DELIVERY=True)
+    @patch('corehq.motech.repeaters.tasks.process_repeater_queue')
+    @patch('corehq.motech.repeaters.tasks.deliver_repeat_records_async')
+    @patch('corehq.motech.repeaters.tasks._can_send_async', side_effect=lambda repeater_id: repeater_id == 'async')
+    @patch.object(RepeatRecordQueueEntry, 'get_due_repeaters', return_value=[('async', 2), ('sync', 2)])
+    def test_dispatch_starts_workers_for_repeaters_that_cannot_be_sent_async(
+        self, get_due_repeaters, can_send_async, deliver, process_repeater_queue
+    ):
+        dispatch_repeat_record_queue()
+
+        deliver.delay.assert_called_once_with()
+        self.assertEqual(process_repeater_queue.delay.call_args_list, [call('sync'), call('sync')])
@@ -738,6 +738,7 @@ class TestRepeaterFormat(BaseRepeaterTest):
                 timeout=POST_TIMEOUT,
                 auth=self.repeater.get_auth(),
                 verify=self.repeater.verify,
+                session=self.repeater.get_session(),
             )
 
     def test_get_format_by_deprecated_name(self):
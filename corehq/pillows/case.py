@@ -134,7 +134,8 @@ def get_case_pillow(
         checkpoint=checkpoint,
         change_processed_event_handler=event_handler,
         processor=processors,
-        processor_chunk_size=processor_chunk_size
+        processor_chunk_size=processor_chunk_size,
+        prefetch_documents=True,
     )
 
 
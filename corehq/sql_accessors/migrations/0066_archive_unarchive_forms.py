@@ -0,0 +1,23 @@
+from django.db import migrations
+
+from corehq.form_processor.models import XFormInstanceSQL, XFormOperationSQL
+from corehq.sql_db.operations import RawSQLMigration
+
+migrator = RawSQLMigration(('corehq', 'sql_accessors', 'sql_templates'), {
+    'FORM_STATE_ARCHIVED': XFormInstanceSQL.ARCHIVED,
+    'FORM_STATE_NORMAL': XFormInstanceSQL.NORMAL,
+    'FORM_OPERATION_ARCHIVE': XFormOperationSQL.ARCHIVE,
+    'FORM_OPERATION_UNARCHIVE': XFormOperationSQL.UNARCHIVE,
+})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sql_accessors', '0065_get_related_indices_closure'),
+    ]
+
+    operations = [
+        migrator.get_migration('archive_unarchive_forms.sql'),
+        migrator.get_migration('revoke_restore_case_transactions_for_forms.sql'),
+    ]
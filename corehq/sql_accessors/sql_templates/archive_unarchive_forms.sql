@@ -0,0 +1,24 @@
+DROP FUNCTION IF EXISTS archive_unarchive_forms(TEXT[], TEXT, BOOLEAN);
+
+CREATE FUNCTION archive_unarchive_forms(p_form_ids TEXT[], archiving_user_id TEXT, archive BOOLEAN, affected_count OUT INTEGER) AS $$
+DECLARE
+    new_state INT;
+    operation TEXT;
+    curtime TIMESTAMP := clock_timestamp();
+BEGIN
+    IF archive THEN
+        new_state := {{ FORM_STATE_ARCHIVED }};
+        operation := '{{ FORM_OPERATION_ARCHIVE }}';
+    ELSE
+        new_state := {{ FORM_STATE_NORMAL }};
+        operation := '{{ FORM_OPERATION_UNARCHIVE }}';
+    END IF;
+
+    INSERT INTO form_processor_xformoperationsql (form_id, user_id, operation, date)
+            SELECT form_id, archiving_user_id, operation, curtime FROM unnest(p_form_ids) AS form_id;
+    UPDATE form_processor_xforminstancesql
+      SET state=new_state, server_modified_on = curtime
+      WHERE form_processor_xforminstancesql.form_id = ANY(p_form_ids);
+    GET DIAGNOSTICS affected_count = ROW_COUNT;
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,57 @@
+DROP FUNCTION IF EXISTS get_related_indices_closure(TEXT, TEXT[], TEXT[]);
+
+CREATE FUNCTION get_related_indices_closure(
+    domain_name TEXT,
+    case_ids_array TEXT[],
+    exclude_indices_array TEXT[]
+) RETURNS SETOF form_processor_commcarecaseindexsql AS $$
+BEGIN
+    -- Recursive version of get_related_indices: follow related indices
+    -- from the given cases until no more related cases can be found on
+    -- this shard. Indices that point to cases on other shards are
+    -- returned so the caller can continue the traversal there.
+    RETURN QUERY
+    WITH RECURSIVE exclude_indices AS (
+        -- exclude_indices is a set of '<index.case_id> <index.identifier>'
+        SELECT UNNEST(exclude_indices_array) AS xid
+    ), related_ids(cid) AS (
+        SELECT UNNEST(case_ids_array)
+
+        UNION
+
+        SELECT CASE WHEN ix.case_id = related_ids.cid
+            THEN ix.referenced_id  -- parent or host case
+            ELSE ix.case_id        -- open extension case
+        END
+        FROM related_ids
+        JOIN form_processor_commcarecaseindexsql ix
+            ON ix.case_id = related_ids.cid
+            OR (ix.referenced_id = related_ids.cid AND ix.relationship_id = 2)
+        JOIN form_processor_commcarecasesql cases
+            ON cases.case_id = ix.case_id AND cases.domain = ix.domain
+        WHERE ix.domain = domain_name
+            AND ix.case_id || ' ' || ix.identifier NOT IN (SELECT xid FROM exclude_indices)
+            AND (ix.case_id = related_ids.cid OR NOT (cases.closed OR cases.deleted))
+    )
+
+    -- parent and host cases
+    SELECT form_processor_commcarecaseindexsql.*
+    FROM form_processor_commcarecaseindexsql
+    JOIN related_ids ON cid = case_id -- case_id points to child/extension
+    WHERE domain = domain_name
+        AND case_id || ' ' || identifier NOT IN (SELECT xid FROM exclude_indices)
+
+    UNION
+
+    -- open extension cases
+    SELECT DISTINCT form_processor_commcarecaseindexsql.*
+    FROM form_processor_commcarecaseindexsql
+    JOIN form_processor_commcarecasesql USING (domain, case_id)
+    JOIN related_ids ON cid = referenced_id -- referenced_id points to host
+    WHERE domain = domain_name
+        AND case_id || ' ' || identifier NOT IN (SELECT xid FROM exclude_indices)
+        AND relationship_id = 2 -- is extension case
+        AND NOT closed
+        AND NOT deleted;
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,13 @@
+DROP FUNCTION IF EXISTS revoke_restore_case_transactions_for_forms(TEXT[], TEXT[], BOOLEAN);
+
+CREATE FUNCTION revoke_restore_case_transactions_for_forms(case_ids TEXT[], form_ids TEXT[], revoke BOOLEAN) RETURNS INTEGER AS $$
+DECLARE
+    rows_updated INTEGER;
+BEGIN
+    UPDATE form_processor_casetransaction SET revoked=revoke
+    WHERE form_processor_casetransaction.case_id = ANY(case_ids)
+      AND form_processor_casetransaction.form_id = ANY(form_ids);
+    GET DIAGNOSTICS rows_updated = ROW_COUNT;
+    RETURN rows_updated;
+END;
+$$ LANGUAGE plpgsql;
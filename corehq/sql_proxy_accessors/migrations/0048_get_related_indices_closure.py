@@ -0,0 +1,19 @@
+from django.conf import settings
+from django.db import migrations
+
+from corehq.sql_db.operations import RawSQLMigration
+
+migrator = RawSQLMigration(('corehq', 'sql_proxy_accessors', 'sql_templates'), {
+    'PL_PROXY_CLUSTER_NAME': settings.PL_PROXY_CLUSTER_NAME
+})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sql_proxy_accessors', '0047_remove_get_case_models_functions'),
+    ]
+
+    operations = [
+        migrator.get_migration('get_related_indices_closure.sql'),
+    ]
@@ -0,0 +1,20 @@
+from django.conf import settings
+from django.db import migrations
+
+from corehq.sql_db.operations import RawSQLMigration
+
+migrator = RawSQLMigration(('corehq', 'sql_proxy_accessors', 'sql_templates'), {
+    'PL_PROXY_CLUSTER_NAME': settings.PL_PROXY_CLUSTER_NAME
+})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sql_proxy_accessors', '0048_get_related_indices_closure'),
+    ]
+
+    operations = [
+        migrator.get_migration('archive_unarchive_forms.sql'),
+        migrator.get_migration('revoke_restore_case_transactions_for_forms.sql'),
+    ]
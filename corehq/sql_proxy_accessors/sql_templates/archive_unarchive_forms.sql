@@ -0,0 +1,7 @@
+DROP FUNCTION IF EXISTS archive_unarchive_forms(TEXT[], TEXT, BOOLEAN);
+
+CREATE FUNCTION archive_unarchive_forms(form_ids TEXT[], archiving_user_id TEXT, archive BOOLEAN) RETURNS SETOF INTEGER AS $$
+    CLUSTER '{{ PL_PROXY_CLUSTER_NAME }}';
+    SPLIT form_ids;
+    RUN ON hash_string(form_ids, 'siphash24');
+$$ LANGUAGE plproxy;
@@ -0,0 +1,10 @@
+DROP FUNCTION IF EXISTS get_related_indices_closure(TEXT, TEXT[], TEXT[]);
+
+CREATE FUNCTION get_related_indices_closure(
+    domain_name TEXT,
+    case_ids_array TEXT[],
+    exclude_indices_array TEXT[]
+) RETURNS SETOF form_processor_commcarecaseindexsql AS $$
+    CLUSTER '{{ PL_PROXY_CLUSTER_NAME }}';
+    RUN ON ALL;
+$$ LANGUAGE plproxy;
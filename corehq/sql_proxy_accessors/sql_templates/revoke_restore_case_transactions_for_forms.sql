@@ -0,0 +1,7 @@
+DROP FUNCTION IF EXISTS revoke_restore_case_transactions_for_forms(TEXT[], TEXT[], BOOLEAN);
+
+CREATE FUNCTION revoke_restore_case_transactions_for_forms(case_ids TEXT[], form_ids TEXT[], revoke BOOLEAN) RETURNS SETOF INTEGER AS $$
+    CLUSTER '{{ PL_PROXY_CLUSTER_NAME }}';
+    SPLIT case_ids;
+    RUN ON hash_string(case_ids, 'siphash24');
+$$ LANGUAGE plproxy;
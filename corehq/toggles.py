@@ -618,6 +618,40 @@ UCR_SUM_WHEN_TEMPLATES = StaticToggle(
     help_link='https://commcare-hq.readthedocs.io/ucr.html#sumwhencolumn-and-sumwhentemplatecolumn',
 )
 
+UCR_COMPILED_EXPRESSIONS = StaticToggle(
+    'ucr_compiled_expressions',
+    'Evaluate UCR data source expressions using the expression compiler',
+    TAG_INTERNAL,
+    [NAMESPACE_DOMAIN],
+    description="""
+    Flatten data source filters, named expressions and indicators into
+    compiled functions when processing documents.
+    """
+)
+
+UCR_COMPILED_EXPRESSIONS_DIFFERENTIAL = StaticToggle(
+    'ucr_compiled_expressions_differential',
+    'Compare compiled UCR expression output against the interpreted output',
+    TAG_INTERNAL,
+    [NAMESPACE_DOMAIN],
+    description="""
+    Evaluate data sources both ways and report any differences. The
+    interpreted result is always the one that is saved.
+    """
+)
+
+UCR_BULK_LOAD_REBUILDS = StaticToggle(
+    'ucr_bulk_load_rebuilds',
+    'Rebuild UCR tables by bulk loading rows into a staging table',
+    TAG_INTERNAL,
+    [NAMESPACE_DOMAIN],
+    description="""
+    Load rebuilt rows with COPY into an unindexed staging table, index it
+    once loading is finished and then swap it in for the current table.
+    The current table stays available to reports until the swap.
+    """
+)
+
 ASYNC_RESTORE = StaticToggle(
     'async_restore',
     'Generate restore response in an asynchronous task to prevent timeouts',
@@ -1286,6 +1320,43 @@ PAGINATED_EXPORTS = StaticToggle(
     [NAMESPACE_DOMAIN]
 )
 
+INCREMENTAL_DAILY_SAVED_EXPORTS = StaticToggle(
+    'incremental_daily_saved_exports',
+    'Rebuild daily saved exports incrementally from the documents that changed',
+    TAG_INTERNAL,
+    [NAMESPACE_DOMAIN],
+    description="""
+    Daily saved form and case exports keep the rows of each document from the
+    previous build and only process documents modified since then. Falls back
+    to a full rebuild when the export configuration or filters change.
+    """
+)
+
+STREAMING_XLSX_EXPORTS = StaticToggle(
+    'streaming_xlsx_exports',
+    'Use the constant memory streaming writer for large Excel exports',
+    TAG_INTERNAL,
+    [NAMESPACE_DOMAIN],
+    description="""
+    Excel exports of more than STREAMING_XLSX_EXPORT_THRESHOLD documents are
+    written by a writer that streams sheet XML to disk instead of keeping
+    openpyxl workbook state in memory.
+    """
+)
+
+EXPORT_COLUMNAR_PAGES = StaticToggle(
+    'export_columnar_pages',
+    'Convert multiprocess export pages to a columnar format that is reused between rebuilds',
+    TAG_INTERNAL,
+    [NAMESPACE_DOMAIN],
+    description="""
+    Multiprocess export rebuilds extract the selected columns of each page once
+    into a columnar file which is kept on the machine running the rebuild.
+    Pages whose content has not changed since the previous rebuild are written
+    from that file without being processed again.
+    """
+)
+
 PUBLISH_CUSTOM_REPORTS = StaticToggle(
     'publish_custom_reports',
     "Publish custom reports (No needed Authorization)",
@@ -1692,6 +1763,46 @@ DISABLE_CASE_UPDATE_RULE_SCHEDULED_TASK = StaticToggle(
     [NAMESPACE_DOMAIN]
 )
 
+CASE_UPDATE_RULE_CANDIDATE_FILTER = StaticToggle(
+    'case_update_rule_candidate_filter',
+    'Only load cases that could match the case update rule criteria during rule runs',
+    TAG_INTERNAL,
+    [NAMESPACE_DOMAIN],
+    description="Criteria that can be expressed in SQL (server modified boundary, case property "
+                "matches on the case itself and closed parent checks) are added to the query for "
+                "cases, so the remaining cases are never loaded. Only applies to domains on the "
+                "SQL backend.",
+)
+
+BULK_FORM_ARCHIVE_PIPELINE = StaticToggle(
+    'bulk_form_archive_pipeline',
+    'Archive and restore forms in bulk, rebuilding each affected case once',
+    TAG_INTERNAL,
+    [NAMESPACE_DOMAIN],
+    description="Used by bulk form management. Forms are un/archived in batches of 100 and the "
+                "cases they touch are rebuilt once all forms are done, instead of once per form. "
+                "Only applies to domains on the SQL backend.",
+)
+
+CASE_UPDATE_RULE_BATCHED_UPDATES = StaticToggle(
+    'case_update_rule_batched_updates',
+    'Submit the updates from case update rules in batches',
+    TAG_INTERNAL,
+    [NAMESPACE_DOMAIN],
+    description="When every rule for a case type only updates the case itself, the updates are "
+                "submitted as one form per rule for up to 100 cases instead of one form per case.",
+)
+
+BULK_SCHEDULE_INSTANCE_REFRESH = StaticToggle(
+    'bulk_schedule_instance_refresh',
+    'Refresh broadcast schedule instances in bulk',
+    TAG_INTERNAL,
+    [NAMESPACE_DOMAIN],
+    description="When a broadcast's recipients change, its schedule instances are loaded with one "
+                "query per partitioned database and created, updated and deleted in bulk, instead "
+                "of being saved one at a time.",
+)
+
 
 PHI_CAS_INTEGRATION = StaticToggle(
     'phi_cas_integration',
@@ -1787,6 +1898,41 @@ LIVEQUERY_READ_FROM_STANDBYS = DynamicallyPredictablyRandomToggle(
     """
 )
 
+LIVEQUERY_RECURSIVE_INDICES = StaticToggle(
+    'livequery_recursive_indices',
+    'Load the related case graph for livequery restores with one recursive query per shard',
+    TAG_INTERNAL,
+    [NAMESPACE_DOMAIN],
+    description="""
+    Alternative to fetching related indices one level at a time, for
+    comparing restore timings of users with deep parent/extension chains.
+    """
+)
+
+STREAMING_RESTORE = StaticToggle(
+    'streaming_restore',
+    'Stream restore responses to the client while they are generated',
+    TAG_INTERNAL,
+    [NAMESPACE_DOMAIN],
+    description="""
+    Send the restore payload as it is produced rather than buffering
+    it to a file first. Does not apply to async restores or restores
+    that include an item count.
+    """
+)
+
+LIVEQUERY_CASE_FRAGMENT_CACHE = StaticToggle(
+    'livequery_case_fragment_cache',
+    'Reuse serialized case XML fragments across livequery restores',
+    TAG_INTERNAL,
+    [NAMESPACE_DOMAIN],
+    description="""
+    Cache the rendered XML of each synced case, keyed on the case's
+    server modified date, so unchanged cases are not re-serialized on
+    every restore.
+    """
+)
+
 
 RUN_CUSTOM_DATA_PULL_REQUESTS = StaticToggle(
     'run_custom_data_pull_requests',
@@ -0,0 +1,191 @@
+import multiprocessing
+import os
+import random
+import resource
+import tempfile
+import time
+import zipfile
+from datetime import date, timedelta
+from queue import Empty
+from xml.sax.saxutils import escape
+
+from django.core.management import BaseCommand, CommandError
+
+from corehq.util.workbook_reading import (
+    open_streaming_xlsx_workbook,
+    open_xlsx_workbook,
+)
+
+READERS = {
+    'openpyxl': open_xlsx_workbook,
+    'streaming': open_streaming_xlsx_workbook,
+}
+
+_CONTENT_TYPES = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">
+<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>
+<Default Extension="xml" ContentType="application/xml"/>
+<Override PartName="/xl/workbook.xml"
+    ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>
+<Override PartName="/xl/worksheets/sheet1.xml"
+    ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>
+<Override PartName="/xl/styles.xml"
+    ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>
+<Override PartName="/xl/sharedStrings.xml"
+    ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sharedStrings+xml"/>
+</Types>"""
+
+_RELS = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1"
+    Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument"
+    Target="xl/workbook.xml"/>
+</Relationships>"""
+
+_WORKBOOK = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+    xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">
+<sheets><sheet name="Sheet1" sheetId="1" r:id="rId1"/></sheets>
+</workbook>"""
+
+_WORKBOOK_RELS = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1"
+    Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet"
+    Target="worksheets/sheet1.xml"/>
+<Relationship Id="rId2"
+    Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles"
+    Target="styles.xml"/>
+<Relationship Id="rId3"
+    Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/sharedStrings"
+    Target="sharedStrings.xml"/>
+</Relationships>"""
+
+_STYLES = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">
+<fonts count="1"><font><sz val="11"/><name val="Calibri"/></font></fonts>
+<fills count="1"><fill><patternFill patternType="none"/></fill></fills>
+<borders count="1"><border/></borders>
+<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>
+<cellXfs count="2">
+<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>
+<xf numFmtId="14" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>
+</cellXfs>
+</styleSheet>"""
+
+_HEADERS = ['case_id', 'name', 'village', 'age', 'weight', 'dob', 'enrolled']
+_VILLAGES = ['village-{}'.format(i) for i in range(200)]
+
+
+def write_synthetic_workbook(path, size_mb):
+    """Write an xlsx file of roughly ``size_mb`` MB that looks like a case
+    import: unique ids and names as shared strings plus numbers, dates
+    and booleans"""
+    target_size = size_mb * 1024 * 1024
+    with open(path, 'wb') as f, zipfile.ZipFile(f, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('[Content_Types].xml', _CONTENT_TYPES)
+        archive.writestr('_rels/.rels', _RELS)
+        archive.writestr('xl/workbook.xml', _WORKBOOK)
+        archive.writestr('xl/_rels/workbook.xml.rels', _WORKBOOK_RELS)
+        archive.writestr('xl/styles.xml', _STYLES)
+
+        shared_strings = {}
+        with tempfile.TemporaryFile(mode='w+', encoding='utf-8') as strings_file:
+            def _string_index(value):
+                if value not in shared_strings:
+                    shared_strings[value] = len(shared_strings)
+                    strings_file.write('<si><t>{}</t></si>'.format(escape(value)))
+                return shared_strings[value]
+
+            with archive.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as sheet:
+                sheet.write(
+                    b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                    b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+                )
+                sheet.write(_row_xml(1, [
+                    't="s"><v>{}</v>'.format(_string_index(header)) for header in _HEADERS
+                ]))
+                row_number = 1
+                while f.tell() < target_size:
+                    row_number += 1
+                    dob = date(1950, 1, 1) + timedelta(days=random.randint(0, 25000))
+                    sheet.write(_row_xml(row_number, [
+                        't="s"><v>{}</v>'.format(_string_index('case-{:012d}'.format(row_number))),
+                        't="s"><v>{}</v>'.format(_string_index('Name {}'.format(random.randint(0, 50000)))),
+                        't="s"><v>{}</v>'.format(_string_index(random.choice(_VILLAGES))),
+                        '><v>{}</v>'.format(random.randint(0, 90)),
+                        '><v>{:.2f}</v>'.format(random.uniform(2, 120)),
+                        's="1"><v>{}</v>'.format((dob - date(1899, 12, 30)).days),
+                        't="b"><v>{}</v>'.format(random.randint(0, 1)),
+                    ]))
+                sheet.write(b'</sheetData></worksheet>')
+
+            strings_file.seek(0)
+            with archive.open('xl/sharedStrings.xml', 'w', force_zip64=True) as sst:
+                sst.write(
+                    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                    '<sst xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+                    'uniqueCount="{}">'.format(len(shared_strings)).encode('utf-8')
+                )
+                for chunk in iter(lambda: strings_file.read(1024 * 1024), ''):
+                    sst.write(chunk.encode('utf-8'))
+                sst.write(b'</sst>')
+    return row_number
+
+
+def _row_xml(row_number, cells):
+    return '<row r="{0}">{1}</row>'.format(row_number, ''.join(
+        '<c r="{}{}" {}</c>'.format(chr(ord('A') + column), row_number, cell)
+        for column, cell in enumerate(cells)
+    )).encode('utf-8')
+
+
+def _read_workbook(reader_name, path, results):
+    start = time.time()
+    rows = 0
+    with READERS[reader_name](path) as workbook:
+        for worksheet in workbook.worksheets:
+            for row in worksheet.iter_rows():
+                rows += 1
+    results.put((rows, time.time() - start, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss))
+
+
+def _get_result(process, results):
+    while True:
+        try:
+            return results.get(timeout=5)
+        except Empty:
+            if not process.is_alive():
+                raise CommandError('Reader process exited with code {}'.format(process.exitcode))
+
+
+class Command(BaseCommand):
+    help = "Compare the time and peak memory of reading a large xlsx file with each workbook reader"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=int, default=100, help='Size of the synthetic workbook in MB')
+        parser.add_argument('--file', help='Read this workbook instead of a synthetic one')
+        parser.add_argument('--readers', nargs='+', choices=list(READERS), default=list(READERS))
+
+    def handle(self, size, file, readers, **options):
+        path = file
+        if not path:
+            fd, path = tempfile.mkstemp(suffix='.xlsx')
+            os.close(fd)
+            start = time.time()
+            row_count = write_synthetic_workbook(path, size)
+            print('Wrote {} rows ({} MB) to {} in {:.1f}s'.format(
+                row_count, os.path.getsize(path) // (1024 * 1024), path, time.time() - start))
+        try:
+            for reader_name in readers:
+                # read in a fresh process so that peak memory is not shared between readers
+                results = multiprocessing.Queue()
+                process = multiprocessing.Process(target=_read_workbook, args=(reader_name, path, results))
+                process.start()
+                rows, duration, max_rss = _get_result(process, results)
+                process.join()
+                print('{:>10}: {} rows in {:.1f}s ({} rows per sec), peak RSS {} MB'.format(
+                    reader_name, rows, duration, int(rows / duration), max_rss // 1024))
+        finally:
+            if not file:
+                os.remove(path)
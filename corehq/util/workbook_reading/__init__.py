@@ -7,12 +7,21 @@ from corehq.util.workbook_reading.exceptions import (
     SpreadsheetFileEncrypted,
 )
 from .datamodels import Workbook, Worksheet, Cell
-from .adapters import open_xls_workbook, open_xlsx_workbook, open_any_workbook, make_worksheet
+from .adapters import (
+    open_xls_workbook,
+    open_xlsx_workbook,
+    open_streaming_xlsx_workbook,
+    open_csv_workbook,
+    open_any_workbook,
+    make_worksheet,
+)
 
 
 __all__ = [
     'open_xls_workbook',
     'open_xlsx_workbook',
+    'open_streaming_xlsx_workbook',
+    'open_csv_workbook',
     'open_any_workbook',
     'make_worksheet',
 
@@ -1,7 +1,16 @@
 from .xls import open_xls_workbook
 from .xlsx import open_xlsx_workbook
+from .streaming_xlsx import open_streaming_xlsx_workbook
+from .csv_file import open_csv_workbook
 from .generic import open_any_workbook
 from .raw_data import make_worksheet
 
 
-__all__ = ['open_xls_workbook', 'open_xlsx_workbook', 'open_any_workbook', 'make_worksheet']
+__all__ = [
+    'open_xls_workbook',
+    'open_xlsx_workbook',
+    'open_streaming_xlsx_workbook',
+    'open_csv_workbook',
+    'open_any_workbook',
+    'make_worksheet',
+]
@@ -0,0 +1,36 @@
+import csv
+from contextlib import contextmanager
+
+from corehq.util.workbook_reading import (
+    Cell,
+    SpreadsheetFileInvalidError,
+    SpreadsheetFileNotFound,
+    Workbook,
+    Worksheet,
+)
+
+
+@contextmanager
+def open_csv_workbook(filename):
+    """Open a csv file as a workbook with a single worksheet
+
+    Rows are read from the file as they are iterated. Empty values are
+    returned as None, like empty cells of other workbooks.
+    """
+    try:
+        f = open(filename, 'r', encoding='utf-8-sig', newline='')
+    except IOError as e:
+        raise SpreadsheetFileNotFound(e)
+
+    with f as f:
+        try:
+            max_row = sum(1 for row in csv.reader(f))
+        except (csv.Error, UnicodeDecodeError) as e:
+            raise SpreadsheetFileInvalidError(str(e))
+
+        def iter_rows():
+            f.seek(0)
+            for row in csv.reader(f):
+                yield [Cell(value if value != '' else None) for value in row]
+
+        yield Workbook(worksheets=[Worksheet(title=None, max_row=max_row, iter_rows=iter_rows)])
@@ -1,7 +1,8 @@
 from contextlib import contextmanager
 from corehq.util.workbook_reading import SpreadsheetFileExtError
+from .csv_file import open_csv_workbook
+from .streaming_xlsx import open_streaming_xlsx_workbook
 from .xls import open_xls_workbook
-from .xlsx import open_xlsx_workbook
 
 
 @contextmanager
@@ -10,8 +11,11 @@ def open_any_workbook(filename):
         with open_xls_workbook(filename) as workbook:
             yield workbook
     elif filename.endswith('.xlsx'):
-        with open_xlsx_workbook(filename) as workbook:
+        with open_streaming_xlsx_workbook(filename) as workbook:
+            yield workbook
+    elif filename.endswith('.csv'):
+        with open_csv_workbook(filename) as workbook:
             yield workbook
     else:
-        raise SpreadsheetFileExtError('File {} does not end in .xls or .xlsx'
+        raise SpreadsheetFileExtError('File {} does not end in .xls or .xlsx or .csv'
                                       .format(filename))
@@ -0,0 +1,421 @@
+"""
+Streaming xlsx reader
+
+openpyxl reads rows lazily in read-only mode, but it still loads the whole
+shared strings table and keeps parser state that grows with the file.
+This reader parses the worksheet and shared strings xml straight from the
+zip with an expat (SAX) parser, only holding on to the row being read. Large
+shared strings tables are kept in a temporary file and read back by index,
+so memory use does not depend on the size of the workbook.
+
+Cell values are the same as those of ``open_xlsx_workbook``.
+"""
+import posixpath
+import tempfile
+import zipfile
+from array import array
+from contextlib import contextmanager
+from datetime import datetime, time
+from functools import lru_cache
+from xml.etree.ElementTree import ParseError, iterparse
+from xml.parsers import expat
+
+from openpyxl.styles.numbers import BUILTIN_FORMATS, is_date_format
+from openpyxl.utils.datetime import CALENDAR_MAC_1904, CALENDAR_WINDOWS_1900, from_excel
+
+from corehq.util.workbook_reading import (
+    Cell,
+    SpreadsheetFileEncrypted,
+    SpreadsheetFileInvalidError,
+    SpreadsheetFileNotFound,
+    Workbook,
+    Worksheet,
+)
+
+from .xlsx import XLSX_ENCRYPTED_MARKER
+
+# Shared strings tables bigger than this (uncompressed) are kept on disk
+MAX_IN_MEMORY_SHARED_STRINGS_SIZE = 10 * 1024 * 1024
+
+# Stop looking for data after this many blank rows (see _XLSXWorksheetAdaptor._max_row)
+MAX_BLANK_ROWS = 1000
+
+READ_CHUNK_SIZE = 64 * 1024
+
+_REL_TYPE_PREFIX = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/'
+
+
+@contextmanager
+def open_streaming_xlsx_workbook(filename):
+    try:
+        f = open(filename, 'rb')
+    except IOError as e:
+        raise SpreadsheetFileNotFound(e)
+
+    with f as f:
+        try:
+            archive = zipfile.ZipFile(f)
+        except zipfile.BadZipfile as e:
+            f.seek(0)
+            if f.read(8) == XLSX_ENCRYPTED_MARKER:
+                raise SpreadsheetFileEncrypted('Workbook is encrypted')
+            else:
+                raise SpreadsheetFileInvalidError(str(e))
+        with archive:
+            try:
+                reader = _StreamingWorkbookReader(archive)
+                workbook = reader.to_workbook()
+            except (KeyError, ParseError, expat.ExpatError) as e:
+                raise SpreadsheetFileInvalidError(str(e))
+            try:
+                yield workbook
+            finally:
+                reader.close()
+
+
+def _local_name(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+class _LocalNames(dict):
+    """Element name without namespace prefix, cached per name"""
+
+    def __missing__(self, name):
+        local_name = self[name] = name.rpartition(':')[2]
+        return local_name
+
+
+class _ColumnIndexes(dict):
+    """Zero based column index of a cell reference like 'AB12', cached per column"""
+
+    def __missing__(self, column_letters):
+        index = 0
+        for letter in column_letters:
+            index = index * 26 + ord(letter) - ord('A') + 1
+        index = self[column_letters] = index - 1
+        return index
+
+
+def _parse_incrementally(fileobj, handler):
+    """Feed the xml in ``fileobj`` to the handler in chunks, yielding the
+    items the handler has completed after each chunk"""
+    parser = expat.ParserCreate()
+    parser.buffer_text = True
+    parser.StartElementHandler = handler.start_element
+    parser.EndElementHandler = handler.end_element
+    parser.CharacterDataHandler = handler.character_data
+    while True:
+        data = fileobj.read(READ_CHUNK_SIZE)
+        parser.Parse(data, not data)
+        completed, handler.completed = handler.completed, []
+        yield from completed
+        if not data:
+            return
+
+
+class _SharedStringsHandler(object):
+    """Collects the text of each <si> element, leaving out phonetic runs"""
+
+    def __init__(self):
+        self.completed = []
+        self._names = _LocalNames()
+        self._parts = None
+        self._in_text = False
+        self._in_phonetic = False
+
+    def start_element(self, name, attrs):
+        name = self._names[name]
+        if name == 'si':
+            self._parts = []
+        elif name == 't' and not self._in_phonetic:
+            self._in_text = True
+        elif name == 'rPh':
+            self._in_phonetic = True
+
+    def end_element(self, name):
+        name = self._names[name]
+        if name == 'si':
+            self.completed.append(''.join(self._parts))
+        elif name == 't':
+            self._in_text = False
+        elif name == 'rPh':
+            self._in_phonetic = False
+
+    def character_data(self, data):
+        if self._in_text:
+            self._parts.append(data)
+
+
+class _RowsHandler(object):
+    """Collects (row number, {column index: (data type, style id, raw value)})
+    for each <row> element of a worksheet"""
+
+    def __init__(self):
+        self.completed = []
+        self._names = _LocalNames()
+        self._columns = _ColumnIndexes()
+        self._next_row_number = 1
+        self._row_number = None
+        self._cells = None
+        self._next_column = 0
+        self._column = None
+        self._cell_type = self._cell_style = self._value = None
+        self._text = None
+        self._in_phonetic = False
+
+    def start_element(self, name, attrs):
+        name = self._names[name]
+        if name == 'c':
+            ref = attrs.get('r')
+            if ref:
+                self._column = self._columns[ref.rstrip('0123456789')]
+            else:
+                self._column = self._next_column
+            self._next_column = self._column + 1
+            self._cell_type = attrs.get('t', 'n')
+            self._cell_style = attrs.get('s')
+            self._value = None
+        elif name == 'v' or name == 't' and not self._in_phonetic:
+            self._text = []
+        elif name == 'row':
+            row_number = attrs.get('r')
+            self._row_number = int(row_number) if row_number else self._next_row_number
+            self._next_row_number = self._row_number + 1
+            self._cells = {}
+            self._next_column = 0
+        elif name == 'rPh':
+            self._in_phonetic = True
+
+    def end_element(self, name):
+        name = self._names[name]
+        if name == 'v':
+            self._value = ''.join(self._text)
+            self._text = None
+        elif name == 't':
+            if self._text is not None:
+                # inline strings may be made up of several runs
+                self._value = (self._value or '') + ''.join(self._text)
+                self._text = None
+        elif name == 'c':
+            self._cells[self._column] = (self._cell_type, self._cell_style, self._value)
+        elif name == 'row':
+            self.completed.append((self._row_number, self._cells))
+        elif name == 'rPh':
+            self._in_phonetic = False
+
+    def character_data(self, data):
+        if self._text is not None:
+            self._text.append(data)
+
+
+def _cast_number(value):
+    if '.' in value or 'E' in value or 'e' in value:
+        return float(value)
+    return int(value)
+
+
+class _SharedStrings(object):
+    """The shared strings table of a workbook, read on first use"""
+
+    def __init__(self, archive, path):
+        self._archive = archive
+        self._path = path
+        self._strings = None
+        self._file = None
+        self._offsets = None
+        self._read = None
+
+    def __getitem__(self, index):
+        if self._strings is None and self._read is None:
+            self._load()
+        if self._strings is not None:
+            return self._strings[index]
+        return self._read(index)
+
+    def _load(self):
+        if self._path is None:
+            self._strings = []
+            return
+        size = self._archive.getinfo(self._path).file_size
+        with self._archive.open(self._path) as f:
+            strings = _parse_incrementally(f, _SharedStringsHandler())
+            if size <= MAX_IN_MEMORY_SHARED_STRINGS_SIZE:
+                self._strings = list(strings)
+            else:
+                self._spill_to_disk(strings)
+
+    def _spill_to_disk(self, strings):
+        self._file = tempfile.TemporaryFile()
+        self._offsets = array('Q', [0])
+        offset = 0
+        for string in strings:
+            data = string.encode('utf-8')
+            self._file.write(data)
+            offset += len(data)
+            self._offsets.append(offset)
+        self._read = lru_cache(maxsize=10000)(self._read_from_disk)
+
+    def _read_from_disk(self, index):
+        start, end = self._offsets[index], self._offsets[index + 1]
+        self._file.seek(start)
+        return self._file.read(end - start).decode('utf-8')
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+
+class _StreamingWorksheetReader(object):
+
+    def __init__(self, archive, path, title, shared_strings, date_style_ids, epoch):
+        self._archive = archive
+        self._path = path
+        self.title = title
+        self._shared_strings = shared_strings
+        self._date_style_ids = date_style_ids
+        self._epoch = epoch
+        self._size = None
+
+    def _iter_raw_rows(self):
+        """Yield (row number, {column index: (data type, style id, raw value)})
+        for each row in the sheet"""
+        with self._archive.open(self._path) as f:
+            yield from _parse_incrementally(f, _RowsHandler())
+
+    def _get_value(self, raw_cell):
+        data_type, style_id, value = raw_cell
+        if value is None:
+            return None
+        if data_type == 's':
+            return self._shared_strings[int(value)]
+        if data_type == 'b':
+            return bool(int(value))
+        if data_type in ('inlineStr', 'str', 'e'):
+            return value
+        value = _cast_number(value)
+        if style_id is not None and int(style_id) in self._date_style_ids:
+            value = from_excel(value, self._epoch)
+            if isinstance(value, datetime) and value.time() == time(0, 0):
+                return value.date()
+        return value
+
+    def _get_size(self):
+        """(max_row, max_column) with the same meaning as _XLSXWorksheetAdaptor"""
+        if self._size is None:
+            max_row = 1
+            last_data_row = 0
+            max_column = 0
+            for row_number, cells in self._iter_raw_rows():
+                if cells:
+                    max_column = max(max_column, max(cells) + 1)
+                if any(self._get_value(raw_cell) for raw_cell in cells.values()):
+                    if row_number - last_data_row - 1 >= MAX_BLANK_ROWS:
+                        break
+                    max_row = last_data_row = row_number
+            self._size = max_row, max_column
+        return self._size
+
+    def iter_rows(self):
+        max_row, max_column = self._get_size()
+        get_value = self._get_value
+        next_row_number = 1
+        for row_number, cells in self._iter_raw_rows():
+            if row_number > max_row:
+                break
+            # rows with no cells are left out of the xml
+            for _ in range(next_row_number, row_number):
+                yield [Cell(None) for _ in range(max_column)]
+            next_row_number = row_number + 1
+            yield [
+                Cell(get_value(cells[column]) if column in cells else None)
+                for column in range(max_column)
+            ]
+
+    def to_worksheet(self):
+        max_row, max_column = self._get_size()
+        return Worksheet(title=self.title, max_row=max_row, iter_rows=self.iter_rows)
+
+
+class _StreamingWorkbookReader(object):
+
+    def __init__(self, archive):
+        self._archive = archive
+        self._rels = self._read_rels('xl/workbook.xml')
+        self._shared_strings = _SharedStrings(archive, self._get_part_path('sharedStrings'))
+
+    def _read_rels(self, part_path):
+        directory, filename = posixpath.split(part_path)
+        rels_path = posixpath.join(directory, '_rels', filename + '.rels')
+        rels = {}
+        with self._archive.open(rels_path) as f:
+            for _, elem in iterparse(f):
+                if _local_name(elem.tag) == 'Relationship':
+                    target = elem.get('Target')
+                    if target.startswith('/'):
+                        target = target.lstrip('/')
+                    else:
+                        target = posixpath.normpath(posixpath.join(directory, target))
+                    rels[elem.get('Id')] = (elem.get('Type'), target)
+        return rels
+
+    def _get_part_path(self, rel_type):
+        for type_, target in self._rels.values():
+            if type_ == _REL_TYPE_PREFIX + rel_type:
+                return target
+        return None
+
+    def _get_date_style_ids(self):
+        path = self._get_part_path('styles')
+        if path is None:
+            return set()
+        number_formats = dict(BUILTIN_FORMATS)
+        date_style_ids = set()
+        with self._archive.open(path) as f:
+            in_cell_xfs = False
+            style_id = 0
+            for event, elem in iterparse(f, events=('start', 'end')):
+                name = _local_name(elem.tag)
+                if event == 'start':
+                    if name == 'cellXfs':
+                        in_cell_xfs = True
+                    continue
+                if name == 'numFmt':
+                    number_formats[int(elem.get('numFmtId'))] = elem.get('formatCode')
+                elif name == 'cellXfs':
+                    in_cell_xfs = False
+                elif name == 'xf' and in_cell_xfs:
+                    number_format = number_formats.get(int(elem.get('numFmtId', 0)))
+                    if number_format and is_date_format(number_format):
+                        date_style_ids.add(style_id)
+                    style_id += 1
+        return date_style_ids
+
+    def _iter_sheets(self):
+        """Yield (title, rel id) of each sheet in workbook order"""
+        with self._archive.open('xl/workbook.xml') as f:
+            for _, elem in iterparse(f):
+                if _local_name(elem.tag) == 'sheet':
+                    rel_id = next(value for key, value in elem.attrib.items() if _local_name(key) == 'id')
+                    yield elem.get('name'), rel_id
+
+    def _get_epoch(self):
+        with self._archive.open('xl/workbook.xml') as f:
+            for _, elem in iterparse(f):
+                if _local_name(elem.tag) == 'workbookPr':
+                    if elem.get('date1904') in ('1', 'true'):
+                        return CALENDAR_MAC_1904
+        return CALENDAR_WINDOWS_1900
+
+    def to_workbook(self):
+        date_style_ids = self._get_date_style_ids()
+        epoch = self._get_epoch()
+        return Workbook(worksheets=[
+            _StreamingWorksheetReader(
+                self._archive, self._rels[rel_id][1], title,
+                self._shared_strings, date_style_ids, epoch,
+            ).to_worksheet()
+            for title, rel_id in self._iter_sheets()
+        ])
+
+    def close(self):
+        self._shared_strings.close()
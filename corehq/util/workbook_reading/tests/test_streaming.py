@@ -0,0 +1,49 @@
+import os
+import tempfile
+
+from django.test import SimpleTestCase
+
+from mock import patch
+
+from corehq.util.workbook_reading import (
+    open_any_workbook,
+    open_csv_workbook,
+    open_streaming_xlsx_workbook,
+    open_xlsx_workbook,
+)
+from corehq.util.workbook_reading.tests.utils import get_file
+
+
+def _read(open_workbook, filename):
+    with open_workbook(filename) as workbook:
+        return [
+            (worksheet.title, worksheet.max_row, [[cell.value for cell in row] for row in worksheet.iter_rows()])
+            for worksheet in workbook.worksheets
+        ]
+
+
+class StreamingXLSXTest(SimpleTestCase):
+
+    @patch('corehq.util.workbook_reading.adapters.streaming_xlsx.MAX_IN_MEMORY_SHARED_STRINGS_SIZE', 0)
+    def test_shared_strings_on_disk(self):
+        filename = get_file('types', 'xlsx')
+        self.assertEqual(_read(open_streaming_xlsx_workbook, filename), _read(open_xlsx_workbook, filename))
+
+
+class CSVWorkbookTest(SimpleTestCase):
+
+    def setUp(self):
+        fd, self.filename = tempfile.mkstemp(suffix='.csv')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write('name,age\r\nDanny,28\r\n,\r\n"Smith, Jo",\r\n')
+        self.addCleanup(os.remove, self.filename)
+
+    def test_rows(self):
+        self.assertEqual(_read(open_any_workbook, self.filename), [
+            (None, 4, [['name', 'age'], ['Danny', '28'], [None, None], ['Smith, Jo', None]]),
+        ])
+
+    def test_rows_can_be_read_again(self):
+        with open_csv_workbook(self.filename) as workbook:
+            worksheet = workbook.worksheets[0]
+            self.assertEqual(list(worksheet.iter_rows()), list(worksheet.iter_rows()))
@@ -652,6 +652,15 @@ REMINDERS_QUEUE_MAX_PROCESSING_ATTEMPTS = 3
 # reminders will not be processed.
 REMINDERS_QUEUE_STALE_REMINDER_DURATION = 7 * 24
 
+# Setting this to True makes queue_schedule_instances query the partitioned
+# databases concurrently and queue due schedule instances in batches grouped
+# by schedule, rather than one task per schedule instance.
+SCHEDULE_INSTANCE_BATCHED_QUEUE = False
+
+# The maximum number of schedule instances handled by one task when
+# SCHEDULE_INSTANCE_BATCHED_QUEUE is True
+SCHEDULE_INSTANCE_BATCH_SIZE = 50
+
 # Reminders rate limiting settings. A single project will only be allowed to
 # fire REMINDERS_RATE_LIMIT_COUNT reminders every REMINDERS_RATE_LIMIT_PERIOD
 # seconds.
@@ -726,6 +735,14 @@ CASE_ES_DROP_FORM_FIELDS = False
 # Set to None to enable all or empty tuple to disable all.
 REPEATERS_WHITELIST = None
 
+# Set to True to queue repeat records in SQL (see RepeatRecordQueueEntry) instead
+# of walking the Couch view in check_repeaters. Run populate_repeat_record_queue
+# after turning this on.
+USE_SQL_REPEAT_RECORD_QUEUE = False
+# Set to True to send records from the SQL queue concurrently from one task
+# (see AsyncRepeatRecordSender) instead of one celery task per repeater.
+REPEAT_RECORD_ASYNC_DELIVERY = False
+
 # If ENABLE_PRELOGIN_SITE is set to true, redirect to Dimagi.com urls
 ENABLE_PRELOGIN_SITE = False
 